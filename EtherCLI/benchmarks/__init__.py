@@ -0,0 +1 @@
+"""Benchmarks of the EtherPKI CLI and library."""
@@ -0,0 +1,291 @@
+"""Microbenchmark of exporting and verifying attribute bundles.
+
+The bundles are exported from a synthetic state, built in memory with the storage layout of the
+contract and served through eth_getProof by a stand-in client, so no node is needed.
+
+Run from the EtherCLI directory:
+
+    python -m benchmarks.bench_bundle --signatures 20 --filler 20000
+"""
+
+import argparse
+import base64
+import binascii
+import hashlib
+import os
+import random
+import time
+
+import rlp
+
+from etherpki import bundle
+from etherpki.abicodec import contract_abi
+from etherpki.abicodec import function_selector
+from etherpki.datahash import compute_datahash
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.stateproof import EMPTY_TRIE_ROOT
+from etherpki.stateproof import HEADER_FIELDS
+from etherpki.keccak import keccak256
+from etherpki.stateproof import slot_key
+
+CONTRACT_ADDRESS = '0x' + '42' * 20
+
+BLOCK_NUMBER = 1000
+BLOCK_TIME = 1600000000
+
+
+def _hex(value):
+    return '0x' + binascii.hexlify(value).decode('ascii')
+
+
+def _nibbles(key):
+    nibbles = []
+    for byte in bytearray(key):
+        nibbles += (byte >> 4, byte & 0x0f)
+    return tuple(nibbles)
+
+
+def _hex_prefix(nibbles, leaf):
+    flag = 2 if leaf else 0
+    if len(nibbles) % 2:
+        nibbles = (flag + 1,) + nibbles
+    else:
+        nibbles = (flag, 0) + nibbles
+    return bytes(bytearray(nibbles[i] * 16 + nibbles[i + 1] for i in range(0, len(nibbles), 2)))
+
+
+class TrieBuilder(object):
+    """A Merkle-Patricia trie built at once from its entries, with proofs of its keys."""
+
+    def __init__(self, entries):
+        """
+        entries: a dictionary mapping keys to values, as bytes
+        """
+        self.nodes = {}
+        items = sorted((_nibbles(key), value) for (key, value) in entries.items())
+        if items:
+            encoded = rlp.encode(self._build(items))
+            self.root = keccak256(encoded)
+            self.nodes[self.root] = encoded
+        else:
+            self.root = EMPTY_TRIE_ROOT
+
+    def _reference(self, node):
+        encoded = rlp.encode(node)
+        if len(encoded) < 32:
+            return node
+        digest = keccak256(encoded)
+        self.nodes[digest] = encoded
+        return digest
+
+    def _build(self, items):
+        if len(items) == 1:
+            (path, value) = items[0]
+            return [_hex_prefix(path, True), value]
+
+        # the length of the prefix common to every path
+        common = 0
+        first, last = items[0][0], items[-1][0]
+        while common < min(len(first), len(last)) and first[common] == last[common]:
+            common += 1
+        if common:
+            child = self._build([(path[common:], value) for (path, value) in items])
+            return [_hex_prefix(first[:common], False), self._reference(child)]
+
+        branch = [b''] * 17
+        groups = {}
+        for (path, value) in items:
+            if not path:
+                branch[16] = value
+            else:
+                groups.setdefault(path[0], []).append((path[1:], value))
+        for (nibble, group) in groups.items():
+            branch[nibble] = self._reference(self._build(group))
+        return branch
+
+    def proof(self, key):
+        """Returns the encoded nodes on the path to a key, as eth_getProof does."""
+        proof = []
+        path = _nibbles(key)
+        reference = self.root
+        while isinstance(reference, bytes) and reference in self.nodes:
+            proof.append(self.nodes[reference])
+            node = rlp.decode(self.nodes[reference])
+            while True:
+                if len(node) == 17:
+                    if not path:
+                        return proof
+                    (reference, path) = (node[path[0]], path[1:])
+                else:
+                    (prefix, leaf) = _decode_prefix(node[0])
+                    if leaf or path[:len(prefix)] != prefix:
+                        return proof
+                    (reference, path) = (node[1], path[len(prefix):])
+                if not isinstance(reference, list):
+                    break
+                node = reference
+        return proof
+
+
+def _decode_prefix(encoded):
+    nibbles = _nibbles(encoded)
+    return (nibbles[1:] if nibbles[0] & 1 else nibbles[2:], bool(nibbles[0] & 2))
+
+
+def _store_string(storage, slot, text):
+    encoded = text.encode('utf-8')
+    if len(encoded) < 32:
+        storage[slot] = int.from_bytes(encoded.ljust(31, b'\x00') + bytes(bytearray([len(encoded) * 2])), 'big')
+        return
+    storage[slot] = len(encoded) * 2 + 1
+    base = bundle._array_base(slot)
+    for index in range(0, len(encoded), 32):
+        storage[base + index // 32] = int.from_bytes(encoded[index:index + 32].ljust(32, b'\x00'), 'big')
+
+
+def synthetic_storage(attributeID, attribute, signatures, filler, seed=0):
+    """
+    Lay out an attribute and its signatures in contract storage.
+
+    signatures: a list of (signatureID, signer, expiry, revocationID or None)
+    filler:     the number of unrelated slots, so that the trie is about as deep as a real one
+
+    returns a dictionary mapping slots to values
+    """
+    rng = random.Random(seed)
+    storage = dict((rng.getrandbits(256), rng.getrandbits(64) + 1) for _ in range(filler))
+
+    storage[bundle.ATTRIBUTES_SLOT] = attributeID + 1
+    storage[bundle.SIGNATURES_SLOT] = max([signatureID for (signatureID, _, _, _) in signatures] + [-1]) + 1
+
+    slot = bundle._array_base(bundle.ATTRIBUTES_SLOT) + attributeID * bundle.ATTRIBUTE_SIZE
+    storage[slot] = int(attribute['owner'], 16)
+    _store_string(storage, slot + 1, attribute['attributeType'])
+    storage[slot + 2] = int(attribute['hasProof'])
+    storage[slot + 3] = int.from_bytes(attribute['identifier'], 'big')
+    _store_string(storage, slot + 4, attribute['data'])
+    _store_string(storage, slot + 5, attribute['dataHash'])
+
+    ids_slot = bundle._mapping_slot(bundle.SIGNATURES_OF_ATTRIBUTE_SLOT, attributeID)
+    storage[ids_slot] = len(signatures)
+    for (index, (signatureID, signer, expiry, revocationID)) in enumerate(signatures):
+        storage[bundle._array_base(ids_slot) + index] = signatureID
+        slot = bundle._array_base(bundle.SIGNATURES_SLOT) + signatureID * bundle.SIGNATURE_SIZE
+        (storage[slot], storage[slot + 1], storage[slot + 2]) = (int(signer, 16), attributeID, expiry)
+        if revocationID is not None:
+            storage[bundle._mapping_slot(bundle.REVOKED_SLOT, signatureID)] = 1
+            storage[bundle._mapping_slot(bundle.REVOCATION_OF_SIGNATURE_SLOT, signatureID)] = revocationID
+
+    return dict((slot, value) for (slot, value) in storage.items() if value)
+
+
+class StateClient(object):
+    """Serves eth_getProof and eth_getBlockByNumber for one block of a synthetic state."""
+
+    def __init__(self, address, storage, accounts=0):
+        """
+        address:    the address of the contract
+        storage:    the storage of the contract, as returned by synthetic_storage
+        accounts:   the number of other accounts in the state
+        """
+        self.address = binascii.unhexlify(address[2:])
+        self.storage = TrieBuilder(dict((keccak256(slot_key(slot)), rlp.encode(value))
+            for (slot, value) in storage.items()))
+
+        account = rlp.encode([1, 0, self.storage.root, keccak256(b'')])
+        entries = dict((keccak256(os.urandom(20)), account) for _ in range(accounts))
+        entries[keccak256(self.address)] = account
+        self.state = TrieBuilder(entries)
+
+        fields = [b'\x11' * 32, b'\x22' * 32, b'\x33' * 20, self.state.root, b'\x44' * 32, b'\x55' * 32,
+            b'\x00' * 256, 2, BLOCK_NUMBER, 2000000, 0, BLOCK_TIME, b'', b'\x00' * 32, b'\x00' * 8]
+        header = dict((name, hex(value) if isinstance(value, int) else _hex(value))
+            for (name, value) in zip(HEADER_FIELDS, fields))
+        header['hash'] = _hex(keccak256(rlp.encode(fields)))
+        self.block = header
+        self.calls = 0
+
+    def get_block_number(self):
+        return BLOCK_NUMBER
+
+    def get_code(self, address, block='latest'):
+        # a dispatcher pushing the selector of every function of the ABI
+        selectors = [function_selector(entry) for entry in contract_abi(get_etherpki_abi())
+            if entry.get('type') == 'function']
+        return _hex(b''.join(b'\x63' + selector for selector in selectors))
+
+    def get_block_by_number(self, block_number, full_transactions=True):
+        return self.block
+
+    def request(self, method, params=None):
+        if method != 'eth_getProof':
+            raise ValueError("Unsupported method: " + method)
+        self.calls += 1
+        (_, keys, _) = params
+        return {
+            'accountProof': [_hex(node) for node in self.state.proof(keccak256(self.address))],
+            'storageProof': [{'key': key, 'proof': [_hex(node) for node in
+                self.storage.proof(keccak256(binascii.unhexlify(key[2:])))]} for key in keys],
+        }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return (result, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signatures', type=int, default=20)
+    parser.add_argument('--revoked', type=int, default=3, help='number of the signatures revoked')
+    parser.add_argument('--filler', type=int, default=20000, help='unrelated storage slots')
+    parser.add_argument('--accounts', type=int, default=5000, help='other accounts in the state')
+    parser.add_argument('--payload', type=int, default=64, help='size of the IPFS payload, in KB')
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    # an IPFS block with a CIDv1 of its SHA-256, as the daemon would store it
+    payload = os.urandom(args.payload * 1024)
+    multihash = b'\x12\x20' + hashlib.sha256(payload).digest()
+    cid = 'b' + base64.b32encode(b'\x01\x55' + multihash).decode('ascii').lower().rstrip('=')
+
+    attribute = {
+        'owner': '0x' + 'ab' * 20,
+        'attributeType': 'document',
+        'hasProof': False,
+        'identifier': b'synthetic'.ljust(32, b'\x00'),
+        'data': 'ipfs-block://' + cid,
+        'dataHash': compute_datahash(payload),
+    }
+    signatures = [(100 + 7 * index, '0x%040x' % (index + 1), BLOCK_TIME + 86400 * 365,
+        50 + index if index < args.revoked else None) for index in range(args.signatures)]
+
+    (client, build_time) = timed(StateClient, CONTRACT_ADDRESS,
+        synthetic_storage(12, attribute, signatures, args.filler), args.accounts)
+    print("state:   %d storage slots, %d accounts built in %.2f s" % (args.filler, args.accounts, build_time))
+
+    (data, export_time) = timed(bundle.export_bundle, 12, address=CONTRACT_ADDRESS, client=client,
+        get={cid: payload}.__getitem__)
+    print("export:  %d bytes (%d of proofs) in %.1f ms, %d eth_getProof calls" % (len(data),
+        len(data) - len(payload), export_time * 1000, client.calls))
+
+    at = BLOCK_TIME + 60
+    times = []
+    for _ in range(args.iterations):
+        (result, seconds) = timed(bundle.verify_bundle, data, address=CONTRACT_ADDRESS,
+            block_hash=client.block['hash'], at=at)
+        times.append(seconds)
+    times.sort()
+    print("verify:  p50 %.2f ms, p99 %.2f ms, verdict %s, %d of %d signatures valid" % (
+        times[len(times) // 2] * 1000, times[min(len(times) - 1, len(times) * 99 // 100)] * 1000,
+        result['verdict'], result['attribute']['signatures_status']['status']['valid'], args.signatures))
+
+    if result['verdict'] != 'valid' or result['attribute']['data_valid'] is not True:
+        raise SystemExit("bundle did not verify")
+    if result['attribute']['signatures_status']['status']['valid'] != args.signatures - args.revoked:
+        raise SystemExit("wrong signature status")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Microbenchmark of hashing and checking large attribute payloads.
+
+Run from the EtherCLI directory:
+
+    python -m benchmarks.bench_datahash --size 64 --payloads 32
+"""
+
+import argparse
+import mmap
+import os
+import tempfile
+import time
+
+from etherpki.datahash import VerifiedCache
+from etherpki.datahash import check_datahash
+from etherpki.datahash import compute_datahash
+from etherpki.datahash import hash_data
+from etherpki.datahash import iter_datahashes
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return (result, time.perf_counter() - start)
+
+
+def rate(size, seconds):
+    return "%7.1f MB/s" % (size / 1048576.0 / seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=64, help='size of the large payload, in MB')
+    parser.add_argument('--payloads', type=int, default=32, help='number of 1 MB payloads hashed in parallel')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size * 1048576)
+    for algorithm in ('keccak256', 'sha256'):
+        (_, seconds) = timed(hash_data, payload, algorithm)
+        print("%-9s bytes:    %s" % (algorithm, rate(len(payload), seconds)))
+
+    with tempfile.TemporaryFile() as payloadfile:
+        payloadfile.write(payload)
+        payloadfile.flush()
+        mapped = mmap.mmap(payloadfile.fileno(), 0, access=mmap.ACCESS_READ)
+        (_, seconds) = timed(hash_data, mapped)
+        mapped.close()
+        print("keccak256 mmap:     %s" % rate(len(payload), seconds))
+
+        payloadfile.seek(0)
+        (_, seconds) = timed(hash_data, payloadfile)
+        print("keccak256 file:     %s" % rate(len(payload), seconds))
+
+    text = payload[:16 * 1048576].hex()
+    (_, seconds) = timed(hash_data, text)
+    print("keccak256 text:     %s" % rate(len(text), seconds))
+
+    # many payloads, as in bulk-add, one after another and in parallel
+    payloads = [os.urandom(1048576) for _ in range(args.payloads)]
+    (serial, serial_time) = timed(lambda: [compute_datahash(data) for data in payloads])
+    (parallel, parallel_time) = timed(list, iter_datahashes(payloads, workers=args.workers))
+    if serial != parallel:
+        raise SystemExit("parallel datahashes differ")
+    print("%d payloads: serial %s, %d workers %s (x%.1f)" % (len(payloads),
+        rate(len(payloads) * 1048576, serial_time), args.workers,
+        rate(len(payloads) * 1048576, parallel_time), serial_time / parallel_time))
+
+    # checking a block again is answered by the verified cache; the cache is keyed by the CID, which
+    # is not checked against the content here
+    cid = 'bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku'
+    datahash = compute_datahash(payload)
+    cache = VerifiedCache(':memory:')
+    (first, first_time) = timed(check_datahash, datahash, payload, cid, cache)
+    (again, again_time) = timed(check_datahash, datahash, payload, cid, cache)
+    if not (first and again):
+        raise SystemExit("payload does not match its datahash")
+    print("check: first %.1f ms, cached %.3f ms" % (first_time * 1000, again_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
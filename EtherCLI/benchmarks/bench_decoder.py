@@ -0,0 +1,79 @@
+"""Microbenchmark of LogDecoder against processblock.Log + ContractTranslator.listen.
+
+Run from the EtherCLI directory:
+
+    python -m benchmarks.bench_decoder --logs 1000000
+"""
+
+import argparse
+import time
+
+from etherpki.abicodec import LogDecoder
+
+from benchmarks.synthetic import load_abi
+from benchmarks.synthetic import make_registry
+
+
+def decode_with_translator(translator, logs):
+    """The decoding path Events used before LogDecoder."""
+    from ethereum import processblock
+    from ethereum.utils import big_endian_to_int
+    from ethereum.utils import decode_hex
+
+    decoded_logs = []
+    for log in logs:
+        logobj = processblock.Log(
+            log['address'][2:],
+            [big_endian_to_int(decode_hex(topic[2:])) for topic in log['topics']],
+            decode_hex(log['data'][2:])
+        )
+        decoded_logs.append(translator.listen(logobj, noprint=True))
+    return decoded_logs
+
+
+def as_text(decoded_log):
+    return dict((name, value.decode('utf-8', 'replace') if isinstance(value, bytes) else value)
+        for (name, value) in decoded_log.items())
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (result, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logs', type=int, default=1000000, help='number of synthetic logs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    abi = load_abi()
+    logs = make_registry(args.logs, seed=args.seed)
+
+    (decoder, build_time) = timed(LogDecoder, abi)
+    (fast, fast_time) = timed(decoder.decode_many, logs)
+    print("LogDecoder:         built in %.2f ms, %d logs in %.2f s (%.0f logs/s)"
+        % (build_time * 1000, len(fast), fast_time, len(fast) / fast_time))
+
+    try:
+        from ethereum import abi as ethabi
+    except ImportError:
+        print("ContractTranslator: skipped, pyethereum is not installed")
+        return
+
+    (translator, build_time) = timed(ethabi.ContractTranslator, abi['abi'])
+    (slow, slow_time) = timed(decode_with_translator, translator, logs)
+    print("ContractTranslator: built in %.2f ms, %d logs in %.2f s (%.0f logs/s)"
+        % (build_time * 1000, len(slow), slow_time, len(slow) / slow_time))
+    print("speedup: %.1fx" % (slow_time / fast_time))
+
+    # the decoders must agree, apart from whether text is returned as str or bytes
+    for (fast_log, slow_log) in zip(fast, slow):
+        (fast_log, slow_log) = (as_text(fast_log), as_text(slow_log))
+        if fast_log != slow_log:
+            raise SystemExit("decoders disagree: %r != %r" % (fast_log, slow_log))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Microbenchmark of committing to a batch of attributes and verifying their inclusion proofs.
+
+Run from the EtherCLI directory:
+
+    python -m benchmarks.bench_merkle --attributes 100000
+"""
+
+import argparse
+import hashlib
+import time
+
+from etherpki.commitments import build_commitment
+from etherpki.commitments import iter_committed_attributes
+from etherpki.merkle import MerkleBuilder
+from etherpki.merkle import leaf_hash
+from etherpki.merkle import verify_proof
+
+
+def synthetic_attributes(count):
+    for number in range(count):
+        yield {
+            'attributeType': 'pgp-key',
+            'hasProof': True,
+            'identifier': hashlib.sha1(str(number).encode('ascii')).digest(),
+            'data': 'ipfs-block://zb2rh%048d' % number,
+            'dataHash': '',
+        }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return (result, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--attributes', type=int, default=100000, help='number of attributes in the batch')
+    parser.add_argument('--page-size', type=int, default=256)
+    args = parser.parse_args()
+
+    # the manifest is kept in memory instead of on IPFS
+    blocks = {}
+
+    def put(data):
+        cid = 'zb' + hashlib.sha256(data).hexdigest()
+        blocks[cid] = data
+        return cid
+
+    (commitment, build_time) = timed(build_commitment, synthetic_attributes(args.attributes), put=put,
+        page_size=args.page_size)
+    size = sum(len(block) for block in blocks.values())
+    print("build:        %d attributes in %.2f s (%.0f attributes/s), manifest of %d blocks, %.1f MB"
+        % (commitment['count'], build_time, commitment['count'] / build_time, len(blocks), size / 1048576.0))
+
+    commitment.update(commitmentID=0, owner='00' * 20)
+    (attributes, verify_time) = timed(list, iter_committed_attributes(commitment, get=blocks.__getitem__))
+    invalid = sum(1 for attribute in attributes if not attribute['inclusion_valid'])
+    print("manifest:     %d proofs checked in %.2f s (%.0f proofs/s), %d invalid"
+        % (len(attributes), verify_time, len(attributes) / verify_time, invalid))
+
+    # the proof checks alone, without reading the manifest
+    builder = MerkleBuilder()
+    leaves = [leaf_hash(str(number).encode('ascii')) for number in range(args.attributes)]
+    for digest in leaves:
+        builder.add_hash(digest)
+    tree = builder.tree()
+    proofs = [tree.proof(position) for position in range(tree.count)]
+    root = tree.root()
+
+    (valid, proof_time) = timed(lambda: sum(verify_proof(digest, position, tree.count, proof, root)
+        for (position, (digest, proof)) in enumerate(zip(leaves, proofs))))
+    print("verify_proof: %d proofs in %.2f s (%.0f proofs/s)" % (valid, proof_time, valid / proof_time))
+
+    if invalid or valid != tree.count:
+        raise SystemExit("invalid proofs")
+
+
+if __name__ == '__main__':
+    main()
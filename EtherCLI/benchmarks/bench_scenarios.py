@@ -0,0 +1,368 @@
+"""End-to-end benchmarks of the hot paths of the CLI against a local stand-in node.
+
+Every scenario runs in its own process against a FakeNode serving a synthetic registry, and
+reports its throughput, the percentiles of its operation latencies and its peak RSS. Run from the
+EtherCLI directory:
+
+    python -m benchmarks.bench_scenarios --events 1000 100000 --latency 5 --output results.json
+    python -m benchmarks.bench_scenarios --events 1000 100000 --compare results.json
+
+Scales of 10^6 events and more take minutes, most of it spent syncing the index.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+
+# scenarios in the order they run; sync runs first so that the others find the index synced
+SCENARIOS = ['sync', 'search', 'search-owner', 'retrieve', 'status', 'status-many', 'expiring', 'scan',
+    'retrieve-state', 'status-state', 'status-many-state', 'submit', 'bulk-submit']
+
+# the metrics that must not get worse, and whether larger is better
+COMPARED_METRICS = [('throughput', True), ('p50', False), ('p99', False)]
+
+
+def percentile(sorted_values, fraction):
+    """Returns a percentile of sorted values by the nearest-rank method."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in bytes."""
+    import resource
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Timer(object):
+    """Records the latency of every operation of a scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.operations = 0
+
+    def time(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        self.operations += 1
+        return result
+
+
+def scenario_sync(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS, autosync=False)
+    added = timer.time(events.sync)
+    # throughput is counted in logs rather than syncs
+    timer.operations = added
+
+
+def scenario_search(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    for _ in range(iterations):
+        identifier = chain.identifier(rng.randrange(chain.attributes)).decode('ascii')
+        timer.time(lambda: list(events.search_attributes(identifier=identifier)))
+
+
+def scenario_search_owner(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    for _ in range(iterations):
+        owner = '0x' + chain.owner(rng.randrange(chain.attributes))
+        timer.time(lambda: list(events.search_attributes(owner=owner, limit=20)))
+
+
+def scenario_retrieve(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    for _ in range(iterations):
+        timer.time(events.retrieve_attribute, rng.randrange(chain.attributes))
+
+
+def scenario_status(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    for _ in range(iterations):
+        timer.time(events.get_attribute_signatures_status, rng.randrange(chain.attributes))
+
+
+def scenario_status_many(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    for _ in range(iterations):
+        timer.time(events.get_signatures_status_many, [rng.randrange(chain.attributes) for _ in range(100)])
+
+
+def scenario_expiring(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS)
+    # the first query builds the expiry index, the others only search it
+    for _ in range(iterations):
+        start = rng.randrange(1500000000, 2500000000)
+        timer.time(events.get_expiring_signatures, start, start + 30 * 24 * 60 * 60)
+
+
+def scenario_scan(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    # without the index every query scans the chain history with eth_getLogs
+    events = Events(CONTRACT_ADDRESS, index=False)
+    for _ in range(max(1, iterations // 10)):
+        timer.time(events.filter_attributes, attributeID=rng.randrange(chain.attributes))
+
+
+def scenario_retrieve_state(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    # contract state is read with eth_call at a pinned block instead of from logs
+    events = Events(CONTRACT_ADDRESS, state=True)
+    for _ in range(iterations):
+        timer.time(events.retrieve_attribute, rng.randrange(chain.attributes))
+
+
+def scenario_status_state(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS, state=True)
+    for _ in range(iterations):
+        timer.time(events.get_attribute_signatures_status, rng.randrange(chain.attributes))
+
+
+def scenario_status_many_state(chain, timer, iterations, rng):
+    from etherpki.events import Events
+
+    events = Events(CONTRACT_ADDRESS, state=True)
+    for _ in range(iterations):
+        timer.time(events.get_signatures_status_many, [rng.randrange(chain.attributes) for _ in range(100)])
+
+
+def scenario_submit(chain, timer, iterations, rng):
+    from etherpki.transactions import Transactions
+
+    transactions = Transactions(to_address=CONTRACT_ADDRESS)
+    for number in range(iterations):
+        timer.time(transactions.add_attribute, 'email', False, 'bench%d@example.com' % number, '', '')
+
+
+def scenario_bulk_submit(chain, timer, iterations, rng):
+    from etherpki.bulk import BulkSubmitter
+    from etherpki.bulk import Journal
+    from etherpki.transactions import Transactions
+
+    directory = tempfile.mkdtemp()
+    try:
+        journal = Journal(os.path.join(directory, 'journal'))
+        submitter = BulkSubmitter(Transactions(to_address=CONTRACT_ADDRESS), journal)
+        calls = [(number, 'bulk%d' % number, 'addAttribute', ['email', False, 'bulk%d@example.com' % number, '', ''])
+            for number in range(iterations)]
+
+        # the latency of a transaction is the time until it is reported mined
+        sent = {}
+        start = time.perf_counter()
+        for progress in submitter.submit(calls):
+            if progress['status'] == 'sent':
+                sent[progress['row']] = time.perf_counter()
+            elif progress['status'] == 'mined':
+                timer.latencies.append(time.perf_counter() - sent[progress['row']])
+                timer.operations += 1
+        # throughput is measured over the whole submission
+        timer.elapsed = time.perf_counter() - start
+        journal.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_child(args):
+    """Runs one scenario in this process and prints its raw results as JSON."""
+    from etherpki import ethapi
+
+    ethapi.configure_client(url=args.rpc_url)
+
+    chain = SyntheticChain(args.child_events, args.logs_per_block, args.seed)
+    rng = random.Random(args.seed)
+    timer = Timer()
+
+    function = globals()['scenario_' + args.child.replace('-', '_')]
+    function(chain, timer, args.iterations, rng)
+
+    # throughput excludes the setup of the scenario, unless the scenario measured it itself
+    elapsed = getattr(timer, 'elapsed', sum(timer.latencies))
+
+    json.dump({
+        'operations': timer.operations,
+        'seconds': elapsed,
+        'latencies': timer.latencies,
+        'peak_rss': peak_rss(),
+    }, sys.stdout)
+
+
+def summarize(raw):
+    latencies = sorted(raw['latencies'])
+    summary = {
+        'operations': raw['operations'],
+        'seconds': raw['seconds'],
+        'throughput': raw['operations'] / raw['seconds'] if raw['seconds'] else None,
+        'peak_rss': raw['peak_rss'],
+    }
+    for (name, fraction) in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+        summary[name] = percentile(latencies, fraction)
+    summary['max'] = latencies[-1] if latencies else None
+    return summary
+
+
+def run_scale(args, events):
+    """Runs every selected scenario against a node serving a registry of events logs."""
+    chain = SyntheticChain(events, args.logs_per_block, args.seed)
+    node = FakeNode(chain, args.latency / 1000.0, args.jitter / 1000.0, args.max_results or None)
+
+    cachedir = tempfile.mkdtemp()
+    env = dict(os.environ, XDG_CACHE_HOME=cachedir, XDG_CONFIG_HOME=cachedir, HOME=cachedir)
+
+    results = {}
+    try:
+        with node:
+            for scenario in args.scenarios:
+                command = [sys.executable, '-m', 'benchmarks.bench_scenarios', '--child', scenario,
+                    '--child-events', str(events), '--rpc-url', node.url, '--iterations', str(args.iterations),
+                    '--logs-per-block', str(args.logs_per_block), '--seed', str(args.seed)]
+                calls_before = sum(node.calls.values())
+                bytes_before = node.bytes_sent
+
+                output = subprocess.check_output(command, env=env, cwd=os.path.dirname(os.path.dirname(
+                    os.path.abspath(__file__))))
+                summary = summarize(json.loads(output.decode('utf-8')))
+                summary['rpc_calls'] = sum(node.calls.values()) - calls_before
+                summary['rpc_bytes'] = node.bytes_sent - bytes_before
+                results[scenario] = summary
+
+                print("%9d events  %-17s %10.1f ops/s  p50 %8s  p99 %8s  rss %6.1f MB  %6d calls"
+                    % (events, scenario, summary['throughput'] or 0, format_seconds(summary['p50']),
+                    format_seconds(summary['p99']), summary['peak_rss'] / 1048576.0, summary['rpc_calls']))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(cachedir)
+
+    return results
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return '%.2fms' % (seconds * 1000)
+    return '%.2fs' % seconds
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline.
+
+    returns a list of descriptions of the metrics that got worse by more than tolerance
+    """
+    regressions = []
+    for (events, scenarios) in results['scales'].items():
+        for (scenario, summary) in scenarios.items():
+            previous = baseline.get('scales', {}).get(events, {}).get(scenario)
+            if previous is None:
+                continue
+            for (metric, larger_is_better) in COMPARED_METRICS:
+                (old, new) = (previous.get(metric), summary.get(metric))
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (larger_is_better and change < -tolerance) or (not larger_is_better and change > tolerance):
+                    regressions.append("%s events, %s: %s went from %.6g to %.6g (%+.0f%%)"
+                        % (events, scenario, metric, old, new, change * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, nargs='+', default=[1000, 100000],
+        help='registry sizes to run the scenarios at')
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--iterations', type=int, default=200, help='operations per scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every RPC request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random milliseconds added')
+    parser.add_argument('--max-results', type=int, default=10000, help='eth_getLogs result limit, 0 for none')
+    parser.add_argument('--logs-per-block', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to save the results to as JSON')
+    parser.add_argument('--compare', help='results file to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='relative change of a metric reported as a regression')
+
+    # arguments of the process running a single scenario
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-events', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--rpc-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    # sync builds the index the other scenarios query
+    if 'sync' not in args.scenarios:
+        args.scenarios.insert(0, 'sync')
+    args.scenarios = [scenario for scenario in SCENARIOS if scenario in args.scenarios]
+
+    results = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'iterations': args.iterations,
+            'latency_ms': args.latency,
+            'jitter_ms': args.jitter,
+            'max_results': args.max_results,
+            'logs_per_block': args.logs_per_block,
+            'seed': args.seed,
+        },
+        'scales': {},
+    }
+    for events in args.events:
+        results['scales'][str(events)] = run_scale(args, events)
+
+    if args.output:
+        with open(args.output, 'w') as outputfile:
+            json.dump(results, outputfile, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baselinefile:
+            baseline = json.load(baselinefile)
+        if baseline.get('settings') != results['settings']:
+            print("Warning: the baseline was run with different settings", file=sys.stderr)
+
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit("Regressions:\n" + '\n'.join(regressions))
+        print("No regressions against " + args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Startup-time benchmark of the etherpki CLI.
+
+Fails if a command takes longer than its budget to run, or if it loads a module that only the
+chain, GPG or IPFS commands need. Run from the EtherCLI directory:
+
+    python -m benchmarks.bench_startup
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# commands and their budgets in milliseconds, as the median of several runs
+BUDGETS = [
+    (['--help'], 250),
+    (['trusted'], 300),
+]
+
+# modules that commands which never touch the chain must not import
+HEAVY_MODULES = ['ethereum', 'gnupg', 'ipfshttpclient', 'ipfsApi', 'requests', 'concurrent.futures']
+
+# runs a command in-process and prints the heavy modules it imported
+IMPORT_CHECK = """
+import sys
+from etherpki.console import main
+try:
+    main(sys.argv[1:], standalone_mode=False)
+finally:
+    sys.stdout.flush()
+    sys.stderr.write(' '.join(m for m in %r if m in sys.modules))
+""" % (HEAVY_MODULES,)
+
+
+def cli_command(args):
+    """Returns the command line that runs the CLI, preferring the installed entry point."""
+    executable = shutil.which('etherpki')
+    if executable is not None:
+        return [executable] + args
+    return [sys.executable, '-c', 'from etherpki.console import main; main()'] + args
+
+
+def measure(args, runs, env):
+    """Returns the median wall-clock time of a CLI invocation in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(cli_command(args), env=env, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def heavy_imports(args, env):
+    """Returns the heavy modules imported when running a CLI command."""
+    process = subprocess.run([sys.executable, '-c', IMPORT_CHECK] + args, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return process.stderr.strip().split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15, help='runs per command')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier applied to every budget')
+    args = parser.parse_args()
+
+    # keep the user's configuration out of the measurements
+    home = tempfile.mkdtemp()
+    env = dict(os.environ, HOME=home, XDG_CONFIG_HOME=home, XDG_CACHE_HOME=home)
+
+    failures = []
+    try:
+        for (command, budget) in BUDGETS:
+            budget *= args.scale
+            median = measure(command, args.runs, env)
+            imported = heavy_imports(command, env)
+
+            print("etherpki %-10s %7.1f ms (budget %.0f ms)%s" % (' '.join(command), median, budget,
+                "  imports: " + ', '.join(imported) if imported else ''))
+
+            if median > budget:
+                failures.append("'etherpki %s' took %.1f ms, over its %.0f ms budget"
+                    % (' '.join(command), median, budget))
+            if imported:
+                failures.append("'etherpki %s' imported %s" % (' '.join(command), ', '.join(imported)))
+    finally:
+        shutil.rmtree(home)
+
+    if failures:
+        raise SystemExit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
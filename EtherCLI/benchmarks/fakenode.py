@@ -0,0 +1,497 @@
+"""A local stand-in for an Ethereum JSON-RPC node, serving a synthetic EtherPKI registry.
+
+Run from the EtherCLI directory to serve a registry to the CLI:
+
+    python -m benchmarks.fakenode --events 1000000 --port 8545 --latency 20
+
+and point the CLI at it with --rpc-url http://127.0.0.1:8545.
+"""
+
+import argparse
+import binascii
+import json
+import os
+import random
+import threading
+import time
+
+from benchmarks.synthetic import LogFactory
+from benchmarks.synthetic import load_abi
+from etherpki.abicodec import decode_values
+from etherpki.abicodec import encode_values
+from etherpki.abicodec import function_selector
+
+# the contract address the synthetic logs are emitted by
+CONTRACT_ADDRESS = '0x' + '42' * 20
+
+# the account transactions are sent from
+ACCOUNT = '0x' + 'aa' * 20
+
+# each group of logs is an attribute followed by GROUP_SIZE - 1 signatures of it
+GROUP_SIZE = 5
+
+# in every REVOCATION_EVERY-th group, the last signature is replaced by a revocation of the first
+REVOCATION_EVERY = 10
+
+# the number of signatures in REVOCATION_EVERY consecutive groups
+SIGNATURES_PER_CYCLE = REVOCATION_EVERY * (GROUP_SIZE - 1) - 1
+
+# gas reported by eth_estimateGas and used by mined transactions
+GAS_ESTIMATE = 150000
+
+
+def _topic_values(topic):
+    """Returns the set of values a topic filter accepts, or None if it accepts any value."""
+    if topic is None:
+        return None
+    if isinstance(topic, list):
+        return set(value.lower() for value in topic)
+    return set([topic.lower()])
+
+
+def _topic_ints(values):
+    return [int(value, 16) for value in values]
+
+
+class SyntheticChain(object):
+    """A synthetic registry whose logs are computed from their position rather than stored.
+
+    Log p of the registry is in block start_block + p // logs_per_block. Positions are grouped in
+    groups of GROUP_SIZE: the first log of group g adds attribute g, and the others sign it, except
+    that in every REVOCATION_EVERY-th group the last revokes the first signature of the group.
+    IDs are consecutive within each event, as in the contract, and are a function of position, so
+    queries by ID are answered without a scan. The view functions of the contract are answered by
+    the view_ methods.
+    """
+
+    def __init__(self, count, logs_per_block=20, seed=0, start_block=1):
+        """
+        count:          the number of logs
+        logs_per_block: the number of logs in each block
+        seed:           the random seed the owner and signer addresses are drawn with
+        start_block:    the number of the block of the first log
+        """
+        self.count = count
+        self.logs_per_block = logs_per_block
+        self.start_block = start_block
+        self.factory = LogFactory(address=CONTRACT_ADDRESS)
+
+        rng = random.Random(seed)
+        self.addresses = ['%040x' % rng.getrandbits(160) for _ in range(max(1, count // 50))]
+
+        self.head = start_block + max(0, count - 1) // logs_per_block
+
+        self._kinds = [
+            ('attribute', self.factory.attribute_topic),
+            ('signature', self.factory.signature_topic),
+            ('revocation', self.factory.revocation_topic),
+        ]
+
+    @property
+    def attributes(self):
+        """The number of attributes in the registry."""
+        return (self.count + GROUP_SIZE - 1) // GROUP_SIZE
+
+    @property
+    def signatures(self):
+        """The number of signatures in the registry."""
+        (groups, partial) = divmod(self.count, GROUP_SIZE)
+        return groups * (GROUP_SIZE - 1) - self._revocations_before(groups) + max(0, partial - 1)
+
+    @property
+    def revocations(self):
+        """The number of revocations in the registry."""
+        return self._revocations_before(self.count // GROUP_SIZE)
+
+    @staticmethod
+    def _revocations_before(group):
+        """Returns the number of revocations in the groups before group."""
+        return (group + REVOCATION_EVERY - 1) // REVOCATION_EVERY
+
+    @staticmethod
+    def signature_id(group, slot):
+        """Returns the ID of the signature in a slot of a group."""
+        (cycle, index) = divmod(group, REVOCATION_EVERY)
+        first = cycle * SIGNATURES_PER_CYCLE
+        if index:
+            # the first group of the cycle has a revocation instead of its last signature
+            first += (GROUP_SIZE - 2) + (index - 1) * (GROUP_SIZE - 1)
+        return first + slot - 1
+
+    @staticmethod
+    def signature_position(signatureID):
+        """Returns the position of the log of a signature."""
+        (cycle, index) = divmod(signatureID, SIGNATURES_PER_CYCLE)
+        if index < GROUP_SIZE - 2:
+            (group, slot) = (0, index + 1)
+        else:
+            (group, slot) = divmod(index - (GROUP_SIZE - 2), GROUP_SIZE - 1)
+            (group, slot) = (group + 1, slot + 1)
+        return (cycle * REVOCATION_EVERY + group) * GROUP_SIZE + slot
+
+    def _address(self, position):
+        return self.addresses[(position * 2654435761) % len(self.addresses)]
+
+    def kind(self, position):
+        (group, slot) = divmod(position, GROUP_SIZE)
+        if slot == 0:
+            return 'attribute'
+        if slot == GROUP_SIZE - 1 and group % REVOCATION_EVERY == 0:
+            return 'revocation'
+        return 'signature'
+
+    def identifier(self, attributeID):
+        return ('user%d@example.com' % attributeID).encode('ascii')
+
+    def owner(self, attributeID):
+        return self._address(attributeID * GROUP_SIZE)
+
+    def log(self, position):
+        """Returns the raw log at a position."""
+        (block, index) = divmod(position, self.logs_per_block)
+        block += self.start_block
+        (group, slot) = divmod(position, GROUP_SIZE)
+
+        kind = self.kind(position)
+        if kind == 'attribute':
+            return self.factory.attribute(block, index, attributeID=group, owner=self._address(position),
+                identifier=self.identifier(group), data='synthetic attribute %d' % group)
+        if kind == 'revocation':
+            return self.factory.revocation(block, index, revocationID=group // REVOCATION_EVERY,
+                signatureID=self.signature_id(group, 1))
+        return self.factory.signature(block, index, signatureID=self.signature_id(group, slot),
+            signer=self._address(position), attributeID=group, expiry=self.expiry(position))
+
+    def expiry(self, position):
+        return 1500000000 + (position * 2654435761) % 10 ** 9
+
+    def _positions_by_id(self, kind, value):
+        """Returns the positions of the logs of a kind whose first indexed argument is value."""
+        if kind == 'attribute':
+            return [value * GROUP_SIZE]
+        if kind == 'signature':
+            return [self.signature_position(value)]
+        return [value * REVOCATION_EVERY * GROUP_SIZE + GROUP_SIZE - 1]
+
+    def _candidates(self, first, last, topics):
+        """Yields the positions in [first, last) that may match topics, in order."""
+        kinds = [kind for (kind, topic) in self._kinds
+            if topics[0] is None or topic in topics[0]]
+
+        if len(topics) > 1 and topics[1] is not None and topics[0] is not None:
+            # the first indexed argument of every event is its ID
+            positions = set()
+            for kind in kinds:
+                for value in _topic_ints(topics[1]):
+                    positions.update(self._positions_by_id(kind, value))
+            for position in sorted(positions):
+                if first <= position < last:
+                    yield position
+            return
+
+        if kinds == ['attribute']:
+            start = ((first + GROUP_SIZE - 1) // GROUP_SIZE) * GROUP_SIZE
+            for position in range(start, last, GROUP_SIZE):
+                yield position
+            return
+
+        for position in range(first, last):
+            if self.kind(position) in kinds:
+                yield position
+
+    def get_logs(self, from_block, to_block, topics, limit=None):
+        """
+        Returns the logs of a block range that match topics.
+
+        limit: the maximum number of logs to return, or None for no maximum
+
+        raises OverflowError if more than limit logs match
+        """
+        first = max(0, (from_block - self.start_block) * self.logs_per_block)
+        last = min(self.count, (to_block - self.start_block + 1) * self.logs_per_block)
+
+        topics = [_topic_values(topic) for topic in topics or []]
+        logs = []
+        for position in self._candidates(first, last, topics or [None]):
+            log = self.log(position)
+            if all(values is None or log['topics'][number] in values
+                    for (number, values) in enumerate(topics) if number < len(log['topics'])):
+                if any(values is not None for values in topics[len(log['topics']):]):
+                    continue
+                logs.append(log)
+                if limit is not None and len(logs) > limit:
+                    raise OverflowError(limit)
+        return logs
+
+    def _signature_positions(self, attributeID):
+        """Returns the positions of the signatures of an attribute, in order."""
+        first = attributeID * GROUP_SIZE
+        return [position for position in range(first + 1, min(first + GROUP_SIZE, self.count))
+            if self.kind(position) == 'signature']
+
+    def view_getCounts(self):
+        return [self.attributes, self.signatures, self.revocations]
+
+    def view_getAttributes(self, start, count):
+        ids = range(start, min(start + count, self.attributes))
+        return [[self.owner(attributeID) for attributeID in ids], ['email'] * len(ids), [False] * len(ids),
+            [self.identifier(attributeID) for attributeID in ids],
+            ['synthetic attribute %d' % attributeID for attributeID in ids], [''] * len(ids)]
+
+    def view_getSignatures(self, start, count):
+        positions = [self.signature_position(signatureID)
+            for signatureID in range(start, min(start + count, self.signatures))]
+        return [[self._address(position) for position in positions],
+            [position // GROUP_SIZE for position in positions], [self.expiry(position) for position in positions]]
+
+    def view_getRevocations(self, start, count):
+        return [[self.signature_id(revocationID * REVOCATION_EVERY, 1)
+            for revocationID in range(start, min(start + count, self.revocations))]]
+
+    def view_getCommitmentCount(self):
+        # the synthetic registry has no commitments
+        return [0]
+
+    def view_getCommitments(self, start, count):
+        return [[], [], [], []]
+
+    def view_getSignaturesForAttribute(self, attributeID, start, count):
+        positions = self._signature_positions(attributeID)
+        page = positions[start:start + count]
+        return [len(positions), [self.signature_id(attributeID, position % GROUP_SIZE) for position in page],
+            [self._address(position) for position in page], [self.expiry(position) for position in page]]
+
+    def view_isRevoked(self, signature_ids):
+        (revoked, revocation_ids) = ([], [])
+        for signatureID in signature_ids:
+            (group, slot) = divmod(self.signature_position(signatureID), GROUP_SIZE)
+            # only the first signature of a group with a revocation is revoked
+            is_revoked = (signatureID < self.signatures and slot == 1 and group % REVOCATION_EVERY == 0
+                and (group + 1) * GROUP_SIZE <= self.count)
+            revoked.append(is_revoked)
+            revocation_ids.append(group // REVOCATION_EVERY if is_revoked else 0)
+        return [revoked, revocation_ids]
+
+
+class FakeNode(object):
+    """An HTTP JSON-RPC server answering the calls the CLI makes from a SyntheticChain.
+
+    Transactions sent to it are mined at once, in the head block, without changing the registry.
+    """
+
+    def __init__(self, chain, latency=0.0, jitter=0.0, max_results=10000, host='127.0.0.1', port=0):
+        """
+        chain:          the SyntheticChain to serve
+        latency:        seconds every HTTP request is delayed by
+        jitter:         the maximum number of seconds randomly added to latency
+        max_results:    the number of logs above which eth_getLogs fails, like Infura, or None
+        host:           the address to listen on
+        port:           the port to listen on, 0 for any free port
+        """
+        from http.server import HTTPServer
+        import socketserver
+
+        self.chain = chain
+        self.latency = latency
+        self.jitter = jitter
+        self.max_results = max_results
+
+        self.calls = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._nonce = 0
+        self._receipts = {}
+        self._rng = random.Random(0)
+        self._functions = dict((function_selector(entry), entry) for entry in load_abi()['abi']
+            if entry['type'] == 'function')
+
+        class Server(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        self._server = Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        (host, port) = self._server.server_address[:2]
+        return 'http://' + host + ':' + str(port)
+
+    def _handler_class(self):
+        from http.server import BaseHTTPRequestHandler
+
+        node = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # headers and body are written separately, which Nagle's algorithm would delay
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                if node.latency or node.jitter:
+                    time.sleep(node.latency + node._rng.random() * node.jitter)
+
+                if isinstance(request, list):
+                    response = [node.handle(call) for call in request]
+                else:
+                    response = node.handle(request)
+
+                body = json.dumps(response).encode('utf-8')
+                with node._lock:
+                    node.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
+
+    def handle(self, call):
+        """Returns the JSON-RPC response to a call."""
+        method = call.get('method')
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        response = {'jsonrpc': '2.0', 'id': call.get('id')}
+        handler = getattr(self, 'rpc_' + str(method), None)
+        if handler is None:
+            response['error'] = {'code': -32601, 'message': 'the method ' + str(method) + ' does not exist'}
+            return response
+
+        try:
+            response['result'] = handler(*call.get('params', []))
+        except OverflowError:
+            response['error'] = {'code': -32005,
+                'message': 'query returned more than ' + str(self.max_results) + ' results'}
+        except (TypeError, ValueError, KeyError) as e:
+            response['error'] = {'code': -32602, 'message': 'invalid params: ' + str(e)}
+        return response
+
+    def _block_number(self, tag):
+        if tag in (None, 'latest', 'pending'):
+            return self.chain.head
+        if tag == 'earliest':
+            return 0
+        return int(tag, 16)
+
+    def rpc_eth_blockNumber(self):
+        return hex(self.chain.head)
+
+    def rpc_eth_getBlockByNumber(self, tag, full=False):
+        number = self._block_number(tag)
+        if number > self.chain.head:
+            return None
+        return {'number': hex(number), 'hash': '0x%064x' % number, 'gasLimit': hex(2000000), 'transactions': []}
+
+    def rpc_eth_getLogs(self, params):
+        address = params.get('address')
+        if address and address.lower() != CONTRACT_ADDRESS:
+            return []
+        return self.chain.get_logs(self._block_number(params.get('fromBlock', 'earliest')),
+            self._block_number(params.get('toBlock', 'latest')), params.get('topics'), self.max_results)
+
+    def rpc_eth_accounts(self):
+        return [ACCOUNT]
+
+    def rpc_eth_getTransactionCount(self, address, tag='latest'):
+        return hex(self._nonce)
+
+    def rpc_eth_estimateGas(self, transaction, tag=None):
+        return hex(GAS_ESTIMATE)
+
+    def rpc_eth_getCode(self, address, tag='latest'):
+        if address.lower() != CONTRACT_ADDRESS:
+            return '0x'
+        # the dispatcher of a contract with every function of the ABI, pushing each selector without
+        # its leading zero bytes and comparing it to that of the call
+        code = b''
+        for selector in self._functions:
+            pushed = selector.lstrip(b'\x00')
+            code += bytes(bytearray([0x5f + len(pushed)])) + pushed + b'\x14'
+        return '0x' + binascii.hexlify(code).decode('ascii')
+
+    def rpc_eth_call(self, transaction, tag=None):
+        # the registry does not change, so the block the call is pinned to does not matter
+        data = binascii.unhexlify(transaction.get('data', '0x')[2:])
+        function = self._functions.get(data[:4])
+        view = getattr(self.chain, 'view_' + function['name'], None) if function else None
+        if view is None:
+            return '0x'
+
+        values = view(*decode_values([arg['type'] for arg in function['inputs']], data[4:]))
+        result = encode_values([arg['type'] for arg in function['outputs']], values)
+        return '0x' + binascii.hexlify(result).decode('ascii')
+
+    def rpc_eth_sendTransaction(self, transaction):
+        with self._lock:
+            nonce = int(transaction['nonce'], 16) if 'nonce' in transaction else self._nonce
+            self._nonce = max(self._nonce, nonce + 1)
+            txhash = '0x' + binascii.hexlify(os.urandom(32)).decode('ascii')
+            self._receipts[txhash] = {
+                'transactionHash': txhash,
+                'blockNumber': hex(self.chain.head),
+                'blockHash': '0x%064x' % self.chain.head,
+                'gasUsed': hex(GAS_ESTIMATE),
+                'status': '0x1',
+                'logs': [],
+            }
+        return txhash
+
+    def rpc_eth_getTransactionReceipt(self, txhash):
+        return self._receipts.get(txhash)
+
+    def rpc_eth_getTransactionByHash(self, txhash):
+        receipt = self._receipts.get(txhash)
+        if receipt is None:
+            return None
+        return {'hash': txhash, 'blockNumber': receipt['blockNumber'], 'from': ACCOUNT}
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=100000, help='number of synthetic logs')
+    parser.add_argument('--logs-per-block', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum random milliseconds added')
+    parser.add_argument('--max-results', type=int, default=10000, help='eth_getLogs result limit, 0 for none')
+    args = parser.parse_args()
+
+    chain = SyntheticChain(args.events, args.logs_per_block, args.seed)
+    node = FakeNode(chain, args.latency / 1000.0, args.jitter / 1000.0, args.max_results or None,
+        port=args.port)
+    print("Serving %d logs in blocks %d to %d at %s, contract %s"
+        % (chain.count, chain.start_block, chain.head, node.url, CONTRACT_ADDRESS))
+    try:
+        node._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node._server.server_close()
+
+
+if __name__ == '__main__':
+    main()
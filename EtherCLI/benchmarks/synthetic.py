@@ -0,0 +1,125 @@
+"""Synthetic EtherPKI contract logs for benchmarks."""
+
+import binascii
+import random
+
+from etherpki.abicodec import LogDecoder
+from etherpki.ethapi import get_etherpki_abi
+
+
+def load_abi():
+    """Loads the EtherPKI contract ABI shipped with the CLI."""
+    return get_etherpki_abi()
+
+
+def _word(value):
+    return '%064x' % value
+
+
+def _encode_strings_and_bools(values):
+    """ABI-encodes the non-indexed arguments of an event, given as a list of str or bool values."""
+    head = []
+    tail = ''
+    offset = 32 * len(values)
+    for value in values:
+        if isinstance(value, bool):
+            head.append(_word(int(value)))
+        else:
+            encoded = binascii.hexlify(value.encode('utf-8')).decode('ascii')
+            padded = encoded.ljust(((len(encoded) + 63) // 64) * 64, '0')
+            head.append(_word(offset))
+            tail += _word(len(encoded) // 2) + padded
+            offset += 32 + len(padded) // 2
+    return '0x' + ''.join(head) + tail
+
+
+class LogFactory(object):
+    """Builds raw logs, as returned by eth_getLogs, for the events of the EtherPKI contract."""
+
+    def __init__(self, abi=None, address='0x' + '42' * 20):
+        decoder = LogDecoder(abi if abi is not None else load_abi())
+        self.address = address
+        self.attribute_topic = decoder.event_topic('AttributeAdded')
+        self.signature_topic = decoder.event_topic('AttributeSigned')
+        self.revocation_topic = decoder.event_topic('SignatureRevoked')
+
+    def _log(self, block_number, log_index, topics, data):
+        return {
+            'address': self.address,
+            'blockNumber': hex(block_number),
+            'logIndex': hex(log_index),
+            'blockHash': '0x' + _word(block_number),
+            'transactionHash': '0x' + _word((block_number << 16) | log_index),
+            'topics': topics,
+            'data': data,
+        }
+
+    def attribute(self, block_number, log_index, attributeID, owner, identifier, attributetype='email',
+            has_proof=False, data='', datahash=''):
+        return self._log(block_number, log_index, [
+            self.attribute_topic,
+            '0x' + _word(attributeID),
+            '0x' + owner.rjust(64, '0'),
+            '0x' + binascii.hexlify(identifier.ljust(32, b'\x00')).decode('ascii'),
+        ], _encode_strings_and_bools([attributetype, has_proof, data, datahash]))
+
+    def signature(self, block_number, log_index, signatureID, signer, attributeID, expiry):
+        return self._log(block_number, log_index, [
+            self.signature_topic,
+            '0x' + _word(signatureID),
+            '0x' + signer.rjust(64, '0'),
+            '0x' + _word(attributeID),
+        ], '0x' + _word(expiry))
+
+    def revocation(self, block_number, log_index, revocationID, signatureID):
+        return self._log(block_number, log_index, [
+            self.revocation_topic,
+            '0x' + _word(revocationID),
+            '0x' + _word(signatureID),
+        ], '0x')
+
+
+def make_registry(count, seed=0, signatures_per_attribute=3, revocation_rate=0.1, logs_per_block=20,
+        factory=None):
+    """
+    Generate the logs of a synthetic registry.
+
+    count:                      the approximate number of logs to generate
+    seed:                       the random seed, so that runs are reproducible
+    signatures_per_attribute:   the average number of signatures of an attribute
+    revocation_rate:            the fraction of signatures that are revoked
+    logs_per_block:             the number of logs in each block
+
+    returns a list of raw logs in (block number, log index) order
+    """
+    rng = random.Random(seed)
+    factory = factory or LogFactory()
+    owners = ['%040x' % rng.getrandbits(160) for _ in range(max(1, count // 50))]
+
+    logs = []
+    counters = {'attribute': 0, 'signature': 0, 'revocation': 0}
+
+    def position():
+        return (len(logs) // logs_per_block, len(logs) % logs_per_block)
+
+    while len(logs) < count:
+        attributeID = counters['attribute']
+        counters['attribute'] += 1
+        logs.append(factory.attribute(*position(), attributeID=attributeID, owner=rng.choice(owners),
+            identifier=('user%d@example.com' % attributeID).encode('ascii'),
+            data='synthetic attribute %d' % attributeID))
+
+        for _ in range(rng.randint(0, 2 * signatures_per_attribute)):
+            if len(logs) >= count:
+                break
+            signatureID = counters['signature']
+            counters['signature'] += 1
+            logs.append(factory.signature(*position(), signatureID=signatureID, signer=rng.choice(owners),
+                attributeID=attributeID, expiry=1500000000 + rng.randint(0, 10 ** 9)))
+
+            if rng.random() < revocation_rate and len(logs) < count:
+                logs.append(factory.revocation(*position(), revocationID=counters['revocation'],
+                    signatureID=signatureID))
+                counters['revocation'] += 1
+
+    return logs
@@ -0,0 +1,407 @@
+"""Precompiled encoding of EtherPKI contract calls and decoding of contract logs."""
+
+import binascii
+import struct
+
+from etherpki.keccak import keccak256
+
+# decoders and encoders already built, keyed by the id of their ABI
+_log_decoders = {}
+_call_encoders = {}
+_result_decoders = {}
+
+
+def contract_abi(abi):
+    """Returns the list of ABI entries of a contract ABI or of a compiled contract description."""
+    if isinstance(abi, dict):
+        return abi['abi']
+    return abi
+
+
+def event_signature(event):
+    """Returns the canonical signature of an ABI event entry, e.g. 'SignatureRevoked(uint256,uint256)'."""
+    return event['name'] + '(' + ','.join(arg['type'] for arg in event['inputs']) + ')'
+
+
+# functions have signatures of the same form
+function_signature = event_signature
+
+
+def function_selector(function):
+    """Returns the 4-byte selector identifying an ABI function entry in call data."""
+    return keccak256(function_signature(function).encode('ascii'))[:4]
+
+
+def get_log_decoder(abi):
+    """Returns the LogDecoder of an ABI, building it on first use."""
+    entry = _log_decoders.get(id(abi))
+    if entry is None:
+        entry = _log_decoders[id(abi)] = (abi, LogDecoder(abi))
+    return entry[1]
+
+
+def get_call_encoder(abi):
+    """Returns the CallEncoder of an ABI, building it on first use."""
+    entry = _call_encoders.get(id(abi))
+    if entry is None:
+        entry = _call_encoders[id(abi)] = (abi, CallEncoder(abi))
+    return entry[1]
+
+
+def get_result_decoder(abi):
+    """Returns the ResultDecoder of an ABI, building it on first use."""
+    entry = _result_decoders.get(id(abi))
+    if entry is None:
+        entry = _result_decoders[id(abi)] = (abi, ResultDecoder(abi))
+    return entry[1]
+
+
+def _read_uint(view, offset):
+    """Reads a 256-bit big-endian unsigned integer whose value fits in 64 bits."""
+    return struct.unpack_from('>Q', view, offset + 24)[0]
+
+
+def _topic_decoder(typ):
+    """Returns a function decoding an indexed argument of type typ from its hex topic."""
+    if typ.startswith('uint'):
+        return lambda topic: int(topic, 16)
+    elif typ.startswith('int'):
+        bits = int(typ[3:] or 256)
+        def decode_int(topic):
+            value = int(topic, 16) & ((1 << bits) - 1)
+            return value - (1 << bits) if value >> (bits - 1) else value
+        return decode_int
+    elif typ == 'address':
+        return lambda topic: topic[-40:].lower()
+    elif typ == 'bool':
+        return lambda topic: int(topic, 16) != 0
+    elif typ.startswith('bytes') and typ != 'bytes':
+        end = 2 + 2 * int(typ[5:])
+        return lambda topic: binascii.unhexlify(topic[2:end])
+    else:
+        # indexed dynamic values are only available as the hash of their contents
+        return lambda topic: binascii.unhexlify(topic[2:])
+
+
+def _data_decoder(typ):
+    """Returns a function decoding a non-indexed argument of type typ from its head slot."""
+    if typ == 'string':
+        def decode_string(data, offset):
+            start = _read_uint(data, offset)
+            length = _read_uint(data, start)
+            return data[start + 32:start + 32 + length].tobytes().decode('utf-8', 'replace')
+        return decode_string
+    elif typ == 'bytes':
+        def decode_bytes(data, offset):
+            start = _read_uint(data, offset)
+            length = _read_uint(data, start)
+            return data[start + 32:start + 32 + length].tobytes()
+        return decode_bytes
+    elif typ.startswith('uint'):
+        return lambda data, offset: int.from_bytes(data[offset:offset + 32], 'big')
+    elif typ.startswith('int'):
+        bits = int(typ[3:] or 256)
+        def decode_int(data, offset):
+            value = int.from_bytes(data[offset:offset + 32], 'big') & ((1 << bits) - 1)
+            return value - (1 << bits) if value >> (bits - 1) else value
+        return decode_int
+    elif typ == 'address':
+        return lambda data, offset: binascii.hexlify(data[offset + 12:offset + 32]).decode('ascii')
+    elif typ == 'bool':
+        return lambda data, offset: data[offset + 31] != 0
+    elif typ.startswith('bytes'):
+        length = int(typ[5:])
+        return lambda data, offset: data[offset:offset + length].tobytes()
+    raise ValueError("Unsupported ABI type: " + typ)
+
+
+class LogDecoder(object):
+    """Decodes raw logs of a contract's events.
+
+    The topic of every event and the layout of its arguments are computed once when the decoder is
+    built. Decoded logs are dictionaries of the event's arguments with the event name stored under
+    '_event_type', as returned by ContractTranslator.listen, except that string arguments are
+    decoded to text.
+    """
+
+    def __init__(self, abi):
+        """
+        abi: the contract ABI, or a compiled contract description containing it
+        """
+        self._events = {}
+        self._topics_by_name = {}
+
+        for entry in contract_abi(abi):
+            if entry.get('type') != 'event' or entry.get('anonymous'):
+                continue
+
+            topic = '0x' + binascii.hexlify(keccak256(event_signature(entry).encode('ascii'))).decode('ascii')
+
+            indexed = []
+            unindexed = []
+            for arg in entry['inputs']:
+                if arg['indexed']:
+                    indexed.append((arg['name'], _topic_decoder(arg['type'])))
+                else:
+                    unindexed.append((arg['name'], _data_decoder(arg['type']), 32 * len(unindexed)))
+
+            self._events[topic] = (entry['name'], tuple(indexed), tuple(unindexed))
+            self._topics_by_name[entry['name']] = topic
+
+    def event_topic(self, event_name):
+        """Returns the hex topic identifying an event, or None if there is no such event."""
+        return self._topics_by_name.get(event_name)
+
+    def decode(self, log):
+        """
+        Decode a single raw log.
+
+        log: a log as returned by eth_getLogs
+
+        returns the decoded log, or None if it is not an event of this contract
+        """
+        topics = log['topics']
+        if not topics:
+            return None
+
+        event = self._events.get(topics[0].lower())
+        if event is None:
+            return None
+
+        (name, indexed, unindexed) = event
+        decoded = {'_event_type': name}
+
+        for ((argname, decode), topic) in zip(indexed, topics[1:]):
+            decoded[argname] = decode(topic)
+
+        if unindexed:
+            data = memoryview(binascii.unhexlify(log['data'][2:]))
+            for (argname, decode, offset) in unindexed:
+                decoded[argname] = decode(data, offset)
+
+        return decoded
+
+    def decode_many(self, logs):
+        """
+        Decode a batch of raw logs, skipping logs that are not events of this contract.
+
+        logs: logs as returned by eth_getLogs
+        """
+        # same as decode, with lookups hoisted out of the loop
+        events = self._events
+        unhexlify = binascii.unhexlify
+        decoded_logs = []
+        append = decoded_logs.append
+
+        for log in logs:
+            topics = log['topics']
+            event = events.get(topics[0].lower()) if topics else None
+            if event is None:
+                continue
+
+            (name, indexed, unindexed) = event
+            decoded = {'_event_type': name}
+
+            for ((argname, decode), topic) in zip(indexed, topics[1:]):
+                decoded[argname] = decode(topic)
+
+            if unindexed:
+                data = memoryview(unhexlify(log['data'][2:]))
+                for (argname, decode, offset) in unindexed:
+                    decoded[argname] = decode(data, offset)
+
+            append(decoded)
+
+        return decoded_logs
+
+
+def _is_dynamic(typ):
+    return typ in ('string', 'bytes') or typ.endswith('[]')
+
+
+def _static_encoder(typ):
+    """Returns a function encoding a value of the static type typ as one 32-byte slot."""
+    if typ.startswith('uint'):
+        bits = int(typ[4:] or 256)
+        def encode_uint(value):
+            value = int(value)
+            if not 0 <= value < (1 << bits):
+                raise ValueError("Value out of range for " + typ + ": " + str(value))
+            return value.to_bytes(32, 'big')
+        return encode_uint
+    elif typ.startswith('int'):
+        bits = int(typ[3:] or 256)
+        def encode_int(value):
+            value = int(value)
+            if not -(1 << (bits - 1)) <= value < (1 << (bits - 1)):
+                raise ValueError("Value out of range for " + typ + ": " + str(value))
+            return (value % (1 << 256)).to_bytes(32, 'big')
+        return encode_int
+    elif typ == 'address':
+        def encode_address(value):
+            if isinstance(value, int):
+                return value.to_bytes(32, 'big')
+            if isinstance(value, str):
+                value = binascii.unhexlify(value[2:] if value.startswith('0x') else value)
+            if len(value) != 20:
+                raise ValueError("Invalid address: " + repr(value))
+            return value.rjust(32, b'\x00')
+        return encode_address
+    elif typ == 'bool':
+        return lambda value: (b'\x00' * 31) + (b'\x01' if value else b'\x00')
+    elif typ.startswith('bytes'):
+        length = int(typ[5:])
+        def encode_fixed_bytes(value):
+            # text is encoded as UTF-8, like identifiers given on the command line
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            if len(value) > length:
+                raise ValueError("Value too long for " + typ + ": " + repr(value))
+            return value.ljust(32, b'\x00')
+        return encode_fixed_bytes
+    raise ValueError("Unsupported ABI type: " + typ)
+
+
+def _encoder(typ):
+    """Returns a function encoding a value of type typ, as its head slot if static or its tail if dynamic."""
+    if typ == 'string' or typ == 'bytes':
+        def encode_bytes(value):
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            padding = -len(value) % 32
+            return len(value).to_bytes(32, 'big') + value + b'\x00' * padding
+        return encode_bytes
+    elif typ.endswith('[]'):
+        element = typ[:-2]
+        (dynamic, encode) = (_is_dynamic(element), _encoder(element))
+        def encode_array(values):
+            return len(values).to_bytes(32, 'big') + _encode_tuple([(dynamic, encode)] * len(values), values)
+        return encode_array
+    elif typ.endswith(']'):
+        raise ValueError("Unsupported ABI type: " + typ)
+    return _static_encoder(typ)
+
+
+def _encode_tuple(encoders, values):
+    """Encodes values as consecutive head slots, with dynamic values in a tail after them."""
+    if len(values) != len(encoders):
+        raise ValueError("Expected %d values, got %d" % (len(encoders), len(values)))
+
+    heads = []
+    tails = []
+    offset = 32 * len(encoders)
+    for ((dynamic, encode), value) in zip(encoders, values):
+        if dynamic:
+            tail = encode(value)
+            heads.append(offset.to_bytes(32, 'big'))
+            tails.append(tail)
+            offset += len(tail)
+        else:
+            heads.append(encode(value))
+
+    return b''.join(heads) + b''.join(tails)
+
+
+def encode_values(types, values):
+    """Encodes values of ABI types as they are laid out in call data after the selector, or in call results."""
+    return _encode_tuple([(_is_dynamic(typ), _encoder(typ)) for typ in types], values)
+
+
+def _decoder(typ):
+    """Returns a function decoding a value of type typ from its head slot, like _data_decoder but also for arrays."""
+    if typ.endswith('[]'):
+        decode = _decoder(typ[:-2])
+        def decode_array(data, offset):
+            start = _read_uint(data, offset)
+            length = _read_uint(data, start)
+            # the elements are laid out like the values of a tuple
+            elements = data[start + 32:]
+            return [decode(elements, 32 * index) for index in range(length)]
+        return decode_array
+    elif typ.endswith(']'):
+        raise ValueError("Unsupported ABI type: " + typ)
+    return _data_decoder(typ)
+
+
+def decode_values(types, data):
+    """Decodes values of ABI types from bytes laid out as by encode_values."""
+    data = memoryview(data)
+    return [_decoder(typ)(data, 32 * index) for (index, typ) in enumerate(types)]
+
+
+class CallEncoder(object):
+    """Encodes calls of a contract's functions as transaction data.
+
+    The selector of every function and the encoders of its arguments are computed once when the
+    encoder is built. Arguments are given as with ContractTranslator.encode; arrays are lists, and
+    arrays of strings are supported.
+    """
+
+    def __init__(self, abi):
+        """
+        abi: the contract ABI, or a compiled contract description containing it
+        """
+        self._functions = {}
+
+        for entry in contract_abi(abi):
+            if entry.get('type') != 'function':
+                continue
+
+            selector = function_selector(entry)
+            encoders = tuple((_is_dynamic(arg['type']), _encoder(arg['type'])) for arg in entry['inputs'])
+            self._functions[entry['name']] = (selector, encoders)
+
+    def encode(self, function, args):
+        """
+        Encode a call of a contract function.
+
+        function:   the name of the function
+        args:       the list of arguments of the function
+
+        returns the transaction data as bytes
+        """
+        try:
+            (selector, encoders) = self._functions[function]
+        except KeyError:
+            raise ValueError("Unknown contract function: " + function)
+        return selector + _encode_tuple(encoders, args)
+
+
+class ResultDecoder(object):
+    """Decodes the results of calls of a contract's functions, as returned by eth_call.
+
+    Values are decoded as by LogDecoder, and arrays to lists.
+    """
+
+    def __init__(self, abi):
+        """
+        abi: the contract ABI, or a compiled contract description containing it
+        """
+        self._functions = {}
+
+        for entry in contract_abi(abi):
+            if entry.get('type') == 'function':
+                self._functions[entry['name']] = tuple(_decoder(arg['type']) for arg in entry['outputs'])
+
+    def decode(self, function, result):
+        """
+        Decode the result of a call.
+
+        function:   the name of the function
+        result:     the result as returned by eth_call, hex with 0x, or as bytes
+
+        returns the list of the outputs of the function
+        """
+        try:
+            decoders = self._functions[function]
+        except KeyError:
+            raise ValueError("Unknown contract function: " + function)
+
+        if isinstance(result, str):
+            result = binascii.unhexlify(result[2:])
+        if len(result) < 32 * len(decoders):
+            # e.g. the result of a call to an address without code
+            raise ValueError("Result of " + function + " is too short: " + repr(result))
+
+        data = memoryview(result)
+        return [decode(data, 32 * index) for (index, decode) in enumerate(decoders)]
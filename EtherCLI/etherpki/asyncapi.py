@@ -0,0 +1,513 @@
+"""asyncio counterparts of the Events and Transactions APIs.
+
+Requires aiohttp, installed with the 'async' extra. JSON-RPC calls are made on an async HTTP
+transport, while IPFS and GPG work, which only has blocking interfaces, is run in an executor.
+Results are the same as those of the blocking API.
+"""
+
+import asyncio
+import binascii
+import itertools
+
+from etherpki import metrics
+from etherpki.abicodec import get_call_encoder
+from etherpki.abicodec import get_log_decoder
+from etherpki.datahash import compute_datahash
+from etherpki.ethapi import DEFAULT_RPC_URL
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import NON_IDEMPOTENT_METHODS
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import _filter_params
+from etherpki.ethapi import _transaction_params
+from etherpki.ethapi import encode_api_data
+from etherpki.ethapi import encode_topic
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.events import MAX_TOPICS_PER_QUERY
+from etherpki.events import _chunks
+from etherpki.events import apply_attribute_blocks
+from etherpki.events import join_signatures_status
+from etherpki.events import pgp_proof_matches
+from etherpki.gpgapi import generate_pgp_attribute_data
+from etherpki.gpgapi import process_proof
+from etherpki.ipfsapi import get_block
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.ipfsapi import put_block
+from etherpki.ipfsapi import release_block
+from etherpki.logfetch import is_range_rpc_error
+from etherpki.logfetch import log_sort_key
+from etherpki.logfetch import settings as logfetch_settings
+from etherpki.transactions import GAS_MARGIN
+
+
+class AsyncRPCTransport(object):
+    """A JSON-RPC 2.0 transport over aiohttp, with a bounded number of requests in flight."""
+
+    def __init__(self, url=DEFAULT_RPC_URL, max_concurrency=10, timeout=30, retries=3, backoff=0.5):
+        """
+        url:                the URL of the Ethereum client's JSON-RPC endpoint
+        max_concurrency:    the maximum number of requests in flight, and of connections kept open
+        timeout:            seconds to wait for a response before giving up
+        retries:            how many times a failed request is retried
+        backoff:            seconds to wait before the first retry, doubled after each attempt
+        """
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        # created on first use, inside the event loop
+        self._session = None
+        self._semaphore = None
+
+        self._ids = itertools.count(1)
+
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _post(self, payload, retry):
+        """Posts a JSON-RPC payload, retrying with exponential backoff on transport errors."""
+        import aiohttp
+
+        session = self._get_session()
+        delay = self.backoff
+        attempt = 0
+
+        calls = payload if isinstance(payload, list) else [payload]
+        if metrics.settings['enabled']:
+            for call in calls:
+                metrics.count('rpc.calls.' + call['method'])
+
+        while True:
+            try:
+                async with self._semaphore:
+                    with metrics.stage('rpc.' + calls[0]['method'] if len(calls) == 1 else 'rpc.batch'):
+                        async with session.post(self.url, json=payload) as response:
+                            if response.status < 500:
+                                return await response.json(content_type=None)
+                            response.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not retry or attempt >= self.retries:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    def _payload(self, method, params):
+        return {
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': params if params is not None else [],
+            'id': next(self._ids),
+        }
+
+    async def request(self, method, params=None):
+        """
+        Make a JSON-RPC call and return its result.
+
+        method: the name of the JSON-RPC method
+        params: the list of parameters
+        """
+        response = await self._post(self._payload(method, params), method not in NON_IDEMPOTENT_METHODS)
+        if 'error' in response:
+            raise RPCError(response['error'])
+        return response.get('result')
+
+    async def batch(self, calls):
+        """
+        Make several JSON-RPC calls in a single batch request.
+
+        calls:  a list of (method, params) tuples
+
+        returns a list of results in the same order as calls, with an RPCError in place of the
+        result of each call that failed
+        """
+        if not calls:
+            return []
+
+        payload = [self._payload(method, params) for (method, params) in calls]
+        retry = not any(method in NON_IDEMPOTENT_METHODS for (method, _) in calls)
+        responses = await self._post(payload, retry)
+
+        if isinstance(responses, dict):
+            # the client rejected the batch as a whole
+            raise RPCError(responses.get('error') or {'message': 'Invalid batch response'})
+
+        responses_by_id = dict((response.get('id'), response) for response in responses)
+        results = []
+        for call in payload:
+            response = responses_by_id.get(call['id'])
+            if response is None:
+                results.append(RPCError({'message': 'No response for ' + call['method']}))
+            elif 'error' in response:
+                results.append(RPCError(response['error']))
+            else:
+                results.append(response.get('result'))
+        return results
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncEthClient(object):
+    """asyncio counterpart of EthClient."""
+
+    def __init__(self, transport=None):
+        """
+        transport: the AsyncRPCTransport to send calls over, created with default settings if None
+        """
+        self.transport = transport if transport is not None else AsyncRPCTransport()
+
+    async def request(self, method, params=None):
+        return await self.transport.request(method, params)
+
+    async def batch(self, calls):
+        """Make several calls in one request, see AsyncRPCTransport.batch."""
+        return await self.transport.batch(calls)
+
+    async def get_accounts(self):
+        return await self.request('eth_accounts')
+
+    async def get_block_number(self):
+        return int(await self.request('eth_blockNumber'), 16)
+
+    async def get_logs(self, from_block=None, to_block=None, address=None, topics=None):
+        return await self.request('eth_getLogs', [_filter_params(from_block, to_block, address, topics)])
+
+    async def get_transaction_receipt(self, txn_hash):
+        return await self.request('eth_getTransactionReceipt', [txn_hash])
+
+    async def get_transaction_count(self, address, block='pending'):
+        return int(await self.request('eth_getTransactionCount', [address, block]), 16)
+
+    async def estimate_gas(self, _from=None, to=None, data=None):
+        return int(await self.request('eth_estimateGas', [_transaction_params(_from, to, None, data)]), 16)
+
+    async def call(self, _from=None, to=None, gas=None, data=None, block='latest'):
+        return await self.request('eth_call', [_transaction_params(_from, to, gas, data), block])
+
+    async def send_transaction(self, _from=None, to=None, gas=None, data=None, nonce=None):
+        return await self.request('eth_sendTransaction', [_transaction_params(_from, to, gas, data, nonce)])
+
+    async def close(self):
+        await self.transport.close()
+
+
+def _is_range_error(error):
+    """Returns True if an error means the block range of a query should be reduced."""
+    return isinstance(error, asyncio.TimeoutError) or is_range_rpc_error(error)
+
+
+class AsyncEvents(object):
+    """asyncio counterpart of Events.
+
+    Queries are answered from the Ethereum client, with the block range of each query fetched as
+    concurrent chunks, rather than from the local event index.
+    """
+
+    def __init__(self, address=ETHERPKI_DEFAULT_ADDRESS, client=None, executor=None, chunk_size=None,
+            max_concurrency=None):
+        """
+        address:            the Ethereum address of the contract
+        client:             the AsyncEthClient to use, created with default settings if None
+        executor:           the concurrent.futures executor running IPFS and GPG work, or None for
+                            the event loop's default executor
+        chunk_size:         the block range of each log query, defaults to the log fetching setting
+        max_concurrency:    the number of block ranges of a query fetched at once, defaults to the
+                            number of requests the client's transport keeps in flight
+        """
+        self.address = address
+        self._owns_client = client is None
+        self.client = client if client is not None else AsyncEthClient()
+        self.executor = executor
+        self.chunk_size = chunk_size or logfetch_settings['initial_chunk']
+        self.min_chunk = logfetch_settings['min_chunk']
+        self.max_concurrency = max_concurrency or getattr(self.client.transport, 'max_concurrency', 10)
+
+        self._decoder = get_log_decoder(get_etherpki_abi())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the client if it was created by this instance."""
+        if self._owns_client:
+            await self.client.close()
+
+    def _run_in_executor(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _fetch_range(self, topics, start, end):
+        """Fetches the logs of a block range, splitting it if the client reports it is too large."""
+        try:
+            return await self.client.get_logs(
+                from_block=encode_api_data(start),
+                to_block=encode_api_data(end),
+                address=self.address,
+                topics=topics,
+            )
+        except Exception as e:
+            if end - start < self.min_chunk or not _is_range_error(e):
+                raise
+
+        middle = (start + end) // 2
+        (first, second) = await asyncio.gather(
+            self._fetch_range(topics, start, middle),
+            self._fetch_range(topics, middle + 1, end),
+        )
+        return first + second
+
+    async def _fetch_ranges(self, topics, ranges):
+        """Fetches the logs of block ranges, with at most max_concurrency ranges in flight.
+
+        returns a list with the logs of each range, in the order of ranges
+        """
+        chunks = [None] * len(ranges)
+        remaining = iter(enumerate(ranges))
+
+        async def worker():
+            # the workers share one iterator, so each range is fetched by the first worker free
+            for (index, (start, end)) in remaining:
+                chunks[index] = await self._fetch_range(topics, start, end)
+
+        await asyncio.gather(*[worker() for _ in range(min(self.max_concurrency, len(ranges)))])
+        return chunks
+
+    async def _get_logs(self, topics, event_name=None):
+        """
+        Get logs of the events that occur.
+
+        topics:     a list of topics to search based on
+        event_name: the name of the event
+        """
+        # set topic to the ID if the name is specified
+        if event_name is None:
+            event_topic = None
+        else:
+            event_topic = self._decoder.event_topic(event_name)
+
+        topics = [encode_topic(topic) for topic in [event_topic] + topics]
+
+        latest = await self.client.get_block_number()
+        ranges = [(start, min(start + self.chunk_size - 1, latest))
+            for start in range(0, latest + 1, self.chunk_size)]
+
+        chunks = await self._fetch_ranges(topics, ranges)
+
+        logs = [log for chunk in chunks for log in chunk]
+        logs.sort(key=log_sort_key)
+        return self._decoder.decode_many(logs)
+
+    async def filter_attributes(self, attributeID=None, owner=None, identifier=None):
+        """Filter and get attributes, see Events.filter_attributes."""
+        return await self._get_logs([attributeID, owner, identifier], event_name='AttributeAdded')
+
+    async def filter_signatures(self, signatureID=None, signer=None, attributeID=None):
+        """Filter and get signatures, see Events.filter_signatures."""
+        return await self._get_logs([signatureID, signer, attributeID], event_name='AttributeSigned')
+
+    async def filter_revocations(self, revocationID=None, signatureID=None):
+        """Filter and get revocations, see Events.filter_revocations."""
+        return await self._get_logs([revocationID, signatureID], event_name='SignatureRevoked')
+
+    async def _filter_chunked(self, query, name, values):
+        """Runs a filter over values in chunks of MAX_TOPICS_PER_QUERY, concurrently."""
+        results = await asyncio.gather(*[query(**{name: chunk})
+            for chunk in _chunks(values, MAX_TOPICS_PER_QUERY)])
+        return [result for chunk in results for result in chunk]
+
+    async def get_attribute_signatures_status(self, attributeID):
+        """Get all of the signatures of an attribute and check their expiration."""
+        return (await self.get_signatures_status_many([attributeID]))[attributeID]
+
+    async def get_signatures_status_many(self, attribute_ids):
+        """Get the signatures status of several attributes at once, see Events.get_signatures_status_many."""
+        attribute_ids = list(attribute_ids)
+
+        rawsignatures = await self._filter_chunked(self.filter_signatures, 'attributeID', attribute_ids)
+
+        signature_ids = [rawsignature['signatureID'] for rawsignature in rawsignatures]
+        rawrevocations = await self._filter_chunked(self.filter_revocations, 'signatureID', signature_ids)
+
+        return join_signatures_status(attribute_ids, rawsignatures, rawrevocations)
+
+    async def resolve_attribute_data(self, attributes):
+        """
+        Replace ipfs-block:// URIs in the data of attributes by the contents of the IPFS blocks, see
+        Events.resolve_attribute_data. The blocks are fetched concurrently, and checked against
+        their dataHash, in the executor.
+        """
+        cids = list(set(cid for cid in (parse_block_uri(attribute['data']) for attribute in attributes)
+            if cid is not None))
+        blocks = await asyncio.gather(*[self._run_in_executor(get_block, cid) for cid in cids],
+            return_exceptions=True)
+        try:
+            return await self._run_in_executor(apply_attribute_blocks, attributes, dict(zip(cids, blocks)))
+        finally:
+            for block in blocks:
+                release_block(block)
+
+    async def verify_attribute_pgp_proof(self, attribute):
+        """
+        Verify the PGP proof of an attribute in the executor.
+
+        Return True if valid, False if invalid, or None if the proof is unspecified.
+        """
+        if not attribute['hasProof']:
+            return None
+
+        return pgp_proof_matches(attribute, await self._run_in_executor(process_proof, attribute['data']))
+
+    async def retrieve_attribute(self, attributeID):
+        """Get an attribute, its status, signatures status, see Events.retrieve_attribute."""
+        (rawattributes, signatures_status) = await asyncio.gather(
+            self.filter_attributes(attributeID=attributeID),
+            self.get_attribute_signatures_status(attributeID),
+        )
+
+        if not rawattributes:
+            return None
+
+        attribute = rawattributes[0]
+        attribute['signatures_status'] = signatures_status
+
+        # download ipfs data if needed
+        await self.resolve_attribute_data([attribute])
+
+        # verify PGP proof
+        if attribute['attributeType'] == 'pgp-key':
+            attribute['proof_valid'] = await self.verify_attribute_pgp_proof(attribute)
+
+        # set proof validity to unknown if the attribute has proof but unable to be processed
+        if attribute['hasProof'] and 'proof_valid' not in attribute:
+            attribute['proof_valid'] = None
+
+        return attribute
+
+    async def retrieve_attributes(self, attribute_ids):
+        """Retrieve several attributes concurrently, see retrieve_attribute."""
+        return await asyncio.gather(*[self.retrieve_attribute(attributeID) for attributeID in attribute_ids])
+
+
+class AsyncTransactions(object):
+    """asyncio counterpart of Transactions."""
+
+    def __init__(self, from_address=None, to_address=ETHERPKI_DEFAULT_ADDRESS, client=None, executor=None):
+        """
+        from_address:   the Ethereum address transactions should come from, defaults to the first
+                        account of the Ethereum client
+        to_address:     the Ethereum EtherPKI contract address
+        client:         the AsyncEthClient to use, created with default settings if None
+        executor:       the concurrent.futures executor running IPFS and GPG work, or None for the
+                        event loop's default executor
+        """
+        self.from_address = from_address
+        self.to_address = to_address
+        self._owns_client = client is None
+        self.client = client if client is not None else AsyncEthClient()
+        self.executor = executor
+
+        self._callencoder = get_call_encoder(get_etherpki_abi())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the client if it was created by this instance."""
+        if self._owns_client:
+            await self.client.close()
+
+    def _run_in_executor(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def _get_from_address(self):
+        if self.from_address is None:
+            # uses the first Ethereum account address if none is specified
+            self.from_address = (await self.client.get_accounts())[0]
+        return self.from_address
+
+    def encode_call(self, function, args):
+        """Encodes a call of a contract function as transaction data, see Transactions.encode_call."""
+        return self._callencoder.encode(function, args)
+
+    async def estimate_gas(self, data):
+        """Estimates the gas a transaction needs, including GAS_MARGIN."""
+        estimate = await self.client.estimate_gas(
+            _from=await self._get_from_address(),
+            to=self.to_address,
+            data=encode_api_data(data),
+        )
+        return int(estimate * GAS_MARGIN)
+
+    async def _send_transaction(self, data, gas=None, nonce=None):
+        """Sends a transaction to the Ethereum client, see Transactions._send_transaction."""
+        if gas is None:
+            gas = await self.estimate_gas(data)
+
+        return await self.client.send_transaction(
+            _from=await self._get_from_address(),
+            to=self.to_address,
+            data=encode_api_data(data),
+            gas=gas,
+            nonce=nonce,
+        )
+
+    async def add_attribute(self, attributetype, has_proof, identifier, data, datahash):
+        """Sends a transaction to add an attribute, see Transactions.add_attribute."""
+        args = [attributetype, has_proof, identifier, data, datahash]
+        return await self._send_transaction(self.encode_call('addAttribute', args))
+
+    async def add_attribute_with_hash(self, attributetype, has_proof, identifier, data):
+        """
+        Sends a transaction to add an attribute, see Transactions.add_attribute_with_hash. The data
+        is hashed in the executor.
+        """
+        datahash = await self._run_in_executor(compute_datahash, data)
+        return await self.add_attribute(attributetype, has_proof, identifier, data, datahash)
+
+    async def add_attribute_over_ipfs(self, attributetype, has_proof, identifier, data):
+        """Sends a transaction to add an attribute & stores and hashes the data on IPFS in the executor."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        (ipfs_key, datahash) = await asyncio.gather(
+            self._run_in_executor(put_block, data),
+            self._run_in_executor(compute_datahash, data),
+        )
+        ipfs_uri = 'ipfs-block://' + ipfs_key
+        return await self.add_attribute(attributetype, has_proof, identifier, ipfs_uri, datahash)
+
+    async def add_pgp_attribute_over_ipfs(self, keyid):
+        """Send a transaction to add an identity PGP attribute, storing the data on IPFS."""
+        (fingerprint, data) = await self._run_in_executor(
+            generate_pgp_attribute_data, keyid, await self._get_from_address())
+
+        return await self.add_attribute_over_ipfs(
+            attributetype='pgp-key',
+            has_proof=True,
+            identifier=binascii.unhexlify(fingerprint),
+            data=data,
+        )
+
+    async def sign_attribute(self, attributeID, expiry):
+        """Send a transaction to sign an attribute, see Transactions.sign_attribute."""
+        return await self._send_transaction(self.encode_call('signAttribute', [attributeID, expiry]))
+
+    async def revoke_signature(self, signatureID):
+        """Sends a transaction to revoke a signature, see Transactions.revoke_signature."""
+        return await self._send_transaction(self.encode_call('revokeSignature', [signatureID]))
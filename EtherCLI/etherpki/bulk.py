@@ -0,0 +1,328 @@
+"""Bulk submission of EtherPKI transactions read from a file.
+
+Nonces are assigned locally, so that many transactions can be sent without waiting for each to be
+mined, and every step is written to a journal so that an interrupted submission can be resumed
+without sending any row twice.
+"""
+
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from etherpki.datahash import HASH_WORKERS
+from etherpki.datahash import iter_datahashes
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import encode_api_data
+from etherpki.receipts import EVENT_IDS
+from etherpki.receipts import ReceiptTracker
+
+# default number of transactions sent but not yet mined
+DEFAULT_IN_FLIGHT = 16
+
+# row statuses that mean a row does not need to be sent again
+FINAL_STATUSES = ('mined', 'failed', 'unknown')
+
+
+def read_rows(path):
+    """
+    Read the rows of a JSONL or CSV file. Files ending in .csv are read as CSV with a header line,
+    any other file as one JSON object per line.
+
+    yields tuples of (row number, dictionary of fields)
+    """
+    with open(path) as rowfile:
+        if path.lower().endswith('.csv'):
+            for (number, row) in enumerate(csv.DictReader(rowfile), 1):
+                yield (number, row)
+        else:
+            for (number, line) in enumerate(rowfile, 1):
+                if line.strip():
+                    yield (number, json.loads(line))
+
+
+def row_key(row):
+    """Returns a hash identifying the content of a row, to detect input files changed between runs."""
+    return hashlib.sha1(json.dumps(row, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'y')
+    return bool(value)
+
+
+def attribute_call(row, datahash=''):
+    """
+    Converts a bulk-add row to an addAttribute call.
+
+    row:        a dictionary with the fields attributetype, identifier and optionally data,
+                datahash and has_proof.
+    datahash:   the datahash used if the row has none, e.g. from with_datahashes.
+
+    returns a tuple of (function name, arguments)
+    """
+    return ('addAttribute', [
+        row['attributetype'],
+        _parse_bool(row.get('has_proof', False)),
+        row['identifier'],
+        row.get('data') or '',
+        row.get('datahash') or datahash,
+    ])
+
+
+def with_datahashes(rows, workers=HASH_WORKERS):
+    """
+    Compute the datahash of bulk-add rows that have data but no datahash, hashing several rows at
+    once, see datahash.iter_datahashes.
+
+    rows:       an iterable of (row number, row) tuples, as from read_rows
+    workers:    the number of rows hashed at once
+
+    yields tuples of (row number, row, datahash), in order, the datahash being '' for rows that do
+    not need one
+
+    raises ValueError if the data of a row cannot be hashed, e.g. because its IPFS block cannot be
+    fetched
+    """
+    (rows, hashed) = itertools.tee(rows)
+    payloads = ('' if row.get('datahash') else row.get('data') or '' for (_, row) in hashed)
+
+    for ((number, row), datahash) in zip(rows, iter_datahashes(payloads, workers=workers)):
+        if isinstance(datahash, Exception):
+            raise ValueError("Cannot hash the data of row " + str(number) + ": " + str(datahash))
+        yield (number, row, datahash)
+
+
+def signature_call(row, now):
+    """
+    Converts a bulk-sign row to a signAttribute call.
+
+    row: a dictionary with the field attributeid and either expiry, in unix time, or expires, in
+         days from now (default: 365).
+    now: the unix time expires is counted from.
+
+    returns a tuple of (function name, arguments)
+    """
+    if row.get('expiry') not in (None, ''):
+        expiry = int(row['expiry'])
+    else:
+        expiry = int(now) + int(row.get('expires') or 365) * 60 * 60 * 24
+    return ('signAttribute', [int(row['attributeid']), expiry])
+
+
+def call_shape(function, args):
+    """
+    Returns a key grouping calls that use the same amount of gas.
+
+    Gas depends on the number of 32-byte words of text arguments and on the values of boolean flags,
+    not on the values of numbers, addresses or the content of text.
+    """
+    shape = [function]
+    for arg in args:
+        if isinstance(arg, bool):
+            shape.append(arg)
+        elif isinstance(arg, (str, bytes)):
+            if not isinstance(arg, bytes):
+                arg = arg.encode('utf-8')
+            shape.append((len(arg) + 31) // 32)
+        else:
+            shape.append(None)
+    return tuple(shape)
+
+
+class Journal(object):
+    """An append-only record of the progress of a bulk submission, one JSON object per line.
+
+    Each line updates the fields of one row: key, the hash of the row; nonce, recorded before the
+    transaction is sent; transaction, its hash once the client accepted it; and status.
+    """
+
+    def __init__(self, path):
+        """
+        path: the path of the journal file, created if it does not exist
+        """
+        self.path = path
+        self.entries = {}
+
+        if os.path.exists(path):
+            with open(path, 'rb+') as journalfile:
+                content = journalfile.read()
+                # drop a line left incomplete by a crash
+                complete = content[:content.rfind(b'\n') + 1]
+                if len(complete) != len(content):
+                    journalfile.truncate(len(complete))
+
+            for line in complete.decode('utf-8').splitlines():
+                fields = json.loads(line)
+                self.entries.setdefault(fields.pop('row'), {}).update(fields)
+
+        self._file = open(path, 'a')
+
+    def record(self, row, **fields):
+        """Durably records new fields of a row."""
+        self._file.write(json.dumps(dict(fields, row=row), sort_keys=True) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entries.setdefault(row, {}).update(fields)
+
+    def close(self):
+        self._file.close()
+
+
+class BulkSubmitter(object):
+    """Sends many transactions from one account, keeping up to a fixed number in flight."""
+
+    def __init__(self, transactions, journal, in_flight=DEFAULT_IN_FLIGHT, confirmations=1):
+        """
+        transactions:   the Transactions instance to send with
+        journal:        the Journal recording progress
+        in_flight:      the maximum number of transactions sent but not yet confirmed
+        confirmations:  the number of blocks a transaction needs before it is reported as mined
+        """
+        self.transactions = transactions
+        self.client = transactions.client
+        self.journal = journal
+        self.in_flight = in_flight
+
+        self.tracker = ReceiptTracker(self.client, confirmations, address=transactions.to_address)
+
+        self._gas = {}
+        self._pending = {}
+        self._nonce = None
+
+    def _estimate(self, function, args, data):
+        """Returns the gas limit for a call, estimating it once per call shape."""
+        shape = call_shape(function, args)
+        if shape not in self._gas:
+            self._gas[shape] = self.transactions.estimate_gas(data)
+        return self._gas[shape]
+
+    def _recover(self):
+        """
+        Works out the state of rows an earlier run left unfinished.
+
+        Transactions still known to the client are waited for again. A row whose nonce was recorded
+        but whose transaction hash was not is considered sent if the account has used that nonce.
+        Every other unfinished row is sent again.
+        """
+        address = self.transactions.from_address
+        used_nonces = None
+
+        for (row, entry) in sorted(self.journal.entries.items()):
+            if entry.get('status') in FINAL_STATUSES:
+                continue
+
+            if entry.get('transaction'):
+                if self.client.get_transaction_by_hash(entry['transaction']) is not None:
+                    self._track(entry['transaction'], row)
+                    continue
+                self.journal.record(row, status='dropped')
+            elif entry.get('nonce') is not None and entry.get('status') is None:
+                if used_nonces is None:
+                    used_nonces = self.client.get_transaction_count(address, 'pending')
+                if entry['nonce'] < used_nonces:
+                    self.journal.record(row, status='unknown')
+                else:
+                    self.journal.record(row, status='dropped')
+
+    def _track(self, txhash, row):
+        self._pending[txhash] = row
+        self.tracker.track(txhash)
+
+    def _wait(self, limit):
+        """Polls for receipts until at most limit transactions are in flight.
+
+        yields progress dictionaries of the transactions that were confirmed
+        """
+        while len(self._pending) > limit:
+            confirmed = self.tracker.poll()
+            for result in confirmed:
+                row = self._pending.pop(result['transaction'])
+                ids = dict((name, result[name]) for name in EVENT_IDS.values() if name in result)
+                self.journal.record(row, status=result['status'], block=result['block'], **ids)
+                yield dict(ids, row=row, status=result['status'], transaction=result['transaction'],
+                    block=result['block'])
+            if not confirmed and len(self._pending) > limit:
+                time.sleep(self.tracker.next_interval())
+
+    def _send(self, row, data, gas):
+        """Sends one transaction with the next local nonce.
+
+        returns a progress dictionary
+        """
+        address = self.transactions.from_address
+        nonce = self._nonce
+
+        self.journal.record(row, nonce=nonce, transaction=None, status=None)
+        try:
+            txhash = self.client.send_transaction(
+                _from=address,
+                to=self.transactions.to_address,
+                gas=gas,
+                data=encode_api_data(data),
+                nonce=nonce,
+            )
+        except Exception as e:
+            # if the client did not take the nonce, the row failed and the nonce is reused
+            self._nonce = self.client.get_transaction_count(address, 'pending')
+            if self._nonce > nonce:
+                self.journal.record(row, status='unknown')
+                return {'row': row, 'status': 'unknown', 'transaction': None}
+            self.journal.record(row, status='error', error=str(e))
+            return {'row': row, 'status': 'error', 'error': str(e)}
+
+        self._nonce = nonce + 1
+        self.journal.record(row, transaction=txhash)
+        self._track(txhash, row)
+        return {'row': row, 'status': 'sent', 'transaction': txhash}
+
+    def submit(self, calls):
+        """
+        Send transactions, resuming from the journal.
+
+        calls:  an iterable of (row number, row key, function name, arguments) tuples
+
+        yields progress dictionaries with the keys row and status, one of 'skipped' for rows
+        finished by an earlier run, 'sent', 'mined', 'failed' for transactions that were mined but
+        reverted, 'unknown' for transactions that were sent but whose hash was lost, and 'error'
+        for transactions the client rejected. 'sent' is followed by 'mined' or 'failed' once the
+        transaction is confirmed, together with the attributeID or signatureID it was assigned.
+        """
+        self._recover()
+        waiting = set(self._pending.values())
+
+        self._nonce = self.client.get_transaction_count(self.transactions.from_address, 'pending')
+
+        for (row, key, function, args) in calls:
+            entry = self.journal.entries.get(row, {})
+            if entry.get('key', key) != key:
+                raise ValueError("Row " + str(row) + " changed since the journal was written")
+
+            if entry.get('status') in FINAL_STATUSES:
+                yield {'row': row, 'status': 'skipped'}
+                continue
+            if row in waiting:
+                continue
+
+            for progress in self._wait(self.in_flight - 1):
+                yield progress
+
+            if 'key' not in entry:
+                self.journal.record(row, key=key)
+
+            data = self.transactions.encode_call(function, args)
+            try:
+                gas = self._estimate(function, args, data)
+            except RPCError as e:
+                # the call would revert, e.g. because the attribute to sign does not exist
+                self.journal.record(row, status='error', error=str(e))
+                yield {'row': row, 'status': 'error', 'error': str(e)}
+                continue
+
+            yield self._send(row, data, gas)
+
+        for progress in self._wait(0):
+            yield progress
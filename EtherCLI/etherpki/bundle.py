@@ -0,0 +1,335 @@
+"""Self-contained bundles proving the state of an attribute, for verification without a node.
+
+A bundle holds the header of a block, the proofs of the contract storage slots that make up an
+attribute, its signatures and whether they are revoked at that block, and the IPFS block of its
+data. Every value is read back from the proofs when the bundle is verified, so the only thing the
+verifier has to trust is the hash of the block, which it can pin, or confirm with a single call to
+any node. Like a stapled OCSP response, a bundle says nothing about revocations after its block,
+so verifiers should bound its age.
+
+The storage layout read is that of the contract state variables, in declaration order:
+
+    0   Attribute[] attributes          6 slots per attribute
+    1   Signature[] signatures          3 slots per signature
+    4   mapping(uint => uint[]) signaturesOfAttribute
+    5   mapping(uint => bool) revoked
+    6   mapping(uint => uint) revocationOfSignature
+
+Contracts deployed from builds older than the mappings keep none of this in storage, so bundles
+are only exported from contracts with the view functions that came with them, LAYOUT_FUNCTIONS.
+
+A bundle file is MAGIC followed by the RLP list [contract address, attributeID, encoded block
+header, trie nodes, IPFS block].
+"""
+
+import binascii
+import time
+
+import rlp
+
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import ethclient
+from etherpki.ethapi import get_deployed_functions
+from etherpki.ethapi import require_functions
+from etherpki.events import apply_attribute_blocks
+from etherpki.events import build_signatures_status
+from etherpki.events import pgp_proof_matches
+from etherpki.gpgapi import process_proof
+from etherpki.ipfsapi import get_block
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.ipfsapi import release_block
+from etherpki.ipfsapi import verify_block
+from etherpki.stateproof import ProvenStorage
+from etherpki.stateproof import StorageProofFetcher
+from etherpki.stateproof import index_nodes
+from etherpki.keccak import keccak256
+from etherpki.stateproof import slot_key
+
+MAGIC = b'EPKIBN1\n'
+
+ATTRIBUTES_SLOT = 0
+SIGNATURES_SLOT = 1
+SIGNATURES_OF_ATTRIBUTE_SLOT = 4
+REVOKED_SLOT = 5
+REVOCATION_OF_SIGNATURE_SLOT = 6
+
+# the number of slots of the Attribute and Signature structs, and the offsets of their fields
+ATTRIBUTE_SIZE = 6
+ATTRIBUTE_FIELDS = ('owner', 'attributeType', 'hasProof', 'identifier', 'data', 'dataHash')
+ATTRIBUTE_STRINGS = ('attributeType', 'data', 'dataHash')
+SIGNATURE_SIZE = 3
+
+# functions of the contract added together with the storage layout above
+LAYOUT_FUNCTIONS = ('getSignaturesForAttribute', 'isRevoked')
+
+# bounds on what is read, so that a forged bundle cannot make a verifier build huge lists of slots
+MAX_SIGNATURES = 10000
+MAX_STRING_SLOTS = 4096
+
+SLOT_COUNT = 2 ** 256
+
+
+def _array_base(slot):
+    """Returns the first slot of the elements of the dynamic array at slot."""
+    return int.from_bytes(keccak256(slot_key(slot)), 'big')
+
+
+def _mapping_slot(slot, key):
+    """Returns the slot of the value of an integer key of the mapping at slot."""
+    return int.from_bytes(keccak256(slot_key(key) + slot_key(slot)), 'big')
+
+
+def _string_slots(slot, value):
+    """Returns the slots holding the content of the string at slot, given the value of slot."""
+    if not value & 1:
+        # strings of up to 31 bytes are kept in their slot
+        return []
+    length = (value - 1) // 2
+    if length > MAX_STRING_SLOTS * 32:
+        raise ValueError("String of " + str(length) + " bytes is too long to read")
+    base = _array_base(slot)
+    return [(base + index) % SLOT_COUNT for index in range((length + 31) // 32)]
+
+
+def _decode_string(value, content):
+    """Decodes the string with the given slot value and content slot values."""
+    if not value & 1:
+        encoded = slot_key(value)[:(value & 0xff) // 2]
+    else:
+        encoded = b''.join(slot_key(word) for word in content)[:(value - 1) // 2]
+    return encoded.decode('utf-8', 'replace')
+
+
+def _address(value):
+    return binascii.hexlify(slot_key(value)[12:]).decode('ascii')
+
+
+def _pack_address(address):
+    address = address[2:] if address.startswith('0x') else address
+    if len(address) != 40:
+        raise ValueError("Invalid contract address: " + repr(address))
+    return binascii.unhexlify(address)
+
+
+def read_attribute_state(storage, attributeID):
+    """
+    Read an attribute, its signatures and their revocations from contract storage.
+
+    The slots are read in three rounds, each depending on the values of the one before.
+
+    storage:        an object with a read_many method returning the values of a list of slots, a
+                    ProvenStorage or StorageProofFetcher
+    attributeID:    the ID of the attribute
+
+    returns a tuple of (attribute, signatures, revocations) in the form of decoded logs, as for
+    events.build_signatures_status, or None if there is no such attribute
+    """
+    attribute_slot = (_array_base(ATTRIBUTES_SLOT) + attributeID * ATTRIBUTE_SIZE) % SLOT_COUNT
+    ids_slot = _mapping_slot(SIGNATURES_OF_ATTRIBUTE_SLOT, attributeID)
+
+    values = storage.read_many([ATTRIBUTES_SLOT, ids_slot]
+        + [(attribute_slot + offset) % SLOT_COUNT for offset in range(ATTRIBUTE_SIZE)])
+    (attribute_count, signature_count) = values[:2]
+    fields = dict(zip(ATTRIBUTE_FIELDS, values[2:]))
+    if attributeID >= attribute_count:
+        return None
+    if signature_count > MAX_SIGNATURES:
+        raise ValueError("Attribute ID #" + str(attributeID) + " has too many signatures to read: "
+            + str(signature_count))
+
+    # the content of long strings and the IDs of the signatures
+    string_slots = dict((name, _string_slots((attribute_slot + ATTRIBUTE_FIELDS.index(name)) % SLOT_COUNT,
+        fields[name]))
+        for name in ATTRIBUTE_STRINGS)
+    ids_base = _array_base(ids_slot)
+    slots = [slot for name in ATTRIBUTE_STRINGS for slot in string_slots[name]]
+    values = storage.read_many(slots + [(ids_base + index) % SLOT_COUNT for index in range(signature_count)])
+
+    attribute = {
+        '_event_type': 'AttributeAdded',
+        'attributeID': attributeID,
+        'owner': _address(fields['owner']),
+        'hasProof': bool(fields['hasProof'] & 0xff),
+        'identifier': slot_key(fields['identifier']),
+    }
+    for name in ATTRIBUTE_STRINGS:
+        content = values[:len(string_slots[name])]
+        values = values[len(string_slots[name]):]
+        attribute[name] = _decode_string(fields[name], content)
+    signature_ids = values
+
+    # the signatures and whether they are revoked
+    signatures_base = _array_base(SIGNATURES_SLOT)
+    slots = []
+    for signatureID in signature_ids:
+        signature_slot = (signatures_base + signatureID * SIGNATURE_SIZE) % SLOT_COUNT
+        slots += [(signature_slot + offset) % SLOT_COUNT for offset in range(SIGNATURE_SIZE)]
+        slots += [_mapping_slot(REVOKED_SLOT, signatureID), _mapping_slot(REVOCATION_OF_SIGNATURE_SLOT, signatureID)]
+    values = storage.read_many(slots)
+
+    signatures = []
+    revocations = {}
+    for (index, signatureID) in enumerate(signature_ids):
+        (signer, signed_attribute, expiry, revoked, revocationID) = values[index * 5:index * 5 + 5]
+        signatures.append({
+            '_event_type': 'AttributeSigned',
+            'signatureID': signatureID,
+            'signer': _address(signer),
+            'attributeID': signed_attribute,
+            'expiry': expiry,
+        })
+        if revoked:
+            # the field name is spelled as in the contract ABI
+            revocations[signatureID] = [{
+                '_event_type': 'SignatureRevoked',
+                'revocationID': revocationID,
+                'signratureID': signatureID,
+            }]
+
+    return (attribute, signatures, revocations)
+
+
+def encode_bundle(address, attributeID, header, nodes, payload):
+    """Returns the bytes of a bundle, see the module documentation."""
+    return MAGIC + rlp.encode([address, attributeID, header, sorted(nodes), payload])
+
+
+def decode_bundle(data):
+    """
+    Decode the bytes of a bundle.
+
+    returns a dictionary with the keys address, attributeID, header, nodes and payload
+
+    raises ValueError if data is not a bundle
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an EtherPKI bundle")
+    try:
+        (address, attributeID, header, nodes, payload) = rlp.decode(data[len(MAGIC):])
+    except (rlp.DecodingError, ValueError, TypeError):
+        raise ValueError("Corrupt EtherPKI bundle")
+    if not isinstance(nodes, list) or len(address) != 20:
+        raise ValueError("Corrupt EtherPKI bundle")
+    return {
+        'address': address,
+        'attributeID': int.from_bytes(attributeID, 'big'),
+        'header': header,
+        'nodes': nodes,
+        'payload': payload,
+    }
+
+
+def export_bundle(attributeID, block=None, address=ETHERPKI_DEFAULT_ADDRESS, client=None, get=get_block):
+    """
+    Build the bundle of an attribute.
+
+    attributeID:    the ID of the attribute
+    block:          the number of the block the bundle proves the state at, the latest if None
+    address:        the address of the EtherPKI contract
+    client:         the EthClient to read with, which must support eth_getProof
+    get:            the function getting an IPFS block by its CID
+
+    returns the bytes of the bundle, or None if there is no such attribute
+
+    raises ValueError if the contract does not have the storage layout of the module documentation
+    """
+    client = client if client is not None else ethclient
+    require_functions(get_deployed_functions(client, address), address, LAYOUT_FUNCTIONS)
+    if block is None:
+        block = client.get_block_number()
+
+    fetcher = StorageProofFetcher(client, _pack_address(address), block)
+    state = read_attribute_state(fetcher, attributeID)
+    if state is None:
+        return None
+
+    cid = parse_block_uri(state[0]['data'])
+    payload = b''
+    if cid is not None:
+        block = get(cid)
+        try:
+            payload = bytes(block)
+        finally:
+            release_block(block)
+
+    return encode_bundle(fetcher.address, attributeID, fetcher.header, fetcher.nodes.values(), payload)
+
+
+def _hash_matches(digest, block_hash):
+    if block_hash is None:
+        return None
+    return binascii.hexlify(digest).decode('ascii') == block_hash.lower().replace('0x', '', 1)
+
+
+def verify_bundle(data, address=ETHERPKI_DEFAULT_ADDRESS, block_hash=None, at=None, max_age=None):
+    """
+    Verify a bundle without a node.
+
+    data:       the bytes of the bundle
+    address:    the address of the EtherPKI contract the bundle must be of, unchecked if empty
+    block_hash: the hash of the block the bundle must be anchored in, as hex, unchecked if None
+    at:         the unix time to check expiration and the age of the bundle against, defaults to
+                the current time
+    max_age:    the maximum age of the block of the bundle, in seconds, unchecked if None
+
+    returns a dictionary with the keys attribute, with signatures_status, data_valid and
+    proof_valid set as by Events.retrieve_attribute; block, a dictionary with the number, hash and
+    timestamp of the block; age, in seconds; contract_valid, block_valid and fresh, each None if
+    unchecked; and verdict, 'invalid' if any check failed, 'unanchored' if the contract or block
+    was unchecked, otherwise 'valid'
+
+    raises ValueError if the bundle is corrupt or its proofs are incomplete
+    """
+    if at is None:
+        at = time.time()
+
+    bundle = decode_bundle(data)
+    storage = ProvenStorage(bundle['header'], bundle['address'], index_nodes(bundle['nodes']))
+    state = read_attribute_state(storage, bundle['attributeID'])
+    if state is None:
+        raise ValueError("The bundle proves that attribute ID #" + str(bundle['attributeID'])
+            + " does not exist")
+    (attribute, signatures, revocations) = state
+
+    # signatures of other attributes cannot be in signaturesOfAttribute, but check anyway
+    signatures = [signature for signature in signatures if signature['attributeID'] == attribute['attributeID']]
+    attribute['signatures_status'] = build_signatures_status(signatures, revocations, at)
+
+    cid = parse_block_uri(attribute['data'])
+    if cid is not None:
+        payload = bundle['payload']
+        if verify_block(cid, payload) is False:
+            payload = ValueError("The IPFS block in the bundle does not match its CID")
+        apply_attribute_blocks([attribute], {cid: payload})
+    else:
+        apply_attribute_blocks([attribute], {})
+
+    if attribute['attributeType'] == 'pgp-key' and attribute['hasProof'] and 'data_error' not in attribute:
+        attribute['proof_valid'] = pgp_proof_matches(attribute, process_proof(attribute['data']))
+    if attribute['hasProof'] and 'proof_valid' not in attribute:
+        attribute['proof_valid'] = None
+
+    header = storage.header
+    result = {
+        'attribute': attribute,
+        'block': {
+            'number': header['number'],
+            'hash': '0x' + binascii.hexlify(header['hash']).decode('ascii'),
+            'timestamp': header['timestamp'],
+        },
+        'age': at - header['timestamp'],
+        'contract_valid': bundle['address'] == _pack_address(address) if address else None,
+        'block_valid': _hash_matches(header['hash'], block_hash),
+        'fresh': at - header['timestamp'] <= max_age if max_age is not None else None,
+    }
+
+    checks = [result['contract_valid'], result['block_valid'], result['fresh'],
+        attribute.get('data_valid'), attribute.get('proof_valid')]
+    if False in checks or 'data_error' in attribute:
+        result['verdict'] = 'invalid'
+    elif result['contract_valid'] is None or result['block_valid'] is None:
+        result['verdict'] = 'unanchored'
+    else:
+        result['verdict'] = 'valid'
+    return result
+
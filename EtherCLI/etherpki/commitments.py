@@ -0,0 +1,235 @@
+"""Commitments to batches of attributes by the root of a Merkle tree over them.
+
+Instead of one addAttribute transaction per attribute, a batch is committed to by a single
+commitAttributes transaction storing the root of a Merkle tree whose leaves are the attributes.
+The attributes are published as a manifest of IPFS blocks: an index block, whose URI goes
+on-chain with the root, and pages of PAGE_SIZE attributes, each with the proof of its inclusion in
+the tree. An attribute is retrieved with two blocks whatever the size of the batch, and checked
+against the root locally.
+
+The root and the number of attributes are taken from the chain; those in the index block are
+only used to detect a manifest that does not belong to its commitment.
+"""
+
+import binascii
+import json
+import tempfile
+
+from etherpki.abicodec import encode_values
+from etherpki.ipfsapi import IPFS_BLOCK_SCHEME
+from etherpki.ipfsapi import block_text
+from etherpki.ipfsapi import get_block
+from etherpki.ipfsapi import release_block
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.ipfsapi import put_block
+from etherpki.merkle import MerkleBuilder
+from etherpki.merkle import leaf_hash
+from etherpki.merkle import verify_proof
+
+MANIFEST_VERSION = 1
+
+# number of attributes in a page of a manifest
+PAGE_SIZE = 256
+
+# a leaf is an attribute's fields encoded as they would be passed to addAttribute
+LEAF_TYPES = ('string', 'bool', 'bytes32', 'string', 'string')
+
+
+def normalize_identifier(identifier):
+    """Returns an identifier as the 32 bytes it is stored as, text being encoded as UTF-8."""
+    if isinstance(identifier, str):
+        identifier = identifier.encode('utf-8')
+    if len(identifier) > 32:
+        raise ValueError("Identifier longer than 32 bytes: " + repr(identifier))
+    return identifier.ljust(32, b'\x00')
+
+
+def attribute_leaf(attribute):
+    """
+    Get the leaf content of an attribute.
+
+    attribute: a dictionary with the fields attributeType, hasProof, identifier, data and dataHash
+    """
+    return encode_values(LEAF_TYPES, [attribute['attributeType'], bool(attribute['hasProof']),
+        normalize_identifier(attribute['identifier']), attribute['data'], attribute['dataHash']])
+
+
+def _hex(value):
+    return '0x' + binascii.hexlify(value).decode('ascii')
+
+
+def _unhex(value):
+    return binascii.unhexlify(value[2:] if value.startswith('0x') else value)
+
+
+def _iter_batches(lines, size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_commitment(attributes, put=put_block, page_size=PAGE_SIZE):
+    """
+    Build the Merkle tree of a batch of attributes and publish its manifest.
+
+    The attributes are read once and spooled to a temporary file until the tree is complete and
+    their proofs are known, so only their leaf hashes are kept in memory.
+
+    attributes: an iterable of dictionaries with the fields attributeType, hasProof, identifier,
+                data and dataHash
+    put:        the function storing a block and returning its CID
+    page_size:  the number of attributes in a page of the manifest
+
+    returns a dictionary with the keys root, as 32 bytes, count and uri, the arguments of
+    commitAttributes
+
+    raises ValueError if there are no attributes
+    """
+    builder = MerkleBuilder()
+    pages = []
+
+    with tempfile.TemporaryFile() as spool:
+        for attribute in attributes:
+            builder.add(attribute_leaf(attribute))
+            entry = {
+                'attributeType': attribute['attributeType'],
+                'hasProof': bool(attribute['hasProof']),
+                'identifier': _hex(normalize_identifier(attribute['identifier'])),
+                'data': attribute['data'],
+                'dataHash': attribute['dataHash'],
+            }
+            spool.write(json.dumps(entry, sort_keys=True).encode('utf-8') + b'\n')
+
+        if not builder.count:
+            raise ValueError("No attributes to commit")
+
+        tree = builder.tree()
+        spool.seek(0)
+        for (number, lines) in enumerate(_iter_batches(spool, page_size)):
+            first = number * page_size
+            entries = []
+            for (offset, line) in enumerate(lines):
+                entry = json.loads(line.decode('utf-8'))
+                entry['proof'] = [_hex(digest) for digest in tree.proof(first + offset)]
+                entries.append(entry)
+            page = {'version': MANIFEST_VERSION, 'first': first, 'attributes': entries}
+            pages.append(put(json.dumps(page, sort_keys=True).encode('utf-8')))
+
+    index = {
+        'version': MANIFEST_VERSION,
+        'root': _hex(tree.root()),
+        'count': tree.count,
+        'page_size': page_size,
+        'pages': pages,
+    }
+    cid = put(json.dumps(index, sort_keys=True).encode('utf-8'))
+
+    return {'root': tree.root(), 'count': tree.count, 'uri': IPFS_BLOCK_SCHEME + cid}
+
+
+def _load_block(uri, get):
+    cid = parse_block_uri(uri)
+    if cid is None:
+        raise ValueError("Not an IPFS block URI: " + uri)
+    block = get(cid)
+    try:
+        document = json.loads(block_text(block))
+    finally:
+        release_block(block)
+    if document.get('version') != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version: " + str(document.get('version')))
+    return document
+
+
+def load_index(commitment, get=get_block):
+    """
+    Get the index block of the manifest of a commitment.
+
+    commitment: a decoded AttributesCommitted event
+    get:        the function getting a block by its CID
+
+    raises ValueError if the index does not belong to the commitment
+    """
+    index = _load_block(commitment['uri'], get)
+    if _unhex(index['root']) != commitment['root'] or index['count'] != commitment['count']:
+        raise ValueError("Manifest does not match commitment #" + str(commitment['commitmentID']))
+    return index
+
+
+def committed_attribute(commitment, position, entry):
+    """
+    Check an entry of a manifest page against its commitment.
+
+    commitment: a decoded AttributesCommitted event
+    position:   the position of the attribute in the batch
+    entry:      the entry of the attribute in its page
+
+    returns the attribute in the form of a decoded AttributeAdded event, with the commitmentID and
+    position of the attribute instead of an attributeID, and inclusion_valid set to whether the
+    proof of its inclusion is valid
+    """
+    attribute = {
+        '_event_type': 'AttributeAdded',
+        'commitmentID': commitment['commitmentID'],
+        'position': position,
+        'owner': commitment['owner'],
+        'attributeType': entry['attributeType'],
+        'hasProof': entry['hasProof'],
+        'identifier': _unhex(entry['identifier']),
+        'data': entry['data'],
+        'dataHash': entry['dataHash'],
+    }
+
+    try:
+        digest = leaf_hash(attribute_leaf(attribute))
+        proof = [_unhex(sibling) for sibling in entry['proof']]
+    except (ValueError, TypeError, KeyError):
+        attribute['inclusion_valid'] = False
+        return attribute
+
+    attribute['inclusion_valid'] = verify_proof(digest, position, commitment['count'], proof, commitment['root'])
+    return attribute
+
+
+def get_committed_attribute(commitment, position, get=get_block):
+    """
+    Get an attribute of a commitment from its manifest, checking the proof of its inclusion.
+
+    commitment: a decoded AttributesCommitted event
+    position:   the position of the attribute in the batch
+    get:        the function getting a block by its CID
+
+    returns the attribute as returned by committed_attribute, or None if there is no attribute at
+    that position
+    """
+    if not 0 <= position < commitment['count']:
+        return None
+
+    index = load_index(commitment, get)
+    (number, offset) = divmod(position, index['page_size'])
+    page = _load_block(IPFS_BLOCK_SCHEME + index['pages'][number], get)
+    return committed_attribute(commitment, position, page['attributes'][offset])
+
+
+def iter_committed_attributes(commitment, get=get_block):
+    """
+    Get every attribute of a commitment, checking the proofs of their inclusion.
+
+    yields the attributes as returned by committed_attribute, in order
+    """
+    index = load_index(commitment, get)
+    position = 0
+    for cid in index['pages']:
+        page = _load_block(IPFS_BLOCK_SCHEME + cid, get)
+        for entry in page['attributes']:
+            yield committed_attribute(commitment, position, entry)
+            position += 1
+
+    if position != commitment['count']:
+        raise ValueError("Manifest of commitment #" + str(commitment['commitmentID']) + " has "
+            + str(position) + " attributes instead of " + str(commitment['count']))
@@ -1,13 +1,20 @@
 """Console application for EtherPKI"""
 
 import atexit
+import binascii
+import json
 import logging
 import time
 
 import click
 
-from etherpki.transactions import Transactions
-from etherpki.events import Events
+# Events and Transactions are imported by the commands that use them, so that commands which
+# never touch the chain do not pay for loading the Ethereum, GPG and IPFS libraries.
+from etherpki import daemon
+from etherpki import ethapi
+from etherpki import logfetch
+from etherpki import metrics
+from etherpki import statereader
 from etherpki import userconfig
 
 # helper method for later
@@ -17,27 +24,140 @@ def echo_attribute_block(attribute, signatures_status=None):
         signatures_status = attribute['signatures_status']
 
     # Encode attribute identifier as hex if it contains non-ASCII characters.
-    if not all(ord(c) < 128 for c in attribute['identifier']):
-        attribute['identifier'] = '0x' + attribute['identifier'].rstrip('\x00').encode('hex')
+    identifier = attribute['identifier'].rstrip(b'\x00')
+    if all(c < 128 for c in identifier):
+        identifier = identifier.decode('ascii')
+    else:
+        identifier = '0x' + binascii.hexlify(identifier).decode('ascii')
 
-    click.echo("Attribute ID #" + str(attribute['attributeID']) + ':')
+    if 'commitmentID' in attribute:
+        click.echo("Attribute #" + str(attribute['position']) + " of commitment ID #"
+            + str(attribute['commitmentID']) + ':')
+    else:
+        click.echo("Attribute ID #" + str(attribute['attributeID']) + ':')
     click.echo("\tType: " + attribute['attributeType'])
     click.echo("\tOwner: " + attribute['owner']
         + (" [trusted]" if userconfig.is_trusted(attribute['owner']) else " [untrusted]"))
-    click.echo("\tIdentifier: " + attribute['identifier'])
+    click.echo("\tIdentifier: " + identifier)
 
     if signatures_status is not None:
         valid_signatures = signatures_status['status']['valid']
         click.echo("\t[" + str(valid_signatures) + " valid signature"
             + ("]" if valid_signatures == 1 else "s]"))
 
+def echo_data_status(attribute):
+    """Echo whether the data of an attribute matches its datahash, if it has one."""
+    if not attribute.get('dataHash'):
+        return
+
+    click.echo("Data hash status:")
+    if 'data_error' in attribute:
+        click.echo("\tUnavailable: " + attribute['data_error'])
+    elif attribute.get('data_valid') is None:
+        click.echo("\tUnknown")
+    elif attribute['data_valid']:
+        click.echo("\tValid")
+    else:
+        click.echo("\tINVALID")
+    click.echo()
+
+def echo_attribute_status(attribute):
+    """Echo whether the proof and data of an attribute are valid, and the status of its signatures."""
+    if 'proof_valid' in attribute:
+        if 'commitmentID' in attribute:
+            click.echo("Proof status:")
+        else:
+            click.echo("Proof status for attribute ID #" + str(attribute['attributeID']) + ':')
+        if attribute['proof_valid'] is None:
+            click.echo("\tUnknown")
+        elif attribute['proof_valid']:
+            click.echo("\tValid")
+        else:
+            click.echo("\tINVALID")
+        click.echo()
+
+    echo_data_status(attribute)
+
+    if 'signatures_status' not in attribute:
+        return
+
+    click.echo("Signatures for attribute ID #" + str(attribute['attributeID']) + ':')
+    for signature in attribute['signatures_status']['signatures']:
+        sig_line = "\t#" + str(signature['signatureID'])
+
+        if signature['revocation']:
+            sig_line += " [revoked]"
+        elif signature['expired']:
+            sig_line += " [expired]"
+        elif signature['valid']:
+            sig_line += " [valid]"
+
+        sig_line += " by " + signature['signer']
+        sig_line += (" [trusted]" if userconfig.is_trusted(signature['signer']) else " [untrusted]")
+        click.echo(sig_line)
+    click.echo()
+
+def wait_options(command):
+    """Adds the --wait and --confirmations options of commands that send a transaction."""
+    command = click.option('--confirmations', help='Wait until the transaction has this many confirmations',
+        type=click.IntRange(1))(command)
+    return click.option('--wait', is_flag=True, help='Wait until the transaction is mined')(command)
+
+def echo_transaction(transactions, txhash, wait=False, confirmations=None):
+    """Echo the outcome of a sent transaction, waiting for it to be mined if asked to."""
+    if not wait and confirmations is None:
+        click.echo("Transaction sent.")
+        return
+
+    from etherpki.receipts import ReceiptTracker
+
+    click.echo("Transaction " + txhash + " sent, waiting for it to be mined...")
+    tracker = ReceiptTracker(transactions.client, confirmations or 1, address=transactions.to_address)
+    result = tracker.wait(txhash)
+
+    if result['status'] == 'failed':
+        raise click.ClickException("Transaction failed in block #" + str(result['block']) + ".")
+
+    click.echo("Transaction mined in block #" + str(result['block']) + " (" + str(result['confirmations'])
+        + " confirmation" + ("" if result['confirmations'] == 1 else "s") + ").")
+    for (idname, label) in (('attributeID', "Attribute"), ('signatureID', "Signature"),
+            ('revocationID', "Revocation"), ('commitmentID', "Commitment")):
+        ids = result.get(idname + 's', [])
+        if len(ids) == 1:
+            click.echo(label + " ID #" + str(ids[0]))
+        elif ids:
+            click.echo(label + " IDs " + ", ".join("#" + str(id_) for id_ in ids))
+
 @click.group()
-def main():
+@click.option('--rpc-url', default=ethapi.DEFAULT_RPC_URL, help='Ethereum client JSON-RPC URL', type=str)
+@click.option('--rpc-timeout', default=30, help='Seconds to wait for the Ethereum client', type=float)
+@click.option('--rpc-retries', default=3, help='Retries of failed Ethereum client requests', type=int)
+@click.option('--log-workers', help='Concurrent log queries', type=click.IntRange(1))
+@click.option('--log-min-chunk', help='Smallest block range per log query', type=click.IntRange(1))
+@click.option('--log-max-chunk', help='Largest block range per log query', type=click.IntRange(1))
+@click.option('--no-daemon', is_flag=True, help='Do not answer queries through a running daemon')
+@click.option('--daemon-socket', help='Socket of the daemon (default: in the cache directory)', type=str)
+@click.option('--profile', is_flag=True, help='Print the time spent in each stage on exit')
+@click.option('--state-reads', is_flag=True,
+    help='Read the registry from contract state with eth_call instead of from logs')
+def main(rpc_url, rpc_timeout, rpc_retries, log_workers, log_min_chunk, log_max_chunk, no_daemon,
+        daemon_socket, profile, state_reads):
     # Prevent the requests module from printing INFO logs to the console.
     logging.getLogger("requests").setLevel(logging.WARNING)
 
+    ethapi.configure_client(url=rpc_url, timeout=rpc_timeout, retries=rpc_retries)
+    logfetch.configure(workers=log_workers, min_chunk=log_min_chunk, max_chunk=log_max_chunk)
+    statereader.configure(enabled=state_reads)
+    # the daemon answers from its log index
+    daemon.configure(enabled=not no_daemon and not state_reads, socket=daemon_socket)
+
     # Save the configuration on exit.
-    atexit.register(userconfig.config.write)
+    atexit.register(userconfig.save)
+
+    if profile:
+        metrics.configure(enabled=True)
+        started = time.perf_counter()
+        atexit.register(lambda: click.echo("\n" + metrics.report(time.perf_counter() - started), err=True))
 
 @click.command()
 @click.option('--attributetype', prompt=True, type=str)
@@ -45,87 +165,108 @@ def main():
 @click.option('--identifier', prompt=True, type=str)
 @click.option('--data', prompt=True, type=str)
 @click.option('--datahash', prompt=True, type=str)
-def rawaddattribute(attributetype, has_proof, identifier, data, datahash):
+@wait_options
+def rawaddattribute(attributetype, has_proof, identifier, data, datahash, wait, confirmations):
     """(Advanced) Manually add an attribute to your identity."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.add_attribute(attributetype, has_proof, identifier, data, datahash)
+    txhash = transactions.add_attribute(attributetype, has_proof, identifier, data, datahash)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--attributeid', prompt=True, type=int)
 @click.option('--expiry', prompt=True, type=str)
-def rawsignattribute(attributeid, expiry):
+@wait_options
+def rawsignattribute(attributeid, expiry, wait, confirmations):
     """(Advanced) Manually sign an attribute about an identity."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.sign_attribute(attributeid, expiry)
+    txhash = transactions.sign_attribute(attributeid, expiry)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--signatureid', prompt=True, type=str)
-def rawrevokeattribute(signatureid):
+@wait_options
+def rawrevokeattribute(signatureid, wait, confirmations):
     """(Advanced) Manaully revoke your signature of an attribute."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.revoke_signature(signatureid)
+    txhash = transactions.revoke_signature(signatureid)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--attributetype', prompt='Attribute type', help='Attribute type', type=str)
 @click.option('--identifier', prompt='Attribute identifier', help='Attribute identifier', type=str)
 @click.option('--data', prompt='Attribute data', default='', help='Attribute data', type=str)
-def add(attributetype, identifier, data):
+@wait_options
+def add(attributetype, identifier, data, wait, confirmations):
     """Add an attribute to your identity."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.add_attribute_with_hash(attributetype, False, identifier, data)
+    txhash = transactions.add_attribute_with_hash(attributetype, False, identifier, data)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--attributetype', prompt='Attribute type', help='Attribute type', type=str)
 @click.option('--identifier', prompt='Attribute identifier', help='Attribute identifier', type=str)
 @click.option('--data', prompt='Attribute data', default='', help='Attribute data', type=str)
-def ipfsadd(attributetype, identifier, data):
+@wait_options
+def ipfsadd(attributetype, identifier, data, wait, confirmations):
     """Add an attribute to your identity over IPFS."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.add_attribute_over_ipfs(attributetype, False, identifier, data)
+    txhash = transactions.add_attribute_over_ipfs(attributetype, False, identifier, data)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--attributeid', prompt='Attribute ID', help='Attribute ID', type=int)
 @click.option('--expires', prompt='Signature days to expire', default=365, help='Signature days to expire', type=int)
-def sign(attributeid, expires):
+@wait_options
+def sign(attributeid, expires, wait, confirmations):
     """Sign an attribute."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
 
     expiry = int(time.time()) + expires * 60 * 60 * 24
-    transactions.sign_attribute(attributeid, expiry)
+    txhash = transactions.sign_attribute(attributeid, expiry)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
 @click.option('--signatureid', prompt='Signature ID', help='Signature ID', type=int)
-def revoke(signatureid):
+@wait_options
+def revoke(signatureid, wait, confirmations):
     """Revoke one of your signatures."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
-    transactions.revoke_signature(signatureid)
+    txhash = transactions.revoke_signature(signatureid)
 
     click.echo()
-    click.echo("Transaction sent.")
+    echo_transaction(transactions, txhash, wait, confirmations)
 
 
 @click.command()
@@ -137,7 +278,10 @@ def trust(address):
     if userconfig.is_trusted(address):
         click.echo("Address " + address + " is already trusted.")
     else:
-        userconfig.trust(address)
+        try:
+            userconfig.trust(address)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--address')
         click.echo("Address " + address + " trusted.")
 
 
@@ -157,15 +301,100 @@ def untrust(address):
 @click.command()
 def trusted():
     """View the list of trusted Ethereum addresses."""
-    for address in userconfig.get_trusted():
-        click.echo(address)
+    addresses = userconfig.get_trusted()
+    if addresses:
+        click.echo('\n'.join(addresses))
+
+
+@click.command('trust-import')
+@click.argument('source', type=click.File('r'))
+@click.option('--replace', is_flag=True, help='Untrust every address not in SOURCE')
+def trust_import(source, replace):
+    """Trust the addresses listed in SOURCE, one per line."""
+    from etherpki.truststore import pack_address
+
+    addresses = []
+    for (number, line) in enumerate(source, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            pack_address(line)
+        except ValueError as e:
+            raise click.ClickException(str(e) + " (line " + str(number) + ")")
+        addresses.append(line)
+
+    truststore = userconfig.get_truststore()
+    if replace:
+        (added, removed) = truststore.replace(addresses)
+    else:
+        (added, removed) = (truststore.add_many(addresses), 0)
+
+    click.echo(str(added) + " addresses trusted, " + str(removed) + " untrusted, "
+        + str(len(truststore)) + " in the truststore.", err=True)
+
+
+@click.command('trust-export')
+@click.argument('destination', default='-', type=click.File('w'))
+def trust_export(destination):
+    """Write the trusted addresses to DESTINATION, one per line."""
+    for address in userconfig.get_truststore():
+        destination.write(address + '\n')
+
+
+@click.command('trust-check')
+@click.option('--attributeid', help='Attribute ID to check the endorsement of', type=int)
+@click.option('--address', help='Ethereum address to check the trust of', type=str)
+@click.option('--depth', default=2, help='Maximum number of signatures away from a trusted address',
+    type=click.IntRange(1))
+@click.option('--threshold', default=1, help='Trusted signers an attribute needs to be endorsed',
+    type=click.IntRange(1))
+@click.option('--attributetype', 'attribute_types', multiple=True,
+    help='Only attributes of this type make their owner trusted (default: all)', type=str)
+def trust_check(attributeid, address, depth, threshold, attribute_types):
+    """Evaluate the web of trust from the trusted addresses."""
+    from etherpki.events import Events
+    from etherpki.trust import TrustEngine
+
+    if attributeid is None and address is None:
+        raise click.UsageError("Specify --attributeid or --address.")
+
+    engine = TrustEngine.from_events(Events(), userconfig.get_trusted(), max_depth=depth, threshold=threshold,
+        attribute_types=attribute_types or None)
+
+    click.echo()
+
+    if address is not None:
+        trust_depth = engine.depth(address)
+        if trust_depth is None:
+            click.echo("Address " + address + " is not trusted.")
+        else:
+            click.echo("Address " + address + " is trusted at depth " + str(trust_depth) + ".")
+
+    if attributeid is not None:
+        verdict = engine.attribute_verdict(attributeid)
+        if verdict is None:
+            click.echo("No such attribute.")
+        elif verdict['endorsed']:
+            click.echo("Attribute ID #" + str(attributeid) + " is endorsed at depth " + str(verdict['depth'])
+                + " by:")
+            for (signer, signer_depth) in sorted(verdict['trusted_signers'].items(), key=lambda item: item[1]):
+                click.echo("\t" + signer + " (depth " + str(signer_depth) + ")")
+        else:
+            click.echo("Attribute ID #" + str(attributeid) + " is not endorsed ("
+                + str(len(verdict['trusted_signers'])) + " of " + str(threshold) + " trusted signers).")
 
 
 @click.command()
 @click.option('--attributeid', prompt='Attribute ID', help='Attribute ID', type=int)
 def retrieve(attributeid):
     """Retrieve an attribute."""
-    events = Events()
+    # answer from the daemon's warm state if it is running
+    events = daemon.connect()
+    if events is None:
+        from etherpki.events import Events
+        events = Events()
+
     attribute = events.retrieve_attribute(attributeid)
 
     if attribute is None:
@@ -177,33 +406,8 @@ def retrieve(attributeid):
     echo_attribute_block(attribute)
     click.echo()
 
-    if 'proof_valid' in attribute:
-        click.echo("Proof status for attribute ID #" + str(attribute['attributeID']) + ':')
-        if attribute['proof_valid'] is None:
-            click.echo("\tUnknown")
-        elif attribute['proof_valid']:
-            click.echo("\tValid")
-        else:
-            click.echo("\tINVALID")
-
-        click.echo()
-
-    click.echo("Signatures for attribute ID #" + str(attribute['attributeID']) + ':')
-    for signature in attribute['signatures_status']['signatures']:
-        sig_line = "\t#" + str(signature['signatureID'])
+    echo_attribute_status(attribute)
 
-        if signature['revocation']:
-            sig_line += " [revoked]"
-        elif signature['expired']:
-            sig_line += " [expired]"
-        elif signature['valid']:
-            sig_line += " [valid]"
-
-        sig_line += " by " + signature['signer']
-        sig_line += (" [trusted]" if userconfig.is_trusted(attribute['owner']) else " [untrusted]")
-        click.echo(sig_line)
-
-    click.echo()
     click.echo("--ATTRIBUTE DATA:")
     click.echo(attribute['data'])
 
@@ -212,7 +416,10 @@ def retrieve(attributeid):
 @click.option('--attributetype', help='Attribute type', type=str)
 @click.option('--identifier', help='Attribute identifier', type=str)
 @click.option('--owner', help='Attribute owner', type=str)
-def search(attributetype, identifier, owner):
+@click.option('--limit', help='Maximum number of attributes to show', type=click.IntRange(0))
+@click.option('--offset', default=0, help='Number of matching attributes to skip', type=click.IntRange(0))
+@click.option('--with-data', is_flag=True, help='Show attribute data, fetching IPFS data in parallel')
+def search(attributetype, identifier, owner, limit, offset, with_data):
     """Search for attributes."""
     # Pad identifiers with zeros.
     if identifier is not None:
@@ -221,30 +428,390 @@ def search(attributetype, identifier, owner):
         else:
             identifier = identifier.ljust(32, '\x00')
 
-    events = Events()
-    attributes = events.filter_attributes(None, owner, identifier)
+    # answer from the daemon's warm state if it is running
+    events = daemon.connect()
+    if events is None:
+        from etherpki.events import Events
+        events = Events()
 
-    for attribute in attributes:
-        if attributetype is not None and attributetype != attribute['attributeType']:
-            continue
+    # signatures are resolved in small batches, so each result is printed as soon as it is resolved
+    results = events.search_attributes(attributetype, identifier, owner, offset, limit, with_data)
+    for (attribute, signatures_status) in results:
+        with metrics.stage('output'):
+            echo_attribute_block(attribute, signatures_status)
 
-        signatures_status = events.get_attribute_signatures_status(attribute['attributeID'])
+            if with_data:
+                if 'data_error' in attribute:
+                    click.echo("\tData: [unavailable: " + attribute['data_error'] + "]")
+                else:
+                    click.echo("\tData:" + (" [INVALID hash]" if attribute.get('data_valid') is False else ""))
+                for line in attribute['data'].splitlines():
+                    click.echo("\t\t" + line)
 
-        echo_attribute_block(attribute, signatures_status)
-        click.echo()
+            click.echo()
 
 
 @click.command()
 @click.option('--keyid', prompt='Key ID', help='Key ID', type=str)
-def ipfsaddpgp(keyid):
+@wait_options
+def ipfsaddpgp(keyid, wait, confirmations):
     """Add a PGP key attribute to your identity over IPFS."""
+    from etherpki.transactions import Transactions
+
     transactions = Transactions()
     click.echo()
 
     try:
-        transactions.add_pgp_attribute_over_ipfs(keyid)
+        txhash = transactions.add_pgp_attribute_over_ipfs(keyid)
     except ValueError as e:
         click.echo("Error: " + str(e))
         return
 
-    click.echo("Transaction sent.")
\ No newline at end of file
+    echo_transaction(transactions, txhash, wait, confirmations)
+
+
+@click.command()
+def sync():
+    """Update the local index of EtherPKI events."""
+    from etherpki.events import Events
+
+    events = Events()
+    added = events.sync()
+
+    if events.state is not None:
+        # state reads keep no index, so syncing only pins the latest block
+        click.echo("State reads pinned to block #" + str(events.state.block) + ".")
+        return
+
+    click.echo("Synced up to block #" + str(events.index.get_cursor()) + " ("
+        + str(added) + " new event" + ("" if added == 1 else "s") + ").")
+
+
+@click.command()
+@click.option('--days', default=30, help='Report signatures expiring within this many days',
+    type=click.IntRange(0))
+@click.option('--at', help='Unix time to start the period at (default: now); signatures revoked by now are '
+    'left out whatever the time', type=int)
+@click.option('--attributeid', help='Only report signatures of this attribute', type=int)
+def expiring(days, at, attributeid):
+    """List signatures that are not revoked now and expire within the period."""
+    from etherpki.events import Events
+
+    start = int(time.time()) if at is None else at
+    end = start + days * 60 * 60 * 24
+
+    events = Events()
+    signatures = events.get_expiring_signatures(start, end, attributeid)
+
+    for signature in signatures:
+        click.echo("#" + str(signature['signatureID']) + " of attribute #" + str(signature['attributeID'])
+            + " by " + signature['signer'] + " expires "
+            + time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(signature['expiry']))
+            + " (in " + str((signature['expiry'] - start) // (60 * 60 * 24)) + " days)")
+
+    click.echo(str(len(signatures)) + " signature" + ("" if len(signatures) == 1 else "s")
+        + " expiring within " + str(days) + " days.", err=True)
+
+
+@click.command('verify-all')
+@click.option('--processes', help='Number of verification processes (default: number of CPUs)',
+    type=click.IntRange(1))
+@click.option('--no-cache', is_flag=True, help='Verify proofs even if a result is cached')
+def verify_all(processes, no_cache):
+    """Verify the PGP proof of every attribute, as JSON lines."""
+    from etherpki.events import Events
+
+    events = Events()
+    for verdict in events.verify_all_pgp_proofs(processes=processes, cache=not no_cache):
+        click.echo(json.dumps(verdict, sort_keys=True))
+
+
+def run_bulk(path, journal, in_flight, confirmations, calls):
+    """Sends a transaction for every call, echoing progress as JSON lines.
+
+    calls: an iterable of (row number, row key, function name, arguments) tuples for the rows of path
+    """
+    from etherpki.bulk import BulkSubmitter
+    from etherpki.bulk import Journal
+    from etherpki.transactions import Transactions
+
+    journal = Journal(journal or path + '.journal')
+    try:
+        submitter = BulkSubmitter(Transactions(), journal, in_flight=in_flight, confirmations=confirmations)
+        for progress in submitter.submit(calls):
+            click.echo(json.dumps(progress, sort_keys=True))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        journal.close()
+
+
+@click.command('bulk-add')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--journal', help='Progress journal to resume from (default: PATH.journal)', type=str)
+@click.option('--in-flight', default=16, help='Transactions sent but not yet mined', type=click.IntRange(1))
+@click.option('--confirmations', default=1, help='Blocks before a transaction is reported as mined',
+    type=click.IntRange(1))
+@click.option('--hash-workers', default=4, help='Rows whose data is hashed at once', type=click.IntRange(1))
+@click.option('--no-datahash', is_flag=True, help='Leave the datahash of rows without one empty')
+def bulk_add(path, journal, in_flight, confirmations, hash_workers, no_datahash):
+    """Add the attributes in a JSONL or CSV file.
+
+    Each row has the fields attributetype, identifier, and optionally data, datahash and has_proof.
+    The datahash of rows with data but no datahash is computed, from the IPFS block if the data is
+    an ipfs-block:// URI.
+    """
+    from etherpki.bulk import attribute_call
+    from etherpki.bulk import read_rows
+    from etherpki.bulk import row_key
+    from etherpki.bulk import with_datahashes
+
+    if no_datahash:
+        rows = ((number, row, '') for (number, row) in read_rows(path))
+    else:
+        rows = with_datahashes(read_rows(path), hash_workers)
+
+    # the key is that of the row as read, so that a journal written with --no-datahash still matches
+    calls = ((number, row_key(row)) + attribute_call(row, datahash) for (number, row, datahash) in rows)
+    run_bulk(path, journal, in_flight, confirmations, calls)
+
+
+@click.command('bulk-sign')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--journal', help='Progress journal to resume from (default: PATH.journal)', type=str)
+@click.option('--in-flight', default=16, help='Transactions sent but not yet mined', type=click.IntRange(1))
+@click.option('--confirmations', default=1, help='Blocks before a transaction is reported as mined',
+    type=click.IntRange(1))
+def bulk_sign(path, journal, in_flight, confirmations):
+    """Sign the attributes in a JSONL or CSV file.
+
+    Each row has the field attributeid, and either expiry in unix time or expires in days (default:
+    365).
+    """
+    from etherpki.bulk import read_rows
+    from etherpki.bulk import row_key
+    from etherpki.bulk import signature_call
+
+    now = time.time()
+    calls = ((number, row_key(row)) + signature_call(row, now) for (number, row) in read_rows(path))
+    run_bulk(path, journal, in_flight, confirmations, calls)
+
+
+@click.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--inline', is_flag=True, help='Keep attribute data in the manifest instead of storing it on IPFS')
+@click.option('--page-size', default=256, help='Attributes per manifest block', type=click.IntRange(1))
+@wait_options
+def commit(path, inline, page_size, wait, confirmations):
+    """Commit to the attributes in a JSONL or CSV file in one transaction.
+
+    Rows have the fields of bulk-add. The attributes are published on IPFS with proofs of their
+    inclusion in a Merkle tree, and only the root of the tree is stored on-chain.
+    """
+    from etherpki.bulk import attribute_call
+    from etherpki.bulk import read_rows
+    from etherpki.bulk import with_datahashes
+    from etherpki.transactions import Transactions
+
+    fields = ('attributeType', 'hasProof', 'identifier', 'data', 'dataHash')
+    attributes = (dict(zip(fields, attribute_call(row, datahash)[1]))
+        for (_, row, datahash) in with_datahashes(read_rows(path)))
+
+    transactions = Transactions()
+    try:
+        (txhash, commitment) = transactions.commit_attributes(attributes, over_ipfs=not inline,
+            page_size=page_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    click.echo("Committed to " + str(commitment['count']) + " attributes with root 0x"
+        + binascii.hexlify(commitment['root']).decode('ascii') + ".")
+    click.echo("Manifest: " + commitment['uri'])
+    echo_transaction(transactions, txhash, wait, confirmations)
+
+
+@click.command('retrieve-committed')
+@click.option('--commitmentid', prompt='Commitment ID', help='Commitment ID', type=int)
+@click.option('--position', prompt='Position', help='Position of the attribute in the commitment',
+    type=click.IntRange(0))
+def retrieve_committed(commitmentid, position):
+    """Retrieve an attribute of a commitment and check its inclusion proof."""
+    from etherpki.events import Events
+
+    try:
+        attribute = Events().retrieve_committed_attribute(commitmentid, position)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if attribute is None:
+        click.echo("No such attribute.")
+        return
+
+    click.echo()
+    echo_attribute_block(attribute)
+    click.echo()
+
+    click.echo("Inclusion in commitment ID #" + str(commitmentid) + ':')
+    click.echo("\tValid" if attribute['inclusion_valid'] else "\tINVALID")
+    click.echo()
+
+    echo_attribute_status(attribute)
+
+    click.echo("--ATTRIBUTE DATA:")
+    click.echo(attribute['data'])
+
+
+@click.command('verify-commitment')
+@click.option('--commitmentid', prompt='Commitment ID', help='Commitment ID', type=int)
+def verify_commitment(commitmentid):
+    """Check the inclusion proofs of every attribute of a commitment."""
+    from etherpki.events import Events
+
+    started = time.perf_counter()
+    try:
+        result = Events().verify_commitment(commitmentid)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if result is None:
+        click.echo("No such commitment.")
+        return
+
+    click.echo(str(result['valid']) + " of " + str(result['count']) + " inclusion proofs valid ("
+        + "%.2f" % (time.perf_counter() - started) + "s).")
+    if result['invalid']:
+        click.echo("Invalid: " + ', '.join('#' + str(position) for position in result['invalid']))
+        raise SystemExit(1)
+
+
+@click.command('export-bundle')
+@click.option('--attributeid', prompt='Attribute ID', help='Attribute ID', type=int)
+@click.option('--block', help='Block to prove the state at (default: the latest)', type=click.IntRange(0))
+@click.option('--address', default=ethapi.ETHERPKI_DEFAULT_ADDRESS, help='Address of the EtherPKI contract',
+    type=str)
+@click.option('--output', default='-', help='File to write the bundle to (default: standard output)',
+    type=click.File('wb'))
+def export_bundle(attributeid, block, address, output):
+    """Export an attribute with proofs of its state, to verify without a node."""
+    from etherpki import bundle
+
+    try:
+        data = bundle.export_bundle(attributeid, block, address)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if data is None:
+        raise click.ClickException("No such attribute.")
+    output.write(data)
+
+
+@click.command('verify-bundle')
+@click.argument('source', type=click.File('rb'))
+@click.option('--address', default=ethapi.ETHERPKI_DEFAULT_ADDRESS, help='Address of the EtherPKI contract',
+    type=str)
+@click.option('--block-hash', help='Hash of the block the bundle must be anchored in', type=str)
+@click.option('--online', is_flag=True, help='Check the block of the bundle is canonical with one call to a node')
+@click.option('--max-age', help='Maximum age of the block of the bundle, in seconds', type=click.IntRange(0))
+@click.option('--at', help='Unix time to verify at (default: now)', type=int)
+def verify_bundle(source, address, block_hash, online, max_age, at):
+    """Verify an exported attribute bundle, exiting with 1 if it is invalid and 2 if it is unanchored."""
+    from etherpki import bundle
+    from etherpki.stateproof import decode_header
+
+    started = time.perf_counter()
+    data = source.read()
+    try:
+        if online and block_hash is None:
+            number = decode_header(bundle.decode_bundle(data)['header'])['number']
+            block = ethapi.ethclient.get_block_by_number(number, False)
+            if block is None:
+                raise click.ClickException("Block #" + str(number) + " of the bundle is not known to the node.")
+            block_hash = block['hash']
+        result = bundle.verify_bundle(data, address, block_hash, at, max_age)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - started
+
+    attribute = result['attribute']
+    click.echo()
+    echo_attribute_block(attribute)
+    click.echo()
+
+    echo_attribute_status(attribute)
+
+    def check(valid, unchecked):
+        return unchecked if valid is None else ("valid" if valid else "INVALID")
+
+    click.echo("State at block #" + str(result['block']['number']) + " " + result['block']['hash'] + ':')
+    click.echo("\tContract: " + check(result['contract_valid'], "unchecked, no --address"))
+    click.echo("\tBlock hash: " + check(result['block_valid'], "unchecked, no --block-hash or --online"))
+    click.echo("\tAge: " + str(int(result['age'])) + "s"
+        + ("" if result['fresh'] is None else " [fresh]" if result['fresh'] else " [STALE]"))
+    click.echo()
+
+    click.echo("Bundle " + result['verdict'] + " (" + "%.1f" % (elapsed * 1000) + "ms).")
+    if result['verdict'] == 'invalid':
+        raise SystemExit(1)
+    if result['verdict'] == 'unanchored':
+        raise SystemExit(2)
+
+
+def _json_hex(value):
+    """Renders bytes values as hex in JSON output."""
+    if isinstance(value, bytes):
+        return '0x' + binascii.hexlify(value).decode('ascii')
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+@click.command()
+@click.option('--from-block', help='First block to report events of (default: the next block)',
+    type=click.IntRange(0))
+@click.option('--cursor', help='File to save the position to and resume from', type=click.Path(dir_okay=False))
+@click.option('--event', 'event_names', multiple=True, help='Event to report (default: all)',
+    type=click.Choice(['AttributeAdded', 'AttributeSigned', 'SignatureRevoked', 'AttributesCommitted']))
+@click.option('--interval', default=2.0, help='Seconds between polls for new blocks', type=float)
+@click.option('--no-filter', is_flag=True, help='Poll eth_getLogs instead of using an eth_newFilter filter')
+def watch(from_block, cursor, event_names, interval, no_filter):
+    """Follow new events as JSON lines, retracting events of blocks that were reorganised away."""
+    from etherpki.subscription import EVENT_NAMES
+    from etherpki.subscription import Subscription
+
+    subscription = Subscription(event_names=event_names or EVENT_NAMES, from_block=from_block,
+        cursor_path=cursor, interval=interval, use_filter=not no_filter)
+
+    try:
+        for notification in subscription:
+            click.echo(json.dumps(notification, sort_keys=True, default=_json_hex))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option('--socket', 'socket_path', help='Socket to listen on (default: in the cache directory)', type=str)
+@click.option('--port', help='Also listen for HTTP on this port of 127.0.0.1', type=click.IntRange(1, 65535))
+@click.option('--interval', default=2.0, help='Seconds between polls for new blocks', type=float)
+@click.option('--metrics-textfile', help='Prometheus textfile to write metrics to after every poll',
+    type=click.Path(dir_okay=False))
+def serve(socket_path, port, interval, metrics_textfile):
+    """Run a daemon answering queries from memory."""
+    path = socket_path or daemon.settings['socket'] or daemon.default_socket_path()
+
+    if metrics_textfile is not None:
+        metrics.configure(enabled=True)
+        metrics.add_sink(metrics.PrometheusTextfile(metrics_textfile))
+
+    def ready(running):
+        click.echo("Serving at block #" + str(running.index.get_cursor()) + " on " + path
+            + ("" if port is None else " and http://127.0.0.1:" + str(port) + "/") + ".")
+
+    try:
+        daemon.serve(path, port, interval=interval, ready=ready)
+    except daemon.DaemonError as e:
+        raise click.ClickException(str(e))
+
+for command in [rawaddattribute, rawsignattribute, rawrevokeattribute, add, ipfsadd, sign,
+        revoke, trust, untrust, trusted, retrieve, search, ipfsaddpgp, sync,
+        verify_all, bulk_add, bulk_sign, serve, watch, trust_check,
+        trust_import, trust_export, expiring, commit, retrieve_committed, verify_commitment,
+        export_bundle, verify_bundle]:
+    main.add_command(command)
@@ -0,0 +1,320 @@
+"""Long-running query daemon, and the client the CLI uses to route queries through it.
+
+The daemon keeps the event index in memory, follows new blocks, and answers queries over HTTP on a
+Unix socket, so that a query does not pay for starting Python, loading the ABI and opening the
+index. Responses are JSON, with bytes values encoded as {"$bytes": "<hex>"}.
+"""
+
+import binascii
+import json
+import os
+import socket
+import threading
+
+from appdirs import user_cache_dir
+
+from etherpki import metrics
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+
+# seconds between polls for new blocks
+DEFAULT_INTERVAL = 2.0
+
+# seconds the CLI waits for the daemon before falling back to querying directly
+CLIENT_TIMEOUT = 30
+
+# settings of the CLI's daemon client
+settings = {
+    'enabled': True,
+    'socket': None,
+}
+
+
+def configure(**new_settings):
+    """
+    Change how the CLI uses the daemon.
+
+    new_settings: enabled, False to never route queries through the daemon, and socket, the path
+                  of the daemon's socket
+    """
+    for (name, value) in new_settings.items():
+        if name not in settings:
+            raise TypeError("Unknown daemon setting: " + name)
+        if value is not None:
+            settings[name] = value
+
+
+def default_socket_path():
+    """Returns the path of the daemon's socket."""
+    cachedir = user_cache_dir("etherpki")
+
+    try:
+        os.makedirs(cachedir)
+    except OSError:
+        if not os.path.isdir(cachedir):
+            raise
+
+    return os.path.join(cachedir, "daemon.sock")
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return {'$bytes': binascii.hexlify(value).decode('ascii')}
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def _json_object_hook(value):
+    if len(value) == 1 and '$bytes' in value:
+        return binascii.unhexlify(value['$bytes'])
+    return value
+
+
+def encode_response(value):
+    return json.dumps(value, default=_json_default).encode('utf-8')
+
+
+def decode_response(data):
+    return json.loads(data.decode('utf-8'), object_hook=_json_object_hook)
+
+
+class DaemonError(IOError):
+    """Raised when the daemon cannot be reached or fails to answer a query."""
+
+
+class DaemonClient(object):
+    """Sends queries to a running daemon. Methods return the same values as those of Events."""
+
+    def __init__(self, path, timeout=CLIENT_TIMEOUT):
+        """
+        path:       the path of the daemon's socket
+        timeout:    seconds to wait for an answer
+        """
+        self.path = path
+        self.timeout = timeout
+
+    def _get(self, endpoint, **params):
+        import http.client
+        from urllib.parse import urlencode
+
+        connection = http.client.HTTPConnection('localhost', timeout=self.timeout)
+        try:
+            # hand the connection a socket that is already connected to the daemon
+            connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.sock.settimeout(self.timeout)
+            connection.sock.connect(self.path)
+
+            query = urlencode(dict((name, value) for (name, value) in params.items() if value is not None),
+                doseq=True)
+            with metrics.stage('daemon.query'):
+                connection.request('GET', endpoint + ('?' + query if query else ''))
+                response = connection.getresponse()
+                body = response.read()
+            metrics.count('daemon.bytes_received', len(body))
+        except (OSError, http.client.HTTPException) as e:
+            raise DaemonError(str(e))
+        finally:
+            connection.close()
+
+        result = decode_response(body)
+        if response.status != 200:
+            raise DaemonError(result.get('error') if isinstance(result, dict) else response.reason)
+        return result
+
+    def ping(self):
+        """Returns the number of the last block the daemon has synced."""
+        return self._get('/ping')['block']
+
+    def retrieve_attribute(self, attributeID):
+        """See Events.retrieve_attribute."""
+        return self._get('/attribute', id=attributeID)
+
+    def get_signatures_status_many(self, attribute_ids):
+        """See Events.get_signatures_status_many."""
+        return dict(self._get('/status', id=list(attribute_ids)))
+
+    def search_attributes(self, attributetype=None, identifier=None, owner=None, offset=0, limit=None,
+            with_data=False):
+        """See Events.search_attributes."""
+        results = self._get('/search', attributetype=attributetype, identifier=identifier, owner=owner,
+            offset=offset, limit=limit, with_data=int(with_data))
+        return [tuple(result) for result in results]
+
+
+def connect():
+    """
+    Get a client of the running daemon.
+
+    returns a DaemonClient, or None if routing through the daemon is disabled or no daemon is running
+    """
+    if not settings['enabled']:
+        return None
+
+    path = settings['socket'] or default_socket_path()
+    if not os.path.exists(path):
+        return None
+
+    client = DaemonClient(path)
+    try:
+        client.ping()
+    except (DaemonError, ValueError):
+        return None
+    return client
+
+
+class Daemon(object):
+    """The warm state of the daemon: an in-memory event index kept up to date with the chain."""
+
+    def __init__(self, address=ETHERPKI_DEFAULT_ADDRESS, interval=DEFAULT_INTERVAL):
+        """
+        address:    the Ethereum address of the contract
+        interval:   seconds between polls for new blocks
+        """
+        from etherpki.eventindex import EventIndex
+        from etherpki.eventindex import MemoryIndex
+        from etherpki.eventindex import default_index_path
+        from etherpki.events import Events
+
+        self.interval = interval
+        self.index = MemoryIndex(EventIndex(default_index_path(address)))
+        # the daemon answers from its log index even if state reads are enabled
+        self.events = Events(address, index=self.index, autosync=False, state=False)
+
+        self._stopped = threading.Event()
+
+    def follow(self):
+        """Syncs the index with the chain every interval seconds until stop is called."""
+        import logging
+
+        while not self._stopped.is_set():
+            try:
+                self.events.sync()
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to sync the event index")
+            try:
+                metrics.flush()
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to write metrics")
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+
+    def ping(self, params):
+        return {'block': self.index.get_cursor()}
+
+    def attribute(self, params):
+        return self.events.retrieve_attribute(int(params['id'][0]))
+
+    def status(self, params):
+        return list(self.events.get_signatures_status_many([int(value) for value in params['id']]).items())
+
+    def search(self, params):
+        def param(name):
+            return params[name][0] if name in params else None
+
+        limit = param('limit')
+        return list(self.events.search_attributes(
+            attributetype=param('attributetype'),
+            identifier=param('identifier'),
+            owner=param('owner'),
+            offset=int(param('offset') or 0),
+            limit=None if limit is None else int(limit),
+            with_data=param('with_data') == '1',
+        ))
+
+    def handle(self, path, params):
+        """
+        Answer a query.
+
+        returns a tuple of (HTTP status, result)
+        """
+        routes = {
+            '/ping': self.ping,
+            '/attribute': self.attribute,
+            '/status': self.status,
+            '/search': self.search,
+        }
+
+        if path not in routes:
+            return (404, {'error': 'Unknown query: ' + path})
+        try:
+            with metrics.stage('daemon.' + path[1:]):
+                return (200, routes[path](params))
+        except (KeyError, ValueError) as e:
+            return (400, {'error': 'Invalid query: ' + str(e)})
+        except Exception as e:
+            return (500, {'error': str(e) or type(e).__name__})
+
+
+def serve(path=None, port=None, address=ETHERPKI_DEFAULT_ADDRESS, interval=DEFAULT_INTERVAL, ready=None):
+    """
+    Run the daemon until interrupted.
+
+    path:       the path of the Unix socket to listen on, defaults to default_socket_path()
+    port:       if set, also listen for HTTP on this port of 127.0.0.1
+    address:    the Ethereum address of the contract
+    interval:   seconds between polls for new blocks
+    ready:      a function called with the Daemon once the index is loaded and it is listening
+    """
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from urllib.parse import parse_qs
+    from urllib.parse import urlparse
+
+    path = path or default_socket_path()
+    if os.path.exists(path):
+        try:
+            DaemonClient(path, timeout=1).ping()
+        except (DaemonError, ValueError):
+            # left behind by a daemon that did not exit cleanly
+            os.remove(path)
+        else:
+            raise DaemonError("A daemon is already listening on " + path)
+
+    daemon = Daemon(address, interval)
+    daemon.events.sync()
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            (status, result) = daemon.handle(url.path, parse_qs(url.query))
+
+            body = encode_response(result)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    class LocalHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    servers = [UnixHTTPServer(path, RequestHandler)]
+    os.chmod(path, 0o600)
+    if port is not None:
+        servers.append(LocalHTTPServer(('127.0.0.1', port), RequestHandler))
+
+    threads = [threading.Thread(target=daemon.follow)]
+    threads += [threading.Thread(target=server.serve_forever) for server in servers[1:]]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    if ready is not None:
+        ready(daemon)
+
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        for server in servers:
+            server.server_close()
+        os.remove(path)
@@ -0,0 +1,274 @@
+"""Hashes of attribute data, computed in chunks.
+
+The dataHash of an attribute is written as '<algorithm>:<hex digest>', e.g. 'keccak256:4e03...'.
+It is the hash of the UTF-8 data of the attribute or, if the data is an ipfs-block:// URI, of the
+content of the block, so that data stored off-chain can be checked against the chain.
+
+Data is hashed in chunks of CHUNK_SIZE bytes through memoryviews, so that a large payload, which
+IPFS blocks read from the local cache are memory-mapped as, is never copied whole to be hashed.
+Both hash functions release the GIL, so hashing runs in parallel in threads.
+"""
+
+import binascii
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from appdirs import user_cache_dir
+
+from etherpki.ipfsapi import MULTIHASH_FUNCTIONS
+from etherpki.ipfsapi import cid_multihash
+from etherpki.ipfsapi import get_block
+from etherpki.ipfsapi import release_block
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.keccak import new_keccak256
+
+# size of the chunks data is hashed in
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_ALGORITHM = 'keccak256'
+
+# number of payloads hashed at once by iter_datahashes
+HASH_WORKERS = 4
+
+# content smaller than this is hashed again rather than looked up in the verified cache
+VERIFIED_CACHE_THRESHOLD = 64 * 1024
+
+# maximum number of results kept by the default verified cache
+VERIFIED_CACHE_SIZE = 100000
+
+_verified_cache = None
+
+
+# hash functions by name, each returning an object with the hashlib update and digest methods
+ALGORITHMS = {
+    'keccak256': new_keccak256,
+    'sha256': hashlib.sha256,
+}
+
+
+def get_verified_cache():
+    """Returns the default on-disk verified cache, opening it on first use."""
+    global _verified_cache
+    if _verified_cache is None:
+        cachedir = user_cache_dir("etherpki")
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        _verified_cache = VerifiedCache(os.path.join(cachedir, "datahashes.db"))
+    return _verified_cache
+
+
+def new_hash(algorithm=DEFAULT_ALGORITHM):
+    """Returns a new hash object for an algorithm of ALGORITHMS."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unsupported hash algorithm: " + algorithm)
+    return ALGORITHMS[algorithm]()
+
+
+def iter_chunks(data, chunk_size=CHUNK_SIZE):
+    """
+    Read data in chunks without copying it.
+
+    data:       text, which is encoded to UTF-8 a chunk at a time, a bytes-like object such as
+                bytes or an mmap, or a binary file object
+    chunk_size: the size of the chunks, in bytes or, for text, in characters
+
+    yields the chunks as bytes or memoryviews, which are only valid until the next chunk is read
+    """
+    if isinstance(data, str):
+        # the encoding of text is the concatenation of the encodings of its slices
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size].encode('utf-8')
+    elif hasattr(data, 'readinto'):
+        buffer = bytearray(chunk_size)
+        with memoryview(buffer) as view:
+            while True:
+                size = data.readinto(buffer)
+                if not size:
+                    break
+                yield view[:size]
+    else:
+        with memoryview(data) as view:
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+
+
+def hash_data(data, algorithm=DEFAULT_ALGORITHM, chunk_size=CHUNK_SIZE):
+    """
+    Hash data in chunks.
+
+    data:       as for iter_chunks
+    algorithm:  the name of an algorithm of ALGORITHMS
+
+    returns the digest as bytes
+    """
+    digest = new_hash(algorithm)
+    for chunk in iter_chunks(data, chunk_size):
+        digest.update(chunk)
+    return digest.digest()
+
+
+def format_datahash(algorithm, digest):
+    """Returns the dataHash of a digest."""
+    return algorithm + ':' + binascii.hexlify(digest).decode('ascii')
+
+
+def parse_datahash(datahash):
+    """
+    Parse a dataHash.
+
+    returns a tuple of (algorithm, digest), or None if datahash is empty or not of a supported
+    algorithm
+    """
+    (algorithm, _, digest) = (datahash or '').partition(':')
+    if algorithm not in ALGORITHMS:
+        return None
+    try:
+        return (algorithm, binascii.unhexlify(digest))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def compute_datahash(data, algorithm=DEFAULT_ALGORITHM, get=get_block):
+    """
+    Get the dataHash of attribute data.
+
+    data:       the data of the attribute, as text or bytes; the block of an ipfs-block:// URI is
+                hashed instead of the URI
+    get:        the function getting a block by its CID
+
+    returns the dataHash, or '' if there is no data
+    """
+    if not data:
+        return ''
+
+    cid = parse_block_uri(data)
+    if cid is None:
+        return format_datahash(algorithm, hash_data(data, algorithm))
+
+    block = get(cid)
+    try:
+        return format_datahash(algorithm, hash_data(block, algorithm))
+    finally:
+        release_block(block)
+
+
+def _content_bound(cid):
+    """Returns True if the content of a block is checked against its CID when it is fetched."""
+    try:
+        code = cid_multihash(cid)[0]
+    except (ValueError, IndexError):
+        return False
+    return code == 0x00 or code in MULTIHASH_FUNCTIONS
+
+
+def check_datahash(datahash, content, cid=None, cache=True):
+    """
+    Check attribute data against its dataHash.
+
+    datahash:   the dataHash of the attribute
+    content:    the data as text, or as bytes or an mmap for the content of an IPFS block
+    cid:        the CID of the block the content was fetched from, if any
+    cache:      a VerifiedCache to answer from and store results to, True for the default cache,
+                or False to always hash the content; only used for large IPFS blocks
+
+    returns True if the data matches, False if it does not, or None if there is no dataHash or its
+    algorithm is not supported
+    """
+    parsed = parse_datahash(datahash)
+    if parsed is None:
+        return None
+    (algorithm, digest) = parsed
+
+    # a block is immutable once it matches its CID, so a result for the pair holds for good
+    if cache and cid is not None and len(content) >= VERIFIED_CACHE_THRESHOLD and _content_bound(cid):
+        if cache is True:
+            cache = get_verified_cache()
+        valid = cache.get(cid, datahash)
+        if valid is None:
+            valid = hash_data(content, algorithm) == digest
+            cache.put(cid, datahash, valid)
+        return valid
+
+    return hash_data(content, algorithm) == digest
+
+
+def iter_datahashes(items, algorithm=DEFAULT_ALGORITHM, workers=HASH_WORKERS, get=get_block):
+    """
+    Compute the dataHashes of many payloads in parallel, see compute_datahash.
+
+    At most workers times two payloads are read ahead of the one being yielded, so a long stream
+    is not held in memory.
+
+    items:      an iterable of attribute data
+    workers:    the number of payloads hashed at once
+
+    yields the dataHashes, in order, or the exception raised hashing a payload
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    def compute(data):
+        try:
+            return compute_datahash(data, algorithm, get)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for data in items:
+            pending.append(pool.submit(compute, data))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class VerifiedCache(object):
+    """An on-disk cache of the results of checking IPFS blocks against dataHashes, bounded by least
+    recent use.
+
+    Results are keyed by the CID of the block and the dataHash, so a block that was checked once
+    is not hashed again.
+    """
+
+    def __init__(self, path, max_entries=VERIFIED_CACHE_SIZE):
+        """
+        path:           the path of the SQLite database, or ':memory:'
+        max_entries:    the number of results kept before the least recently used are evicted
+        """
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS verified (cid TEXT NOT NULL, datahash TEXT NOT NULL, "
+            "valid INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (cid, datahash))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS verified_last_used ON verified (last_used)")
+
+    def get(self, cid, datahash):
+        """Returns whether the block matched the dataHash, or None if it was not checked."""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT valid FROM verified WHERE cid = ? AND datahash = ?",
+                (cid, datahash)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE verified SET last_used = ? WHERE cid = ? AND datahash = ?",
+                (time.time(), cid, datahash))
+        return bool(row[0])
+
+    def put(self, cid, datahash, valid):
+        """Stores whether the block matched the dataHash."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?)",
+                (cid, datahash, bool(valid), time.time()))
+
+            # evict the least recently used results
+            self._db.execute(
+                "DELETE FROM verified WHERE rowid IN "
+                "(SELECT rowid FROM verified ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
@@ -1,18 +1,394 @@
 """Interface for accessing Ethereum client and EtherPKI contracts."""
 
+import binascii
+import itertools
 import json
+import numbers
 import os
+import threading
+import time
 
-import eth_rpc_client
-from ethereum.utils import encode_hex
-
-import EtherCLI
+from etherpki import metrics
+from etherpki.abicodec import contract_abi
+from etherpki.abicodec import function_selector
 
 # contract addresses
 ETHERPKI_DEFAULT_ADDRESS = ''
-ETHERPKI_ABI = json.load(open(os.path.join(os.path.dirname(EtherCLI.__file__), 'etherpki_abi.json')))
+ETHERPKI_ABI_PATH = os.path.join(os.path.dirname(__file__), 'etherpki_abi.json')
+
+# ABI entries of the batch, view and commitment functions, whose contract source is kept on the
+# contract-batch-functions branch until it is compiled; contracts deployed from the build of
+# ETHERPKI_ABI_PATH do not have them, so their functions are only called once the code of the
+# contract is found to have them, see require_functions
+ETHERPKI_ABI_ADDITIONS_PATH = os.path.join(os.path.dirname(__file__), 'etherpki_abi_additions.json')
+
+_etherpki_abi = None
+
+DEFAULT_RPC_URL = 'http://127.0.0.1:8545/'
+
+# methods that must not be resent if the first attempt may have reached the client
+NON_IDEMPOTENT_METHODS = frozenset(['eth_sendTransaction'])
+
+
+def get_etherpki_abi():
+    """Returns the EtherPKI contract ABI, with the entries of ETHERPKI_ABI_ADDITIONS_PATH, loading it on first use."""
+    global _etherpki_abi
+    if _etherpki_abi is None:
+        with open(ETHERPKI_ABI_PATH) as abifile:
+            abi = json.load(abifile)
+        with open(ETHERPKI_ABI_ADDITIONS_PATH) as abifile:
+            abi['abi'] = abi['abi'] + json.load(abifile)
+        _etherpki_abi = abi
+    return _etherpki_abi
+
+
+def _selector_push(selector):
+    # the dispatcher of a compiled contract compares the selector of a call to that of each of its
+    # functions, pushed without leading zero bytes
+    selector = selector.lstrip(b'\x00')
+    return bytes(bytearray([0x5f + len(selector)])) + selector
+
+
+def get_deployed_functions(client, address):
+    """
+    Find the functions of the EtherPKI ABI that the contract deployed at an address has, from its code.
+
+    client:     the EthClient to read the code of the contract with
+    address:    the address of the contract
+
+    returns a set of function names, or None if address is empty, as there is then no deployment
+    to read
+    """
+    if not address:
+        return None
+
+    code = binascii.unhexlify(client.get_code(address)[2:])
+    return set(entry['name'] for entry in contract_abi(get_etherpki_abi())
+        if entry.get('type') == 'function' and _selector_push(function_selector(entry)) in code)
+
+
+def require_functions(deployed, address, functions):
+    """
+    Check that a contract has functions of the EtherPKI ABI.
+
+    deployed:   the functions of the contract, as returned by get_deployed_functions; nothing is
+                checked if None
+    address:    the address of the contract
+    functions:  the names of the functions
+
+    raises ValueError naming the functions the contract does not have
+    """
+    if deployed is None:
+        return
+
+    missing = [name for name in functions if name not in deployed]
+    if missing:
+        raise ValueError("The EtherPKI contract at " + address + " does not have " + ', '.join(missing)
+            + "; it was deployed from an older build of the contract")
+
+
+class RPCError(ValueError):
+    """An error returned by the Ethereum client for a JSON-RPC call."""
+
+    def __init__(self, error):
+        self.code = error.get('code')
+        self.message = error.get('message')
+        self.data = error.get('data')
+
+        super(RPCError, self).__init__(error)
+
+
+class _PendingCall(object):
+    """A call waiting to be sent as part of a coalesced batch."""
+
+    __slots__ = ('method', 'params', 'done', 'result', 'error')
+
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RPCTransport(object):
+    """A JSON-RPC 2.0 transport over a pool of keep-alive HTTP connections.
+
+    Calls made concurrently from several threads within coalesce_window seconds of each other are
+    sent to the client as a single batch request.
+    """
+
+    def __init__(self, url=DEFAULT_RPC_URL, pool_size=10, timeout=30, retries=3, backoff=0.5,
+            coalesce_window=0.002):
+        """
+        url:                the URL of the Ethereum client's JSON-RPC endpoint
+        pool_size:          the maximum number of keep-alive connections kept open
+        timeout:            seconds to wait for a response before giving up
+        retries:            how many times a failed request is retried
+        backoff:            seconds to wait before the first retry, doubled after each attempt
+        coalesce_window:    seconds to wait for concurrent calls to join a batch, 0 to disable
+        """
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+
+        # the HTTP session is created on first use, so that importing requests is deferred too
+        self._session = None
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._active = 0
+
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def _post(self, payload, retry):
+        """Posts a JSON-RPC payload, retrying with exponential backoff on transport errors."""
+        import requests
+
+        session = self._get_session()
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                response = session.post(self.url, json=payload, timeout=self.timeout)
+                if metrics.settings['enabled']:
+                    metrics.count('rpc.bytes_sent', len(response.request.body or b''))
+                    metrics.count('rpc.bytes_received', len(response.content))
+                if response.status_code < 500:
+                    return response.json()
+                response.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                if not retry or attempt >= self.retries:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+            delay *= 2
+
+    def _send(self, calls):
+        """Sends pending calls in one request and stores each call's result or error."""
+        payload = []
+        calls_by_id = {}
+        for call in calls:
+            request_id = next(self._ids)
+            calls_by_id[request_id] = call
+            payload.append({
+                'jsonrpc': '2.0',
+                'method': call.method,
+                'params': call.params,
+                'id': request_id,
+            })
+
+        retry = not any(call.method in NON_IDEMPOTENT_METHODS for call in calls)
+
+        if metrics.settings['enabled']:
+            for call in calls:
+                metrics.count('rpc.calls.' + call.method)
+
+        try:
+            if len(payload) == 1:
+                with metrics.stage('rpc.' + payload[0]['method']):
+                    responses = [self._post(payload[0], retry)]
+            else:
+                with metrics.stage('rpc.batch'):
+                    responses = self._post(payload, retry)
+
+            if isinstance(responses, dict):
+                # the client rejected the batch as a whole
+                raise RPCError(responses.get('error') or {'message': 'Invalid batch response'})
+
+            for response in responses:
+                call = calls_by_id.get(response.get('id'))
+                if call is None:
+                    continue
+                if 'error' in response:
+                    call.error = RPCError(response['error'])
+                else:
+                    call.result = response.get('result')
+                call.done.set()
 
-ethclient = eth_rpc_client.Client(host='127.0.0.1', port='8545')
+            for call in calls:
+                if not call.done.is_set():
+                    call.error = RPCError({'message': 'No response for ' + call.method})
+        except Exception as e:
+            for call in calls:
+                if not call.done.is_set():
+                    call.error = e
+        finally:
+            for call in calls:
+                call.done.set()
+
+    def request(self, method, params=None):
+        """
+        Make a JSON-RPC call and return its result.
+
+        method: the name of the JSON-RPC method
+        params: the list of parameters
+        """
+        call = _PendingCall(method, params if params is not None else [])
+
+        with self._lock:
+            self._pending.append(call)
+            self._active += 1
+            leader = len(self._pending) == 1
+            concurrent = self._active > 1
+
+        try:
+            if leader:
+                # only wait for other calls to join when there are calls made concurrently
+                if concurrent and self.coalesce_window:
+                    time.sleep(self.coalesce_window)
+                with self._lock:
+                    (calls, self._pending) = (self._pending, [])
+                self._send(calls)
+            else:
+                call.done.wait()
+        finally:
+            with self._lock:
+                self._active -= 1
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def batch(self, calls):
+        """
+        Make several JSON-RPC calls in a single batch request.
+
+        calls:  a list of (method, params) tuples
+
+        returns a list of results in the same order as calls, with an RPCError in place of the
+        result of each call that failed
+        """
+        pending = [_PendingCall(method, params if params is not None else []) for (method, params) in calls]
+        if pending:
+            self._send(pending)
+        return [call.result if call.error is None else call.error for call in pending]
+
+
+class EthClient(object):
+    """Client for the subset of the Ethereum JSON-RPC API used by EtherPKI."""
+
+    def __init__(self, transport=None):
+        """
+        transport: the RPCTransport to send calls over, created on first use if None
+        """
+        self._transport = transport
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = RPCTransport()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    def request(self, method, params=None):
+        return self.transport.request(method, params)
+
+    def batch(self, calls):
+        """Make several calls in one request, see RPCTransport.batch."""
+        return self.transport.batch(calls)
+
+    def get_accounts(self):
+        return self.request('eth_accounts')
+
+    def get_block_number(self):
+        return int(self.request('eth_blockNumber'), 16)
+
+    def get_block_by_number(self, block_number, full_transactions=True):
+        if isinstance(block_number, numbers.Integral):
+            block_number = hex(block_number).rstrip('L')
+        return self.request('eth_getBlockByNumber', [block_number, full_transactions])
+
+    def get_code(self, address, block='latest'):
+        return self.request('eth_getCode', [address, block])
+
+    def get_logs(self, from_block=None, to_block=None, address=None, topics=None):
+        return self.request('eth_getLogs', [_filter_params(from_block, to_block, address, topics)])
+
+    def new_filter(self, from_block=None, to_block=None, address=None, topics=None):
+        return self.request('eth_newFilter', [_filter_params(from_block, to_block, address, topics)])
+
+    def get_filter_changes(self, filter_id):
+        return self.request('eth_getFilterChanges', [filter_id])
+
+    def uninstall_filter(self, filter_id):
+        return self.request('eth_uninstallFilter', [filter_id])
+
+    def get_transaction_receipt(self, txn_hash):
+        return self.request('eth_getTransactionReceipt', [txn_hash])
+
+    def get_transaction_by_hash(self, txn_hash):
+        return self.request('eth_getTransactionByHash', [txn_hash])
+
+    def get_transaction_count(self, address, block='pending'):
+        return int(self.request('eth_getTransactionCount', [address, block]), 16)
+
+    def estimate_gas(self, _from=None, to=None, data=None):
+        return int(self.request('eth_estimateGas', [_transaction_params(_from, to, None, data)]), 16)
+
+    def call(self, _from=None, to=None, gas=None, data=None, block='latest'):
+        return self.request('eth_call', [_transaction_params(_from, to, gas, data), block])
+
+    def send_transaction(self, _from=None, to=None, gas=None, data=None, nonce=None):
+        return self.request('eth_sendTransaction', [_transaction_params(_from, to, gas, data, nonce)])
+
+
+def _filter_params(from_block=None, to_block=None, address=None, topics=None):
+    """Builds the filter object of eth_getLogs and eth_newFilter."""
+    params = {}
+    if from_block is not None:
+        params['fromBlock'] = from_block
+    if to_block is not None:
+        params['toBlock'] = to_block
+    if address:
+        params['address'] = address
+    if topics is not None:
+        params['topics'] = topics
+    return params
+
+
+def _transaction_params(_from=None, to=None, gas=None, data=None, nonce=None):
+    """Builds the transaction object of eth_sendTransaction, eth_estimateGas and eth_call."""
+    params = {}
+    if _from is not None:
+        params['from'] = _from
+    if to:
+        params['to'] = to
+    if gas is not None:
+        params['gas'] = hex(gas).rstrip('L')
+    if data is not None:
+        params['data'] = data
+    if nonce is not None:
+        params['nonce'] = hex(nonce).rstrip('L')
+    return params
+
+
+ethclient = EthClient()
+
+def configure_client(**settings):
+    """
+    Replace the transport of the shared Ethereum client.
+
+    settings: keyword arguments of RPCTransport, e.g. url, timeout, retries, backoff
+    """
+    ethclient.transport = RPCTransport(**settings)
 
 def encode_api_data(data):
     """Prepares data to be sent to the Ethereum client."""
@@ -26,4 +402,26 @@ def encode_api_data(data):
         # use the native hex() function
         return hex(data)
     else:
-        return '0x' + encode_hex(data)
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return '0x' + binascii.hexlify(data).decode('ascii')
+
+def encode_topic(data):
+    """Prepares a log topic to be sent to or compared against the Ethereum client.
+
+    Topics are always 32 bytes long. Numbers and hex values such as addresses are left-padded with
+    zeros, while text and bytes are bytes32 values, which are right-padded. A list of values is
+    encoded as an OR-topic array matching any of them.
+    """
+
+    if isinstance(data, (list, tuple)):
+        return [encode_topic(item) for item in data]
+
+    encoded = encode_api_data(data)
+
+    if encoded is None:
+        return None
+
+    if isinstance(data, bytes) or (isinstance(data, str) and not data.startswith('0x')):
+        return '0x' + encoded[2:].lower().ljust(64, '0')
+    return '0x' + encoded[2:].rstrip('L').lower().rjust(64, '0')
@@ -0,0 +1,345 @@
+"""Persistent local index of EtherPKI contract logs."""
+
+import os
+import sqlite3
+import threading
+
+from appdirs import user_cache_dir
+
+# number of blocks to roll back when the chain reorganizes under the index
+DEFAULT_CONFIRMATIONS = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    block_hash TEXT,
+    transaction_hash TEXT,
+    topic0 TEXT,
+    topic1 TEXT,
+    topic2 TEXT,
+    topic3 TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS logs_topic1 ON logs (topic0, topic1);
+CREATE INDEX IF NOT EXISTS logs_topic2 ON logs (topic0, topic2);
+CREATE INDEX IF NOT EXISTS logs_topic3 ON logs (topic0, topic3);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    block_number INTEGER PRIMARY KEY,
+    block_hash TEXT NOT NULL
+);
+"""
+
+
+def default_index_path(address):
+    """Returns the path of the index file for a contract address."""
+    cachedir = user_cache_dir("etherpki")
+
+    try:
+        os.makedirs(cachedir)
+    except OSError:
+        if not os.path.isdir(cachedir):
+            raise
+
+    return os.path.join(cachedir, "events-" + (address.lower() or "default") + ".db")
+
+
+class EventIndex(object):
+    """An on-disk index of the raw logs emitted by an EtherPKI contract.
+
+    The index stores logs exactly as returned by eth_getLogs so that they can be decoded by the
+    same code path as logs fetched straight from the Ethereum client.
+    """
+
+    def __init__(self, path, confirmations=DEFAULT_CONFIRMATIONS):
+        """
+        path:           the path of the SQLite database, or ':memory:'
+        confirmations:  how many blocks to roll back when a reorg is detected
+        """
+        self.path = path
+        self.confirmations = confirmations
+
+        # the number of times logs were removed by rollback, so that copies can tell they are stale
+        self.rollbacks = 0
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get_cursor(self):
+        """Returns the number of the last synced block, or None if the index is empty."""
+        with self._lock:
+            row = self._db.execute("SELECT MAX(block_number) FROM checkpoints").fetchone()
+        return row[0]
+
+    def query(self, topics):
+        """
+        Get indexed logs matching topics, ordered by (block number, log index).
+
+        topics: a list of encoded topics, where None matches any value and a list matches any
+                of its values
+        """
+        logs = []
+        for page in self.iter_query(topics):
+            logs += page
+        return logs
+
+    def iter_query(self, topics, page_size=1000, after=(-1, -1)):
+        """
+        Get indexed logs matching topics page by page, see query.
+
+        The index is only locked while a page is read, so the pages can be consumed slowly.
+
+        after:  the (block number, log index) position to return logs after
+
+        yields lists of at most page_size logs
+        """
+        clauses = []
+        params = []
+        for position, topic in enumerate(topics):
+            if topic is None:
+                continue
+            elif isinstance(topic, list):
+                clauses.append("topic%d IN (%s)" % (position, ", ".join("?" * len(topic))))
+                params += topic
+            else:
+                clauses.append("topic%d = ?" % position)
+                params.append(topic)
+
+        # continue each page after the last log of the previous one
+        clauses.append("(block_number > ? OR (block_number = ? AND log_index > ?))")
+
+        sql = "SELECT block_number, log_index, block_hash, transaction_hash, " \
+            "topic0, topic1, topic2, topic3, data FROM logs WHERE " + " AND ".join(clauses) + \
+            " ORDER BY block_number, log_index LIMIT ?"
+
+        (block_number, log_index) = after
+        while True:
+            with self._lock:
+                rows = self._db.execute(sql, params + [block_number, block_number, log_index, page_size]).fetchall()
+
+            if not rows:
+                return
+
+            (block_number, log_index) = rows[-1][:2]
+            yield [self._row_to_log(row) for row in rows]
+
+            if len(rows) < page_size:
+                return
+
+    def _row_to_log(self, row):
+        """Converts a database row back to the eth_getLogs representation."""
+        (block_number, log_index, block_hash, transaction_hash) = row[:4]
+        return {
+            'blockNumber': hex(block_number),
+            'logIndex': hex(log_index),
+            'blockHash': block_hash,
+            'transactionHash': transaction_hash,
+            'topics': [topic for topic in row[4:8] if topic is not None],
+            'data': row[8],
+        }
+
+    def add_logs(self, logs):
+        """Stores raw logs as returned by eth_getLogs."""
+        rows = []
+        for log in logs:
+            if log.get('removed'):
+                continue
+            topics = [topic.lower() for topic in log['topics']]
+            topics += [None] * (4 - len(topics))
+            rows.append([
+                int(log['blockNumber'], 16),
+                int(log['logIndex'], 16),
+                log.get('blockHash'),
+                log.get('transactionHash'),
+            ] + topics + [log['data']])
+
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_checkpoint(self, block_number, block_hash):
+        """Records that every block up to block_number has been synced."""
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?)", (block_number, block_hash))
+
+            # only keep the checkpoints needed to roll back by the confirmation depth
+            self._db.execute(
+                "DELETE FROM checkpoints WHERE block_number < "
+                "(SELECT MAX(block_number) FROM checkpoints WHERE block_number <= ?)",
+                (block_number - self.confirmations,)
+            )
+
+    def rollback(self, client):
+        """
+        Roll back the index until its newest checkpoint matches the chain.
+
+        client: the Ethereum client to compare block hashes against
+
+        returns the number of the last block that is still considered synced
+        """
+        with self._lock:
+            while True:
+                row = self._db.execute(
+                    "SELECT block_number, block_hash FROM checkpoints ORDER BY block_number DESC LIMIT 1"
+                ).fetchone()
+
+                if row is None:
+                    cursor = -1
+                    break
+
+                (block_number, block_hash) = row
+                block = client.get_block_by_number(block_number, False)
+
+                if block is not None and block['hash'] == block_hash:
+                    cursor = block_number
+                    break
+
+                # the checkpoint was reorged away, so drop everything within the confirmation depth
+                with self._db:
+                    self._db.execute(
+                        "DELETE FROM checkpoints WHERE block_number > ?",
+                        (block_number - self.confirmations,)
+                    )
+
+            with self._db:
+                if self._db.execute("DELETE FROM logs WHERE block_number > ?", (cursor,)).rowcount:
+                    self.rollbacks += 1
+
+        return cursor
+
+    def sync(self, fetcher, address):
+        """
+        Fetch the logs of blocks newer than the last synced block.
+
+        fetcher:    the LogFetcher to fetch logs with
+        address:    the Ethereum address of the contract
+
+        returns the number of logs added
+        """
+        client = fetcher.client
+        added = 0
+
+        with self._lock:
+            cursor = self.rollback(client)
+            latest = client.get_block_number()
+
+            if latest <= cursor:
+                return 0
+
+            for logs in fetcher.iter_chunks(address, from_block=cursor + 1, to_block=latest):
+                self.add_logs(logs)
+                added += len(logs)
+
+            block = client.get_block_by_number(latest, False)
+            self.add_checkpoint(latest, block['hash'])
+
+        return added
+
+
+class MemoryIndex(object):
+    """An in-memory copy of an EventIndex, answering the same queries without reading from disk.
+
+    Logs are kept in chain order with a posting list per topic value, so a query only looks at the
+    logs of its most selective topic. refresh copies the logs added to the source index since the
+    last refresh, and copies the whole index again if the source was rolled back.
+    """
+
+    def __init__(self, source):
+        """
+        source: the EventIndex to copy
+        """
+        self.source = source
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._logs = []
+        self._postings = [{} for _ in range(4)]
+        self._position = (-1, -1)
+        self._rollbacks = self.source.rollbacks
+
+    def get_cursor(self):
+        return self.source.get_cursor()
+
+    def refresh(self):
+        """
+        Copy the logs added to the source index since the last refresh.
+
+        returns the number of logs copied
+        """
+        added = 0
+        with self._lock:
+            cursor = self.source.get_cursor()
+            if self.source.rollbacks != self._rollbacks or (cursor is not None and cursor < self._position[0]):
+                self._reset()
+
+            # logs are only ever appended, so queries holding on to earlier positions stay correct
+            for page in self.source.iter_query([], after=self._position):
+                for log in page:
+                    for (topic_position, topic) in enumerate(log['topics']):
+                        self._postings[topic_position].setdefault(topic, []).append(len(self._logs))
+                    self._logs.append(log)
+                self._position = (int(page[-1]['blockNumber'], 16), int(page[-1]['logIndex'], 16))
+                added += len(page)
+
+        return added
+
+    def sync(self, fetcher, address):
+        """Sync the source index, see EventIndex.sync, then copy the new logs."""
+        added = self.source.sync(fetcher, address)
+        self.refresh()
+        return added
+
+    def query(self, topics):
+        """Get logs matching topics, see EventIndex.query."""
+        logs = []
+        for page in self.iter_query(topics):
+            logs += page
+        return logs
+
+    def iter_query(self, topics, page_size=1000):
+        """Get logs matching topics page by page, see EventIndex.iter_query."""
+        filters = []
+        candidates = None
+        with self._lock:
+            logs = self._logs
+            count = len(logs)
+
+            # find the positions of the logs matching the most selective topic
+            for (topic_position, topic) in enumerate(topics):
+                if topic is None:
+                    continue
+                values = topic if isinstance(topic, list) else [topic]
+                filters.append((topic_position, set(values)))
+
+                positions = []
+                for value in set(values):
+                    positions += self._postings[topic_position].get(value, [])
+                if candidates is None or len(positions) < len(candidates):
+                    (candidates, merged) = (positions, len(set(values)) > 1)
+
+        if candidates is None:
+            candidates = range(count)
+        elif merged:
+            candidates.sort()
+
+        page = []
+        for position in candidates:
+            if position >= count:
+                break
+            log = logs[position]
+            log_topics = log['topics']
+            if all(topic_position < len(log_topics) and log_topics[topic_position] in values
+                    for (topic_position, values) in filters):
+                page.append(log)
+                if len(page) == page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
@@ -1,47 +1,253 @@
 """API for EtherPKI events"""
 
+import binascii
+import itertools
 import time
 
-from ethereum import abi
-from ethereum import processblock
-from ethereum.utils import big_endian_to_int
-from ethereum.utils import decode_hex
-
-import ipfshttpclient
-from gpgapi import process_proof
-from ethapi import ETHERPKI_ABI
-from ethapi import ETHERPKI_DEFAULT_ADDRESS
-from ethapi import ethclient
-from ethapi import encode_api_data
+from etherpki import metrics
+from etherpki.abicodec import get_log_decoder
+from etherpki.commitments import get_committed_attribute
+from etherpki.commitments import iter_committed_attributes
+from etherpki.datahash import check_datahash
+from etherpki.gpgapi import ProofVerificationPool
+from etherpki.gpgapi import get_proof_cache
+from etherpki.gpgapi import process_proof
+from etherpki.ipfsapi import PREFETCH_WORKERS
+from etherpki.ipfsapi import block_text
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.ipfsapi import prefetch
+from etherpki.ipfsapi import release_block
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import ethclient
+from etherpki.ethapi import encode_topic
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.eventindex import EventIndex
+from etherpki.eventindex import default_index_path
+from etherpki.expiry import ExpiryIndex
+from etherpki.logfetch import LogFetcher
+from etherpki.statereader import StateReader
+from etherpki.statereader import settings as state_settings
+
+# maximum number of alternative values in a single topic of a log query
+MAX_TOPICS_PER_QUERY = 500
+
+# number of streamed attributes whose signatures are resolved together
+STATUS_BATCH_SIZE = 25
+
+# number of attributes whose PGP proofs are handed to the verification pool together
+VERIFY_BATCH_SIZE = 1000
+
+# number of streamed attributes whose IPFS data is fetched together
+PREFETCH_BATCH_SIZE = 25
+
+
+def _chunks(items, size):
+    """Split a list into lists of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _iter_batches(items, size):
+    """Split an iterable into lists of at most size items, reading it lazily."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_signatures_status(rawsignatures, revocations, now=None):
+    """
+    Check the expiration and revocation of the signatures of an attribute.
+
+    rawsignatures:  the decoded AttributeSigned events of the attribute
+    revocations:    a dictionary mapping signature IDs to their decoded SignatureRevoked events
+    now:            the unix time to check expiration against, defaults to the current time
+
+    returns a dictionary representing the signatures' status
+    """
+    if now is None:
+        now = time.time()
+
+    signatures = []
+    status = {
+        'valid': 0,
+        'invalid': 0
+    }
+
+    signatures_status = {
+        'status': status,
+        'signatures': signatures
+    }
+
+    # process the signatures
+    for rawsignature in rawsignatures:
+        signature = {}
+
+        # add signature properties to the dictionary
+        signature.update(rawsignature)
+
+        # check if expired
+        signature['expired'] = now > signature['expiry']
+
+        # check if revoked
+        signature['revocation'] = revocations.get(signature['signatureID']) or False
+
+        # check if valid
+        if not signature['expired'] and not signature['revocation']:
+            signature['valid'] = True
+            status['valid'] += 1
+        else:
+            signature['valid'] = False
+            status['invalid'] += 1
+
+        signatures.append(signature)
+
+    return signatures_status
+
+def join_signatures_status(attribute_ids, rawsignatures, rawrevocations, now=None):
+    """
+    Build the signatures status of several attributes.
+
+    attribute_ids:  the IDs of the attributes
+    rawsignatures:  the decoded AttributeSigned events of the attributes
+    rawrevocations: the decoded SignatureRevoked events of the signatures
+    now:            the unix time to check expiration against, defaults to the current time
+
+    returns a dictionary mapping each attribute ID to its signatures status
+    """
+    revocations = {}
+    for rawrevocation in rawrevocations:
+        # the field name is spelled as in the contract ABI
+        revocations.setdefault(rawrevocation['signratureID'], []).append(rawrevocation)
+
+    # join signatures to their attributes
+    signatures_by_attribute = dict((attributeID, []) for attributeID in attribute_ids)
+    for rawsignature in rawsignatures:
+        signatures_by_attribute.setdefault(rawsignature['attributeID'], []).append(rawsignature)
+
+    if now is None:
+        now = time.time()
+
+    return dict(
+        (attributeID, build_signatures_status(rawsignatures, revocations, now))
+        for (attributeID, rawsignatures) in signatures_by_attribute.items()
+    )
+
+def apply_attribute_blocks(attributes, blocks, cache=True):
+    """
+    Replace ipfs-block:// URIs in the data of attributes by fetched blocks, and check the data
+    against the dataHash of the attributes.
+
+    attributes: decoded attributes, which are modified in place
+    blocks:     a dictionary mapping CIDs to block data or to the exception raised fetching them
+    cache:      the VerifiedCache of datahash.check_datahash
+
+    returns attributes, with data_valid set to the result of datahash.check_datahash for those
+    whose data is available
+    """
+    for attribute in attributes:
+        cid = parse_block_uri(attribute['data'])
+        if cid is None:
+            attribute['data_valid'] = check_datahash(attribute['dataHash'], attribute['data'])
+            continue
+        if cid not in blocks:
+            continue
+
+        block = blocks[cid]
+        if isinstance(block, Exception):
+            attribute['data_error'] = str(block)
+            continue
+
+        # the block is hashed before it is decoded, as decoding replaces invalid UTF-8
+        attribute['data_valid'] = check_datahash(attribute['dataHash'], block, cid, cache)
+        attribute['data_uri'] = attribute['data']
+        attribute['data'] = block_text(block)
+
+    return attributes
 
 class Events(object):
-    def __init__(self, address=ETHERPKI_DEFAULT_ADDRESS):
+    def __init__(self, address=ETHERPKI_DEFAULT_ADDRESS, index=True, autosync=True, client=None, state=None):
         """
         Initialization of the event retriever.
 
-        address: the Ethereum address of the contract
+        address:    the Ethereum address of the contract
+        index:      an EventIndex to answer queries from, True to use the default on-disk index,
+                    or False to scan the chain history on every query
+        autosync:   if True, the index is synced before it is first queried
+        client:     the EthClient to use, defaults to the shared pooled client
+        state:      a StateReader to answer queries from contract state instead of logs, True to
+                    create one, or None to do so if state reads are enabled in statereader.settings
         """
         self.address = address
+        self.client = client if client is not None else ethclient
+        self.fetcher = LogFetcher(self.client)
+
+        if state is None:
+            state = state_settings['enabled']
+        if state is True:
+            state = StateReader(address, self.client)
+        self.state = state or None
+
+        if self.state is not None:
+            # logs are not read at all
+            index = False
+        elif index is True:
+            index = EventIndex(default_index_path(address))
+        self.index = index or None
+
+        self._synced = not autosync
+
+        # the expiry index, and the index cursor it was built at
+        self._expiry_index = None
+        self._expiry_cursor = None
+
+        self._decoder = get_log_decoder(get_etherpki_abi())
+
+    def sync(self):
+        """
+        Bring the local event index up to date with the Ethereum client, or pin state reads to the
+        latest block.
+
+        returns the number of logs added to the index
+        """
+        if self.state is not None:
+            self.state.pin()
+            self._synced = True
+            return 0
+
+        if self.index is None:
+            return 0
 
-        self._contracttranslator = abi.ContractTranslator(ETHERPKI_ABI)
+        with metrics.stage('index.sync'):
+            added = self.index.sync(self.fetcher, self.address)
+        self._synced = True
+        return added
 
     def _get_event_id_by_name(self, event_name):
         """
-        Get the name of the event based on its name.
+        Get the ID of the event based on its name.
 
         event_name: the event's name
         """
-        for event_id, event in self._contracttranslator.event_data.items():
-            if event['name'] == event_name:
-                return event_id
+        return self._decoder.event_topic(event_name)
 
-    def _get_logs(self, topics, event_name=None):
+    def _iter_log_chunks(self, topics, event_name=None):
         """
-        Get logs of the events that occur.
+        Get logs of the events that occur, chunk by chunk.
 
         topics:     a list of topics to search based on
         event_name: the name of the event
+
+        yields lists of decoded logs, in the order the events occurred
         """
+        if self.state is not None:
+            # read the records the events created from contract state instead
+            for records in self.state.iter_chunks(event_name, topics):
+                yield records
+            return
 
         # set topic to the ID if the name is specified
         if event_name == None:
@@ -53,29 +259,94 @@ class Events(object):
         topics = [event_topic] + topics
 
         # encode topics to be sent to the eth client
-        topics = [encode_api_data(topic) for topic in topics]
-
-        # gets logs from eth client
-        logs = ethclient.get_logs(
-            from_block='earliest',
-            address=self.address,
-            topics=topics,
-        )
-        
+        topics = [encode_topic(topic) for topic in topics]
+
+        if self.index is not None:
+            # answer from the local index
+            if not self._synced:
+                self.sync()
+            chunks = self.index.iter_query(topics)
+            source = 'index.query'
+        else:
+            # gets logs from eth client in concurrent block-range chunks
+            chunks = self.fetcher.iter_chunks(self.address, topics)
+            source = 'logs.fetch'
 
         # decode logs using the ABI
-        decoded_logs = []
-        for log in logs:
-            logobj = processblock.Log(
-                log['address'][2:],
-                [big_endian_to_int(decode_hex(topic[2:])) for topic in log['topics']],
-                decode_hex(log['data'][2:])
-            )
-            decoded_log = self._contracttranslator.listen(logobj, noprint=True)
-            decoded_logs.append(decoded_log)
+        chunks = iter(chunks)
+        while True:
+            with metrics.stage(source):
+                logs = next(chunks, None)
+            if logs is None:
+                break
+
+            with metrics.stage('decode'):
+                decoded_logs = self._decoder.decode_many(logs)
+            metrics.count('decode.logs', len(logs))
+            if decoded_logs:
+                yield decoded_logs
+
+    def _iter_logs(self, topics, event_name=None):
+        """
+        Get logs of the events that occur, one at a time, see _iter_log_chunks.
+        """
+        for decoded_logs in self._iter_log_chunks(topics, event_name):
+            for decoded_log in decoded_logs:
+                yield decoded_log
+
+    def _get_logs(self, topics, event_name=None):
+        """
+        Get logs of the events that occur.
 
+        topics:     a list of topics to search based on
+        event_name: the name of the event
+        """
+        decoded_logs = []
+        for chunk in self._iter_log_chunks(topics, event_name):
+            decoded_logs += chunk
         return decoded_logs
 
+    def iter_attributes(self, attributeID=None, owner=None, identifier=None):
+        """
+        Filter attributes, yielding each one as soon as it has been fetched.
+
+        Takes the same arguments as filter_attributes. Fetching stops when the generator is closed.
+        """
+        return self._iter_logs([attributeID, owner, identifier], event_name='AttributeAdded')
+
+    def iter_signatures(self, signatureID=None, signer=None, attributeID=None):
+        """
+        Filter signatures, yielding each one as soon as it has been fetched.
+
+        Takes the same arguments as filter_signatures. Fetching stops when the generator is closed.
+        """
+        return self._iter_logs([signatureID, signer, attributeID], event_name='AttributeSigned')
+
+    def iter_revocations(self, revocationID=None, signatureID=None):
+        """
+        Filter revocations, yielding each one as soon as it has been fetched.
+
+        Takes the same arguments as filter_revocations. Fetching stops when the generator is closed.
+        """
+        return self._iter_logs([revocationID, signatureID], event_name='SignatureRevoked')
+
+    def iter_commitments(self, commitmentID=None, owner=None, root=None):
+        """
+        Filter commitments, yielding each one as soon as it has been fetched.
+
+        Takes the same arguments as filter_commitments. Fetching stops when the generator is closed.
+        """
+        return self._iter_logs([commitmentID, owner, root], event_name='AttributesCommitted')
+
+    def iter_all_events(self):
+        """
+        Get every event of the contract, chunk by chunk.
+
+        yields lists of decoded events of any type, each with its name in _event_type, in the order
+        they occurred, or one event type after the other when reading from contract state
+        """
+        return self._iter_log_chunks([], None)
+
     def filter_attributes(self, attributeID=None, owner=None, identifier=None):
         """
         Filter and get attributes.
@@ -83,6 +354,8 @@ class Events(object):
         attributeID: the ID of the attribute
         owner: the Ethereum address that owns the attribute
         identifier: the identifier of the attribute
+
+        Any of the arguments may also be a list of values, matching any of them.
         """
         return self._get_logs([attributeID, owner, identifier], event_name='AttributeAdded')
 
@@ -93,6 +366,8 @@ class Events(object):
         signatureID: the ID of the signature
         signer: the Ethereum address that owns the signature
         attributeID: the ID of the attribute
+
+        Any of the arguments may also be a list of values, matching any of them.
         """
         return self._get_logs([signatureID, signer, attributeID], event_name='AttributeSigned')
 
@@ -102,9 +377,48 @@ class Events(object):
 
         revocationID: the ID of the revocation
         signatureID: the ID of the signature
+
+        Any of the arguments may also be a list of values, matching any of them.
         """
         return self._get_logs([revocationID, signatureID], event_name='SignatureRevoked')
 
+    def filter_commitments(self, commitmentID=None, owner=None, root=None):
+        """
+        Filter and get commitments to batches of attributes.
+
+        commitmentID: the ID of the commitment
+        owner: the Ethereum address that owns the committed attributes
+        root: the root of the Merkle tree of the attributes, as 32 bytes
+
+        Any of the arguments may also be a list of values, matching any of them.
+        """
+        return self._get_logs([commitmentID, owner, root], event_name='AttributesCommitted')
+
+    def search_attributes(self, attributetype=None, identifier=None, owner=None, offset=0, limit=None,
+            with_data=False):
+        """
+        Search attributes and resolve their signatures status, streaming the results.
+
+        attributetype:  the type of the attributes
+        identifier:     the identifier of the attributes
+        owner:          the Ethereum address that owns the attributes
+        offset:         the number of matching attributes to skip
+        limit:          the maximum number of attributes, or None for all of them
+        with_data:      if True, the IPFS data of the attributes is resolved
+
+        yields tuples of (attribute, signatures status)
+        """
+        attributes = (attribute for attribute in self.iter_attributes(None, owner, identifier)
+            if attributetype is None or attributetype == attribute['attributeType'])
+
+        # stop fetching as soon as enough attributes have been found
+        attributes = itertools.islice(attributes, offset, None if limit is None else offset + limit)
+
+        if with_data:
+            attributes = self.iter_resolved_data(attributes)
+
+        return self.iter_signatures_status(attributes)
+
     def get_attribute_signatures_status(self, attributeID):
         """
         Get all of the signatures of an attribute and check their expiration.
@@ -113,48 +427,125 @@ class Events(object):
 
         returns a dictionary representing the signatures' status
         """
-        signatures = []
-        status = {
-            'valid': 0,
-            'invalid': 0
-        }
+        return self.get_signatures_status_many([attributeID])[attributeID]
 
-        signatures_status = {
-            'status': status,
-            'signatures': signatures
-        }
+    def get_signatures_status_many(self, attribute_ids):
+        """
+        Get the signatures status of several attributes at once.
 
-        # filter signatures for a specified attribute
-        rawsignatures = self.filter_signatures(attributeID=attributeID)
+        The signatures and their revocations are fetched with OR-topic queries, so the number of
+        queries depends on the number of IDs divided by MAX_TOPICS_PER_QUERY rather than on the
+        number of signatures.
 
-        # process the signatures
-        for rawsignature in rawsignatures:
-            signature = {}
+        attribute_ids: the IDs of the attributes
 
-            # add signature properties to the dictionary
-            signature.update(rawsignature)
+        returns a dictionary mapping each attribute ID to its signatures status
+        """
+        attribute_ids = list(attribute_ids)
 
-            # check if expired
-            signature['expired'] = time.time() > signature['expiry']
+        # fetch the signatures of all attributes
+        rawsignatures = []
+        for chunk in _chunks(attribute_ids, MAX_TOPICS_PER_QUERY):
+            rawsignatures += self.filter_signatures(attributeID=chunk)
 
-            # check if revoked
-            rawrevocations = self.filter_revocations(signatureID=signature['signatureID'])
+        # fetch the revocations of all signatures
+        rawrevocations = []
+        signature_ids = [rawsignature['signatureID'] for rawsignature in rawsignatures]
+        for chunk in _chunks(signature_ids, MAX_TOPICS_PER_QUERY):
+            rawrevocations += self.filter_revocations(signatureID=chunk)
 
-            if len(rawrevocations) > 0:
-                signature['revocation'] = rawrevocations
-            else:
-                signature['revocation'] = False
-            # check if valid
-            if not signature['expired'] and not signature['revocation']:
-                signature['valid'] = True
-                status['valid'] += 1
-            else:
-                signature['valid'] = False
-                status['invalid'] += 1
+        return join_signatures_status(attribute_ids, rawsignatures, rawrevocations)
+
+    def get_expiry_index(self):
+        """
+        Get the index of signatures ordered by expiry.
+
+        The expiry index is built on first use from the local index, and built again once the local
+        index has synced new blocks. With state reads it is built again once they are pinned to
+        another block. Without either it is built from the chain on every call.
 
-            signatures.append(signature)
+        returns an ExpiryIndex
+        """
+        cursor = None
+        if self.state is not None:
+            cursor = self.state.block if self.state.block is not None else self.state.pin()
+        elif self.index is not None:
+            if not self._synced:
+                self.sync()
+            cursor = self.index.get_cursor()
+
+        if self._expiry_index is None or cursor is None or cursor != self._expiry_cursor:
+            self._expiry_index = ExpiryIndex(self.filter_signatures(), self.filter_revocations())
+            self._expiry_cursor = cursor
+        return self._expiry_index
+
+    def get_expiring_signatures(self, start=None, end=None, attributeID=None):
+        """
+        Get the signatures that are not revoked and expire between start and end.
+
+        start:          the unix time the period starts at, defaults to the current time
+        end:            the unix time the period ends at, defaults to no end
+        attributeID:    if set, only signatures of this attribute
+
+        returns a list of decoded AttributeSigned events that are not revoked, in the order they expire
+        """
+        if start is None:
+            start = time.time()
+        if end is None:
+            end = float('inf')
+        return self.get_expiry_index().expiring(start, end, attributeID)
+
+    def get_signatures_valid_until(self, attributeID, until=None):
+        """
+        Get the signatures of an attribute that are valid now and will not have expired by a point in
+        time. Revocations carry no time, so this does not tell which signatures were valid in the past.
 
-        return signatures_status
+        attributeID:    the ID of the attribute
+        until:          the unix time, defaults to the current time
+
+        returns a list of decoded AttributeSigned events that are not revoked, in the order they expire
+        """
+        return self.get_expiry_index().signatures_valid_until(attributeID, time.time() if until is None else until)
+
+    def get_attributes_valid_until(self, until=None, attribute_ids=None):
+        """
+        Get the attributes that have at least one signature that is valid now and will not have
+        expired by a point in time.
+
+        until:          the unix time, defaults to the current time
+        attribute_ids:  if set, only these attributes are checked
+
+        returns a list of attribute IDs
+        """
+        if until is None:
+            until = time.time()
+
+        expiry_index = self.get_expiry_index()
+        if attribute_ids is None:
+            return expiry_index.attributes_valid_until(until)
+        counts = expiry_index.count_valid_until(attribute_ids, until)
+        return [attributeID for (attributeID, valid) in counts.items() if valid]
+
+    def iter_signatures_status(self, attributes, batch_size=STATUS_BATCH_SIZE):
+        """
+        Resolve the signatures status of a stream of attributes.
+
+        The statuses are resolved with get_signatures_status_many, batch_size attributes at a time,
+        so the first results are available before the stream has been fully read.
+
+        attributes: an iterable of decoded attributes, e.g. from iter_attributes
+        batch_size: the number of attributes to resolve at once
+
+        yields tuples of (attribute, signatures status)
+        """
+        for batch in _iter_batches(attributes, batch_size):
+            for result in self._resolve_batch(batch):
+                yield result
+
+    def _resolve_batch(self, attributes):
+        signatures_status = self.get_signatures_status_many(
+            [attribute['attributeID'] for attribute in attributes])
+        return [(attribute, signatures_status[attribute['attributeID']]) for attribute in attributes]
 
     def retrieve_attribute(self, attributeID):
         """
@@ -173,20 +564,101 @@ class Events(object):
         attribute['signatures_status'] = self.get_attribute_signatures_status(attributeID)
 
         # download ipfs data if needed
-        if attribute['data'].startswith('ipfs-block://'):
-            ipfs_key = attribute['data'][len('ipfs-block://'):]
-            ipfshttpclient.Client.get(ipfs_key)
+        self.resolve_attribute_data([attribute])
 
         # verify PGP proof
         if attribute['attributeType'] == 'pgp-key':
             attribute['proof_valid'] = self.verify_attribute_pgp_proof(attribute)
 
         # set proof validity to unknown if the attribute has proof but unable to be processed
-        if attribute['has_proof'] and 'proof_valid' not in attribute:
+        if attribute['hasProof'] and 'proof_valid' not in attribute:
+            attribute['proof_valid'] = None
+
+        return attribute
+
+    def retrieve_committed_attribute(self, commitmentID, position):
+        """
+        Get an attribute of a commitment and check the proof of its inclusion in the commitment.
+
+        commitmentID:   the ID of the commitment
+        position:       the position of the attribute in the committed batch
+
+        returns a dictionary representing the properties of the attribute, as returned by
+        commitments.committed_attribute, or None if there is no such attribute
+        """
+        commitments = self.filter_commitments(commitmentID=commitmentID)
+        if not commitments:
+            return None
+
+        attribute = get_committed_attribute(commitments[0], position)
+        if attribute is None:
+            return None
+
+        # the data and proof are only trusted if the attribute belongs to the commitment
+        if attribute['inclusion_valid']:
+            self.resolve_attribute_data([attribute])
+
+            if attribute['attributeType'] == 'pgp-key':
+                attribute['proof_valid'] = self.verify_attribute_pgp_proof(attribute)
+
+        if attribute['hasProof'] and 'proof_valid' not in attribute:
             attribute['proof_valid'] = None
 
         return attribute
 
+    def verify_commitment(self, commitmentID):
+        """
+        Check the proofs of inclusion of every attribute of a commitment.
+
+        commitmentID: the ID of the commitment
+
+        returns a dictionary with the keys count, the number of attributes, valid, the number of
+        attributes whose proof is valid, and invalid, the positions of the others, or None if there
+        is no such commitment
+        """
+        commitments = self.filter_commitments(commitmentID=commitmentID)
+        if not commitments:
+            return None
+
+        result = {'count': commitments[0]['count'], 'valid': 0, 'invalid': []}
+        for attribute in iter_committed_attributes(commitments[0]):
+            if attribute['inclusion_valid']:
+                result['valid'] += 1
+            else:
+                result['invalid'].append(attribute['position'])
+        return result
+
+    def resolve_attribute_data(self, attributes, workers=PREFETCH_WORKERS):
+        """
+        Replace ipfs-block:// URIs in the data of attributes by the contents of the IPFS blocks.
+
+        The blocks of all attributes are fetched concurrently, through the local block cache. The
+        original URI is kept under 'data_uri', and if a block cannot be fetched the data is left
+        unchanged and the error is stored under 'data_error'. The data is checked against the
+        dataHash of the attribute, see apply_attribute_blocks.
+
+        attributes: decoded attributes, which are modified in place
+        workers:    the number of blocks fetched at once
+        """
+        cids = [parse_block_uri(attribute['data']) for attribute in attributes]
+        blocks = prefetch([cid for cid in cids if cid is not None], workers)
+        try:
+            return apply_attribute_blocks(attributes, blocks)
+        finally:
+            for block in blocks.values():
+                release_block(block)
+
+    def iter_resolved_data(self, attributes, batch_size=PREFETCH_BATCH_SIZE):
+        """
+        Resolve the IPFS data of a stream of attributes, see resolve_attribute_data.
+
+        attributes: an iterable of decoded attributes, e.g. from iter_attributes
+        batch_size: the number of attributes whose blocks are fetched together
+        """
+        for batch in _iter_batches(attributes, batch_size):
+            for attribute in self.resolve_attribute_data(batch):
+                yield attribute
+
     def verify_attribute_pgp_proof(self, attribute):
         """
         Verify the PGP proof of an attribute.
@@ -197,22 +669,106 @@ class Events(object):
         """
 
         # case for unspecified proof
-        if not attribute['has_proof']:
+        if not attribute['hasProof']:
             return None
 
-        proof = process_proof(attribute['data'])
+        return pgp_proof_matches(attribute, process_proof(attribute['data']))
 
-        if not proof:
-            return False
+    def _iter_batches_with_data(self, attributes, batch_size):
+        for batch in _iter_batches(attributes, batch_size):
+            yield self.resolve_attribute_data(batch)
 
-        (proof_address, proof_fingerprint) = proof
+    def verify_all_pgp_proofs(self, processes=None, cache=True, batch_size=VERIFY_BATCH_SIZE):
+        """
+        Verify the PGP proofs of every attribute that has a proof, across a pool of processes.
 
-        if (
-            # check that the fingerprints match
-            proof_fingerprint.decode('hex') == attribute['identifier'].rstrip('\x00')
-            # check that the ethereum addresses match
-            and proof_address == '0x' + attribute['owner']
-            ):
-            return True
+        processes:  the number of worker processes, defaults to the number of CPUs
+        cache:      a ProofCache to answer from and store results to, True for the default cache,
+                    or False to verify every proof
+        batch_size: the number of attributes read from the chain before their proofs are verified
 
-        return False
\ No newline at end of file
+        yields a dictionary for each attribute with its attributeID, owner, verdict ('valid',
+        'invalid' or 'error'), whether the result was cached, the verification time in seconds,
+        and the error message if the verdict is 'error'
+        """
+        if cache is True:
+            cache = get_proof_cache()
+
+        attributes = (attribute for attribute in self.iter_attributes() if attribute['hasProof'])
+
+        pool = None
+        try:
+            for batch in self._iter_batches_with_data(attributes, batch_size):
+                pending = {}
+                for attribute in batch:
+                    start = time.time()
+                    proof = cache.get(attribute['data']) if cache else None
+
+                    if proof is None:
+                        pending[attribute['attributeID']] = attribute
+                    else:
+                        yield _verdict(attribute, proof, time.time() - start, cached=True)
+
+                if not pending:
+                    continue
+
+                # only start the worker processes once there is something to verify
+                if pool is None:
+                    pool = ProofVerificationPool(processes)
+
+                tasks = [(attributeID, attribute['data']) for (attributeID, attribute) in pending.items()]
+                for (attributeID, proof, error, seconds) in pool.verify(tasks):
+                    attribute = pending[attributeID]
+                    if error is not None:
+                        yield _verdict(attribute, None, seconds, error=error)
+                        continue
+
+                    if cache:
+                        cache.put(attribute['data'], proof)
+                    yield _verdict(attribute, proof, seconds)
+        finally:
+            if pool is not None:
+                pool.close()
+
+
+def pgp_proof_matches(attribute, proof):
+    """
+    Check that a processed PGP proof belongs to an attribute.
+
+    attribute:  the attribute the proof was taken from
+    proof:      the result of process_proof for the attribute's data
+
+    returns True if the proof is valid for the attribute's identifier and owner, otherwise False
+    """
+    if not proof:
+        return False
+
+    (proof_address, proof_fingerprint) = proof
+
+    if (
+        # check that the fingerprints match
+        binascii.unhexlify(proof_fingerprint) == attribute['identifier'].rstrip(b'\x00')
+        # check that the ethereum addresses match
+        and proof_address.lower() == '0x' + attribute['owner']
+        ):
+        return True
+
+    return False
+
+
+def _verdict(attribute, proof, seconds, cached=False, error=None):
+    """Builds the result of verify_all_pgp_proofs for an attribute."""
+    verdict = {
+        'attributeID': attribute['attributeID'],
+        'owner': attribute['owner'],
+        'cached': cached,
+        'seconds': round(seconds, 6),
+    }
+
+    if error is not None:
+        verdict['verdict'] = 'error'
+        verdict['error'] = error
+    else:
+        verdict['verdict'] = 'valid' if pgp_proof_matches(attribute, proof) else 'invalid'
+
+    return verdict
@@ -0,0 +1,80 @@
+"""Index of signatures ordered by expiry, for time-based validity queries."""
+
+import bisect
+
+
+class ExpiryIndex(object):
+    """The unrevoked signatures of the registry in sorted arrays of their expiry times.
+
+    Revocations carry no time, so the index cannot tell what was valid at a past time. Its queries
+    are about the signatures that are valid now, that is not revoked, and whose expiry is at or after
+    a time T: a signature is valid until T if it is not revoked and expires at T or later, as in
+    build_signatures_status with T the current time. Revoked signatures are left out of the index
+    altogether. Every query is a binary search followed by reading the results.
+    """
+
+    def __init__(self, rawsignatures, rawrevocations):
+        """
+        rawsignatures:  the decoded AttributeSigned events
+        rawrevocations: the decoded SignatureRevoked events
+        """
+        # the field name is spelled as in the contract ABI
+        self.revoked = set(rawrevocation['signratureID'] for rawrevocation in rawrevocations)
+
+        self._signatures = sorted((rawsignature for rawsignature in rawsignatures
+            if rawsignature['signatureID'] not in self.revoked),
+            key=lambda rawsignature: (rawsignature['expiry'], rawsignature['signatureID']))
+        self._expiries = [rawsignature['expiry'] for rawsignature in self._signatures]
+
+        # the signatures of each attribute, in the same order
+        self._by_attribute = {}
+        for rawsignature in self._signatures:
+            self._by_attribute.setdefault(rawsignature['attributeID'], []).append(rawsignature)
+        self._attribute_expiries = dict((attributeID, [rawsignature['expiry'] for rawsignature in signatures])
+            for (attributeID, signatures) in self._by_attribute.items())
+
+        # attributes ordered by the expiry of their last signature, which is when they stop being valid
+        latest = dict((attributeID, expiries[-1]) for (attributeID, expiries) in self._attribute_expiries.items())
+        self._attributes = sorted(latest, key=lambda attributeID: (latest[attributeID], attributeID))
+        self._latest = [latest[attributeID] for attributeID in self._attributes]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def expiring(self, start, end, attributeID=None):
+        """
+        Get the signatures that are not revoked and expire at start or later, but before end.
+
+        start:          the unix time from which
+        end:            the unix time until which
+        attributeID:    if set, only signatures of this attribute
+
+        returns a list of decoded AttributeSigned events, in the order they expire
+        """
+        if attributeID is None:
+            (signatures, expiries) = (self._signatures, self._expiries)
+        else:
+            signatures = self._by_attribute.get(attributeID, [])
+            expiries = self._attribute_expiries.get(attributeID, [])
+
+        return signatures[bisect.bisect_left(expiries, start):bisect.bisect_left(expiries, end)]
+
+    def signatures_valid_until(self, attributeID, until):
+        """Returns the signatures of an attribute that are not revoked and expire at until or later,
+        in the order they expire."""
+        expiries = self._attribute_expiries.get(attributeID, [])
+        return self._by_attribute.get(attributeID, [])[bisect.bisect_left(expiries, until):]
+
+    def count_valid_until(self, attribute_ids, until):
+        """Returns a dictionary mapping each attribute ID to its number of signatures that are not
+        revoked and expire at until or later."""
+        counts = {}
+        for attributeID in attribute_ids:
+            expiries = self._attribute_expiries.get(attributeID, [])
+            counts[attributeID] = len(expiries) - bisect.bisect_left(expiries, until)
+        return counts
+
+    def attributes_valid_until(self, until):
+        """Returns the IDs of the attributes with at least one signature that is not revoked and
+        expires at until or later."""
+        return self._attributes[bisect.bisect_left(self._latest, until):]
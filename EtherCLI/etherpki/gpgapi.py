@@ -1,16 +1,137 @@
 """API for interacting with GPG."""
 
+import hashlib
+import os
 import shutil
+import sqlite3
 import tempfile
+import threading
+import time
 
-import gnupg
+from appdirs import user_cache_dir
 
-gpgclient = gnupg.GPG()
+from etherpki import metrics
+
+# maximum number of verification results kept by the default proof cache
+PROOF_CACHE_SIZE = 10000
+
+_gpgclient = None
+_keyring = None
+_proof_cache = None
+
+# the isolated keyring of a proof verification worker process
+_worker_keyring = None
+
+def get_gpgclient():
+    """Returns the interface to the user's GPG directory, creating it on first use."""
+    global _gpgclient
+    if _gpgclient is None:
+        import gnupg
+        _gpgclient = gnupg.GPG()
+    return _gpgclient
+
+def _cache_path(name):
+    """Returns the path of a file or directory in the EtherPKI cache directory."""
+    cachedir = user_cache_dir("etherpki")
+
+    try:
+        os.makedirs(cachedir)
+    except OSError:
+        if not os.path.isdir(cachedir):
+            raise
+
+    return os.path.join(cachedir, name)
+
+def get_keyring():
+    """Returns the long-lived isolated keyring used to verify proofs, creating it on first use."""
+    global _keyring
+    if _keyring is None:
+        _keyring = KeyringGPG(_cache_path("keyring"))
+    return _keyring
+
+def get_proof_cache():
+    """Returns the default on-disk proof cache, opening it on first use."""
+    global _proof_cache
+    if _proof_cache is None:
+        _proof_cache = ProofCache(_cache_path("proofs.db"))
+    return _proof_cache
+
+class KeyringGPG(object):
+    """a class for a GPG instance with its own keyring, separate from the user's GPG directory.
+
+    Unlike tempGPG, the keyring persists so that it can be reused by many verifications.
+    """
+
+    def __init__(self, gnupghome):
+        import gnupg
+
+        if not os.path.isdir(gnupghome):
+            os.makedirs(gnupghome)
+            os.chmod(gnupghome, 0o700)
+
+        self.gnupghome = gnupghome
+        self.gpgclient = gnupg.GPG(gnupghome=gnupghome)
+
+class ProofCache(object):
+    """An on-disk cache of proof verification results, bounded by least recent use.
+
+    Attribute data on the blockchain is immutable, so results are keyed by a hash of the data.
+    """
+
+    def __init__(self, path, max_entries=PROOF_CACHE_SIZE):
+        """
+        path:           the path of the SQLite database, or ':memory:'
+        max_entries:    the number of results kept before the least recently used are evicted
+        """
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS proofs (key TEXT PRIMARY KEY, valid INTEGER NOT NULL, "
+            "address TEXT, fingerprint TEXT, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS proofs_last_used ON proofs (last_used)")
+
+    @staticmethod
+    def key(data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self, data):
+        """Returns the cached result of process_proof for data, or None if it is not cached."""
+        key = self.key(data)
+        with self._lock, self._db:
+            row = self._db.execute("SELECT valid, address, fingerprint FROM proofs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE proofs SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        (valid, address, fingerprint) = row
+        return (address, fingerprint) if valid else False
+
+    def put(self, data, result):
+        """Stores the result of process_proof for data."""
+        (valid, address, fingerprint) = (True,) + tuple(result) if result else (False, None, None)
+
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO proofs VALUES (?, ?, ?, ?, ?)",
+                (self.key(data), valid, address, fingerprint, time.time()))
+
+            # evict the least recently used results
+            self._db.execute(
+                "DELETE FROM proofs WHERE key IN "
+                "(SELECT key FROM proofs ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
 
 class tempGPG(object):
     """a class for creating a temporary GPG instance separate from the user's GPG directory."""
 
     def __init__(self):
+        import gnupg
+
         # create the temporary directory
         self.tempdir = tempfile.mkdtemp()
 
@@ -30,7 +151,7 @@ def generate_pgp_attribute_data(keyid, address):
     """
 
     # export the public key
-    public_key = gpgclient.export_keys(keyid, minimal=True)
+    public_key = get_gpgclient().export_keys(keyid, minimal=True)
 
     # use the temporary GPG interface to key that only one key has been exported and get its fingerprint
     tempgpg = tempGPG()
@@ -38,7 +159,7 @@ def generate_pgp_attribute_data(keyid, address):
         import_results = tempgpg.gpgclient.import_keys(public_key)
 
         # check that only 1 key was imported
-        if import_results.counts != 1: #TODO: verify that it should be 'counts'
+        if import_results.count != 1:
             raise ValueError("Invalid PGP key ID specified")
 
         fingerprint = str(import_results.fingerprints[0])
@@ -46,7 +167,7 @@ def generate_pgp_attribute_data(keyid, address):
         tempgpg.destroy()
 
     # generate the proof signature
-    proof = gpgclient.sign('Ethereum addres: ' + address, keyid=fingerprint)
+    proof = get_gpgclient().sign('Ethereum addres: ' + address, keyid=fingerprint)
 
 
     if not proof:
@@ -57,12 +178,10 @@ def generate_pgp_attribute_data(keyid, address):
 
     return (fingerprint, data)
 
-def process_proof(data):
-    """Process the cryptographic proof of PGP attribute data.
+def _parse_proof(data):
+    """Extracts the public key, the signed message and the Ethereum address from PGP attribute data.
 
-    returns a tuple of (Ethereum address, PGP key fingerprint) if the proof is valid, otherwise False
-    
-    data:   the PGP attribute data.
+    returns a tuple of (key, signature, address)
     """
 
     key = ''
@@ -91,15 +210,117 @@ def process_proof(data):
                 address = line[len('Ethereum address: '):]
             signature += line + '\n'
 
-    # create a temporary keychain and import the key
-    tempgpg = tempGPG()
-    tempgpg.gpgclient.import_keys(key)
+    return (key, signature, address)
 
-    verified = tempgpg.gpgclient.verify(signature)
+def verify_proof(data, gpgclient):
+    """Verify the cryptographic proof of PGP attribute data against a GPG interface.
 
-    tempgpg.destroy()
+    The key is imported into the keyring of gpgclient, and the signature is only accepted if it was
+    made by that key, so one keyring can be used to verify many proofs.
+
+    returns a tuple of (Ethereum address, PGP key fingerprint) if the proof is valid, otherwise False
+
+    data:       the PGP attribute data.
+    gpgclient:  the python-gnupg interface to verify with.
+    """
+    (key, signature, address) = _parse_proof(data)
+
+    import_results = gpgclient.import_keys(key)
+    verified = gpgclient.verify(signature)
 
     if not verified:
         return False
 
+    # reject signatures made by another key already in the keyring
+    signing_key = verified.pubkey_fingerprint or verified.fingerprint
+    if signing_key not in import_results.fingerprints:
+        return False
+
     return (address, verified.fingerprint)
+
+def process_proof(data, cache=True):
+    """Process the cryptographic proof of PGP attribute data.
+
+    returns a tuple of (Ethereum address, PGP key fingerprint) if the proof is valid, otherwise False
+    
+    data:   the PGP attribute data.
+    cache:  a ProofCache to look the result up in and store it to, True for the default cache, or
+            False to always run GnuPG.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+
+    if cache is True:
+        cache = get_proof_cache()
+
+    if cache:
+        cached = cache.get(data)
+        if cached is not None:
+            metrics.count('gpg.cache_hits')
+            return cached
+
+    with metrics.stage('gpg.verify'):
+        result = verify_proof(data, get_keyring().gpgclient)
+
+    if cache:
+        cache.put(data, result)
+
+    return result
+
+def _init_verification_worker(basedir):
+    """Gives a verification worker process its own isolated keyring under basedir."""
+    global _worker_keyring
+    _worker_keyring = KeyringGPG(tempfile.mkdtemp(dir=basedir))
+
+def _verify_in_worker(task):
+    """Verifies one proof in a worker process.
+
+    returns a tuple of (task key, verify_proof result or None, error message or None, seconds)
+    """
+    (key, data) = task
+    start = time.time()
+
+    try:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return (key, verify_proof(data, _worker_keyring.gpgclient), None, time.time() - start)
+    except Exception as e:
+        return (key, None, str(e) or type(e).__name__, time.time() - start)
+
+class ProofVerificationPool(object):
+    """a pool of processes verifying proofs in parallel, each with its own isolated keyring."""
+
+    def __init__(self, processes=None):
+        """
+        processes:  the number of worker processes, defaults to the number of CPUs.
+        """
+        import multiprocessing
+
+        self.basedir = tempfile.mkdtemp()
+        self.pool = multiprocessing.Pool(processes, initializer=_init_verification_worker,
+            initargs=(self.basedir,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def verify(self, tasks, chunksize=4):
+        """Verify many proofs. Results are yielded in the order they complete, not in the order of tasks.
+
+        tasks:      an iterable of (key, PGP attribute data) tuples, where key identifies the task.
+        chunksize:  the number of tasks sent to a worker at once.
+
+        yields tuples of (key, result, error, seconds), where result is as returned by process_proof,
+        or None if verification raised the error message error.
+        """
+        for result in self.pool.imap_unordered(_verify_in_worker, tasks, chunksize):
+            # verification runs in the workers, which report how long it took
+            metrics.observe('gpg.verify', result[3])
+            yield result
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        shutil.rmtree(self.basedir, ignore_errors=True)
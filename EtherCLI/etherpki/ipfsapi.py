@@ -1,6 +1,347 @@
 """IPFS Interface"""
 
-import ipfsApi
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
 
-# opens connection to ipfs on localhost on port 5001
-ipfsclient = ipfsApi.Client('127.0.0.1', 5001)
\ No newline at end of file
+from appdirs import user_cache_dir
+
+from etherpki import metrics
+
+# address of the local IPFS daemon's API
+IPFS_API_ADDRESS = '/ip4/127.0.0.1/tcp/5001/http'
+
+# URI scheme of attribute data stored as an IPFS block
+IPFS_BLOCK_SCHEME = 'ipfs-block://'
+
+# maximum total size of the default block cache
+BLOCK_CACHE_SIZE = 256 * 1024 * 1024
+
+# blocks at least this large are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1024 * 1024
+
+# number of blocks fetched concurrently by prefetch
+PREFETCH_WORKERS = 8
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+# multihash function codes and the hashlib constructors computing them
+MULTIHASH_FUNCTIONS = {
+    0x11: hashlib.sha1,
+    0x12: hashlib.sha256,
+    0x13: hashlib.sha512,
+}
+
+_ipfsclient = None
+_block_cache = None
+_client_lock = threading.Lock()
+
+
+def get_ipfsclient():
+    """Returns a connection to the local IPFS daemon, opening it on first use."""
+    global _ipfsclient
+    with _client_lock:
+        if _ipfsclient is None:
+            import ipfshttpclient
+            _ipfsclient = ipfshttpclient.connect(IPFS_API_ADDRESS)
+    return _ipfsclient
+
+
+def get_block_cache():
+    """Returns the default on-disk block cache."""
+    global _block_cache
+    if _block_cache is None:
+        _block_cache = BlockCache(os.path.join(user_cache_dir("etherpki"), "ipfs-blocks"))
+    return _block_cache
+
+
+def parse_block_uri(data):
+    """Returns the CID of an ipfs-block:// URI, or None if data is not such a URI."""
+    if isinstance(data, str) and data.startswith(IPFS_BLOCK_SCHEME):
+        return data[len(IPFS_BLOCK_SCHEME):]
+    return None
+
+
+def block_text(block):
+    """Decodes block data, as returned by get_block, to text."""
+    # decoding through a memoryview does not copy a memory-mapped block into memory first
+    with memoryview(block) as view:
+        return str(view, 'utf-8', 'replace')
+
+
+def release_block(block):
+    """Closes block data returned by get_block. Large cached blocks are memory maps, which keep a
+    file open until they are closed; other data, or an exception in its place, is left alone."""
+    if isinstance(block, mmap.mmap):
+        block.close()
+
+
+def _b58decode(text):
+    value = 0
+    for char in text:
+        value = value * 58 + BASE58_ALPHABET.index(char)
+    decoded = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    # leading '1's encode leading zero bytes
+    return b'\x00' * (len(text) - len(text.lstrip('1'))) + decoded
+
+
+def _b32decode(text):
+    import base64
+    text = text.upper()
+    return base64.b32decode(text + '=' * (-len(text) % 8))
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return (value, offset)
+        shift += 7
+
+
+def cid_multihash(cid):
+    """
+    Decode the multihash of a CID.
+
+    Supports CIDv0 ('Qm...') and base32 CIDv1 ('b...') identifiers.
+
+    returns a tuple of (hash function code, digest)
+    """
+    if cid.startswith('Qm'):
+        multihash = _b58decode(cid)
+    elif cid.startswith('b'):
+        raw = _b32decode(cid[1:])
+        (version, offset) = _read_varint(raw, 0)
+        if version != 1:
+            raise ValueError("Unsupported CID version: " + cid)
+        (_, offset) = _read_varint(raw, offset)
+        multihash = raw[offset:]
+    else:
+        raise ValueError("Unsupported CID encoding: " + cid)
+
+    (code, offset) = _read_varint(multihash, 0)
+    (length, offset) = _read_varint(multihash, offset)
+    return (code, multihash[offset:offset + length])
+
+
+def verify_block(cid, data):
+    """
+    Check that block data hashes to its CID.
+
+    returns True if the hash matches, False if it does not, or None if the hash function of the CID
+    is not supported
+    """
+    try:
+        (code, digest) = cid_multihash(cid)
+    except (ValueError, IndexError):
+        return False
+
+    if code == 0x00:
+        # identity multihash, the data is inlined in the CID
+        return bytes(data) == digest
+    if code not in MULTIHASH_FUNCTIONS:
+        return None
+
+    return MULTIHASH_FUNCTIONS[code](data).digest() == digest
+
+
+class BlockCache(object):
+    """A local on-disk cache of IPFS blocks, keyed by CID and bounded in size by least recent use.
+
+    Blocks are checked against their CID both when they are stored and when they are read, so a
+    corrupted cache entry is refetched rather than returned.
+    """
+
+    def __init__(self, directory, max_bytes=BLOCK_CACHE_SIZE, mmap_threshold=MMAP_THRESHOLD):
+        """
+        directory:      the directory the blocks are stored in
+        max_bytes:      the total size of blocks kept before the least recently used are evicted
+        mmap_threshold: blocks at least this large are read through a memory map
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap_threshold = mmap_threshold
+
+        self._lock = threading.Lock()
+        self._size = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, cid):
+        # CIDs only contain base58 or base32 characters, but guard against path traversal anyway
+        if not cid.isalnum():
+            raise ValueError("Invalid CID: " + cid)
+        return os.path.join(self.directory, cid)
+
+    def _read(self, path, size):
+        """Reads a cached block, memory-mapping it if it is large."""
+        with open(path, 'rb') as blockfile:
+            if size >= self.mmap_threshold:
+                return mmap.mmap(blockfile.fileno(), 0, access=mmap.ACCESS_READ)
+            return blockfile.read()
+
+    def get(self, cid):
+        """
+        Get a block from the cache.
+
+        returns the block as bytes, or as a read-only mmap for large blocks, which the caller closes
+        with release_block, or None if the block is not cached or failed its hash check
+        """
+        path = self._path(cid)
+        try:
+            size = os.path.getsize(path)
+            data = self._read(path, size)
+        except (IOError, OSError):
+            return None
+
+        if not verify_block(cid, data):
+            release_block(data)
+            self._remove(cid)
+            return None
+
+        # mark the block as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, cid, data):
+        """Store a block in the cache, if it matches its CID."""
+        if not verify_block(cid, data):
+            return False
+
+        (fd, temppath) = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as blockfile:
+            blockfile.write(data)
+        os.rename(temppath, self._path(cid))
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+        self._evict()
+        return True
+
+    def _remove(self, cid):
+        try:
+            size = os.path.getsize(self._path(cid))
+            os.remove(self._path(cid))
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self):
+        """Removes the least recently used blocks while the cache is over its size limit."""
+        with self._lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.startswith('.tmp-'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+            self._size = sum(size for (_, size, _) in entries)
+            for (_, size, name) in sorted(entries):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                self._size -= size
+
+
+def get_block(cid, cache=True):
+    """
+    Get an IPFS block, from the local cache if possible.
+
+    cid:    the CID of the block
+    cache:  a BlockCache, True for the default cache, or False to always ask the IPFS daemon
+
+    returns the block data as bytes or as a read-only mmap, which the caller closes with
+    release_block once it is done with the data
+    """
+    if cache is True:
+        cache = get_block_cache()
+
+    if cache:
+        data = cache.get(cid)
+        if data is not None:
+            metrics.count('ipfs.cache_hits')
+            return data
+
+    with metrics.stage('ipfs.get'):
+        data = get_ipfsclient().block.get(cid)
+    metrics.count('ipfs.bytes_received', len(data))
+
+    if verify_block(cid, data) is False:
+        raise ValueError("IPFS block does not match its CID: " + cid)
+
+    if cache:
+        cache.put(cid, data)
+
+    return data
+
+
+def put_block(data, cache=True):
+    """
+    Store data as an IPFS block.
+
+    data:   the block data as bytes
+    cache:  as for get_block, the cache the block is also kept in since it is likely to be read back
+
+    returns the CID of the block
+    """
+    with metrics.stage('ipfs.put'):
+        cid = get_ipfsclient().block.put(io.BytesIO(data))['Key']
+    metrics.count('ipfs.bytes_sent', len(data))
+
+    if cache is True:
+        cache = get_block_cache()
+    if cache:
+        cache.put(cid, data)
+
+    return cid
+
+
+def prefetch(cids, workers=PREFETCH_WORKERS, cache=True):
+    """
+    Get many IPFS blocks concurrently.
+
+    cids:       the CIDs of the blocks
+    workers:    the number of blocks fetched at once
+    cache:      as for get_block
+
+    returns a dictionary mapping each CID to its data, or to the exception raised fetching it
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    cids = list(set(cids))
+    if not cids:
+        return {}
+
+    def fetch(cid):
+        try:
+            return get_block(cid, cache)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(cids))) as pool:
+        return dict(zip(cids, pool.map(fetch, cids)))
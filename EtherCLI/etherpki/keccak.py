@@ -0,0 +1,30 @@
+"""The Keccak-256 hash of Ethereum.
+
+Ethereum hashes with the original Keccak, which differs from the standardized SHA3-256 of hashlib
+in its padding. It is taken from pycryptodome, or from pysha3 where pycryptodome is not installed.
+"""
+
+import functools
+
+# the constructor of hash objects, resolved on first use
+_new_keccak256 = None
+
+
+def new_keccak256():
+    """Returns a new Keccak-256 hash object, with the hashlib update and digest methods."""
+    global _new_keccak256
+    if _new_keccak256 is None:
+        try:
+            from Crypto.Hash import keccak
+            _new_keccak256 = functools.partial(keccak.new, digest_bits=256)
+        except ImportError:
+            import sha3
+            _new_keccak256 = sha3.keccak_256
+    return _new_keccak256()
+
+
+def keccak256(data):
+    """Returns the Keccak-256 digest of bytes."""
+    digest = new_keccak256()
+    digest.update(data)
+    return digest.digest()
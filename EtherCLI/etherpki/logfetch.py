@@ -0,0 +1,188 @@
+"""Parallel, block-range chunked log fetching."""
+
+import threading
+
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import encode_api_data
+
+# settings used by LogFetcher instances created without explicit arguments
+settings = {
+    'workers': 4,
+    'min_chunk': 16,
+    'max_chunk': 100000,
+    'initial_chunk': 5000,
+    'target_results': 2000,
+}
+
+# fragments of the error messages nodes return when a log query is too large
+RANGE_ERROR_HINTS = ('more than', 'too many', 'too large', 'range', 'limit', 'exceed', 'timeout', 'timed out')
+
+
+def configure(**new_settings):
+    """
+    Change the default settings of log fetchers.
+
+    new_settings: any of workers, min_chunk, max_chunk, initial_chunk, target_results
+    """
+    for (name, value) in new_settings.items():
+        if name not in settings:
+            raise TypeError("Unknown log fetching setting: " + name)
+        if value is not None:
+            settings[name] = value
+
+
+def log_sort_key(log):
+    """Returns the (block number, log index) position of a raw log."""
+    return (int(log['blockNumber'], 16), int(log['logIndex'], 16))
+
+
+def is_range_rpc_error(error):
+    """Returns True if an error is a JSON-RPC error reporting that a log query was too large."""
+    if isinstance(error, RPCError):
+        message = (error.message or '').lower()
+        return any(hint in message for hint in RANGE_ERROR_HINTS)
+    return False
+
+
+def _is_range_error(error):
+    """Returns True if an error means the block range of a query should be reduced."""
+    import requests
+
+    if isinstance(error, requests.Timeout):
+        return True
+    return is_range_rpc_error(error)
+
+
+class LogFetcher(object):
+    """Fetches logs over a block range as concurrent eth_getLogs queries of adaptive size.
+
+    The chunk size is halved whenever the node reports that a query returned too many results or
+    timed out, and doubled whenever a query returns few results.
+    """
+
+    def __init__(self, client, workers=None, min_chunk=None, max_chunk=None, initial_chunk=None,
+            target_results=None):
+        """
+        client:         the EthClient to query
+        workers:        the maximum number of queries in flight
+        min_chunk:      the smallest block range of a query
+        max_chunk:      the largest block range of a query
+        initial_chunk:  the block range of the first queries
+        target_results: the number of logs per query the chunk size is adjusted towards
+        """
+        self.client = client
+        self.workers = workers or settings['workers']
+        self.min_chunk = min_chunk or settings['min_chunk']
+        self.max_chunk = max_chunk or settings['max_chunk']
+        self.target_results = target_results or settings['target_results']
+
+        self.chunk_size = max(self.min_chunk, min(initial_chunk or settings['initial_chunk'], self.max_chunk))
+
+        self._lock = threading.Lock()
+
+    def _resolve_block(self, block):
+        """Converts a block tag to a block number."""
+        if block == 'earliest':
+            return 0
+        if block in ('latest', 'pending', None):
+            return self.client.get_block_number()
+        if isinstance(block, str):
+            return int(block, 16)
+        return block
+
+    def _adapt(self, results):
+        """Adjusts the chunk size after a successful query that returned results logs."""
+        with self._lock:
+            if results > self.target_results:
+                self.chunk_size = max(self.min_chunk, self.chunk_size // 2)
+            elif results < self.target_results // 4:
+                self.chunk_size = min(self.max_chunk, self.chunk_size * 2)
+
+    def _shrink(self):
+        """Halves the chunk size after a query failed because its range was too large."""
+        with self._lock:
+            self.chunk_size = max(self.min_chunk, self.chunk_size // 2)
+
+    def _fetch(self, address, topics, start, end):
+        return self.client.get_logs(
+            from_block=encode_api_data(start),
+            to_block=encode_api_data(end),
+            address=address,
+            topics=topics,
+        )
+
+    def iter_chunks(self, address, topics=None, from_block='earliest', to_block='latest'):
+        """
+        Fetch logs chunk by chunk.
+
+        address:    the Ethereum address of the contract
+        topics:     the encoded topics to filter by
+        from_block: the first block of the range, as a number or block tag
+        to_block:   the last block of the range, as a number or block tag
+
+        yields lists of raw logs, in (block number, log index) order across all lists
+        """
+        from concurrent.futures import FIRST_COMPLETED
+        from concurrent.futures import ThreadPoolExecutor
+        from concurrent.futures import wait
+
+        from_block = self._resolve_block(from_block)
+        to_block = self._resolve_block(to_block)
+
+        next_submit = from_block
+        next_yield = from_block
+        futures = {}
+        done = {}
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+
+        def submit(start, end):
+            futures[pool.submit(self._fetch, address, topics, start, end)] = (start, end)
+
+        try:
+            while next_yield <= to_block:
+                # keep the pool busy, without buffering too far ahead of the next chunk to yield
+                while (next_submit <= to_block and len(futures) < self.workers
+                        and len(futures) + len(done) < 2 * self.workers):
+                    end = min(next_submit + self.chunk_size - 1, to_block)
+                    submit(next_submit, end)
+                    next_submit = end + 1
+
+                (finished, _) = wait(list(futures), return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    (start, end) = futures.pop(future)
+                    try:
+                        logs = future.result()
+                    except Exception as e:
+                        if start == end or end - start < self.min_chunk or not _is_range_error(e):
+                            raise
+                        # retry the range as two halves
+                        self._shrink()
+                        middle = (start + end) // 2
+                        submit(start, middle)
+                        submit(middle + 1, end)
+                        continue
+
+                    self._adapt(len(logs))
+                    done[start] = (end, logs)
+
+                while next_yield in done:
+                    (end, logs) = done.pop(next_yield)
+                    next_yield = end + 1
+                    yield sorted(logs, key=log_sort_key)
+        finally:
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    def get_logs(self, address, topics=None, from_block='earliest', to_block='latest'):
+        """
+        Fetch all logs in a block range, see iter_chunks.
+
+        returns a list of raw logs in (block number, log index) order
+        """
+        logs = []
+        for chunk in self.iter_chunks(address, topics, from_block, to_block):
+            logs += chunk
+        return logs
@@ -0,0 +1,162 @@
+"""Merkle trees over batches of leaves, with inclusion proofs.
+
+The trees are those of RFC 6962: leaves and inner nodes are hashed with SHA-256 under different
+prefixes, so that a leaf cannot be passed off as an inner node, and the last node of a level that
+has no sibling is carried to the level above as is, rather than paired with a copy of itself.
+SHA-256 rather than Keccak-256 keeps the verification of proofs in the standard library; the
+contract only stores roots and never hashes leaves itself.
+"""
+
+import hashlib
+
+HASH_SIZE = 32
+
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+# the root of a tree without leaves
+EMPTY_ROOT = hashlib.sha256(b'').digest()
+
+
+def leaf_hash(data):
+    """Returns the hash of a leaf with the given content."""
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+
+def node_hash(left, right):
+    """Returns the hash of an inner node with the given children."""
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleBuilder(object):
+    """Builds a tree from a stream of leaves.
+
+    Only the roots of the complete subtrees seen so far are needed to compute the root, one per
+    level at most. The leaf hashes are also kept, 32 bytes per leaf, unless keep_leaves is False,
+    so that the proofs can be computed once all leaves have been added.
+    """
+
+    def __init__(self, keep_leaves=True):
+        """
+        keep_leaves:    if False, only the root can be computed, in memory logarithmic in the
+                        number of leaves
+        """
+        self.count = 0
+        # tuples of (number of leaves, hash) of complete subtrees, largest first
+        self._subtrees = []
+        self._leaves = bytearray() if keep_leaves else None
+
+    def add(self, data):
+        """Adds a leaf with the given content."""
+        self.add_hash(leaf_hash(data))
+
+    def add_hash(self, digest):
+        """Adds a leaf by its hash."""
+        if self._leaves is not None:
+            self._leaves += digest
+
+        size = 1
+        subtrees = self._subtrees
+        while subtrees and subtrees[-1][0] == size:
+            digest = node_hash(subtrees.pop()[1], digest)
+            size *= 2
+        subtrees.append((size, digest))
+        self.count += 1
+
+    def root(self):
+        """Returns the root of the tree of the leaves added so far."""
+        if not self._subtrees:
+            return EMPTY_ROOT
+
+        # the subtrees are joined from the right, as the last node of a level is carried up
+        digest = self._subtrees[-1][1]
+        for (_, left) in reversed(self._subtrees[:-1]):
+            digest = node_hash(left, digest)
+        return digest
+
+    def tree(self):
+        """Returns the MerkleTree of the leaves added so far."""
+        if self._leaves is None:
+            raise ValueError("The leaves were not kept")
+        return MerkleTree(bytes(self._leaves))
+
+
+class MerkleTree(object):
+    """A tree with every level kept, to compute the proofs of its leaves."""
+
+    def __init__(self, leaves):
+        """
+        leaves: the leaf hashes, concatenated
+        """
+        if len(leaves) % HASH_SIZE:
+            raise ValueError("Leaf hashes must be %d bytes each" % HASH_SIZE)
+
+        self.count = len(leaves) // HASH_SIZE
+        self._levels = [leaves]
+
+        level = leaves
+        while len(level) > HASH_SIZE:
+            parents = []
+            for offset in range(0, len(level) - HASH_SIZE, 2 * HASH_SIZE):
+                parents.append(node_hash(level[offset:offset + HASH_SIZE],
+                    level[offset + HASH_SIZE:offset + 2 * HASH_SIZE]))
+            if (len(level) // HASH_SIZE) % 2:
+                parents.append(level[-HASH_SIZE:])
+            level = b''.join(parents)
+            self._levels.append(level)
+
+    def root(self):
+        return self._levels[-1] if self.count else EMPTY_ROOT
+
+    def proof(self, index):
+        """
+        Get the proof of inclusion of a leaf.
+
+        index:  the position of the leaf
+
+        returns the list of the hashes of the siblings of the leaf and its ancestors, from the
+        bottom up, leaving out levels where it has no sibling
+        """
+        if not 0 <= index < self.count:
+            raise IndexError("No leaf at position " + str(index))
+
+        path = []
+        for level in self._levels[:-1]:
+            sibling = (index ^ 1) * HASH_SIZE
+            if sibling < len(level):
+                path.append(level[sibling:sibling + HASH_SIZE])
+            index >>= 1
+        return path
+
+
+def verify_proof(digest, index, count, path, root):
+    """
+    Check the proof of inclusion of a leaf in a tree.
+
+    digest: the hash of the leaf
+    index:  the position of the leaf
+    count:  the number of leaves of the tree
+    path:   the proof, as returned by MerkleTree.proof
+    root:   the root of the tree
+
+    returns True if the proof is valid
+    """
+    if not 0 <= index < count:
+        return False
+
+    used = 0
+    width = count
+    while width > 1:
+        if index ^ 1 < width:
+            if used == len(path):
+                return False
+            sibling = path[used]
+            used += 1
+            if index & 1:
+                digest = hashlib.sha256(NODE_PREFIX + sibling + digest).digest()
+            else:
+                digest = hashlib.sha256(NODE_PREFIX + digest + sibling).digest()
+        index >>= 1
+        width = (width + 1) >> 1
+
+    return used == len(path) and digest == root
@@ -0,0 +1,281 @@
+"""Counters and latency histograms of the hot paths of the CLI and library.
+
+Recording is off by default and costs a dictionary lookup per call while off. Stages are named
+after what they time, e.g. rpc.eth_getLogs for an eth_getLogs round trip, decode for ABI decoding
+or gpg.verify for a GnuPG verification, and may nest: the time of index.sync includes the RPC
+round trips it makes.
+
+Sinks are callables that are given a snapshot of all metrics when flush is called, e.g. a
+PrometheusTextfile for the node_exporter textfile collector.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+# upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    float('inf'))
+
+settings = {
+    'enabled': False,
+}
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_sinks = []
+
+
+def configure(**new_settings):
+    """
+    Change how metrics are recorded.
+
+    new_settings: enabled, True to record metrics
+    """
+    for (name, value) in new_settings.items():
+        if name not in settings:
+            raise TypeError("Unknown metrics setting: " + name)
+        if value is not None:
+            settings[name] = value
+
+
+class Histogram(object):
+    """The distribution of the latencies of a stage, in fixed buckets."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while seconds > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Estimates a quantile by interpolating within the bucket it falls in."""
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for (bound, count) in zip(BUCKETS, self.buckets):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.buckets = list(self.buckets)
+        (histogram.count, histogram.sum, histogram.max) = (self.count, self.sum, self.max)
+        return histogram
+
+
+def count(name, value=1):
+    """Adds value to a counter, e.g. of calls or bytes."""
+    if not settings['enabled']:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """Records the duration of one run of a stage."""
+    if not settings['enabled']:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+class _Stage(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_stage = _NoStage()
+
+
+def stage(name):
+    """
+    Time a stage.
+
+    name: the name of the stage
+
+    returns a context manager recording the time spent in it
+    """
+    if not settings['enabled']:
+        return _no_stage
+    return _Stage(name)
+
+
+def snapshot():
+    """
+    Get the current value of all metrics.
+
+    returns a dictionary with the keys counters, a dictionary of counter names to values, and
+    stages, a dictionary of stage names to Histograms
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'stages': dict((name, histogram.copy()) for (name, histogram) in _histograms.items()),
+        }
+
+
+def reset():
+    """Forgets all recorded metrics."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def add_sink(sink):
+    """
+    Send metrics to a sink whenever flush is called.
+
+    sink: a callable taking a snapshot, as returned by snapshot
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def flush():
+    """Sends a snapshot of all metrics to every sink."""
+    if _sinks:
+        current = snapshot()
+        for sink in list(_sinks):
+            sink(current)
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return '%.2fms' % (seconds * 1000)
+    return '%.2fs' % seconds
+
+
+def _format_bytes(value):
+    for unit in ('B', 'KiB', 'MiB'):
+        if value < 1024:
+            return '%.0f%s' % (value, unit) if unit == 'B' else '%.1f%s' % (value, unit)
+        value /= 1024.0
+    return '%.1fGiB' % value
+
+
+def report(wall_time=None):
+    """
+    Format a breakdown of the time spent in each stage.
+
+    wall_time: the total run time in seconds, to show each stage's share of it
+
+    returns the breakdown as text
+    """
+    current = snapshot()
+    lines = ["%-32s %8s %10s %10s %10s %10s %6s" % ('stage', 'count', 'total', 'p50', 'p95', 'max',
+        'share' if wall_time else '')]
+
+    stages = sorted(current['stages'].items(), key=lambda item: item[1].sum, reverse=True)
+    for (name, histogram) in stages:
+        share = '%5.1f%%' % (100 * histogram.sum / wall_time) if wall_time else ''
+        lines.append("%-32s %8d %10s %10s %10s %10s %6s" % (name, histogram.count,
+            _format_seconds(histogram.sum), _format_seconds(histogram.quantile(0.5)),
+            _format_seconds(histogram.quantile(0.95)), _format_seconds(histogram.max), share))
+
+    if wall_time:
+        lines.append("%-32s %8s %10s" % ('wall time', '', _format_seconds(wall_time)))
+
+    if current['counters']:
+        lines.append('')
+        for (name, value) in sorted(current['counters'].items()):
+            shown = _format_bytes(value) if name.endswith('bytes_sent') or name.endswith('bytes_received') \
+                else str(value)
+            lines.append("%-32s %8s" % (name, shown))
+
+    return '\n'.join(lines)
+
+
+def _metric_name(name):
+    return ''.join(character if character.isalnum() else '_' for character in name)
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(current, prefix='etherpki'):
+    """Formats a snapshot in the Prometheus text exposition format."""
+    lines = [
+        '# HELP ' + prefix + '_stage_seconds Time spent in each stage.',
+        '# TYPE ' + prefix + '_stage_seconds histogram',
+    ]
+    for (name, histogram) in sorted(current['stages'].items()):
+        label = 'stage="' + _label(name) + '"'
+        cumulative = 0
+        for (bound, bucket) in zip(BUCKETS, histogram.buckets):
+            cumulative += bucket
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s_stage_seconds_bucket{%s,le="%s"} %d' % (prefix, label, le, cumulative))
+        lines.append('%s_stage_seconds_sum{%s} %r' % (prefix, label, histogram.sum))
+        lines.append('%s_stage_seconds_count{%s} %d' % (prefix, label, histogram.count))
+
+    for (name, value) in sorted(current['counters'].items()):
+        metric = prefix + '_' + _metric_name(name) + '_total'
+        lines.append('# TYPE ' + metric + ' counter')
+        lines.append('%s %d' % (metric, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusTextfile(object):
+    """A sink writing metrics to a file for the node_exporter textfile collector."""
+
+    def __init__(self, path, prefix='etherpki'):
+        """
+        path:   the path of the .prom file, replaced atomically on every flush
+        prefix: the prefix of the metric names
+        """
+        self.path = path
+        self.prefix = prefix
+
+    def __call__(self, current):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        (fd, temppath) = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as promfile:
+            promfile.write(prometheus_text(current, self.prefix))
+        os.chmod(temppath, 0o644)
+        os.replace(temppath, self.path)
@@ -0,0 +1,170 @@
+"""Tracking of sent transactions until they are mined and confirmed."""
+
+import time
+
+from etherpki.abicodec import get_log_decoder
+from etherpki.ethapi import get_etherpki_abi
+
+# the ID reported for each event of a mined transaction
+EVENT_IDS = {
+    'AttributeAdded': 'attributeID',
+    'AttributeSigned': 'signatureID',
+    'SignatureRevoked': 'revocationID',
+    'AttributesCommitted': 'commitmentID',
+}
+
+
+class ReceiptTracker(object):
+    """Polls the receipts of many transactions at once.
+
+    Every poll is a single JSON-RPC batch of eth_blockNumber and the receipts of all tracked
+    transactions. Receipts only change when a block arrives, so polls are timed by the observed
+    block interval, backing off while a block is overdue.
+    """
+
+    def __init__(self, client, confirmations=1, address=None, min_interval=0.2, max_interval=15.0):
+        """
+        client:         the EthClient to poll
+        confirmations:  the number of blocks, including the one it was mined in, a transaction
+                        needs before it is reported
+        address:        the contract address whose events are decoded, or None for any address
+        min_interval:   the shortest time between polls in seconds
+        max_interval:   the longest time between polls in seconds
+        """
+        self.client = client
+        self.confirmations = max(confirmations, 1)
+        self.address = address.lower() if address else None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self._decoder = get_log_decoder(get_etherpki_abi())
+        self._tracked = []
+
+        self._head = None
+        self._head_time = None
+        self._block_time = None
+        self._backoff = min_interval
+
+    def __len__(self):
+        return len(self._tracked)
+
+    def track(self, txhash):
+        """Start tracking a sent transaction."""
+        if txhash not in self._tracked:
+            self._tracked.append(txhash)
+
+    def _observe_head(self, head, now):
+        """Updates the block interval estimate from the latest block number."""
+        if self._head is not None and head > self._head:
+            observed = (now - self._head_time) / (head - self._head)
+            if self._block_time is None:
+                self._block_time = observed
+            else:
+                self._block_time = 0.8 * self._block_time + 0.2 * observed
+
+        if head != self._head:
+            self._head = head
+            self._head_time = now
+            self._backoff = self.min_interval
+        else:
+            self._backoff = min(self.max_interval, self._backoff * 1.5)
+
+    def next_interval(self):
+        """Returns the number of seconds to wait before the next poll."""
+        interval = self._backoff
+        if self._block_time is not None:
+            expected = self._head_time + self._block_time - time.time()
+            if expected > 0:
+                interval = expected
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _result(self, txhash, receipt):
+        block = int(receipt['blockNumber'], 16)
+        result = {
+            'transaction': txhash,
+            'block': block,
+            'confirmations': self._head - block + 1,
+            'gas_used': int(receipt['gasUsed'], 16),
+            # pre-Byzantium receipts have no status field
+            'status': 'failed' if receipt.get('status') == '0x0' else 'mined',
+        }
+
+        logs = receipt.get('logs') or []
+        if self.address is not None:
+            logs = [log for log in logs if log['address'].lower() == self.address]
+
+        result['events'] = self._decoder.decode_many(logs)
+        for event in result['events']:
+            idname = EVENT_IDS.get(event['_event_type'])
+            if idname is not None:
+                # batch functions emit one event per item, in the order of the items
+                result.setdefault(idname + 's', []).append(event[idname])
+                result.setdefault(idname, event[idname])
+
+        return result
+
+    def poll(self):
+        """
+        Fetch the receipts of all tracked transactions in one batch request.
+
+        returns a list of result dictionaries of the transactions that now have enough
+        confirmations, which are no longer tracked. Results have the keys transaction, block,
+        confirmations, gas_used, status ('mined', or 'failed' if the transaction reverted), events,
+        the decoded EtherPKI events of the transaction, and attributeID, signatureID, revocationID
+        or commitmentID if the transaction emitted the event reporting it. The IDs of every such
+        event, as emitted by the batch functions, are listed in order under attributeIDs,
+        signatureIDs, revocationIDs or commitmentIDs, of which the singular key is the first.
+        """
+        hashes = list(self._tracked)
+        calls = [('eth_blockNumber', [])] + [('eth_getTransactionReceipt', [txhash]) for txhash in hashes]
+        responses = self.client.batch(calls)
+
+        if isinstance(responses[0], Exception):
+            raise responses[0]
+        self._observe_head(int(responses[0], 16), time.time())
+
+        results = []
+        for (txhash, receipt) in zip(hashes, responses[1:]):
+            if receipt is None or isinstance(receipt, Exception) or receipt.get('blockNumber') is None:
+                continue
+            # receipts are fetched again on every poll, so a transaction moved by a reorganisation
+            # is only reported once it is confirmed in its final block
+            if self._head - int(receipt['blockNumber'], 16) + 1 < self.confirmations:
+                continue
+            self._tracked.remove(txhash)
+            results.append(self._result(txhash, receipt))
+
+        return results
+
+    def iter_results(self, timeout=None):
+        """
+        Poll until every tracked transaction is confirmed.
+
+        timeout: the maximum number of seconds to wait, or None to wait indefinitely
+
+        yields results as returned by poll, in the order the transactions are confirmed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        while self._tracked:
+            for result in self.poll():
+                yield result
+            if not self._tracked:
+                break
+
+            interval = self.next_interval()
+            if deadline is not None:
+                if time.time() + interval > deadline:
+                    raise TimeoutError("Transactions not confirmed after " + str(timeout) + " seconds")
+            time.sleep(interval)
+
+    def wait(self, txhash, timeout=None):
+        """
+        Wait for one transaction to be confirmed.
+
+        returns its result, as returned by poll
+        """
+        self.track(txhash)
+        for result in self.iter_results(timeout):
+            if result['transaction'] == txhash:
+                return result
@@ -0,0 +1,255 @@
+"""Proofs of contract storage against a block header.
+
+eth_getProof (EIP-1186) returns the nodes of the Merkle-Patricia tries of the state of a block on
+the paths to an account and to some of its storage slots. With the header of the block, they prove
+the values of the slots, and that slots missing from the trie are zero, to anyone who trusts the
+hash of the block, without asking a node.
+"""
+
+import binascii
+
+import rlp
+
+from etherpki.keccak import keccak256
+
+# the root of a trie without entries, the hash of the RLP encoding of the empty string
+EMPTY_TRIE_ROOT = binascii.unhexlify('56e81f171bcc55a6ff8345e692c0f86e5b48e01b996cadc001622fb5e363b421')
+
+# the fields of a block header as named by eth_getBlockByNumber, in the order they are encoded in;
+# the fields after nonce were added by later forks and are only in the headers of blocks after them
+HEADER_FIELDS = ('parentHash', 'sha3Uncles', 'miner', 'stateRoot', 'transactionsRoot', 'receiptsRoot',
+    'logsBloom', 'difficulty', 'number', 'gasLimit', 'gasUsed', 'timestamp', 'extraData', 'mixHash',
+    'nonce', 'baseFeePerGas', 'withdrawalsRoot', 'blobGasUsed', 'excessBlobGas',
+    'parentBeaconBlockRoot', 'requestsHash')
+
+# the header fields that are integers, which RLP encodes without leading zeros
+HEADER_INTEGERS = frozenset(['difficulty', 'number', 'gasLimit', 'gasUsed', 'timestamp',
+    'baseFeePerGas', 'blobGasUsed', 'excessBlobGas'])
+
+# the positions of fields in an encoded header
+HEADER_STATE_ROOT = 3
+HEADER_NUMBER = 8
+HEADER_TIMESTAMP = 11
+
+# the position of the storage root in an encoded account
+ACCOUNT_STORAGE_ROOT = 2
+
+
+def _unhex(value):
+    value = value[2:] if value.startswith('0x') else value
+    return binascii.unhexlify(value if len(value) % 2 == 0 else '0' + value)
+
+
+def _bytes_to_int(value):
+    return int.from_bytes(value, 'big')
+
+
+def _decode(encoded, what):
+    # proofs come from untrusted nodes and bundles, so malformed RLP is a ValueError like any
+    # other bad proof
+    try:
+        return rlp.decode(encoded)
+    except rlp.DecodingError:
+        raise ValueError("Malformed " + what)
+
+
+def encode_header(block):
+    """
+    Encode the header of a block, as the hash of the block is computed over.
+
+    block: the block as returned by eth_getBlockByNumber
+
+    returns the encoded header
+
+    raises ValueError if the encoding does not match the hash of the block, e.g. because the block
+    has header fields that are not in HEADER_FIELDS
+    """
+    fields = []
+    for name in HEADER_FIELDS:
+        if block.get(name) is None:
+            # the fields of later forks are only present if the ones before them are
+            if name in HEADER_FIELDS[:HEADER_FIELDS.index('nonce') + 1]:
+                raise ValueError("Block header without " + name)
+            break
+        value = _unhex(block[name])
+        fields.append(_bytes_to_int(value) if name in HEADER_INTEGERS else value)
+
+    encoded = rlp.encode(fields)
+    if '0x' + binascii.hexlify(keccak256(encoded)).decode('ascii') != block['hash']:
+        raise ValueError("Cannot encode the header of block " + str(int(block['number'], 16))
+            + " to its hash")
+    return encoded
+
+
+def decode_header(encoded):
+    """
+    Decode an encoded block header.
+
+    returns a dictionary with the keys hash, as 32 bytes, number, timestamp and stateRoot
+    """
+    fields = _decode(encoded, "block header")
+    if not isinstance(fields, list) or len(fields) <= HEADER_TIMESTAMP:
+        raise ValueError("Not a block header")
+    return {
+        'hash': keccak256(encoded),
+        'number': _bytes_to_int(fields[HEADER_NUMBER]),
+        'timestamp': _bytes_to_int(fields[HEADER_TIMESTAMP]),
+        'stateRoot': fields[HEADER_STATE_ROOT],
+    }
+
+
+def _nibbles(key):
+    nibbles = []
+    for byte in bytearray(key):
+        nibbles += (byte >> 4, byte & 0x0f)
+    return nibbles
+
+
+def _decode_path(encoded):
+    """Decodes the hex-prefix path of a leaf or extension node to (nibbles, is_leaf)."""
+    nibbles = _nibbles(encoded)
+    flag = nibbles[0]
+    # an odd path has its first nibble next to the flag, an even one a padding nibble
+    return (nibbles[1:] if flag & 1 else nibbles[2:], bool(flag & 2))
+
+
+def trie_get(root, key, nodes):
+    """
+    Look up a key in a Merkle-Patricia trie.
+
+    root:   the hash of the root node
+    key:    the key, as bytes
+    nodes:  a dictionary mapping the hashes of nodes to the nodes, as returned by index_nodes,
+            which must include the nodes on the path to the key
+
+    returns the value of the key, or None if the trie proves the key is absent
+
+    raises ValueError if a node on the path to the key is missing or malformed
+    """
+    if root == EMPTY_TRIE_ROOT:
+        return None
+
+    path = _nibbles(key)
+    reference = root
+    while True:
+        if isinstance(reference, list):
+            # nodes shorter than a hash are embedded in their parent
+            node = reference
+        elif reference == b'':
+            return None
+        else:
+            if reference not in nodes:
+                raise ValueError("Incomplete proof, missing trie node 0x"
+                    + binascii.hexlify(reference).decode('ascii'))
+            node = nodes[reference]
+
+        if not isinstance(node, list):
+            raise ValueError("Malformed trie node")
+        if len(node) == 17:
+            if not path:
+                return node[16] or None
+            reference = node[path[0]]
+            path = path[1:]
+        elif len(node) == 2 and isinstance(node[0], bytes) and node[0]:
+            (prefix, is_leaf) = _decode_path(node[0])
+            if is_leaf:
+                return node[1] if path == prefix else None
+            if path[:len(prefix)] != prefix:
+                return None
+            path = path[len(prefix):]
+            reference = node[1]
+        else:
+            raise ValueError("Malformed trie node")
+
+
+def slot_key(slot):
+    """Returns the 32 bytes of a storage slot number."""
+    return slot.to_bytes(32, 'big')
+
+
+def index_nodes(encodings):
+    """
+    Decode trie nodes for trie_get.
+
+    The nodes near the root are on the path to every key, so they are decoded once here rather
+    than once per lookup.
+
+    returns a dictionary mapping the hashes of the nodes to the decoded nodes
+    """
+    return dict((keccak256(node), _decode(node, "trie node")) for node in encodings)
+
+
+class ProvenStorage(object):
+    """The storage of a contract at a block, read from proofs."""
+
+    def __init__(self, header, address, nodes):
+        """
+        header:     the encoded header of the block
+        address:    the address of the contract, as 20 bytes
+        nodes:      the trie nodes of the proofs, as returned by index_nodes
+
+        raises ValueError if the proofs do not contain the account of the contract
+        """
+        self.header = decode_header(header)
+        self.address = address
+        self.nodes = nodes
+
+        account = trie_get(self.header['stateRoot'], keccak256(address), self.nodes)
+        if account is None:
+            raise ValueError("No contract at 0x" + binascii.hexlify(address).decode('ascii')
+                + " in block " + str(self.header['number']))
+        account = _decode(account, "account")
+        if not isinstance(account, list) or len(account) <= ACCOUNT_STORAGE_ROOT:
+            raise ValueError("Malformed account")
+        self.storage_root = account[ACCOUNT_STORAGE_ROOT]
+
+    def read(self, slot):
+        """Returns the value of a storage slot as an integer."""
+        value = trie_get(self.storage_root, keccak256(slot_key(slot)), self.nodes)
+        if value is None:
+            return 0
+        value = _decode(value, "storage value")
+        if not isinstance(value, bytes):
+            raise ValueError("Malformed storage value")
+        return _bytes_to_int(value)
+
+    def read_many(self, slots):
+        return [self.read(slot) for slot in slots]
+
+
+class StorageProofFetcher(object):
+    """Reads the storage of a contract at a block through eth_getProof, keeping the proofs."""
+
+    def __init__(self, client, address, block):
+        """
+        client:     the EthClient to read with
+        address:    the address of the contract, as 20 bytes
+        block:      the number of the block
+        """
+        self.client = client
+        self.address = address
+        self.block = block
+        self.header = encode_header(client.get_block_by_number(block, False))
+        # the encodings of the nodes of the proofs, by hash
+        self.nodes = {}
+        self._decoded = {}
+
+    def read_many(self, slots):
+        """
+        Returns the values of storage slots as integers, checked against the proofs the node
+        returned for them.
+        """
+        proof = self.client.request('eth_getProof', [
+            '0x' + binascii.hexlify(self.address).decode('ascii'),
+            ['0x' + binascii.hexlify(slot_key(slot)).decode('ascii') for slot in slots],
+            hex(self.block),
+        ])
+
+        encodings = [_unhex(node) for node in proof['accountProof']]
+        for storage_proof in proof['storageProof']:
+            encodings += [_unhex(node) for node in storage_proof['proof']]
+        for node in encodings:
+            self.nodes[keccak256(node)] = node
+        self._decoded.update(index_nodes(encodings))
+
+        return ProvenStorage(self.header, self.address, self._decoded).read_many(slots)
@@ -0,0 +1,371 @@
+"""Reads of the EtherPKI registry from contract state, as an alternative to scanning logs.
+
+The view functions of the contract are called with eth_call, many calls to a JSON-RPC batch, and
+all at the same block, so that the results of a query are consistent with each other even while
+new blocks are mined. Records are returned in the form of the decoded logs of the events that
+created them, so they can be used wherever decoded logs are.
+
+The cost of a query depends on the number of its results rather than on the length of the chain
+history, and a node without log indexing can serve it. Filters on owners, identifiers and signers
+are the exception: the contract keeps no index of them, so they are answered by reading every
+attribute, signature or commitment, page by page.
+"""
+
+from etherpki import metrics
+from etherpki.abicodec import get_call_encoder
+from etherpki.abicodec import get_result_decoder
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import ethclient
+from etherpki.ethapi import encode_api_data
+from etherpki.ethapi import encode_topic
+from etherpki.ethapi import get_deployed_functions
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.ethapi import require_functions
+
+# settings used by StateReader instances created without explicit arguments
+settings = {
+    'enabled': False,
+    'page_size': 100,
+    'batch_size': 50,
+}
+
+# the indexed arguments of each event, in the order of their topics
+INDEXED_ARGUMENTS = {
+    'AttributeAdded': ('attributeID', 'owner', 'identifier'),
+    'AttributeSigned': ('signatureID', 'signer', 'attributeID'),
+    # the field name is spelled as in the contract ABI
+    'SignatureRevoked': ('revocationID', 'signratureID'),
+    'AttributesCommitted': ('commitmentID', 'owner', 'root'),
+}
+
+
+def configure(**new_settings):
+    """
+    Change the default settings of state reads.
+
+    new_settings: any of enabled, True for Events to read contract state instead of logs by
+                  default, page_size, the number of records read by a call, and batch_size, the
+                  number of calls sent in one JSON-RPC batch
+    """
+    for (name, value) in new_settings.items():
+        if name not in settings:
+            raise TypeError("Unknown state reading setting: " + name)
+        if value is not None:
+            settings[name] = value
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _topic_set(values):
+    """Returns the set of topics a filter value or list of values matches, or None if it matches any."""
+    if values is None:
+        return None
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    return set(encode_topic(value) for value in values)
+
+
+def _record_topic(value):
+    """Returns the topic an indexed value of a record would have in its log."""
+    if isinstance(value, str):
+        # addresses are decoded to hex without 0x
+        return encode_topic('0x' + value)
+    return encode_topic(value)
+
+
+class StateReader(object):
+    """Reads the records of the registry with the view functions of the contract."""
+
+    def __init__(self, address=ETHERPKI_DEFAULT_ADDRESS, client=None, block=None, page_size=None,
+            batch_size=None):
+        """
+        address:    the Ethereum address of the contract
+        client:     the EthClient to use, defaults to the shared pooled client
+        block:      the number of the block to read at, or None to pin the latest block on first use
+        page_size:  the number of records read by a call
+        batch_size: the number of calls sent in one JSON-RPC batch
+        """
+        self.address = address
+        self.client = client if client is not None else ethclient
+        self.block = block
+        self.page_size = page_size or settings['page_size']
+        self.batch_size = batch_size or settings['batch_size']
+
+        abi = get_etherpki_abi()
+        self._encoder = get_call_encoder(abi)
+        self._decoder = get_result_decoder(abi)
+
+        # the functions of the contract, read before the first call; the view functions are newer
+        # than some deployments
+        self._deployed = None
+        self._deployed_read = False
+
+    def pin(self, block=None):
+        """
+        Read at a block from now on.
+
+        block: the number of the block, defaults to the latest block
+
+        returns the number of the block
+        """
+        self.block = block if block is not None else self.client.get_block_number()
+        return self.block
+
+    def _call_many(self, function, calls):
+        """
+        Call a view function several times at the pinned block.
+
+        function:   the name of the function
+        calls:      a list of the argument lists of the calls
+
+        returns the list of the decoded outputs of each call, in order
+
+        raises ValueError if the contract does not have the function
+        """
+        if not self._deployed_read:
+            self._deployed = get_deployed_functions(self.client, self.address)
+            self._deployed_read = True
+        require_functions(self._deployed, self.address, [function])
+
+        if self.block is None:
+            self.pin()
+        tag = hex(self.block)
+
+        results = []
+        for chunk in _chunks(calls, self.batch_size):
+            requests = [('eth_call', [{'to': self.address, 'data': encode_api_data(self._encoder.encode(function, args))},
+                tag]) for args in chunk]
+            with metrics.stage('state.' + function):
+                responses = self.client.batch(requests)
+            for response in responses:
+                if isinstance(response, Exception):
+                    raise response
+                results.append(self._decoder.decode(function, response))
+        return results
+
+    def get_counts(self):
+        """Returns a tuple of the numbers of attributes, signatures and revocations."""
+        return tuple(self._call_many('getCounts', [[]])[0])
+
+    def _iter_pages(self, function, total, start=0):
+        """Yields tuples of the first index and the outputs of the pages of a paged view function."""
+        starts = list(range(start, total, self.page_size))
+        for chunk in _chunks(starts, self.batch_size):
+            results = self._call_many(function, [[first, self.page_size] for first in chunk])
+            for (first, outputs) in zip(chunk, results):
+                yield (first, outputs)
+
+    def _get_by_id(self, function, ids, build):
+        """Reads the records of a paged view function by ID, as pages of one record."""
+        ids = sorted(set(ids))
+        records = []
+        for (first, outputs) in zip(ids, self._call_many(function, [[recordID, 1] for recordID in ids])):
+            records += build(first, outputs)
+        return records
+
+    @staticmethod
+    def _attributes(first, outputs):
+        (owners, attribute_types, has_proofs, identifiers, data, data_hashes) = outputs
+        return [{
+            '_event_type': 'AttributeAdded',
+            'attributeID': first + index,
+            'owner': owners[index],
+            'attributeType': attribute_types[index],
+            'hasProof': has_proofs[index],
+            'identifier': identifiers[index],
+            'data': data[index],
+            'dataHash': data_hashes[index],
+        } for index in range(len(owners))]
+
+    @staticmethod
+    def _signatures(first, outputs):
+        (signers, attribute_ids, expiries) = outputs
+        return [{
+            '_event_type': 'AttributeSigned',
+            'signatureID': first + index,
+            'signer': signers[index],
+            'attributeID': attribute_ids[index],
+            'expiry': expiries[index],
+        } for index in range(len(signers))]
+
+    @staticmethod
+    def _revocations(first, outputs):
+        (signature_ids,) = outputs
+        return [{
+            '_event_type': 'SignatureRevoked',
+            'revocationID': first + index,
+            'signratureID': signature_ids[index],
+        } for index in range(len(signature_ids))]
+
+    @staticmethod
+    def _commitments(first, outputs):
+        (owners, roots, counts, uris) = outputs
+        return [{
+            '_event_type': 'AttributesCommitted',
+            'commitmentID': first + index,
+            'owner': owners[index],
+            'root': roots[index],
+            'count': counts[index],
+            'uri': uris[index],
+        } for index in range(len(owners))]
+
+    def get_attributes(self, attribute_ids):
+        """Returns the attributes with the given IDs that exist, in the order of their IDs."""
+        return self._get_by_id('getAttributes', attribute_ids, self._attributes)
+
+    def get_signatures(self, signature_ids):
+        """Returns the signatures with the given IDs that exist, in the order of their IDs."""
+        return self._get_by_id('getSignatures', signature_ids, self._signatures)
+
+    def get_revocations(self, revocation_ids):
+        """Returns the revocations with the given IDs that exist, in the order of their IDs."""
+        return self._get_by_id('getRevocations', revocation_ids, self._revocations)
+
+    def get_commitments(self, commitment_ids):
+        """Returns the commitments with the given IDs that exist, in the order of their IDs."""
+        return self._get_by_id('getCommitments', commitment_ids, self._commitments)
+
+    def iter_attributes(self):
+        """Yields every attribute, page by page."""
+        for (first, outputs) in self._iter_pages('getAttributes', self.get_counts()[0]):
+            yield self._attributes(first, outputs)
+
+    def iter_signatures(self):
+        """Yields every signature, page by page."""
+        for (first, outputs) in self._iter_pages('getSignatures', self.get_counts()[1]):
+            yield self._signatures(first, outputs)
+
+    def iter_revocations(self):
+        """Yields every revocation, page by page."""
+        for (first, outputs) in self._iter_pages('getRevocations', self.get_counts()[2]):
+            yield self._revocations(first, outputs)
+
+    def iter_commitments(self):
+        """Yields every commitment, page by page."""
+        (total,) = self._call_many('getCommitmentCount', [[]])[0]
+        for (first, outputs) in self._iter_pages('getCommitments', total):
+            yield self._commitments(first, outputs)
+
+    def get_signatures_of_attributes(self, attribute_ids):
+        """
+        Get the signatures of several attributes.
+
+        The first page of signatures of every attribute is read in one round of batched calls, and
+        the further pages of the attributes that have more in another.
+
+        returns the signatures, in the order of their IDs
+        """
+        attribute_ids = sorted(set(attribute_ids))
+        calls = [[attributeID, 0, self.page_size] for attributeID in attribute_ids]
+        results = self._call_many('getSignaturesForAttribute', calls)
+
+        more = []
+        for (attributeID, (total, _, _, _)) in zip(attribute_ids, results):
+            more += [[attributeID, start, self.page_size] for start in range(self.page_size, total, self.page_size)]
+        if more:
+            calls += more
+            results += self._call_many('getSignaturesForAttribute', more)
+
+        signatures = []
+        for ((attributeID, _, _), (_, signature_ids, signers, expiries)) in zip(calls, results):
+            signatures += [{
+                '_event_type': 'AttributeSigned',
+                'signatureID': signatureID,
+                'signer': signer,
+                'attributeID': attributeID,
+                'expiry': expiry,
+            } for (signatureID, signer, expiry) in zip(signature_ids, signers, expiries)]
+
+        signatures.sort(key=lambda signature: signature['signatureID'])
+        return signatures
+
+    def get_revocations_of_signatures(self, signature_ids):
+        """
+        Get the revocations of several signatures.
+
+        Only the first revocation of a signature is kept in state, so a signature revoked more than
+        once has a single revocation here, while it has several logs.
+
+        returns the revocations, in the order of their IDs
+        """
+        chunks = _chunks(sorted(set(signature_ids)), self.page_size)
+        results = self._call_many('isRevoked', [[chunk] for chunk in chunks])
+
+        revocations = []
+        for (chunk, (revoked, revocation_ids)) in zip(chunks, results):
+            revocations += [{
+                '_event_type': 'SignatureRevoked',
+                'revocationID': revocationID,
+                'signratureID': signatureID,
+            } for (signatureID, is_revoked, revocationID) in zip(chunk, revoked, revocation_ids) if is_revoked]
+
+        revocations.sort(key=lambda revocation: revocation['revocationID'])
+        return revocations
+
+    def _iter_event_chunks(self, event_name, topics):
+        """Yields chunks of the records of an event, read by the most selective of the filters."""
+        if event_name == 'AttributeAdded':
+            if topics[0] is not None:
+                yield self.get_attributes(int(topic, 16) for topic in topics[0])
+            else:
+                for chunk in self.iter_attributes():
+                    yield chunk
+        elif event_name == 'AttributeSigned':
+            if topics[0] is not None:
+                yield self.get_signatures(int(topic, 16) for topic in topics[0])
+            elif topics[2] is not None:
+                yield self.get_signatures_of_attributes(int(topic, 16) for topic in topics[2])
+            else:
+                for chunk in self.iter_signatures():
+                    yield chunk
+        elif event_name == 'SignatureRevoked':
+            if topics[0] is not None:
+                yield self.get_revocations(int(topic, 16) for topic in topics[0])
+            elif topics[1] is not None:
+                yield self.get_revocations_of_signatures(int(topic, 16) for topic in topics[1])
+            else:
+                for chunk in self.iter_revocations():
+                    yield chunk
+        elif event_name == 'AttributesCommitted':
+            if topics[0] is not None:
+                yield self.get_commitments(int(topic, 16) for topic in topics[0])
+            else:
+                for chunk in self.iter_commitments():
+                    yield chunk
+
+    def iter_chunks(self, event_name, filters):
+        """
+        Get the records of an event that match filters, chunk by chunk, like Events._iter_log_chunks.
+
+        event_name: the name of the event, or None for the records of every event, one event after
+                    the other
+        filters:    the values of the indexed arguments of the event, in order, each None to match
+                    any value, a value, or a list of values matching any of them
+
+        yields lists of records in the form of decoded logs
+        """
+        if event_name is None:
+            if any(values is not None for values in filters):
+                raise ValueError("Filters need an event name")
+            for name in ('AttributeAdded', 'AttributeSigned', 'SignatureRevoked', 'AttributesCommitted'):
+                for chunk in self.iter_chunks(name, []):
+                    yield chunk
+            return
+
+        if event_name not in INDEXED_ARGUMENTS:
+            raise ValueError("Unknown event: " + str(event_name))
+
+        names = INDEXED_ARGUMENTS[event_name]
+        topics = [_topic_set(values) for values in filters]
+        topics += [None] * (len(names) - len(topics))
+
+        # filters that were not used to read the records are applied to them here
+        checks = [(name, values) for (name, values) in zip(names, topics) if values is not None]
+        for chunk in self._iter_event_chunks(event_name, topics):
+            if checks:
+                chunk = [record for record in chunk
+                    if all(_record_topic(record[name]) in values for (name, values) in checks)]
+            if chunk:
+                yield chunk
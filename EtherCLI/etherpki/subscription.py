@@ -0,0 +1,290 @@
+"""Live subscription to EtherPKI events."""
+
+import json
+import os
+import tempfile
+import time
+
+from etherpki.abicodec import get_log_decoder
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import encode_api_data
+from etherpki.ethapi import ethclient
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.logfetch import LogFetcher
+from etherpki.logfetch import log_sort_key
+
+# the events delivered by default
+EVENT_NAMES = ('AttributeAdded', 'AttributeSigned', 'SignatureRevoked', 'AttributesCommitted')
+
+# number of recent blocks whose hashes and logs are kept to detect reorganisations and retract logs
+REORG_DEPTH = 64
+
+# seconds between polls for new blocks
+DEFAULT_INTERVAL = 2.0
+
+
+def _log_key(log):
+    return (log['blockHash'], int(log['logIndex'], 16))
+
+
+class Subscription(object):
+    """Follows the events of the EtherPKI contract as blocks are mined.
+
+    New logs are read from an eth_newFilter filter, or by polling eth_getLogs block range by block
+    range if the client does not support filters. Delivery is at least once: the cursor only moves
+    past events once the consumer has taken them, so a resumed subscription may repeat the events of
+    the last poll.
+
+    The hashes of recent blocks are kept, and when the chain reorganises under them, the events of
+    the blocks that were replaced are retracted before the events of the new blocks are delivered.
+    """
+
+    def __init__(self, client=None, address=ETHERPKI_DEFAULT_ADDRESS, event_names=EVENT_NAMES,
+            from_block=None, cursor_path=None, interval=DEFAULT_INTERVAL, use_filter=True,
+            depth=REORG_DEPTH):
+        """
+        client:         the EthClient to use, defaults to the shared pooled client
+        address:        the Ethereum address of the contract
+        event_names:    the names of the events to deliver
+        from_block:     the first block to deliver events of, or None to start at the next block,
+                        unless a saved cursor is resumed
+        cursor_path:    a file the cursor is saved to after every poll and resumed from
+        interval:       seconds between polls
+        use_filter:     if False, always poll with eth_getLogs instead of using a filter
+        depth:          the number of recent blocks checked for reorganisations
+        """
+        self.client = client if client is not None else ethclient
+        self.address = address
+        self.cursor_path = cursor_path
+        self.interval = interval
+        self.use_filter = use_filter
+        self.depth = depth
+
+        self._decoder = get_log_decoder(get_etherpki_abi())
+        self._topics = [[self._decoder.event_topic(name) for name in event_names]]
+        self._fetcher = LogFetcher(self.client)
+
+        # the last block delivered, and the hashes and delivered logs of recent blocks
+        self._cursor = None if from_block is None else from_block - 1
+        self._hashes = {}
+        self._logs = {}
+
+        self._filter_id = None
+
+        if cursor_path is not None and os.path.exists(cursor_path):
+            self._load_cursor()
+
+    def _load_cursor(self):
+        with open(self.cursor_path) as cursorfile:
+            state = json.load(cursorfile)
+
+        self._cursor = state['block']
+        self._hashes = dict((int(number), blockhash) for (number, blockhash) in state['hashes'].items())
+        self._logs = dict((int(number), logs) for (number, logs) in state['logs'].items())
+
+    def save_cursor(self):
+        """Saves the position of the subscription to cursor_path, atomically."""
+        if self.cursor_path is None or self._cursor is None:
+            return
+
+        state = {'block': self._cursor, 'hashes': self._hashes, 'logs': self._logs}
+
+        directory = os.path.dirname(os.path.abspath(self.cursor_path))
+        (fd, temppath) = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as cursorfile:
+            json.dump(state, cursorfile)
+        os.rename(temppath, self.cursor_path)
+
+    def _notification(self, kind, log):
+        return {
+            'type': kind,
+            'event': self._decoder.decode(log),
+            'block': int(log['blockNumber'], 16),
+            'blockHash': log['blockHash'],
+            'transactionHash': log.get('transactionHash'),
+            'logIndex': int(log['logIndex'], 16),
+        }
+
+    def _headers(self, numbers):
+        """Fetches the hashes of several blocks in one batch request."""
+        numbers = sorted(numbers)
+        blocks = self.client.batch([('eth_getBlockByNumber', [encode_api_data(number), False])
+            for number in numbers])
+        hashes = {}
+        for (number, block) in zip(numbers, blocks):
+            if isinstance(block, Exception):
+                raise block
+            hashes[number] = block['hash'] if block is not None else None
+        return hashes
+
+    def _rewind(self):
+        """
+        Finds the newest recorded block still on the chain, and retracts the logs of newer blocks.
+
+        returns a list of retraction notifications, newest first
+        """
+        canonical = self._headers(self._hashes)
+
+        retractions = []
+        fork = None
+        for number in sorted(self._hashes, reverse=True):
+            if canonical[number] == self._hashes[number]:
+                # every block before a matching block matches too
+                fork = number
+                break
+            for log in reversed(self._logs.pop(number, [])):
+                retractions.append(self._notification('retraction', log))
+            del self._hashes[number]
+
+        if fork is None:
+            # the reorganisation is deeper than the recorded blocks
+            fork = min(canonical) - 1 if canonical else self._cursor
+        self._cursor = min(self._cursor, fork)
+
+        # the filter may have missed or repeated logs across the reorganisation, so start over
+        self._drop_filter()
+
+        return retractions
+
+    def _drop_filter(self):
+        if self._filter_id is not None:
+            try:
+                self.client.uninstall_filter(self._filter_id)
+            except Exception:
+                pass
+            self._filter_id = None
+
+    def _filter_changes(self):
+        """
+        Get logs from the filter, installing it first if needed.
+
+        returns a list of logs, or None if the logs must be fetched with eth_getLogs
+        """
+        if self._filter_id is None:
+            try:
+                self._filter_id = self.client.new_filter(address=self.address, topics=self._topics)
+            except RPCError:
+                # the client does not support filters
+                self.use_filter = False
+            # blocks mined before the filter was installed are not reported by it
+            return None
+
+        try:
+            return self.client.get_filter_changes(self._filter_id)
+        except RPCError:
+            # filters expire when they are not polled for a while
+            self._filter_id = None
+            return None
+
+    def _fetch(self, head):
+        """
+        Fetch the logs of blocks after the cursor.
+
+        returns a tuple of (logs, removed logs reported by the filter, whether the logs can be
+        fetched again)
+        """
+        logs = None
+        if self.use_filter:
+            logs = self._filter_changes()
+
+        if logs is None:
+            if head <= self._cursor:
+                return ([], [], True)
+            logs = self._fetcher.get_logs(self.address, self._topics, self._cursor + 1, head)
+            return (logs, [], True)
+
+        removed = [log for log in logs if log.get('removed')]
+        logs = [log for log in logs if not log.get('removed')]
+        return (logs, removed, False)
+
+    def poll(self):
+        """
+        Check for new blocks once.
+
+        returns a list of notifications: retractions of events of blocks that were reorganised away,
+        then the events of new blocks in chain order. A notification is a dictionary with the keys
+        type ('event' or 'retraction'), event (the decoded log), block, blockHash, transactionHash
+        and logIndex.
+        """
+        notifications = []
+
+        head = self.client.get_block_number()
+        if self._cursor is None:
+            self._cursor = head
+
+        # detect a reorganisation by the hash of the newest recorded block
+        if self._hashes:
+            tip = max(self._hashes)
+            if self._headers([tip])[tip] != self._hashes[tip]:
+                notifications += self._rewind()
+
+        (logs, removed, refetchable) = self._fetch(head)
+        head = max([head] + [int(log['blockNumber'], 16) for log in logs])
+
+        # retract logs the filter reports as removed
+        delivered = dict((_log_key(log), number) for (number, block_logs) in self._logs.items()
+            for log in block_logs)
+        for log in removed:
+            number = delivered.pop(_log_key(log), None)
+            if number is not None:
+                self._logs[number] = [other for other in self._logs[number] if _log_key(other) != _log_key(log)]
+                notifications.append(self._notification('retraction', log))
+
+        # check that the logs of recent blocks are from the chain as it is now
+        recent = set(int(log['blockNumber'], 16) for log in logs if int(log['blockNumber'], 16) > head - self.depth)
+        canonical = self._headers(recent | set([head]))
+        if canonical[head] is None and refetchable:
+            # the client has not caught up with its own head yet
+            return notifications
+
+        stale = [log for log in logs if int(log['blockNumber'], 16) in recent
+            and canonical[int(log['blockNumber'], 16)] != log['blockHash']]
+        if stale:
+            if refetchable:
+                # the chain changed while the logs were fetched, so fetch them again next time
+                return notifications
+            logs = [log for log in logs if log not in stale]
+
+        for log in sorted(logs, key=log_sort_key):
+            if _log_key(log) in delivered:
+                continue
+            number = int(log['blockNumber'], 16)
+            delivered[_log_key(log)] = number
+            if number > head - self.depth:
+                self._logs.setdefault(number, []).append(log)
+            notifications.append(self._notification('event', log))
+
+        self._hashes.update((number, blockhash) for (number, blockhash) in canonical.items() if blockhash)
+        self._cursor = max(self._cursor, head)
+
+        # forget blocks too old to be reorganised
+        for number in [number for number in self._hashes if number <= self._cursor - self.depth]:
+            del self._hashes[number]
+            self._logs.pop(number, None)
+
+        return notifications
+
+    def __iter__(self):
+        """
+        Poll forever, yielding notifications as they arrive.
+
+        The cursor is saved once all notifications of a poll have been taken.
+        """
+        try:
+            while True:
+                for notification in self.poll():
+                    yield notification
+                self.save_cursor()
+                time.sleep(self.interval)
+        finally:
+            self.close()
+
+    def run(self, callback):
+        """Poll forever, calling callback with each notification."""
+        for notification in self:
+            callback(notification)
+
+    def close(self):
+        """Uninstalls the filter of the subscription from the client."""
+        self._drop_filter()
@@ -1,44 +1,109 @@
 """API for adding transactions to the EtherPKI network"""
 
-import io
+import binascii
 
-from ethereum import abi
-from ethapi import ETHERPKI_ABI
-from ethapi import ETHERPKI_DEFAULT_ADDRESS
-from ethapi import ethclient
-from ethapi import encode_api_data
-from gpgapi import generate_pgp_attribute_data
-import ipfshttpclient
+from etherpki import metrics
+from etherpki.abicodec import get_call_encoder
+from etherpki.commitments import PAGE_SIZE
+from etherpki.commitments import build_commitment
+from etherpki.datahash import compute_datahash
+from etherpki.ethapi import ETHERPKI_DEFAULT_ADDRESS
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import ethclient
+from etherpki.ethapi import encode_api_data
+from etherpki.ethapi import get_deployed_functions
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.ethapi import require_functions
+from etherpki.gpgapi import generate_pgp_attribute_data
+from etherpki.ipfsapi import parse_block_uri
+from etherpki.ipfsapi import put_block
+
+# multiplier applied to gas estimates, so that a transaction does not run out of gas if the state it
+# runs against changes slightly between estimation and mining
+GAS_MARGIN = 1.2
+
+# the gas limit of a block of the test network, see TestNet/genesis.json; every transaction of a
+# batch must fit in one block
+BLOCK_GAS_LIMIT = 2000000
 
 
 class Transactions(object):
-    def __init__(self, from_address=None, to_address=ETHERPKI_DEFAULT_ADDRESS):
+    def __init__(self, from_address=None, to_address=ETHERPKI_DEFAULT_ADDRESS, client=None,
+            block_gas_limit=BLOCK_GAS_LIMIT):
         """Initialize transactions.
 
-        from_address:   the Ethereum address transactions should come from
-        to_address:     the Ethereum EtherPKI contract address.
+        from_address:       the Ethereum address transactions should come from
+        to_address:         the Ethereum EtherPKI contract address.
+        client:             the EthClient to use, defaults to the shared pooled client.
+        block_gas_limit:    the gas limit of a block, which batches are split to fit in.
         """
+        self.client = client if client is not None else ethclient
+        self.block_gas_limit = block_gas_limit
+
         if from_address is None:
             # Uses the first Ethereum account address if none is specified.
-            self.from_address = ethclient.get_accounts()[0]
+            self.from_address = self.client.get_accounts()[0]
         else:
             self.from_address = from_address
         
         self.to_address = to_address
 
         # initialize contract ABI
-        self._contracttranslator = abi.ContractTranslator(ETHERPKI_ABI)
+        self._callencoder = get_call_encoder(get_etherpki_abi())
+
+        # the functions of the contract, read when a function older deployments lack is first sent
+        self._deployed = None
+        self._deployed_read = False
+
+    def require_functions(self, functions):
+        """Checks that the contract has functions that older deployments lack.
+
+        functions:  the names of the functions.
+
+        raises ValueError naming the functions the contract does not have.
+        """
+        if not self._deployed_read:
+            self._deployed = get_deployed_functions(self.client, self.to_address)
+            self._deployed_read = True
+        require_functions(self._deployed, self.to_address, functions)
+
+    def encode_call(self, function, args):
+        """Encodes a call of a contract function as transaction data.
+
+        function:   the name of the contract function.
+        args:       the list of arguments of the function.
+        """
+        with metrics.stage('abi.encode'):
+            return self._callencoder.encode(function, args)
+
+    def estimate_gas(self, data):
+        """Estimates the gas a transaction needs, including GAS_MARGIN.
+
+        data:   the data to be sent.
+        """
+        estimate = self.client.estimate_gas(
+            _from=self.from_address,
+            to=self.to_address,
+            data=encode_api_data(data),
+        )
+        return int(estimate * GAS_MARGIN)
 
-    def _send_transaction(self, data):
+    def _send_transaction(self, data, gas=None, nonce=None):
         """ Sends a transaction to the Ethereum client.
 
         data:   the data to be sent.
+        gas:    the gas limit of the transaction, estimated if None.
+        nonce:  the nonce of the transaction, assigned by the Ethereum client if None.
         """
-        return ethclient.send_transaction(
+        if gas is None:
+            gas = self.estimate_gas(data)
+
+        return self.client.send_transaction(
             _from=self.from_address,
             to=self.to_address,
             data=encode_api_data(data),
-            gas=100 # TODO: modify?
+            gas=gas,
+            nonce=nonce,
         )
 
     def add_attribute(self, attributetype, has_proof, identifier, data, datahash):
@@ -51,7 +116,7 @@ class Transactions(object):
         datahash:       the hash of the data if it is stored off of the blockchain.
         """
         args = [attributetype, has_proof, identifier, data, datahash]
-        data = self._contracttranslator.encode('addAttribute', args)
+        data = self.encode_call('addAttribute', args)
         return self._send_transaction(data)
 
     def add_attribute_with_hash(self, attributetype, has_proof, identifier, data):
@@ -60,9 +125,10 @@ class Transactions(object):
         attributetype:  the type of attribute.
         has_proof:      True if the attribute has proof, otherwise false.
         identifier:     the indexable identifier of the attribute.
-        data:           the data of the attribute.
+        data:           the data of the attribute. If it is an ipfs-block:// URI, the datahash is
+                        that of the content of the block, see datahash.compute_datahash.
         """
-        datahash = '' # TODO: calculate hash
+        datahash = compute_datahash(data)
         return self.add_attribute(attributetype, has_proof, identifier, data, datahash)
 
     def add_attribute_over_ipfs(self, attributetype, has_proof, identifier, data):
@@ -71,18 +137,19 @@ class Transactions(object):
         attributetype:  the type of attribute.
         has_proof:      True if the attribute has proof, otherwise false.
         identifier:     the indexable identifier of the attribute.
-        data:           the data of the attribute.
+        data:           the data of the attribute, as text or bytes.
         """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
 
-        # stores the data as an IPFS block and gets the key.
-        with ipfshttpclient.connect() as client:
-            ipfs_key = client.block.put(io.StringIO(data))['Key']
+        # stores the data as an IPFS block, keeping it in the local cache, and gets the key.
+        ipfs_key = put_block(data)
 
         # generates the EtherPKI-specific URI for the IPFS block
         ipfs_uri = 'ipfs-block://' + ipfs_key
 
-        # adds the attribute by automatically calculating the hash
-        self.add_attribute_with_hash(attributetype, has_proof, identifier, ipfs_uri)
+        # hashes the data it still holds rather than reading the block back
+        return self.add_attribute(attributetype, has_proof, identifier, ipfs_uri, compute_datahash(data))
 
     def add_pgp_attribute_over_ipfs(self, keyid):
         """Send a transaction to add an identity PGP attribute, storing the data on IPFS.
@@ -93,9 +160,9 @@ class Transactions(object):
         (fingerprint, data) = generate_pgp_attribute_data(keyid, self.from_address)
 
         # express identifier as fingerprint in binary format
-        identifier = fingerprint.decode('hex')
+        identifier = binascii.unhexlify(fingerprint)
 
-        self.add_attribute_over_ipfs(
+        return self.add_attribute_over_ipfs(
             attributetype='pgp-key',
             has_proof=True,
             identifier=identifier,
@@ -111,7 +178,7 @@ class Transactions(object):
         """
 
         args = [attributeID, expiry]
-        data = self._contracttranslator.encode('signAttribute', args)
+        data = self.encode_call('signAttribute', args)
         return self._send_transaction(data)
 
     def revoke_signature(self, signatureID):
@@ -121,5 +188,135 @@ class Transactions(object):
         """
 
         args = [signatureID]
-        data = self._contracttranslator.encode('revokeSignature', args)
-        return self._send_transaction(data)
\ No newline at end of file
+        data = self.encode_call('revokeSignature', args)
+        return self._send_transaction(data)
+
+    def _send_batches(self, function, columns):
+        """Sends a call of a batch function as transactions that each fit in a block.
+
+        The first item is estimated on its own to size the first transaction, and every transaction
+        after that is sized from the gas estimate of the one before, assuming its items cost about
+        as much. A transaction that is estimated to need more gas than a block has is shrunk in
+        proportion and estimated again.
+
+        function:   the name of the batch function.
+        columns:    the arguments of the function, each a list with one value per item.
+
+        returns a list of (transaction hash, number of items) tuples, one per transaction, in order.
+
+        raises ValueError if the contract does not have the batch function.
+        """
+        total = len(columns[0])
+        if any(len(column) != total for column in columns):
+            raise ValueError("The arguments of " + function + " must have one value per item")
+        self.require_functions([function])
+
+        sent = []
+        start = 0
+        size = None
+        while start < total:
+            if size is None:
+                probe = self.encode_call(function, [column[start:start + 1] for column in columns])
+                size = max(1, self.block_gas_limit // self.estimate_gas(probe))
+            size = min(size, total - start)
+
+            data = self.encode_call(function, [column[start:start + size] for column in columns])
+            try:
+                gas = self.estimate_gas(data)
+            except RPCError:
+                # the client fails to estimate calls that need more gas than a block has
+                if size == 1:
+                    raise
+                size //= 2
+                continue
+
+            if gas > self.block_gas_limit:
+                if size == 1:
+                    raise ValueError("An item of " + function + " needs more gas than a block has")
+                size = max(1, size * self.block_gas_limit // gas)
+                continue
+
+            sent.append((self._send_transaction(data, gas=gas), size))
+            start += size
+            size = max(1, size * self.block_gas_limit // gas)
+
+        return sent
+
+    def add_attributes_batch(self, attributes):
+        """Sends transactions adding several attributes, as many in each as fit in a block.
+
+        attributes: a list of (attributetype, has_proof, identifier, data, datahash) tuples, with
+                    the arguments of add_attribute.
+
+        returns a list of (transaction hash, number of attributes) tuples, one per transaction, in
+        order. The attributes of a transaction are assigned consecutive IDs.
+        """
+        attributes = list(attributes)
+        if not attributes:
+            return []
+        return self._send_batches('addAttributes', [list(column) for column in zip(*attributes)])
+
+    def sign_attributes_batch(self, signatures):
+        """Sends transactions signing several attributes, as many in each as fit in a block.
+
+        signatures: a list of (attributeID, expiry) tuples, with the arguments of sign_attribute.
+
+        returns a list of (transaction hash, number of signatures) tuples, one per transaction, in
+        order. The signatures of a transaction are assigned consecutive IDs.
+        """
+        signatures = list(signatures)
+        if not signatures:
+            return []
+        return self._send_batches('signAttributes', [list(column) for column in zip(*signatures)])
+
+    def revoke_signatures_batch(self, signatureIDs):
+        """Sends transactions revoking several signatures, as many in each as fit in a block.
+
+        signatureIDs:   a list of IDs of signatures. Signatures not made by from_address are
+                        skipped by the contract, as by revoke_signature.
+
+        returns a list of (transaction hash, number of signatures) tuples, one per transaction, in
+        order.
+        """
+        signatureIDs = list(signatureIDs)
+        if not signatureIDs:
+            return []
+        return self._send_batches('revokeSignatures', [signatureIDs])
+
+    def commit_attributes(self, attributes, over_ipfs=True, page_size=PAGE_SIZE):
+        """Sends a transaction committing to a batch of attributes by the root of a Merkle tree.
+
+        The attributes and the proofs of their inclusion are published as a manifest on IPFS, see
+        commitments.build_commitment.
+
+        attributes: an iterable of dictionaries with the fields attributeType, hasProof,
+                    identifier, data and dataHash.
+        over_ipfs:  if True, the data of each attribute is stored as an IPFS block of its own and
+                    replaced by its URI, as by add_attribute_over_ipfs. A missing dataHash is
+                    computed from the data either way.
+        page_size:  the number of attributes in a page of the manifest.
+
+        returns a tuple of (transaction hash, commitment), the commitment being a dictionary with
+        the keys root, count and uri.
+
+        raises ValueError if the contract does not have commitAttributes.
+        """
+        # checked before anything is stored on IPFS
+        self.require_functions(['commitAttributes'])
+
+        attributes = (self._publish_committed(attribute, over_ipfs) for attribute in attributes)
+
+        commitment = build_commitment(attributes, page_size=page_size)
+        data = self.encode_call('commitAttributes', [commitment['root'], commitment['count'], commitment['uri']])
+        return (self._send_transaction(data), commitment)
+
+    @staticmethod
+    def _publish_committed(attribute, over_ipfs):
+        """Fills in the dataHash of an attribute to commit, and stores its data on IPFS if asked to."""
+        data = attribute['data']
+        # rows may leave the dataHash out, which is computed from the data, or '' without data
+        if not attribute.get('dataHash'):
+            attribute = dict(attribute, dataHash=compute_datahash(data))
+        if data and over_ipfs and parse_block_uri(data) is None:
+            attribute = dict(attribute, data='ipfs-block://' + put_block(data.encode('utf-8')))
+        return attribute
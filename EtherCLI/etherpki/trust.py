@@ -0,0 +1,295 @@
+"""Web-of-trust evaluation over EtherPKI signatures and the truststore.
+
+Addresses in the truststore are trusted at depth 0. An attribute is endorsed at depth n + 1 when at
+least threshold different signers, other than its owner, hold valid signatures of it and are
+trusted at depth n or less, where a signature is valid if it has neither expired nor been revoked.
+The owner of an endorsed attribute is trusted at the depth of the attribute, up to max_depth.
+"""
+
+import heapq
+import time
+
+# how many signatures away from the truststore trust extends by default
+DEFAULT_DEPTH = 2
+
+# number of trusted signers an attribute needs to be endorsed by default
+DEFAULT_THRESHOLD = 1
+
+UNTRUSTED = float('inf')
+
+
+def normalize_address(address):
+    """Returns an address as 40 lowercase hex characters, the form decoded events use."""
+    address = address.lower()
+    if address.startswith('0x'):
+        address = address[2:]
+    return address
+
+
+class TrustEngine(object):
+    """Computes trust from indexes of attributes and signatures, updated incrementally.
+
+    Events are added with apply. Only the addresses downstream of a change, that is the owners of
+    attributes signed by a changed address and so on up to max_depth signatures away, are evaluated
+    again, so the cost of an update depends on the part of the graph it touches.
+
+    The trust-check command builds a new engine with from_events each time it runs, so it only uses
+    the full evaluation of recompute_all; apply, advance and set_roots are for callers that keep
+    an engine across new events.
+    """
+
+    def __init__(self, roots=(), max_depth=DEFAULT_DEPTH, threshold=DEFAULT_THRESHOLD, attribute_types=None,
+            now=None):
+        """
+        roots:              the trusted addresses, e.g. userconfig.get_trusted()
+        max_depth:          the largest depth an address can be trusted at
+        threshold:          the number of trusted signers an attribute needs to be endorsed
+        attribute_types:    if set, only attributes of these types make their owner trusted
+        now:                the unix time expiry is checked against, defaults to the current time
+        """
+        self.max_depth = max_depth
+        self.threshold = threshold
+        self.attribute_types = None if attribute_types is None else set(attribute_types)
+        self.now = time.time() if now is None else now
+
+        self.roots = set(normalize_address(address) for address in roots)
+
+        # attributeID -> (owner, attribute type)
+        self._attributes = {}
+        # signatureID -> (signer, attributeID, expiry)
+        self._signatures = {}
+        self._revoked = set()
+
+        # adjacency indexes, signer -> signatures -> attribute -> owner
+        self._by_signer = {}
+        self._by_attribute = {}
+        self._by_owner = {}
+
+        # (expiry, signatureID) of signatures that are still valid
+        self._expiries = []
+
+        self._depths = dict((address, 0) for address in self.roots)
+        self._dirty = set()
+
+    @classmethod
+    def from_events(cls, events, roots=(), **settings):
+        """
+        Build an engine from every event of the contract.
+
+        events:     the Events instance to read from
+        roots:      the trusted addresses
+        settings:   other arguments of TrustEngine
+        """
+        engine = cls(roots, **settings)
+        for chunk in events.iter_all_events():
+            engine.apply(chunk, recompute=False)
+        engine.recompute_all()
+        return engine
+
+    def _add_attribute(self, event):
+        attributeID = event['attributeID']
+        owner = event['owner']
+        self._attributes[attributeID] = (owner, event['attributeType'])
+        self._by_owner.setdefault(owner, set()).add(attributeID)
+        self._dirty.add(owner)
+
+    def _add_signature(self, event):
+        signatureID = event['signatureID']
+        attributeID = event['attributeID']
+        self._signatures[signatureID] = (event['signer'], attributeID, event['expiry'])
+        self._by_signer.setdefault(event['signer'], set()).add(signatureID)
+        self._by_attribute.setdefault(attributeID, set()).add(signatureID)
+
+        if event['expiry'] > self.now:
+            heapq.heappush(self._expiries, (event['expiry'], signatureID))
+        self._touch_attribute(attributeID)
+
+    def _add_revocation(self, event):
+        # the field name is spelled as in the contract ABI
+        signatureID = event['signratureID']
+        self._revoked.add(signatureID)
+        if signatureID in self._signatures:
+            self._touch_attribute(self._signatures[signatureID][1])
+
+    def _touch_attribute(self, attributeID):
+        if attributeID in self._attributes:
+            self._dirty.add(self._attributes[attributeID][0])
+
+    def apply(self, events, recompute=True):
+        """
+        Add decoded events, in the order they occurred.
+
+        events:     decoded AttributeAdded, AttributeSigned and SignatureRevoked events
+        recompute:  if False, the affected addresses are only evaluated by the next recompute
+
+        returns the set of addresses whose depth changed, if recompute is True
+        """
+        handlers = {
+            'AttributeAdded': self._add_attribute,
+            'AttributeSigned': self._add_signature,
+            'SignatureRevoked': self._add_revocation,
+        }
+        for event in events:
+            handler = handlers.get(event['_event_type'])
+            if handler is not None:
+                handler(event)
+
+        if recompute:
+            return self.recompute()
+
+    def set_roots(self, roots):
+        """Replace the trusted addresses, e.g. after the truststore changed."""
+        roots = set(normalize_address(address) for address in roots)
+        self._dirty |= roots ^ self.roots
+        self.roots = roots
+        return self.recompute()
+
+    def advance(self, now=None):
+        """
+        Move the time expiry is checked against forward.
+
+        returns the set of addresses whose depth changed
+        """
+        self.now = time.time() if now is None else now
+        while self._expiries and self._expiries[0][0] <= self.now:
+            (_, signatureID) = heapq.heappop(self._expiries)
+            self._touch_attribute(self._signatures[signatureID][1])
+        return self.recompute()
+
+    def _is_valid(self, signatureID):
+        expiry = self._signatures[signatureID][2]
+        return expiry > self.now and signatureID not in self._revoked
+
+    def _trusted_signers(self, attributeID, depths=None):
+        """Returns a dictionary of the signers of valid signatures of an attribute to their depths."""
+        depths = self._depths if depths is None else depths
+        owner = self._attributes[attributeID][0]
+
+        signers = {}
+        for signatureID in self._by_attribute.get(attributeID, ()):
+            signer = self._signatures[signatureID][0]
+            if signer == owner or not self._is_valid(signatureID):
+                continue
+            depth = depths.get(signer, UNTRUSTED)
+            if depth < self.max_depth:
+                signers[signer] = depth
+        return signers
+
+    def _attribute_depth(self, attributeID, depths=None):
+        """Returns the depth an attribute is endorsed at, or UNTRUSTED."""
+        signers = self._trusted_signers(attributeID, depths)
+        if len(signers) < self.threshold:
+            return UNTRUSTED
+        return 1 + heapq.nsmallest(self.threshold, signers.values())[-1]
+
+    def _candidate(self, address, depths):
+        """Evaluates the depth of an address from the depths of the signers of its attributes."""
+        if address in self.roots:
+            return 0
+
+        best = UNTRUSTED
+        for attributeID in self._by_owner.get(address, ()):
+            if self.attribute_types is not None and self._attributes[attributeID][1] not in self.attribute_types:
+                continue
+            best = min(best, self._attribute_depth(attributeID, depths))
+        return best
+
+    def _downstream(self, addresses):
+        """Returns the addresses whose depth may depend on the depth of any of addresses."""
+        affected = set(addresses)
+        frontier = set(addresses)
+        for _ in range(self.max_depth):
+            reached = set()
+            for signer in frontier:
+                for signatureID in self._by_signer.get(signer, ()):
+                    attributeID = self._signatures[signatureID][1]
+                    if attributeID in self._attributes:
+                        reached.add(self._attributes[attributeID][0])
+            frontier = reached - affected
+            if not frontier:
+                break
+            affected |= frontier
+        return affected
+
+    def recompute(self):
+        """
+        Evaluate the addresses affected by changes since the last recompute.
+
+        returns the set of addresses whose depth changed
+        """
+        if not self._dirty:
+            return set()
+
+        affected = self._downstream(self._dirty)
+        self._dirty = set()
+
+        # the depths of affected addresses are found again from scratch, while the depths of all
+        # other addresses cannot depend on them and stay fixed
+        depths = dict(self._depths)
+        for address in affected:
+            depths.pop(address, None)
+
+        # relax until nothing changes; depths only decrease, and are bounded by max_depth
+        for _ in range(self.max_depth + 2):
+            changed = False
+            for address in affected:
+                depth = self._candidate(address, depths)
+                if depth <= self.max_depth and depth != depths.get(address, UNTRUSTED):
+                    depths[address] = depth
+                    changed = True
+            if not changed:
+                break
+
+        updated = set(address for address in affected
+            if depths.get(address, UNTRUSTED) != self._depths.get(address, UNTRUSTED))
+        self._depths = depths
+        return updated
+
+    def recompute_all(self):
+        """Evaluate every address, layer by layer outwards from the roots."""
+        self._dirty = set()
+        depths = dict((address, 0) for address in self.roots)
+
+        layer = list(self.roots)
+        for depth in range(1, self.max_depth + 1):
+            candidates = set()
+            for signer in layer:
+                for signatureID in self._by_signer.get(signer, ()):
+                    attributeID = self._signatures[signatureID][1]
+                    if attributeID in self._attributes:
+                        owner = self._attributes[attributeID][0]
+                        if owner not in depths:
+                            candidates.add(owner)
+
+            layer = [owner for owner in candidates if self._candidate(owner, depths) == depth]
+            for owner in layer:
+                depths[owner] = depth
+            if not layer:
+                break
+
+        self._depths = depths
+
+    def depth(self, address):
+        """Returns the depth an address is trusted at, or None if it is not trusted."""
+        return self._depths.get(normalize_address(address))
+
+    def is_trusted(self, address):
+        return self.depth(address) is not None
+
+    def attribute_verdict(self, attributeID):
+        """
+        Evaluate an attribute.
+
+        returns a dictionary with the keys endorsed, depth (None if it is not endorsed) and
+        trusted_signers, a dictionary of the signers counted to their depths, or None if the
+        attribute is unknown
+        """
+        if attributeID not in self._attributes:
+            return None
+
+        depth = self._attribute_depth(attributeID)
+        return {
+            'endorsed': depth <= self.max_depth,
+            'depth': depth if depth <= self.max_depth else None,
+            'trusted_signers': self._trusted_signers(attributeID),
+        }
@@ -0,0 +1,251 @@
+"""Compact on-disk truststore.
+
+The truststore file is a header followed by the trusted addresses as sorted 20-byte values. It is
+memory-mapped and searched in place, so checking an address does not read the whole store. Changes
+are kept in memory as additions and removals, and saving applies them to the file as it is on disk
+at that time, under a lock, so concurrent invocations do not lose each other's changes.
+"""
+
+import binascii
+import mmap
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # file locking is not available on this platform
+    fcntl = None
+
+MAGIC = b'EPKITS1\n'
+
+ADDRESS_SIZE = 20
+
+
+def pack_address(address):
+    """
+    Convert an Ethereum address to its 20-byte form.
+
+    address: the address as hex, with or without 0x, in any case
+
+    raises ValueError if address is not a valid address
+    """
+    address = address.strip().lower()
+    if address.startswith('0x'):
+        address = address[2:]
+    if len(address) != ADDRESS_SIZE * 2:
+        raise ValueError("Invalid Ethereum address: " + address)
+    try:
+        return binascii.unhexlify(address)
+    except (binascii.Error, TypeError):
+        raise ValueError("Invalid Ethereum address: " + address)
+
+
+def unpack_address(packed):
+    """Returns the 0x-prefixed hex form of a 20-byte address."""
+    return '0x' + binascii.hexlify(packed).decode('ascii')
+
+
+class _SortedFile(object):
+    """The addresses of a truststore file, searched in place."""
+
+    def __init__(self, path):
+        self._file = None
+        self._map = None
+        self.count = 0
+
+        try:
+            self._file = open(path, 'rb')
+        except IOError:
+            return
+
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            return
+        if size < len(MAGIC) or (size - len(MAGIC)) % ADDRESS_SIZE:
+            self.close()
+            raise ValueError("Corrupt truststore: " + path)
+
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a truststore: " + path)
+        self.count = (size - len(MAGIC)) // ADDRESS_SIZE
+
+    def _get(self, index):
+        offset = len(MAGIC) + index * ADDRESS_SIZE
+        return self._map[offset:offset + ADDRESS_SIZE]
+
+    def __contains__(self, packed):
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            if self._get(middle) < packed:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self._get(low) == packed
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._get(index)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+
+class TrustStore(object):
+    """A set of trusted addresses backed by a truststore file."""
+
+    def __init__(self, path):
+        """
+        path: the path of the truststore file, which need not exist yet
+        """
+        self.path = path
+        self._disk = _SortedFile(path)
+
+        # the full set of packed addresses, only loaded to iterate over changes or replace the store
+        self._set = None
+
+        # changes not yet saved
+        self._added = set()
+        self._removed = set()
+
+    @property
+    def dirty(self):
+        """True if the store has changes that are not saved."""
+        return bool(self._added or self._removed)
+
+    def _load(self):
+        if self._set is None:
+            self._set = set(self._disk)
+            self._set -= self._removed
+            self._set |= self._added
+        return self._set
+
+    def _trusts(self, packed):
+        if self._set is not None:
+            return packed in self._set
+        if packed in self._added:
+            return True
+        if packed in self._removed:
+            return False
+        return packed in self._disk
+
+    def __contains__(self, address):
+        try:
+            packed = pack_address(address)
+        except ValueError:
+            return False
+        return self._trusts(packed)
+
+    def __len__(self):
+        if self._set is not None:
+            return len(self._set)
+        # an address removed and added again is in both the file and the additions
+        return (self._disk.count + sum(1 for packed in self._added if packed not in self._disk)
+            - sum(1 for packed in self._removed if packed in self._disk))
+
+    def __iter__(self):
+        """Yields the trusted addresses in sorted order, as 0x-prefixed hex."""
+        # the file is already sorted, unless there are changes to merge into it
+        addresses = self._disk if not self.dirty else sorted(self._load())
+        for packed in addresses:
+            yield unpack_address(packed)
+
+    def add_many(self, addresses):
+        """
+        Trust several addresses.
+
+        returns the number of addresses that were not already trusted
+
+        raises ValueError if any of addresses is invalid, without adding any of them
+        """
+        packed = set(pack_address(address) for address in addresses)
+
+        # looked up in the file in place, so that adding an address does not load the whole store
+        new = set(address for address in packed if not self._trusts(address))
+        if self._set is not None:
+            self._set |= new
+        self._added |= new
+        self._removed -= new
+        return len(new)
+
+    def remove_many(self, addresses):
+        """
+        Stop trusting several addresses.
+
+        returns the number of addresses that were trusted
+        """
+        packed = set()
+        for address in addresses:
+            try:
+                packed.add(pack_address(address))
+            except ValueError:
+                pass
+
+        old = set(address for address in packed if self._trusts(address))
+        if self._set is not None:
+            self._set -= old
+        self._removed |= old
+        self._added -= old
+        return len(old)
+
+    def replace(self, addresses):
+        """
+        Trust exactly the given addresses.
+
+        returns a tuple of (number of addresses added, number of addresses removed)
+        """
+        addresses = list(addresses)
+        packed = set(pack_address(address) for address in addresses)
+        old = [unpack_address(address) for address in self._load() - packed]
+
+        return (self.add_many(addresses), self.remove_many(old))
+
+    def save(self):
+        """
+        Write the changes to the truststore file, if there are any.
+
+        The file is locked, read again and replaced atomically, so changes saved by other processes
+        since it was opened are kept.
+        """
+        if not self.dirty:
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with open(self.path + '.lock', 'a') as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+
+            current = _SortedFile(self.path)
+            try:
+                trusted = set(current)
+            finally:
+                current.close()
+            trusted -= self._removed
+            trusted |= self._added
+
+            (fd, temppath) = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as storefile:
+                    storefile.write(MAGIC)
+                    storefile.write(b''.join(sorted(trusted)))
+                    storefile.flush()
+                    os.fsync(storefile.fileno())
+                os.replace(temppath, self.path)
+            except BaseException:
+                os.remove(temppath)
+                raise
+
+        self._disk.close()
+        self._disk = _SortedFile(self.path)
+        self._set = None
+        self._added = set()
+        self._removed = set()
+
+    def close(self):
+        self._disk.close()
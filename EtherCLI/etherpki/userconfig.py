@@ -1,39 +1,98 @@
 """Configuration management"""
 
+import logging
 import os
 
 from appdirs import user_config_dir
-from configobj import ConfigObj
-
-try:
-    os.makedirs(user_config_dir("etherpki"))
-except OSError:
-    if not os.path.isdir(user_config_dir("etherpki")):
-        raise
 
 configfile = os.path.join(user_config_dir("etherpki"), "config.ini")
+truststorefile = os.path.join(user_config_dir("etherpki"), "truststore.bin")
+
+_config = None
+_config_changed = False
+
+_truststore = None
+
+
+def _make_config_dir():
+    try:
+        os.makedirs(user_config_dir("etherpki"))
+    except OSError:
+        if not os.path.isdir(user_config_dir("etherpki")):
+            raise
+
+
+def get_config():
+    """Returns the user configuration, reading it from disk on first use."""
+    global _config
+
+    if _config is None:
+        from configobj import ConfigObj
+
+        _make_config_dir()
+        _config = ConfigObj(configfile)
+
+    return _config
+
+
+def get_truststore():
+    """Returns the TrustStore of trusted addresses, opening it on first use."""
+    global _truststore
+
+    if _truststore is None:
+        from etherpki.truststore import TrustStore
+
+        _make_config_dir()
+        _truststore = TrustStore(truststorefile)
+        if not os.path.exists(truststorefile) and os.path.exists(configfile):
+            _migrate_truststore(_truststore)
+
+    return _truststore
+
+
+def _migrate_truststore(truststore):
+    """Moves addresses from the truststore section of the configuration file to the truststore."""
+    global _config_changed
+
+    config = get_config()
+    if 'truststore' not in config:
+        return
+
+    for (address, trusted) in config['truststore'].items():
+        if trusted not in (True, 'True'):
+            continue
+        try:
+            truststore.add_many([address])
+        except ValueError:
+            logging.getLogger(__name__).warning("Dropping invalid address from the truststore: %s", address)
+
+    del config['truststore']
+    _config_changed = True
 
-config = ConfigObj(configfile)
 
-if 'truststore' not in config:
-    config['truststore'] = {}
+def save():
+    """Writes the user configuration and truststore back to disk if they were changed."""
+    if _truststore is not None:
+        _truststore.save()
+    if _config is not None and _config_changed:
+        _config.write()
 
 
 def trust(address):
     """Adds an address to the truststore"""
 
-    config['truststore'][address] = True
+    get_truststore().add_many([address])
 
 def untrust(address):
     """Removes an address from the truststore"""
 
-    del config['truststore'][address]
+    get_truststore().remove_many([address])
 
 def is_trusted(address):
     """Returns true if an address is in the truststore & is trusted"""
 
-    return address in config['truststore'] and config['truststore'][address]
+    return address in get_truststore()
 
 def get_trusted():
     """Returns a list of trusted Ethereum addresses"""
-    return config['truststore'].keys()
\ No newline at end of file
+    return list(get_truststore())
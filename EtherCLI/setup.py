@@ -5,20 +5,22 @@ setup(
     name='etherpki',
     version='0.1',
     packages=['etherpki'],
-    package_data={'etherpki': ['EtherCLI/etherpki_abi.json']},
+    package_data={'etherpki': ['etherpki_abi.json', 'etherpki_abi_additions.json']},
     install_requires=[
         'click',
-        'jsonrpc-requests',
-        'ethereum',
+        'pycryptodome',
         'rlp',
         'configobj',
         'appdirs',
-        'ethereum-rpc-client',
+        'requests',
         'python-gnupg',
-        'ipfs-api'
+        'ipfshttpclient'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     entry_points='''
         [console_scripts]
-        etherpki=etherpki.console:cli
+        etherpki=etherpki.console:main
     ''',
 )
\ No newline at end of file
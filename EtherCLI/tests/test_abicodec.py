@@ -0,0 +1,152 @@
+"""Tests of the ABI encoding of calls and decoding of results and logs."""
+
+import binascii
+
+import pytest
+
+from etherpki.abicodec import CallEncoder
+from etherpki.abicodec import LogDecoder
+from etherpki.abicodec import ResultDecoder
+from etherpki.abicodec import decode_values
+from etherpki.abicodec import encode_values
+from etherpki.abicodec import function_selector
+from etherpki.ethapi import get_etherpki_abi
+from etherpki.keccak import keccak256
+
+
+def word(value):
+    return ('%064x' % value) if isinstance(value, int) else binascii.hexlify(value.ljust(32, b'\x00')).decode('ascii')
+
+
+def function(name, inputs, outputs=()):
+    return {
+        'type': 'function',
+        'name': name,
+        'inputs': [{'name': '', 'type': typ} for typ in inputs],
+        'outputs': [{'name': '', 'type': typ} for typ in outputs],
+    }
+
+
+def test_keccak256():
+    assert binascii.hexlify(keccak256(b'')) == b'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
+    assert function_selector(function('transfer', ['address', 'uint256'])) == binascii.unhexlify('a9059cbb')
+
+
+# the examples of the Solidity ABI specification
+SPEC_EXAMPLES = [
+    (function('baz', ['uint32', 'bool']), [69, True],
+        'cdcd77c0' + word(69) + word(1)),
+    (function('sam', ['bytes', 'bool', 'uint256[]']), [b'dave', True, [1, 2, 3]],
+        'a5643bf2' + word(0x60) + word(1) + word(0xa0) + word(4) + word(b'dave')
+        + word(3) + word(1) + word(2) + word(3)),
+    (function('f', ['uint256', 'uint32[]', 'bytes10', 'bytes']),
+        [0x123, [0x456, 0x789], b'1234567890', b'Hello, world!'],
+        '8be65246' + word(0x123) + word(0x80) + word(b'1234567890') + word(0xe0)
+        + word(2) + word(0x456) + word(0x789) + word(13) + word(b'Hello, world!')),
+]
+
+
+@pytest.mark.parametrize(('entry', 'args', 'expected'), SPEC_EXAMPLES)
+def test_encode_spec_examples(entry, args, expected):
+    data = CallEncoder([entry]).encode(entry['name'], args)
+    assert binascii.hexlify(data).decode('ascii') == expected
+
+    types = [arg['type'] for arg in entry['inputs']]
+    assert decode_values(types, data[4:]) == args
+
+
+ROUND_TRIPS = [
+    (['uint256', 'uint8', 'int256', 'int32'], [2 ** 256 - 1, 255, -(2 ** 255), -1]),
+    (['address', 'bool', 'bool'], ['00' * 19 + 'ff', True, False]),
+    (['bytes32', 'bytes1'], [b'identifier'.ljust(32, b'\x00'), b'\x07']),
+    (['string', 'bytes', 'string'], [u'grüße ✓', b'\x00' * 33, '']),
+    (['uint256[]', 'string[]', 'uint256[]'], [[], ['a', 'b' * 40, ''], [1, 2 ** 200]]),
+    (['bool[]', 'address[]', 'bytes32[]'], [[True, False], ['ab' * 20, '00' * 20], [b'x' * 32]]),
+    (['string[]', 'bool', 'string'], [['pgp-key'] * 5, True, 'x' * 100]),
+]
+
+
+@pytest.mark.parametrize(('types', 'values'), ROUND_TRIPS)
+def test_round_trip(types, values):
+    data = encode_values(types, values)
+    assert len(data) % 32 == 0
+    assert decode_values(types, data) == values
+
+
+def test_encode_rejects_invalid_values():
+    with pytest.raises(ValueError):
+        encode_values(['uint8'], [256])
+    with pytest.raises(ValueError):
+        encode_values(['uint256'], [-1])
+    with pytest.raises(ValueError):
+        encode_values(['int8'], [128])
+    with pytest.raises(ValueError):
+        encode_values(['address'], ['0x1234'])
+    with pytest.raises(ValueError):
+        encode_values(['bytes4'], [b'12345'])
+    with pytest.raises(ValueError):
+        encode_values(['uint256', 'uint256'], [1])
+    with pytest.raises(ValueError):
+        CallEncoder(get_etherpki_abi()).encode('noSuchFunction', [])
+
+
+def test_contract_calls_round_trip():
+    encoder = CallEncoder(get_etherpki_abi())
+    decoder = ResultDecoder(get_etherpki_abi())
+
+    args = [['pgp-key', 'email'], [True, False], [b'a' * 32, b'b' * 32], ['data', ''], ['hash', '']]
+    data = encoder.encode('addAttributes', args)
+    assert data[:4] == function_selector(function('addAttributes',
+        ['string[]', 'bool[]', 'bytes32[]', 'string[]', 'string[]']))
+    assert decode_values(['string[]', 'bool[]', 'bytes32[]', 'string[]', 'string[]'], data[4:]) == args
+
+    outputs = [3, [7, 8, 9], ['ab' * 20, 'cd' * 20, 'ef' * 20], [0, 1, 2 ** 64]]
+    result = encode_values(['uint256', 'uint256[]', 'address[]', 'uint256[]'], outputs)
+    assert decoder.decode('getSignaturesForAttribute', '0x' + binascii.hexlify(result).decode('ascii')) == outputs
+    assert decoder.decode('getSignaturesForAttribute', result) == outputs
+
+
+def test_decode_logs():
+    decoder = LogDecoder(get_etherpki_abi())
+    identifier = b'alice@example.com'.ljust(32, b'\x00')
+    added = {
+        'topics': [
+            decoder.event_topic('AttributeAdded'),
+            '0x' + word(12),
+            '0x' + word(0xab),
+            '0x' + binascii.hexlify(identifier).decode('ascii'),
+        ],
+        'data': '0x' + binascii.hexlify(encode_values(['string', 'bool', 'string', 'string'],
+            ['email', True, u'mailto:alice@example.com ✉', ''])).decode('ascii'),
+    }
+    signed = {
+        'topics': [decoder.event_topic('AttributeSigned').upper().replace('0X', '0x'),
+            '0x' + word(5), '0x' + word(0xcd), '0x' + word(12)],
+        'data': '0x' + word(1600000000),
+    }
+    foreign = {'topics': ['0x' + word(1)], 'data': '0x'}
+    anonymous = {'topics': [], 'data': '0x'}
+
+    expected = [
+        {
+            '_event_type': 'AttributeAdded',
+            'attributeID': 12,
+            'owner': '%040x' % 0xab,
+            'identifier': identifier,
+            'attributeType': 'email',
+            'hasProof': True,
+            'data': u'mailto:alice@example.com ✉',
+            'dataHash': '',
+        },
+        {
+            '_event_type': 'AttributeSigned',
+            'signatureID': 5,
+            'signer': '%040x' % 0xcd,
+            'attributeID': 12,
+            'expiry': 1600000000,
+        },
+    ]
+
+    assert [decoder.decode(log) for log in (added, signed, foreign, anonymous)] == expected + [None, None]
+    assert decoder.decode_many([foreign, added, anonymous, signed]) == expected
+    assert decoder.event_topic('NoSuchEvent') is None
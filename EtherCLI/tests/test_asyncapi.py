@@ -0,0 +1,178 @@
+"""Tests that the asyncio API returns the same results as the blocking API, against the fake node."""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from benchmarks.fakenode import ACCOUNT
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki.asyncapi import AsyncEthClient
+from etherpki.asyncapi import AsyncEvents
+from etherpki.asyncapi import AsyncRPCTransport
+from etherpki.asyncapi import AsyncTransactions
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.events import Events
+from etherpki.transactions import Transactions
+
+
+class RecordingNode(FakeNode):
+    """A FakeNode that keeps the transactions sent to it."""
+
+    def __init__(self, chain, **kwargs):
+        FakeNode.__init__(self, chain, **kwargs)
+        self.sent = []
+
+    def rpc_eth_sendTransaction(self, transaction):
+        self.sent.append(transaction)
+        return FakeNode.rpc_eth_sendTransaction(self, transaction)
+
+
+@pytest.fixture(scope='module')
+def chain():
+    return SyntheticChain(3000, logs_per_block=10)
+
+
+@pytest.fixture(scope='module')
+def node(chain):
+    # a small result limit makes both APIs split their block ranges
+    with RecordingNode(chain, max_results=400) as node:
+        yield node
+
+
+@pytest.fixture(scope='module')
+def events(node):
+    return Events(address=CONTRACT_ADDRESS, index=False, client=EthClient(RPCTransport(node.url)), state=False)
+
+
+def run_async(node, function, max_concurrency=4, chunk_size=50):
+    """Runs function(AsyncEvents) in a new event loop, closing the client afterwards."""
+    async def main():
+        client = AsyncEthClient(AsyncRPCTransport(node.url, max_concurrency=max_concurrency))
+        try:
+            return await function(AsyncEvents(address=CONTRACT_ADDRESS, client=client, chunk_size=chunk_size))
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def filters(chain, events):
+    owner = '0x' + chain.owner(7)
+    signer = '0x' + events.filter_signatures(signatureID=9)[0]['signer']
+    return [
+        ('filter_attributes', {}),
+        ('filter_attributes', {'attributeID': 7}),
+        ('filter_attributes', {'owner': owner}),
+        ('filter_attributes', {'identifier': chain.identifier(42)}),
+        ('filter_attributes', {'attributeID': 10 ** 6}),
+        ('filter_signatures', {}),
+        ('filter_signatures', {'attributeID': 10}),
+        ('filter_signatures', {'signatureID': 9}),
+        ('filter_signatures', {'signer': signer}),
+        ('filter_revocations', {}),
+        ('filter_revocations', {'signatureID': chain.signature_id(10, 1)}),
+    ]
+
+
+def test_filters_match(node, chain, events):
+    queries = filters(chain, events)
+
+    async def query_all(async_events):
+        return [await getattr(async_events, name)(**kwargs) for (name, kwargs) in queries]
+
+    results = run_async(node, query_all)
+    for ((name, kwargs), result) in zip(queries, results):
+        expected = getattr(events, name)(**kwargs)
+        assert result == expected, (name, kwargs)
+    # only the query of a missing attribute comes back empty
+    assert [bool(result) for result in results].count(False) == 1
+
+
+@pytest.mark.parametrize('max_concurrency', [1, 3, 16])
+def test_concurrency_does_not_change_results(node, events, max_concurrency):
+    result = run_async(node, lambda async_events: async_events.filter_signatures(), max_concurrency, chunk_size=7)
+    assert result == events.filter_signatures()
+
+
+def test_concurrency_is_bounded(node, events):
+    in_flight = [0, 0]
+
+    class CountingEvents(AsyncEvents):
+        async def _fetch_range(self, topics, start, end):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            try:
+                return await AsyncEvents._fetch_range(self, topics, start, end)
+            finally:
+                in_flight[0] -= 1
+
+    async def main():
+        client = AsyncEthClient(AsyncRPCTransport(node.url))
+        try:
+            return await CountingEvents(address=CONTRACT_ADDRESS, client=client, chunk_size=5,
+                max_concurrency=3).filter_attributes()
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == events.filter_attributes()
+    assert in_flight[1] == 3
+
+
+def test_signatures_status_match(node, events):
+    # attribute 0 has a revoked signature, 10 ** 6 does not exist
+    attribute_ids = [0, 7, 20, 10 ** 6]
+
+    async def statuses(async_events):
+        return [await async_events.get_attribute_signatures_status(attributeID) for attributeID in attribute_ids]
+
+    results = run_async(node, statuses)
+    for (attributeID, result) in zip(attribute_ids, results):
+        assert result == events.get_attribute_signatures_status(attributeID)
+    assert results[0]['status']['invalid'] >= 1
+
+
+def test_retrieve_attribute_match(node, events):
+    attribute_ids = [0, 7, 599, 10 ** 6]
+
+    async def retrieve(async_events):
+        return await async_events.retrieve_attributes(attribute_ids)
+
+    results = run_async(node, retrieve)
+    for (attributeID, result) in zip(attribute_ids, results):
+        assert result == events.retrieve_attribute(attributeID)
+    assert results[-1] is None
+    assert results[1]['attributeID'] == 7 and results[1]['data_valid'] is None
+
+
+def test_transactions_match(node):
+    calls = [
+        ('add_attribute', ['email', False, 'alice@example.com', 'mailto:alice@example.com', '']),
+        ('add_attribute_with_hash', ['email', True, b'bob@example.com', 'mailto:bob@example.com']),
+        ('sign_attribute', [7, 1700000000]),
+        ('revoke_signature', [5]),
+    ]
+
+    del node.sent[:]
+    transactions = Transactions(to_address=CONTRACT_ADDRESS, client=EthClient(RPCTransport(node.url)))
+    for (name, args) in calls:
+        getattr(transactions, name)(*args)
+    expected = list(node.sent)
+
+    async def send():
+        client = AsyncEthClient(AsyncRPCTransport(node.url))
+        try:
+            async_transactions = AsyncTransactions(to_address=CONTRACT_ADDRESS, client=client)
+            for (name, args) in calls:
+                await getattr(async_transactions, name)(*args)
+            return async_transactions.from_address
+        finally:
+            await client.close()
+
+    del node.sent[:]
+    assert asyncio.run(send()) == ACCOUNT
+    assert node.sent == expected
+    assert len(expected) == len(calls)
@@ -0,0 +1,142 @@
+"""Tests of sending batches of attributes, signatures and revocations, against the fake node."""
+
+import binascii
+
+import pytest
+
+from benchmarks.fakenode import ACCOUNT
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki.abicodec import decode_values
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import RPCTransport
+from etherpki.ethapi import get_deployed_functions
+from etherpki.ethapi import require_functions
+from etherpki.transactions import GAS_MARGIN
+from etherpki.transactions import Transactions
+
+
+class GasNode(FakeNode):
+    """A fake node whose gas estimates grow with the number of items of a batch call.
+
+    Estimates above max_estimate fail, as clients fail to estimate calls that need more gas than a
+    block has, and the code of the contract only has the functions of deployed, if given.
+    """
+
+    def __init__(self, base=30000, per_item=50000, max_estimate=None, deployed=None):
+        FakeNode.__init__(self, SyntheticChain(100))
+        self.base = base
+        self.per_item = per_item
+        self.max_estimate = max_estimate
+        self.sent = []
+        if deployed is not None:
+            self._functions = dict((selector, entry) for (selector, entry) in self._functions.items()
+                if entry['name'] in deployed)
+
+    def decode(self, transaction):
+        data = binascii.unhexlify(transaction['data'][2:])
+        function = self._functions[data[:4]]
+        return (function['name'], decode_values([arg['type'] for arg in function['inputs']], data[4:]))
+
+    def rpc_eth_estimateGas(self, transaction, tag=None):
+        (_, args) = self.decode(transaction)
+        gas = self.base + self.per_item * len(args[0])
+        if self.max_estimate is not None and gas > self.max_estimate:
+            raise ValueError('gas required exceeds allowance')
+        return hex(gas)
+
+    def rpc_eth_sendTransaction(self, transaction):
+        (name, args) = self.decode(transaction)
+        self.sent.append((name, args, int(transaction['gas'], 16)))
+        return FakeNode.rpc_eth_sendTransaction(self, transaction)
+
+
+def transactions_for(node, **kwargs):
+    return Transactions(from_address=ACCOUNT, to_address=CONTRACT_ADDRESS, client=EthClient(RPCTransport(node.url)),
+        **kwargs)
+
+
+def attribute(number):
+    return ('email', False, b'user%d' % number, 'user%d@example.com' % number, '0x%064x' % number)
+
+
+def test_batches_fit_in_a_block():
+    with GasNode() as node:
+        attributes = [attribute(number) for number in range(100)]
+        sent = transactions_for(node).add_attributes_batch(attributes)
+
+    # the first transaction is sized from the estimate of one item, and the next ones from the
+    # estimate of the one before
+    assert [count for (_, count) in sent] == [20, 32, 32, 16]
+    assert [txhash for (txhash, _) in sent] == list(node._receipts)
+    for (name, args, gas) in node.sent:
+        assert name == 'addAttributes'
+        assert gas == int((node.base + node.per_item * len(args[0])) * GAS_MARGIN) <= 2000000
+
+    received = [item for (_, args, _) in node.sent for item in zip(*args)]
+    assert [(attributetype, has_proof, identifier.rstrip(b'\x00'), data, datahash)
+        for (attributetype, has_proof, identifier, data, datahash) in received] == attributes
+
+
+def test_batches_shrink_when_estimates_fail():
+    with GasNode(max_estimate=1000000) as node:
+        signatures = [(number, 2000000000 + number) for number in range(60)]
+        sent = transactions_for(node, block_gas_limit=10 ** 8).sign_attributes_batch(signatures)
+
+    assert sum(count for (_, count) in sent) == 60
+    assert all(node.base + node.per_item * len(args[0]) <= node.max_estimate for (_, args, _) in node.sent)
+    assert [item for (_, args, _) in node.sent for item in zip(*args)] == signatures
+
+
+def test_items_that_do_not_fit_in_a_block():
+    with GasNode(per_item=3000000) as node:
+        with pytest.raises(ValueError):
+            transactions_for(node).revoke_signatures_batch([1, 2])
+    with GasNode(max_estimate=10000) as node:
+        with pytest.raises(RPCError):
+            transactions_for(node).revoke_signatures_batch([1, 2])
+    assert node.sent == []
+
+
+def test_revoke_and_empty_batches():
+    with GasNode() as node:
+        transactions = transactions_for(node)
+        sent = transactions.revoke_signatures_batch(range(5, 10))
+        assert (transactions.add_attributes_batch([]), transactions.sign_attributes_batch([])) == ([], [])
+        assert transactions.revoke_signatures_batch([]) == []
+
+    assert len(sent) == 1 and sent[0][1] == 5
+    assert node.sent[0][:2] == ('revokeSignatures', [[5, 6, 7, 8, 9]])
+
+    with pytest.raises(ValueError):
+        transactions._send_batches('signAttributes', [[1, 2], [2000000000]])
+
+
+def test_older_deployments_are_refused():
+    with GasNode(deployed=['addAttribute', 'signAttribute', 'revokeSignature']) as node:
+        transactions = transactions_for(node)
+        with pytest.raises(ValueError) as error:
+            transactions.sign_attributes_batch([(1, 2000000000)])
+        assert 'signAttributes' in str(error.value) and CONTRACT_ADDRESS in str(error.value)
+
+        with pytest.raises(ValueError):
+            transactions.add_attributes_batch([attribute(1)])
+        # the code of the contract is only read once
+        assert node.calls['eth_getCode'] == 1
+        assert node.sent == []
+
+        client = EthClient(RPCTransport(node.url))
+        assert get_deployed_functions(client, CONTRACT_ADDRESS) == set(['addAttribute', 'signAttribute',
+            'revokeSignature'])
+        assert get_deployed_functions(client, '0x' + '43' * 20) == set()
+        assert get_deployed_functions(client, '') is None
+
+
+def test_require_functions():
+    require_functions(None, CONTRACT_ADDRESS, ['addAttributes'])
+    require_functions(set(['addAttributes', 'getCounts']), CONTRACT_ADDRESS, ['addAttributes'])
+    with pytest.raises(ValueError) as error:
+        require_functions(set(['addAttribute']), CONTRACT_ADDRESS, ['addAttributes', 'getCounts'])
+    assert 'addAttributes, getCounts' in str(error.value)
@@ -0,0 +1,203 @@
+"""Tests of bulk submission resuming from its journal after a crash."""
+
+import json
+
+import pytest
+
+from etherpki.bulk import BulkSubmitter
+from etherpki.bulk import Journal
+from etherpki.bulk import attribute_call
+from etherpki.bulk import row_key
+from etherpki.ethapi import encode_api_data
+from etherpki.transactions import Transactions
+
+SENDER = '0x' + '11' * 20
+
+
+class Crash(BaseException):
+    """Stands in for the process being killed, so that no except clause of the submitter catches it."""
+
+
+class Node(object):
+    """An Ethereum client for one account, mining every pending transaction when receipts are polled."""
+
+    def __init__(self):
+        self.mined = []
+        self.pending = []
+        self.head = 100
+        self.receipts = {}
+        self.sent = 0
+
+        # when set, the send_transaction call with this nonce crashes, after the node accepted the
+        # transaction if crash_accepted is set
+        self.crash_nonce = None
+        self.crash_accepted = False
+
+    def nonce(self):
+        return len(self.mined) + len(self.pending)
+
+    def sent_data(self):
+        return [data for (_, data) in self.mined + self.pending]
+
+    def drop_pending(self):
+        """Forget the transactions not yet mined, as a restarted node without them would."""
+        self.pending = []
+
+    def estimate_gas(self, _from, to, data):
+        return 100000
+
+    def send_transaction(self, _from, to, gas, data, nonce):
+        assert _from == SENDER
+        if nonce == self.crash_nonce and not self.crash_accepted:
+            raise Crash()
+        if nonce != self.nonce():
+            raise ValueError("nonce too low" if nonce < self.nonce() else "nonce gap")
+        self.sent += 1
+        txhash = '0x%064x' % self.sent
+        self.pending.append((txhash, data))
+        if nonce == self.crash_nonce:
+            raise Crash()
+        return txhash
+
+    def get_transaction_count(self, address, block):
+        return self.nonce()
+
+    def get_transaction_by_hash(self, txhash):
+        if txhash in self.receipts or txhash in [pending for (pending, _) in self.pending]:
+            return {'hash': txhash}
+        return None
+
+    def batch(self, calls):
+        if self.pending:
+            self.head += 1
+            for (txhash, data) in self.pending:
+                self.receipts[txhash] = {'blockNumber': hex(self.head), 'gasUsed': '0x5208', 'status': '0x1', 'logs': []}
+            self.mined += self.pending
+            self.pending = []
+        return [hex(self.head)] + [self.receipts.get(params[0]) for (_, params) in calls[1:]]
+
+
+def make_calls(count):
+    rows = [{'attributetype': 'email', 'identifier': 'user%d@example.com' % number} for number in range(1, count + 1)]
+    return [(number, row_key(row)) + attribute_call(row) for (number, row) in enumerate(rows, 1)]
+
+
+def run(node, path, calls, in_flight=2):
+    journal = Journal(path)
+    try:
+        transactions = Transactions(from_address=SENDER, client=node)
+        submitter = BulkSubmitter(transactions, journal, in_flight=in_flight)
+        progress = []
+        try:
+            for entry in submitter.submit(calls):
+                progress.append(entry)
+        except Crash:
+            pass
+        return progress
+    finally:
+        journal.close()
+
+
+def final_statuses(path):
+    journal = Journal(path)
+    journal.close()
+    return dict((row, entry.get('status')) for (row, entry) in journal.entries.items())
+
+
+def assert_sent_once(node, calls):
+    transactions = Transactions(from_address=SENDER, client=node)
+    expected = sorted(encode_api_data(transactions.encode_call(function, args)) for (_, _, function, args) in calls)
+    assert sorted(node.sent_data()) == expected
+
+
+def test_journal_drops_incomplete_line(tmpdir):
+    path = str(tmpdir.join('journal'))
+    with open(path, 'w') as journalfile:
+        journalfile.write(json.dumps({'row': 1, 'key': 'a', 'nonce': 4}) + '\n')
+        journalfile.write(json.dumps({'row': 1, 'transaction': '0x01'}) + '\n')
+        journalfile.write(json.dumps({'row': 2, 'key': 'b'}) + '\n')
+        journalfile.write('{"row": 2, "nonce"')
+
+    journal = Journal(path)
+    assert journal.entries == {1: {'key': 'a', 'nonce': 4, 'transaction': '0x01'}, 2: {'key': 'b'}}
+    journal.record(2, nonce=5)
+    journal.close()
+
+    with open(path) as journalfile:
+        lines = journalfile.read().splitlines()
+    assert len(lines) == 4 and json.loads(lines[-1]) == {'row': 2, 'nonce': 5}
+    assert Journal(path).entries[2] == {'key': 'b', 'nonce': 5}
+
+
+def test_submit_without_crash(tmpdir):
+    path = str(tmpdir.join('journal'))
+    node = Node()
+    calls = make_calls(5)
+
+    progress = run(node, path, calls)
+    assert sorted(entry['row'] for entry in progress if entry['status'] == 'sent') == [1, 2, 3, 4, 5]
+    assert sorted(entry['row'] for entry in progress if entry['status'] == 'mined') == [1, 2, 3, 4, 5]
+    assert_sent_once(node, calls)
+
+    # a second run sends nothing
+    assert run(node, path, calls) == [{'row': row, 'status': 'skipped'} for row in range(1, 6)]
+    assert_sent_once(node, calls)
+
+
+@pytest.mark.parametrize('accepted', [False, True])
+@pytest.mark.parametrize('crash_row', [1, 3, 6])
+def test_resume_after_crash_while_sending(tmpdir, accepted, crash_row):
+    path = str(tmpdir.join('journal'))
+    node = Node()
+    calls = make_calls(6)
+
+    node.crash_nonce = crash_row - 1
+    node.crash_accepted = accepted
+    run(node, path, calls)
+    assert node.nonce() == crash_row - (not accepted)
+
+    node.crash_nonce = None
+    progress = run(node, path, calls)
+
+    # the row whose hash was lost is not sent again if the node took it
+    statuses = final_statuses(path)
+    assert statuses.pop(crash_row) == ('unknown' if accepted else 'mined')
+    assert set(statuses.values()) == set(['mined'])
+    assert all(entry['status'] != 'error' for entry in progress)
+    assert_sent_once(node, calls)
+
+
+@pytest.mark.parametrize('dropped', [False, True])
+def test_resume_after_crash_while_waiting(tmpdir, dropped):
+    path = str(tmpdir.join('journal'))
+    node = Node()
+    calls = make_calls(4)
+
+    # crash while polling for receipts, with every transaction sent but none mined
+    def crash(calls):
+        raise Crash()
+    node.batch = crash
+    run(node, path, calls, in_flight=10)
+    assert node.nonce() == 4
+    del node.batch
+
+    if dropped:
+        node.drop_pending()
+    progress = run(node, path, calls, in_flight=10)
+
+    resent = sorted(entry['row'] for entry in progress if entry['status'] == 'sent')
+    assert resent == ([1, 2, 3, 4] if dropped else [])
+    assert sorted(entry['row'] for entry in progress if entry['status'] == 'mined') == [1, 2, 3, 4]
+    assert set(final_statuses(path).values()) == set(['mined'])
+    assert_sent_once(node, calls)
+
+
+def test_changed_row_is_rejected(tmpdir):
+    path = str(tmpdir.join('journal'))
+    node = Node()
+    run(node, path, make_calls(2))
+
+    calls = make_calls(3)
+    calls[1] = (2, 'changed') + calls[1][2:]
+    with pytest.raises(ValueError):
+        run(node, path, calls)
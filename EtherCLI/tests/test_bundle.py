@@ -0,0 +1,179 @@
+"""Tests of exporting attribute bundles and verifying them without a node."""
+
+import base64
+import hashlib
+
+import pytest
+import rlp
+
+from benchmarks.bench_bundle import BLOCK_TIME
+from benchmarks.bench_bundle import CONTRACT_ADDRESS
+from benchmarks.bench_bundle import StateClient
+from benchmarks.bench_bundle import synthetic_storage
+from etherpki import bundle
+from etherpki.abicodec import contract_abi
+from etherpki.abicodec import function_selector
+from etherpki.datahash import compute_datahash
+from etherpki.ethapi import get_etherpki_abi
+
+ATTRIBUTE_ID = 12
+
+PAYLOAD = b'certificate of alice' * 100
+CID = 'b' + base64.b32encode(b'\x01\x55\x12\x20' + hashlib.sha256(PAYLOAD).digest()).decode('ascii').lower().rstrip('=')
+
+ATTRIBUTE = {
+    'owner': '0x' + 'ab' * 20,
+    'attributeType': 'document',
+    'hasProof': False,
+    'identifier': b'alice'.ljust(32, b'\x00'),
+    'data': 'ipfs-block://' + CID,
+    'dataHash': compute_datahash(PAYLOAD),
+}
+
+# (signatureID, signer, expiry, revocationID or None)
+SIGNATURES = [
+    (100, '0x' + '01' * 20, BLOCK_TIME + 86400, None),
+    (107, '0x' + '02' * 20, BLOCK_TIME + 86400, 50),
+    (114, '0x' + '03' * 20, BLOCK_TIME - 86400, None),
+    (121, '0x' + '04' * 20, BLOCK_TIME + 86400 * 365, None),
+]
+
+
+def make_client(attribute=ATTRIBUTE, signatures=SIGNATURES):
+    return StateClient(CONTRACT_ADDRESS, synthetic_storage(ATTRIBUTE_ID, attribute, signatures, 500), 50)
+
+
+def export(client, attributeID=ATTRIBUTE_ID, payload=PAYLOAD):
+    return bundle.export_bundle(attributeID, address=CONTRACT_ADDRESS, client=client, get={CID: payload}.__getitem__)
+
+
+@pytest.fixture(scope='module')
+def client():
+    return make_client()
+
+
+@pytest.fixture(scope='module')
+def data(client):
+    return export(client)
+
+
+def verify(data, client, **kwargs):
+    kwargs.setdefault('address', CONTRACT_ADDRESS)
+    kwargs.setdefault('block_hash', client.block['hash'])
+    kwargs.setdefault('at', BLOCK_TIME + 60)
+    return bundle.verify_bundle(data, **kwargs)
+
+
+def test_valid_bundle(client, data):
+    result = verify(data, client)
+    assert result['verdict'] == 'valid'
+    assert (result['contract_valid'], result['block_valid'], result['fresh']) == (True, True, None)
+    assert result['block'] == {'number': 1000, 'hash': client.block['hash'], 'timestamp': BLOCK_TIME}
+    assert result['age'] == 60
+
+    attribute = result['attribute']
+    assert attribute['attributeID'] == ATTRIBUTE_ID
+    assert attribute['owner'] == ATTRIBUTE['owner'][2:]
+    assert attribute['attributeType'] == 'document'
+    assert attribute['data'] == PAYLOAD.decode('ascii')
+    assert attribute['data_valid'] is True
+
+    status = attribute['signatures_status']
+    assert status['status'] == {'valid': 2, 'invalid': 2}
+    signatures = dict((signature['signatureID'], signature) for signature in status['signatures'])
+    assert sorted(signatures) == [100, 107, 114, 121]
+    assert [signatures[signatureID]['valid'] for signatureID in (100, 107, 114, 121)] == [True, False, False, True]
+    assert signatures[107]['revocation'][0]['revocationID'] == 50
+    assert signatures[114]['expired'] and not signatures[114]['revocation']
+
+
+def test_unanchored_bundle(client, data):
+    assert verify(data, client, block_hash=None)['verdict'] == 'unanchored'
+    assert verify(data, client, address='')['verdict'] == 'unanchored'
+
+
+def test_anchor_checks(client, data):
+    other = '0x' + 'ee' * 32
+    assert verify(data, client, block_hash=other)['verdict'] == 'invalid'
+    assert verify(data, client, address='0x' + '43' * 20)['verdict'] == 'invalid'
+
+    assert verify(data, client, max_age=3600)['fresh'] is True
+    result = verify(data, client, max_age=3600, at=BLOCK_TIME + 7200)
+    assert (result['fresh'], result['verdict']) == (False, 'invalid')
+
+
+def test_bundle_of_another_state_is_not_anchored(client):
+    # the same attribute without the revocation proves a different state root, so a block hash
+    # vouching for the real state rejects it
+    unrevoked = [(signatureID, signer, expiry, None) for (signatureID, signer, expiry, _) in SIGNATURES]
+    forged_client = make_client(signatures=unrevoked)
+    forged = export(forged_client)
+
+    assert verify(forged, forged_client)['verdict'] == 'valid'
+    assert verify(forged, client)['verdict'] == 'invalid'
+
+
+def test_tampered_payload(client, data):
+    decoded = bundle.decode_bundle(data)
+    tampered = bundle.encode_bundle(decoded['address'], ATTRIBUTE_ID, decoded['header'], decoded['nodes'],
+        PAYLOAD + b'!')
+    result = verify(tampered, client)
+    assert result['verdict'] == 'invalid'
+    assert 'data_error' in result['attribute'] or result['attribute']['data_valid'] is False
+
+
+def test_tampered_header(client, data):
+    decoded = bundle.decode_bundle(data)
+    header = rlp.decode(decoded['header'])
+    header[11] = (BLOCK_TIME + 3600).to_bytes(4, 'big')
+    tampered = bundle.encode_bundle(decoded['address'], ATTRIBUTE_ID, rlp.encode(header), decoded['nodes'],
+        decoded['payload'])
+    assert verify(tampered, client)['verdict'] == 'invalid'
+
+
+def test_missing_or_altered_nodes(client, data):
+    decoded = bundle.decode_bundle(data)
+    nodes = decoded['nodes']
+
+    for index in range(0, len(nodes), max(1, len(nodes) // 10)):
+        missing = bundle.encode_bundle(decoded['address'], ATTRIBUTE_ID, decoded['header'],
+            nodes[:index] + nodes[index + 1:], decoded['payload'])
+        with pytest.raises(ValueError):
+            verify(missing, client)
+
+        altered = list(nodes)
+        altered[index] = altered[index][:-1] + bytes([altered[index][-1] ^ 1])
+        altered = bundle.encode_bundle(decoded['address'], ATTRIBUTE_ID, decoded['header'], altered,
+            decoded['payload'])
+        with pytest.raises(ValueError):
+            verify(altered, client)
+
+
+def test_corrupt_bundle(client, data):
+    for corrupt in (b'', b'not a bundle', data[:len(bundle.MAGIC) + 10], bundle.MAGIC + rlp.encode([b'x'])):
+        with pytest.raises(ValueError):
+            verify(corrupt, client)
+
+
+def test_missing_attribute(client):
+    assert export(client, attributeID=ATTRIBUTE_ID + 1) is None
+
+    # a bundle cannot claim an attribute the state proves does not exist
+    data = export(client)
+    decoded = bundle.decode_bundle(data)
+    claimed = bundle.encode_bundle(decoded['address'], ATTRIBUTE_ID + 1, decoded['header'], decoded['nodes'],
+        decoded['payload'])
+    with pytest.raises(ValueError):
+        verify(claimed, client)
+
+
+def test_export_requires_storage_layout():
+    class OldContractClient(StateClient):
+        def get_code(self, address, block='latest'):
+            old = [entry for entry in contract_abi(get_etherpki_abi())
+                if entry.get('type') == 'function' and entry['name'] not in bundle.LAYOUT_FUNCTIONS]
+            return '0x' + b''.join(b'\x63' + function_selector(entry) for entry in old).hex()
+
+    old_client = OldContractClient(CONTRACT_ADDRESS, synthetic_storage(ATTRIBUTE_ID, ATTRIBUTE, SIGNATURES, 10))
+    with pytest.raises(ValueError):
+        export(old_client)
@@ -0,0 +1,115 @@
+"""Tests of the query daemon and its client, against the fake node."""
+
+import os
+import threading
+
+import pytest
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki import daemon
+from etherpki import ethapi
+from etherpki.daemon import DaemonClient
+from etherpki.daemon import DaemonError
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.events import Events
+
+
+@pytest.fixture(scope='module')
+def node():
+    with FakeNode(SyntheticChain(1000, logs_per_block=10)) as node:
+        yield node
+
+
+@pytest.fixture(scope='module')
+def running(node, tmp_path_factory):
+    """Starts a daemon for the fake node, returning the path of its socket and the Daemon."""
+    cachedir = str(tmp_path_factory.mktemp('cache'))
+    path = os.path.join(cachedir, 'daemon.sock')
+
+    patch = pytest.MonkeyPatch()
+    patch.setenv('XDG_CACHE_HOME', cachedir)
+    patch.setattr(ethapi.ethclient, 'transport', RPCTransport(node.url))
+
+    started = []
+    ready = threading.Event()
+
+    def on_ready(warm):
+        started.append(warm)
+        ready.set()
+
+    # the server thread runs until the test process exits; the interval keeps the daemon from
+    # polling the node after its first sync
+    thread = threading.Thread(target=daemon.serve, args=(path,),
+        kwargs={'address': CONTRACT_ADDRESS, 'interval': 3600, 'ready': on_ready})
+    thread.daemon = True
+    thread.start()
+    assert ready.wait(30)
+
+    yield (path, started[0])
+
+    started[0].stop()
+    patch.undo()
+
+
+@pytest.fixture(scope='module')
+def events(node):
+    return Events(address=CONTRACT_ADDRESS, index=False, client=EthClient(RPCTransport(node.url)), state=False)
+
+
+def test_ping(running, node):
+    (path, warm) = running
+    assert DaemonClient(path).ping() == node.chain.head == warm.index.get_cursor()
+
+
+def test_answers_match_direct_queries(running, events):
+    client = DaemonClient(running[0])
+
+    for attributeID in (0, 7, 10 ** 6):
+        assert client.retrieve_attribute(attributeID) == events.retrieve_attribute(attributeID)
+    assert isinstance(client.retrieve_attribute(7)['identifier'], bytes)
+
+    statuses = client.get_signatures_status_many([0, 7, 10 ** 6])
+    assert statuses == events.get_signatures_status_many([0, 7, 10 ** 6])
+
+    for kwargs in ({'limit': 5}, {'offset': 10, 'limit': 3}, {'identifier': 'user42@example.com'},
+            {'attributetype': 'email', 'limit': 2}):
+        assert client.search_attributes(**kwargs) == list(events.search_attributes(**kwargs))
+
+
+def test_errors(running):
+    client = DaemonClient(running[0])
+    with pytest.raises(DaemonError):
+        client._get('/unknown')
+    with pytest.raises(DaemonError) as error:
+        client._get('/attribute', id='seven')
+    assert 'Invalid query' in str(error.value)
+
+    with pytest.raises(DaemonError):
+        DaemonClient(running[0] + '.missing').ping()
+
+
+def test_second_daemon_is_refused(running):
+    with pytest.raises(DaemonError):
+        daemon.serve(running[0], address=CONTRACT_ADDRESS)
+
+
+def test_connect(running, monkeypatch):
+    monkeypatch.setattr(daemon, 'settings', {'enabled': True, 'socket': running[0]})
+    assert daemon.connect().ping() is not None
+
+    daemon.configure(enabled=False)
+    assert daemon.connect() is None
+
+    monkeypatch.setattr(daemon, 'settings', {'enabled': True, 'socket': running[0] + '.missing'})
+    assert daemon.connect() is None
+
+    with pytest.raises(TypeError):
+        daemon.configure(port=1)
+
+
+def test_response_encoding():
+    value = {'identifier': b'alice\x00', 'nested': [{'data': b''}], 'text': 'plain'}
+    assert daemon.decode_response(daemon.encode_response(value)) == value
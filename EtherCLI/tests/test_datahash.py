@@ -0,0 +1,189 @@
+"""Tests of hashing attribute data in chunks and of the verified cache of IPFS block checks."""
+
+import hashlib
+import io
+import mmap
+
+import pytest
+
+from etherpki import datahash
+from etherpki.datahash import VERIFIED_CACHE_THRESHOLD
+from etherpki.datahash import VerifiedCache
+from etherpki.datahash import check_datahash
+from etherpki.datahash import compute_datahash
+from etherpki.datahash import format_datahash
+from etherpki.datahash import hash_data
+from etherpki.datahash import iter_datahashes
+from etherpki.datahash import parse_datahash
+from tests.test_ipfsapi import cid_v0
+from tests.test_ipfsapi import cid_v1
+
+KECCAK_ABC = '4e03657aea45a94fc7d47ba826c8d667c0d1e6e33a64a036ec44f58fa12d6c45'
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    """Records the data hash_data is called with."""
+    hashed = []
+
+    def counting_hash_data(data, algorithm=datahash.DEFAULT_ALGORITHM, chunk_size=datahash.CHUNK_SIZE):
+        hashed.append(len(data))
+        return hash_data(data, algorithm, chunk_size)
+    monkeypatch.setattr(datahash, 'hash_data', counting_hash_data)
+    return hashed
+
+
+def test_known_digests():
+    assert hash_data(b'abc').hex() == KECCAK_ABC
+    assert hash_data(b'').hex() == 'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
+    assert hash_data(b'abc', 'sha256') == hashlib.sha256(b'abc').digest()
+    with pytest.raises(ValueError):
+        hash_data(b'abc', 'md5')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1000, datahash.CHUNK_SIZE])
+@pytest.mark.parametrize('algorithm', ['keccak256', 'sha256'])
+def test_every_form_of_data_hashes_alike(tmpdir, chunk_size, algorithm):
+    text = 'héllo wörld ☃ ' * 50
+    data = text.encode('utf-8')
+    expected = hash_data(data, algorithm, chunk_size=len(data))
+
+    path = str(tmpdir.join('data'))
+    with open(path, 'wb') as datafile:
+        datafile.write(data)
+
+    assert hash_data(text, algorithm, chunk_size) == expected
+    assert hash_data(bytearray(data), algorithm, chunk_size) == expected
+    assert hash_data(memoryview(data), algorithm, chunk_size) == expected
+    assert hash_data(io.BytesIO(data), algorithm, chunk_size) == expected
+    with open(path, 'rb') as datafile:
+        assert hash_data(datafile, algorithm, chunk_size) == expected
+        with mmap.mmap(datafile.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert hash_data(mapped, algorithm, chunk_size) == expected
+
+
+def test_format_and_parse():
+    assert format_datahash('keccak256', bytes.fromhex(KECCAK_ABC)) == 'keccak256:' + KECCAK_ABC
+    assert parse_datahash('keccak256:' + KECCAK_ABC) == ('keccak256', bytes.fromhex(KECCAK_ABC))
+    for invalid in ('', None, 'md5:00', 'keccak256:zz', 'keccak256:abc', KECCAK_ABC):
+        assert parse_datahash(invalid) is None
+
+
+def test_compute_datahash():
+    assert compute_datahash('') == ''
+    assert compute_datahash('abc') == compute_datahash(b'abc') == 'keccak256:' + KECCAK_ABC
+    assert compute_datahash('abc', 'sha256') == 'sha256:' + hashlib.sha256(b'abc').hexdigest()
+
+    # the block of an ipfs-block:// URI is hashed rather than the URI
+    requested = []
+
+    def get(cid):
+        requested.append(cid)
+        return b'abc'
+    assert compute_datahash('ipfs-block://' + cid_v0(b'abc'), get=get) == 'keccak256:' + KECCAK_ABC
+    assert requested == [cid_v0(b'abc')]
+
+
+def test_check_datahash():
+    valid = 'keccak256:' + KECCAK_ABC
+    assert check_datahash(valid, 'abc') is True
+    assert check_datahash(valid, b'abd') is False
+    assert check_datahash('', 'abc') is None
+    assert check_datahash('md5:' + KECCAK_ABC, 'abc') is None
+
+
+def test_large_blocks_are_checked_once(hashes):
+    cache = VerifiedCache(':memory:')
+    block = b'x' * VERIFIED_CACHE_THRESHOLD
+    (valid, invalid) = (compute_datahash(block), compute_datahash(b'y'))
+    del hashes[:]
+
+    for cid in (cid_v0(block), cid_v1(block)):
+        assert check_datahash(valid, block, cid, cache) is True
+        assert check_datahash(valid, block, cid, cache) is True
+        assert check_datahash(invalid, block, cid, cache) is False
+        assert check_datahash(invalid, block, cid, cache) is False
+    assert len(hashes) == 4
+    assert cache.get(cid_v0(block), valid) is True and cache.get(cid_v0(block), invalid) is False
+
+
+def test_other_checks_always_hash(hashes):
+    cache = VerifiedCache(':memory:')
+    (small, large) = (b'x' * (VERIFIED_CACHE_THRESHOLD - 1), b'x' * VERIFIED_CACHE_THRESHOLD)
+
+    checks = [
+        # too small to be worth a lookup
+        (small, cid_v0(small), cache),
+        # not looked up without a cache or a CID
+        (large, cid_v0(large), False),
+        (large, None, cache),
+        # a CID whose hash function is not checked when a block is fetched does not vouch for it
+        (large, cid_v1(large, code=0x1b), cache),
+        (large, 'not a cid', cache),
+    ]
+    for (content, cid, checkcache) in checks:
+        valid = compute_datahash(content)
+        del hashes[:]
+        assert check_datahash(valid, content, cid, checkcache) is True
+        assert check_datahash(valid, content, cid, checkcache) is True
+        assert len(hashes) == 2, cid
+
+
+def test_default_cache(hashes, monkeypatch):
+    cache = VerifiedCache(':memory:')
+    monkeypatch.setattr(datahash, 'get_verified_cache', lambda: cache)
+    block = b'z' * VERIFIED_CACHE_THRESHOLD
+    valid = compute_datahash(block)
+    del hashes[:]
+
+    assert check_datahash(valid, block, cid_v0(block)) is True
+    assert check_datahash(valid, block, cid_v0(block), cache=True) is True
+    assert len(hashes) == 1
+    assert cache.get(cid_v0(block), valid) is True
+
+
+def test_verified_cache_evicts_least_recently_used(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(datahash.time, 'time', lambda: clock[0])
+    cache = VerifiedCache(':memory:', max_entries=3)
+
+    for name in ('a', 'b', 'c'):
+        clock[0] += 1
+        cache.put(name, 'keccak256:00', True)
+    clock[0] += 1
+    assert cache.get('a', 'keccak256:00') is True
+
+    clock[0] += 1
+    cache.put('d', 'keccak256:00', False)
+    assert [cache.get(name, 'keccak256:00') for name in ('a', 'b', 'c', 'd')] == [True, None, True, False]
+    assert cache.get('a', 'sha256:00') is None
+
+
+def test_verified_cache_persists(tmpdir):
+    path = str(tmpdir.join('datahashes.db'))
+    VerifiedCache(path).put('cid', 'keccak256:00', True)
+    assert VerifiedCache(path).get('cid', 'keccak256:00') is True
+
+
+def test_iter_datahashes_keeps_order_and_reads_ahead_a_bounded_amount():
+    read = []
+
+    def get(cid):
+        # the blocks of the URIs are their CIDs
+        if cid == 'missing':
+            raise IOError('block not found')
+        return cid.encode('ascii')
+
+    def items():
+        for number in range(20):
+            read.append(number)
+            yield 'ipfs-block://bafy%d' % number if number != 7 else 'ipfs-block://missing'
+
+    results = iter_datahashes(items(), workers=2, get=get)
+    first = next(results)
+    assert len(read) <= 2 * 2 + 1
+
+    rest = list(results)
+    assert first == compute_datahash(b'bafy0')
+    assert isinstance(rest[6], IOError)
+    assert rest[:6] + rest[7:] == [compute_datahash(b'bafy%d' % number) for number in range(1, 20) if number != 7]
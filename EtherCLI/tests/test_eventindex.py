@@ -0,0 +1,166 @@
+"""Tests of the local event index, and of its rollback when the chain reorganizes."""
+
+import hashlib
+
+import pytest
+
+from etherpki.eventindex import EventIndex
+from etherpki.eventindex import MemoryIndex
+
+TOPIC = '0x' + 'aa' * 32
+
+
+class Chain(object):
+    """A chain of blocks whose hashes commit to all earlier blocks, with one log per block."""
+
+    def __init__(self, height):
+        self.blocks = []
+        self.extend(height, 'main')
+
+    def extend(self, count, fork):
+        for _ in range(count):
+            number = len(self.blocks)
+            parent = self.blocks[-1]['hash'] if self.blocks else '0x'
+            content = (parent + fork + str(number)).encode('ascii')
+            self.blocks.append({'number': number, 'hash': '0x' + hashlib.sha256(content).hexdigest(), 'fork': fork})
+
+    def reorg(self, depth, fork, length=None):
+        """Replace the newest depth blocks with length blocks of another fork."""
+        del self.blocks[len(self.blocks) - depth:]
+        self.extend(depth if length is None else length, fork)
+
+    def logs(self, from_block=0, to_block=None):
+        to_block = len(self.blocks) - 1 if to_block is None else to_block
+        return [{
+            'blockNumber': hex(block['number']),
+            'logIndex': '0x0',
+            'blockHash': block['hash'],
+            'transactionHash': '0x' + hashlib.sha256(block['hash'].encode('ascii')).hexdigest(),
+            'topics': [TOPIC, '0x%064x' % block['number']],
+            'data': '0x' + block['fork'].encode('ascii').hex(),
+        } for block in self.blocks[from_block:to_block + 1]]
+
+    # the client interface used by EventIndex
+
+    def get_block_number(self):
+        return len(self.blocks) - 1
+
+    def get_block_by_number(self, block_number, full_transactions=True):
+        if block_number < len(self.blocks):
+            return self.blocks[block_number]
+        return None
+
+
+class Fetcher(object):
+    """A LogFetcher fetching from a Chain in chunks."""
+
+    def __init__(self, chain, chunk=7):
+        self.client = chain
+        self.chunk = chunk
+
+    def iter_chunks(self, address, from_block, to_block):
+        for start in range(from_block, to_block + 1, self.chunk):
+            yield self.client.logs(start, min(to_block, start + self.chunk - 1))
+
+
+@pytest.fixture
+def index():
+    index = EventIndex(':memory:', confirmations=4)
+    yield index
+    index.close()
+
+
+def test_sync_and_query(index):
+    chain = Chain(30)
+    fetcher = Fetcher(chain)
+
+    assert index.get_cursor() is None
+    assert index.sync(fetcher, 'address') == 30
+    assert index.get_cursor() == 29
+    assert index.query([TOPIC]) == chain.logs()
+    assert index.query([TOPIC, '0x%064x' % 3]) == chain.logs(3, 3)
+    assert index.query([TOPIC, ['0x%064x' % 3, '0x%064x' % 5]]) == chain.logs(3, 3) + chain.logs(5, 5)
+    assert [len(page) for page in index.iter_query([TOPIC], page_size=8)] == [8, 8, 8, 6]
+
+    assert index.sync(fetcher, 'address') == 0
+    chain.extend(5, 'main')
+    assert index.sync(fetcher, 'address') == 5
+    assert index.query([None]) == chain.logs()
+    assert index.rollbacks == 0
+
+
+@pytest.mark.parametrize('depth', [1, 3, 4, 5, 9, 17, 28])
+def test_rollback_after_reorg(index, depth):
+    chain = Chain(10)
+    fetcher = Fetcher(chain)
+
+    # several syncs leave checkpoints at several heights
+    for _ in range(6):
+        index.sync(fetcher, 'address')
+        chain.extend(3, 'main')
+    index.sync(fetcher, 'address')
+    assert index.query([TOPIC]) == chain.logs()
+
+    first_reorged = len(chain.blocks) - depth
+    chain.reorg(depth, 'fork', length=depth + 2)
+    cursor = index.rollback(chain)
+
+    # what is left was not reorged, and nothing that was reorged is left
+    assert cursor < first_reorged
+    assert index.get_cursor() in (None, cursor)
+    assert index.query([TOPIC]) == chain.logs(0, cursor)
+    assert index.rollbacks == 1
+
+    index.sync(fetcher, 'address')
+    assert index.query([TOPIC]) == chain.logs()
+    assert index.get_cursor() == len(chain.blocks) - 1
+
+
+def test_rollback_to_shorter_chain(index):
+    chain = Chain(20)
+    fetcher = Fetcher(chain)
+    index.sync(fetcher, 'address')
+
+    # the checkpoint is now above the head of the chain
+    chain.reorg(6, 'fork', length=2)
+    index.sync(fetcher, 'address')
+    assert index.query([TOPIC]) == chain.logs()
+    assert index.get_cursor() == 15
+
+
+def test_removed_logs_are_not_stored(index):
+    chain = Chain(3)
+    logs = chain.logs()
+    logs[1]['removed'] = True
+    index.add_logs(logs)
+    assert index.query([TOPIC]) == chain.logs(0, 0) + chain.logs(2, 2)
+
+
+def test_memory_index_follows_rollback(index):
+    chain = Chain(20)
+    fetcher = Fetcher(chain)
+    memory = MemoryIndex(index)
+    memory.sync(fetcher, 'address')
+    assert memory.query([TOPIC]) == chain.logs()
+
+    chain.reorg(3, 'fork')
+    index.sync(fetcher, 'address')
+    assert memory.refresh() == 20
+    assert memory.query([TOPIC]) == chain.logs()
+    assert memory.query([TOPIC, '0x%064x' % 19]) == chain.logs(19, 19)
+
+
+def test_index_persists(tmpdir):
+    path = str(tmpdir.join('events.db'))
+    chain = Chain(12)
+
+    index = EventIndex(path, confirmations=4)
+    index.sync(Fetcher(chain), 'address')
+    index.close()
+
+    chain.reorg(2, 'fork')
+    index = EventIndex(path, confirmations=4)
+    assert index.get_cursor() == 11
+    index.sync(Fetcher(chain), 'address')
+    assert index.query([TOPIC]) == chain.logs()
+    index.close()
@@ -0,0 +1,100 @@
+"""Tests of the index of signatures ordered by expiry."""
+
+import random
+
+import pytest
+
+from etherpki.events import join_signatures_status
+from etherpki.expiry import ExpiryIndex
+
+NOW = 1700000000
+
+
+def random_registry(seed, attributes=40, signatures=300, revocations=40):
+    rng = random.Random(seed)
+    rawsignatures = [{
+        'signatureID': signatureID,
+        'attributeID': rng.randrange(attributes),
+        'signer': '%040x' % rng.randrange(20),
+        # many signatures share an expiry, to test the bounds of the searches
+        'expiry': NOW + rng.randrange(-100, 100) * 10,
+    } for signatureID in range(signatures)]
+    rawrevocations = [{'revocationID': revocationID, 'signratureID': signatureID}
+        for (revocationID, signatureID) in enumerate(rng.sample(range(signatures), revocations))]
+    return (rawsignatures, rawrevocations)
+
+
+def unrevoked(rawsignatures, rawrevocations):
+    revoked = set(rawrevocation['signratureID'] for rawrevocation in rawrevocations)
+    return [rawsignature for rawsignature in rawsignatures if rawsignature['signatureID'] not in revoked]
+
+
+def by_expiry(rawsignatures):
+    return sorted(rawsignatures, key=lambda rawsignature: (rawsignature['expiry'], rawsignature['signatureID']))
+
+
+TIMES = [NOW - 2000, NOW - 1000, NOW - 10, NOW - 5, NOW, NOW + 5, NOW + 990, NOW + 1000, NOW + 2000]
+
+
+@pytest.fixture(scope='module', params=range(3))
+def registry(request):
+    (rawsignatures, rawrevocations) = random_registry(request.param)
+    return (rawsignatures, rawrevocations, ExpiryIndex(rawsignatures, rawrevocations))
+
+
+def test_revoked_signatures_are_left_out(registry):
+    (rawsignatures, rawrevocations, expiry_index) = registry
+    assert len(expiry_index) == len(rawsignatures) - len(rawrevocations)
+    assert expiry_index.revoked == set(rawrevocation['signratureID'] for rawrevocation in rawrevocations)
+
+
+@pytest.mark.parametrize('until', TIMES)
+def test_signatures_valid_until(registry, until):
+    (rawsignatures, rawrevocations, expiry_index) = registry
+    for attributeID in list(range(40)) + [1000]:
+        expected = by_expiry(rawsignature for rawsignature in unrevoked(rawsignatures, rawrevocations)
+            if rawsignature['attributeID'] == attributeID and rawsignature['expiry'] >= until)
+        assert expiry_index.signatures_valid_until(attributeID, until) == expected
+
+
+@pytest.mark.parametrize('until', TIMES)
+def test_count_and_attributes_valid_until(registry, until):
+    (rawsignatures, rawrevocations, expiry_index) = registry
+    counts = dict((attributeID, 0) for attributeID in range(41))
+    for rawsignature in unrevoked(rawsignatures, rawrevocations):
+        if rawsignature['expiry'] >= until:
+            counts[rawsignature['attributeID']] += 1
+
+    assert expiry_index.count_valid_until(range(41), until) == counts
+    assert sorted(expiry_index.attributes_valid_until(until)) == sorted(attributeID
+        for (attributeID, count) in counts.items() if count)
+
+
+def test_valid_until_now_matches_signatures_status(registry):
+    (rawsignatures, rawrevocations, expiry_index) = registry
+    statuses = join_signatures_status(range(40), rawsignatures, rawrevocations, now=NOW)
+    assert expiry_index.count_valid_until(range(40), NOW) == dict((attributeID, status['status']['valid'])
+        for (attributeID, status) in statuses.items())
+
+
+@pytest.mark.parametrize('start', TIMES)
+@pytest.mark.parametrize('length', [0, 5, 10, 500, float('inf')])
+def test_expiring(registry, start, length):
+    (rawsignatures, rawrevocations, expiry_index) = registry
+    end = start + length
+
+    expected = by_expiry(rawsignature for rawsignature in unrevoked(rawsignatures, rawrevocations)
+        if start <= rawsignature['expiry'] < end)
+    assert expiry_index.expiring(start, end) == expected
+    for attributeID in (0, 7, 1000):
+        assert expiry_index.expiring(start, end, attributeID) == [rawsignature for rawsignature in expected
+            if rawsignature['attributeID'] == attributeID]
+
+
+def test_empty_index():
+    expiry_index = ExpiryIndex([], [])
+    assert len(expiry_index) == 0
+    assert expiry_index.expiring(NOW, NOW + 10) == []
+    assert expiry_index.signatures_valid_until(0, NOW) == []
+    assert expiry_index.count_valid_until([0], NOW) == {0: 0}
+    assert expiry_index.attributes_valid_until(NOW) == []
@@ -0,0 +1,164 @@
+"""Tests of PGP proof verification with a shared keyring or a pool of processes, and of the proof cache."""
+
+import shutil
+import tempfile
+
+import pytest
+
+gnupg = pytest.importorskip('gnupg')
+
+from etherpki import gpgapi
+from etherpki.gpgapi import KeyringGPG
+from etherpki.gpgapi import ProofCache
+from etherpki.gpgapi import ProofVerificationPool
+from etherpki.gpgapi import process_proof
+from etherpki.gpgapi import verify_proof
+
+ADDRESS = '0x' + 'ab' * 20
+
+
+class Signer(object):
+    """A GPG home with keys to make proofs with."""
+
+    def __init__(self):
+        self.gnupghome = tempfile.mkdtemp()
+        try:
+            self.gpg = gnupg.GPG(gnupghome=self.gnupghome)
+        except OSError:
+            self.destroy()
+            pytest.skip('GnuPG is not installed')
+
+    def new_key(self, email):
+        key = self.gpg.gen_key(self.gpg.gen_key_input(key_type='EDDSA', key_curve='ed25519', name_email=email,
+            key_usage='sign', no_protection=True))
+        assert key.fingerprint
+        return key.fingerprint
+
+    def proof(self, fingerprint, address=ADDRESS, signed_by=None):
+        """Returns PGP attribute data with the key of fingerprint and a signature of address."""
+        public_key = self.gpg.export_keys(fingerprint, minimal=True)
+        signature = self.gpg.sign('Ethereum address: ' + address, keyid=signed_by or fingerprint)
+        return public_key + '\n' + str(signature)
+
+    def destroy(self):
+        shutil.rmtree(self.gnupghome, ignore_errors=True)
+
+
+@pytest.fixture(scope='module')
+def signer():
+    signer = Signer()
+    yield signer
+    signer.destroy()
+
+
+@pytest.fixture(scope='module')
+def alice(signer):
+    return signer.new_key('alice@example.com')
+
+
+@pytest.fixture(scope='module')
+def mallory(signer):
+    return signer.new_key('mallory@example.com')
+
+
+@pytest.fixture
+def keyring():
+    gnupghome = tempfile.mkdtemp()
+    yield KeyringGPG(gnupghome + '/keyring')
+    shutil.rmtree(gnupghome, ignore_errors=True)
+
+
+def test_verify_proof(signer, alice, keyring):
+    data = signer.proof(alice)
+    assert verify_proof(data, keyring.gpgclient) == (ADDRESS, alice)
+    # the keyring is reused for the next proofs
+    assert verify_proof(data, keyring.gpgclient) == (ADDRESS, alice)
+
+
+def test_signature_of_another_key_in_the_keyring_is_rejected(signer, alice, mallory, keyring):
+    # mallory's key is now in the keyring, so her signature verifies, but not as made by alice's key
+    assert verify_proof(signer.proof(mallory), keyring.gpgclient) == (ADDRESS, mallory)
+    assert verify_proof(signer.proof(alice, signed_by=mallory), keyring.gpgclient) is False
+
+
+def test_tampered_proof_is_rejected(signer, alice, keyring):
+    data = signer.proof(alice).replace(ADDRESS, '0x' + 'cd' * 20)
+    assert verify_proof(data, keyring.gpgclient) is False
+
+
+def test_proof_cache_round_trip():
+    cache = ProofCache(':memory:')
+    assert cache.get('data') is None
+
+    cache.put('data', ('0x01', 'FINGERPRINT'))
+    cache.put(b'invalid', False)
+    assert cache.get(b'data') == ('0x01', 'FINGERPRINT')
+    assert cache.get('invalid') is False
+
+
+def test_proof_cache_evicts_least_recently_used(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(gpgapi.time, 'time', lambda: clock[0])
+    cache = ProofCache(':memory:', max_entries=3)
+
+    for name in ('a', 'b', 'c'):
+        clock[0] += 1
+        cache.put(name, False)
+    clock[0] += 1
+    assert cache.get('a') is False
+
+    clock[0] += 1
+    cache.put('d', False)
+    assert [cache.get(name) for name in ('a', 'b', 'c', 'd')] == [False, None, False, False]
+
+
+def test_proof_cache_persists(tmpdir):
+    path = str(tmpdir.join('proofs.db'))
+    ProofCache(path).put('data', ('0x01', 'FINGERPRINT'))
+    assert ProofCache(path).get('data') == ('0x01', 'FINGERPRINT')
+
+
+def test_process_proof_uses_the_cache(signer, alice, keyring, monkeypatch):
+    monkeypatch.setattr(gpgapi, '_keyring', keyring)
+    verifications = []
+
+    def counting_verify_proof(data, gpgclient):
+        verifications.append(data)
+        return verify_proof(data, gpgclient)
+    monkeypatch.setattr(gpgapi, 'verify_proof', counting_verify_proof)
+
+    cache = ProofCache(':memory:')
+    data = signer.proof(alice)
+    assert process_proof(data, cache) == (ADDRESS, alice)
+    assert process_proof(data.encode('utf-8'), cache) == (ADDRESS, alice)
+    assert len(verifications) == 1
+
+    tampered = data.replace(ADDRESS, '0x' + 'cd' * 20)
+    assert process_proof(tampered, cache) is False
+    assert process_proof(tampered, cache) is False
+    assert len(verifications) == 2
+
+    assert process_proof(data, cache=False) == (ADDRESS, alice)
+    assert len(verifications) == 3
+
+
+def test_verification_pool(signer, alice, mallory):
+    tasks = [
+        ('alice', signer.proof(alice)),
+        ('mallory', signer.proof(mallory).encode('utf-8')),
+        ('forged', signer.proof(alice, signed_by=mallory)),
+        ('tampered', signer.proof(alice).replace(ADDRESS, '0x' + 'cd' * 20)),
+        ('undecodable', b'\xff\xfe'),
+    ] + [('alice%d' % number, signer.proof(alice, address='0x%040x' % number)) for number in range(8)]
+
+    with ProofVerificationPool(processes=2) as pool:
+        results = dict((key, (result, error)) for (key, result, error, seconds) in pool.verify(tasks, chunksize=2))
+
+    assert sorted(results) == sorted(key for (key, _) in tasks)
+    assert results['alice'] == ((ADDRESS, alice), None)
+    assert results['mallory'] == ((ADDRESS, mallory), None)
+    assert results['forged'] == (False, None)
+    assert results['tampered'] == (False, None)
+    assert results['undecodable'][0] is None and results['undecodable'][1]
+    for number in range(8):
+        assert results['alice%d' % number] == (('0x%040x' % number, alice), None)
@@ -0,0 +1,164 @@
+"""Tests of IPFS CID checks, the local block cache and prefetching."""
+
+import base64
+import hashlib
+import mmap
+import os
+
+import pytest
+
+from etherpki import ipfsapi
+from etherpki.ipfsapi import BASE58_ALPHABET
+from etherpki.ipfsapi import BlockCache
+from etherpki.ipfsapi import cid_multihash
+from etherpki.ipfsapi import get_block
+from etherpki.ipfsapi import prefetch
+from etherpki.ipfsapi import release_block
+from etherpki.ipfsapi import verify_block
+
+
+def b58encode(data):
+    value = int.from_bytes(data, 'big')
+    text = ''
+    while value:
+        (value, digit) = divmod(value, 58)
+        text = BASE58_ALPHABET[digit] + text
+    return '1' * (len(data) - len(data.lstrip(b'\x00'))) + text
+
+
+def cid_v0(data):
+    return b58encode(b'\x12\x20' + hashlib.sha256(data).digest())
+
+
+def cid_v1(data, code=0x12, digest=None):
+    digest = hashlib.sha256(data).digest() if digest is None else digest
+    raw = b'\x01\x55' + bytes([code, len(digest)]) + digest
+    return 'b' + base64.b32encode(raw).decode('ascii').lower().rstrip('=')
+
+
+class Daemon(object):
+    """Stands in for the IPFS daemon, serving blocks from a dictionary."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.requests = []
+
+    @property
+    def block(self):
+        return self
+
+    def get(self, cid):
+        self.requests.append(cid)
+        if cid not in self.blocks:
+            raise IOError("block not found: " + cid)
+        return self.blocks[cid]
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return BlockCache(str(tmpdir.join('blocks')), max_bytes=1000, mmap_threshold=100)
+
+
+def test_cid_multihash():
+    data = b'hello world'
+    assert cid_multihash(cid_v0(data)) == (0x12, hashlib.sha256(data).digest())
+    assert cid_multihash(cid_v1(data)) == (0x12, hashlib.sha256(data).digest())
+    with pytest.raises(ValueError):
+        cid_multihash('zb2rhe5P4gXftAwvA4eXQ5HJwsER2owDyS9sKaQRRVQPn93bA')
+
+
+def test_verify_block():
+    data = b'hello world'
+    assert verify_block(cid_v0(data), data)
+    assert verify_block(cid_v1(data), data)
+    assert verify_block(cid_v1(data), bytearray(data))
+    assert verify_block(cid_v0(data), data + b'!') is False
+    assert verify_block(cid_v1(b'', code=0x00, digest=data), data)
+    assert verify_block(cid_v1(data, code=0x1b), data) is None
+    assert verify_block('not a cid', data) is False
+
+
+def test_cache_round_trip(cache):
+    small = b'small block'
+    large = b'large block ' * 20
+    assert cache.put(cid_v0(small), small)
+    assert cache.put(cid_v1(large), large)
+
+    assert cache.get(cid_v0(small)) == small
+    block = cache.get(cid_v1(large))
+    assert isinstance(block, mmap.mmap) and block[:] == large
+    release_block(block)
+    assert block.closed
+    release_block(small)
+
+    assert cache.get(cid_v0(b'missing')) is None
+
+
+def test_cache_rejects_blocks_not_matching_their_cid(cache):
+    assert not cache.put(cid_v0(b'one'), b'two')
+    assert cache.get(cid_v0(b'one')) is None
+    with pytest.raises(ValueError):
+        cache.get('../escape')
+
+
+@pytest.mark.parametrize('size', [10, 500])
+def test_corrupted_entry_is_removed(cache, size):
+    data = b'x' * size
+    cid = cid_v0(data)
+    cache.put(cid, data)
+    with open(os.path.join(cache.directory, cid), 'r+b') as blockfile:
+        blockfile.write(b'y')
+
+    assert cache.get(cid) is None
+    assert not os.path.exists(os.path.join(cache.directory, cid))
+
+
+def test_least_recently_used_blocks_are_evicted(cache):
+    blocks = [bytes([number]) * 300 for number in range(3)]
+    cids = [cid_v0(block) for block in blocks]
+    for (number, (cid, block)) in enumerate(zip(cids, blocks)):
+        cache.put(cid, block)
+        os.utime(os.path.join(cache.directory, cid), (1000 + number, 1000 + number))
+
+    # reading the oldest block makes it the most recently used
+    release_block(cache.get(cids[0]))
+
+    fourth = b'\x03' * 300
+    cache.put(cid_v0(fourth), fourth)
+    assert sorted(os.listdir(cache.directory)) == sorted([cids[0], cids[2], cid_v0(fourth)])
+
+    # a single block larger than the cache is not kept
+    huge = b'\x04' * 2000
+    cache.put(cid_v0(huge), huge)
+    assert cache.get(cid_v0(huge)) is None
+
+
+def test_get_block_uses_the_cache(cache, monkeypatch):
+    data = b'block data'
+    daemon = Daemon({cid_v0(data): data, cid_v0(b'other'): b'forged'})
+    monkeypatch.setattr(ipfsapi, '_ipfsclient', daemon)
+
+    assert get_block(cid_v0(data), cache) == data
+    assert get_block(cid_v0(data), cache) == data
+    assert daemon.requests == [cid_v0(data)]
+
+    assert get_block(cid_v0(data), cache=False) == data
+    assert len(daemon.requests) == 2
+
+    with pytest.raises(ValueError):
+        get_block(cid_v0(b'other'), cache)
+    assert cache.get(cid_v0(b'other')) is None
+
+
+def test_prefetch(cache, monkeypatch):
+    blocks = dict((cid_v0(data), data) for data in (b'a', b'b', b'c' * 200))
+    monkeypatch.setattr(ipfsapi, '_ipfsclient', Daemon(blocks))
+
+    missing = cid_v0(b'missing')
+    results = prefetch(list(blocks) + list(blocks) + [missing], workers=3, cache=cache)
+    assert sorted(results) == sorted(list(blocks) + [missing])
+    assert isinstance(results.pop(missing), IOError)
+    assert dict((cid, bytes(block)) for (cid, block) in results.items()) == blocks
+    for block in results.values():
+        release_block(block)
+    assert prefetch([], cache=cache) == {}
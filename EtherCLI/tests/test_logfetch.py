@@ -0,0 +1,127 @@
+"""Tests of fetching logs in concurrent block-range chunks of adaptive size."""
+
+import pytest
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki import logfetch
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import RPCTransport
+from etherpki.ethapi import encode_topic
+from etherpki.logfetch import LogFetcher
+from etherpki.logfetch import is_range_rpc_error
+from etherpki.logfetch import log_sort_key
+
+
+@pytest.fixture(scope='module')
+def chain():
+    # 500 blocks of 10 logs
+    return SyntheticChain(5000, logs_per_block=10)
+
+
+@pytest.fixture(scope='module')
+def node(chain):
+    with FakeNode(chain, max_results=200) as node:
+        yield node
+
+
+@pytest.fixture(scope='module')
+def client(node):
+    return EthClient(RPCTransport(node.url))
+
+
+def all_logs(chain, topics=None, from_block=0, to_block=None):
+    return chain.get_logs(from_block, chain.head if to_block is None else to_block, topics)
+
+
+def test_chunks_shrink_until_the_node_accepts_them(chain, node, client):
+    fetcher = LogFetcher(client, workers=4, min_chunk=1, initial_chunk=1000, target_results=150)
+    calls = node.calls.get('eth_getLogs', 0)
+
+    chunks = list(fetcher.iter_chunks(CONTRACT_ADDRESS))
+    assert [log for chunk in chunks for log in chunk] == all_logs(chain)
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert fetcher.chunk_size <= 20
+
+    # the failed queries are part of the calls, but the chunk size does not stay too large for long
+    assert node.calls['eth_getLogs'] - calls < 3 * len(chunks)
+
+
+def test_chunks_grow_when_results_are_sparse(chain, client):
+    # revocations are 1 in 50 logs, 2 in 10 blocks
+    topics = [encode_topic(chain.factory.revocation_topic)]
+    fetcher = LogFetcher(client, workers=2, min_chunk=1, initial_chunk=4, max_chunk=64, target_results=100)
+
+    assert fetcher.get_logs(CONTRACT_ADDRESS, topics) == all_logs(chain, topics)
+    assert fetcher.chunk_size == 64
+
+
+@pytest.mark.parametrize('workers', [1, 3, 8])
+def test_ranges_and_order(chain, client, workers):
+    fetcher = LogFetcher(client, workers=workers, min_chunk=1, initial_chunk=7, target_results=60)
+    logs = fetcher.get_logs(CONTRACT_ADDRESS, from_block=hex(37), to_block=123)
+    assert logs == all_logs(chain, from_block=37, to_block=123)
+    assert logs == sorted(logs, key=log_sort_key)
+
+    assert fetcher.get_logs(CONTRACT_ADDRESS, from_block=600, to_block='latest') == []
+    assert fetcher.get_logs('0x' + '43' * 20) == []
+
+
+def test_closing_the_generator_stops_fetching(node, client):
+    fetcher = LogFetcher(client, workers=2, min_chunk=1, initial_chunk=5, max_chunk=5)
+    calls = node.calls.get('eth_getLogs', 0)
+
+    # block 0 has no logs
+    chunks = fetcher.iter_chunks(CONTRACT_ADDRESS)
+    assert len(next(chunks)) == 40
+    chunks.close()
+    assert node.calls['eth_getLogs'] - calls <= 4
+
+
+class FailingClient(object):
+    """A client whose log queries fail with an error."""
+
+    def __init__(self, error):
+        self.error = error
+        self.queries = []
+
+    def get_block_number(self):
+        return 1000
+
+    def get_logs(self, from_block, to_block, address, topics):
+        self.queries.append((int(from_block, 16), int(to_block, 16)))
+        raise self.error
+
+
+def test_other_errors_are_raised():
+    client = FailingClient(RPCError({'code': -32602, 'message': 'invalid params'}))
+    with pytest.raises(RPCError):
+        LogFetcher(client, workers=1, initial_chunk=100).get_logs(CONTRACT_ADDRESS)
+    assert len(client.queries) == 1
+
+
+def test_range_errors_stop_at_min_chunk():
+    client = FailingClient(RPCError({'code': -32005, 'message': 'query returned more than 10000 results'}))
+    with pytest.raises(RPCError):
+        LogFetcher(client, workers=1, min_chunk=16, initial_chunk=64).get_logs(CONTRACT_ADDRESS, to_block=63)
+    # 0-63 is split in halves, which are split once more into ranges of 16 blocks, which are not
+    assert client.queries[:3] == [(0, 63), (0, 31), (32, 63)]
+    assert set(client.queries[3:]) <= set([(0, 15), (16, 31), (32, 47), (48, 63)])
+
+
+def test_is_range_rpc_error():
+    assert is_range_rpc_error(RPCError({'code': -32005, 'message': 'Query returned more than 10000 results'}))
+    assert is_range_rpc_error(RPCError({'code': -32000, 'message': 'block range too large'}))
+    assert not is_range_rpc_error(RPCError({'code': -32602, 'message': 'invalid argument'}))
+    assert not is_range_rpc_error(ValueError('more than'))
+
+
+def test_configure(monkeypatch):
+    monkeypatch.setattr(logfetch, 'settings', dict(logfetch.settings))
+    logfetch.configure(workers=9, initial_chunk=None)
+    assert LogFetcher(None).workers == 9
+    assert LogFetcher(None).chunk_size == logfetch.settings['initial_chunk']
+    with pytest.raises(TypeError):
+        logfetch.configure(chunk=10)
@@ -0,0 +1,87 @@
+"""Tests of the RFC 6962 Merkle trees of committed attributes."""
+
+import hashlib
+
+import pytest
+
+from etherpki.merkle import EMPTY_ROOT
+from etherpki.merkle import MerkleBuilder
+from etherpki.merkle import MerkleTree
+from etherpki.merkle import leaf_hash
+from etherpki.merkle import node_hash
+from etherpki.merkle import verify_proof
+
+
+def reference_root(leaves):
+    """The Merkle Tree Hash of RFC 6962 section 2.1, splitting at the largest power of two below n."""
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+    if len(leaves) == 1:
+        return hashlib.sha256(b'\x00' + leaves[0]).digest()
+    split = 1
+    while split * 2 < len(leaves):
+        split *= 2
+    return hashlib.sha256(b'\x01' + reference_root(leaves[:split]) + reference_root(leaves[split:])).digest()
+
+
+def build(count):
+    leaves = [b'leaf %d' % index for index in range(count)]
+    builder = MerkleBuilder()
+    for leaf in leaves:
+        builder.add(leaf)
+    return (leaves, builder)
+
+
+def test_empty_root():
+    assert MerkleBuilder().root() == EMPTY_ROOT == reference_root([])
+    assert MerkleTree(b'').root() == EMPTY_ROOT
+
+
+@pytest.mark.parametrize('count', range(1, 70))
+def test_root_matches_rfc6962(count):
+    (leaves, builder) = build(count)
+    assert builder.root() == reference_root(leaves)
+    assert builder.tree().root() == reference_root(leaves)
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8, 13, 32, 33, 69])
+def test_every_proof_verifies(count):
+    (leaves, builder) = build(count)
+    tree = builder.tree()
+    root = tree.root()
+    for index in range(count):
+        assert verify_proof(leaf_hash(leaves[index]), index, count, tree.proof(index), root)
+
+
+def test_proof_out_of_range():
+    tree = build(5)[1].tree()
+    with pytest.raises(IndexError):
+        tree.proof(5)
+
+
+@pytest.mark.parametrize('count', [2, 3, 7, 16, 21])
+def test_forged_proofs_are_rejected(count):
+    (leaves, builder) = build(count)
+    tree = builder.tree()
+    root = tree.root()
+
+    for index in range(count):
+        digest = leaf_hash(leaves[index])
+        path = tree.proof(index)
+
+        # a different leaf, or the leaf data itself instead of its hash
+        assert not verify_proof(leaf_hash(b'forged'), index, count, path, root)
+        assert not verify_proof(leaves[index], index, count, path, root)
+        # the proof of another position or of a tree of another size
+        assert not verify_proof(digest, (index + 1) % count, count, path, root)
+        assert not verify_proof(digest, index, count * 2, path, root)
+        assert not verify_proof(digest, index, index, path, root)
+        # a proof with a sibling missing, added, changed or out of order
+        assert not verify_proof(digest, index, count, path[:-1], root)
+        assert not verify_proof(digest, index, count, path + [root], root)
+        assert not verify_proof(digest, index, count, [node_hash(path[0], path[0])] + path[1:], root)
+        if len(path) > 1 and path[0] != path[1]:
+            assert not verify_proof(digest, index, count, [path[1], path[0]] + path[2:], root)
+        # another tree
+        assert not verify_proof(digest, index, count, path, reference_root(leaves[:-1]))
+
@@ -0,0 +1,187 @@
+"""Tests of the metrics counters, stage histograms, sinks and the --profile breakdown."""
+
+import os
+import stat
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki import metrics
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.metrics import BUCKETS
+from etherpki.metrics import Histogram
+
+
+@pytest.fixture
+def recording(monkeypatch):
+    monkeypatch.setitem(metrics.settings, 'enabled', True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_nothing_is_recorded_while_disabled():
+    metrics.reset()
+    with metrics.stage('disabled'):
+        pass
+    metrics.count('disabled')
+    metrics.observe('disabled', 1.0)
+    assert metrics.snapshot() == {'counters': {}, 'stages': {}}
+
+
+def test_configure(monkeypatch):
+    monkeypatch.setitem(metrics.settings, 'enabled', False)
+    metrics.configure(enabled=None)
+    assert metrics.settings['enabled'] is False
+    with pytest.raises(TypeError):
+        metrics.configure(interval=1)
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None
+
+    for seconds in (0.0001, 0.0005, 0.003, 0.003, 0.2, 100.0):
+        histogram.observe(seconds)
+    assert histogram.buckets[0] == 2
+    assert histogram.buckets[BUCKETS.index(0.005)] == 2
+    assert histogram.buckets[BUCKETS.index(0.25)] == 1
+    assert histogram.buckets[-1] == 1
+    assert (histogram.count, histogram.max) == (6, 100.0)
+    assert histogram.sum == pytest.approx(100.2066)
+
+    # quantiles fall within the bucket of the value of their rank, and never above the maximum
+    assert 0.0025 <= histogram.quantile(0.5) <= 0.005
+    assert histogram.quantile(1.0) == 100.0
+
+    copy = histogram.copy()
+    histogram.observe(1.0)
+    assert (copy.count, sum(copy.buckets)) == (6, 6)
+
+
+def test_stages_and_counters(recording):
+    with metrics.stage('outer'):
+        with metrics.stage('inner'):
+            pass
+        with metrics.stage('inner'):
+            pass
+    metrics.count('calls')
+    metrics.count('calls', 4)
+    metrics.observe('observed', 0.5)
+
+    current = metrics.snapshot()
+    assert current['counters'] == {'calls': 5}
+    assert dict((name, histogram.count) for (name, histogram) in current['stages'].items()) \
+        == {'outer': 1, 'inner': 2, 'observed': 1}
+    assert current['stages']['outer'].sum >= current['stages']['inner'].sum
+
+    # a stage is recorded even when it raises
+    with pytest.raises(ValueError):
+        with metrics.stage('failing'):
+            raise ValueError()
+    assert metrics.snapshot()['stages']['failing'].count == 1
+
+
+def test_flush_sends_snapshots_to_sinks(recording):
+    received = []
+    sink = received.append
+    metrics.flush()
+
+    metrics.add_sink(sink)
+    try:
+        metrics.count('calls')
+        metrics.flush()
+        metrics.count('calls')
+        metrics.flush()
+    finally:
+        metrics.remove_sink(sink)
+    metrics.flush()
+
+    assert [current['counters'] for current in received] == [{'calls': 1}, {'calls': 2}]
+
+
+def test_prometheus_text(recording):
+    for seconds in (0.0002, 0.02, 0.02, 50.0):
+        metrics.observe('rpc.eth_getLogs', seconds)
+    metrics.count('rpc.bytes_sent', 1234)
+
+    lines = metrics.prometheus_text(metrics.snapshot(), prefix='test').splitlines()
+    assert '# TYPE test_stage_seconds histogram' in lines
+    assert 'test_stage_seconds_bucket{stage="rpc.eth_getLogs",le="0.0005"} 1' in lines
+    assert 'test_stage_seconds_bucket{stage="rpc.eth_getLogs",le="0.025"} 3' in lines
+    assert 'test_stage_seconds_bucket{stage="rpc.eth_getLogs",le="30.0"} 3' in lines
+    assert 'test_stage_seconds_bucket{stage="rpc.eth_getLogs",le="+Inf"} 4' in lines
+    assert 'test_stage_seconds_count{stage="rpc.eth_getLogs"} 4' in lines
+    assert '# TYPE test_rpc_bytes_sent_total counter' in lines
+    assert 'test_rpc_bytes_sent_total 1234' in lines
+
+    metrics.observe('quote"d', 0.1)
+    assert 'stage="quote\\"d"' in metrics.prometheus_text(metrics.snapshot())
+
+
+def test_prometheus_textfile(recording, tmpdir):
+    path = str(tmpdir.join('etherpki.prom'))
+    sink = metrics.PrometheusTextfile(path)
+
+    metrics.count('calls')
+    sink(metrics.snapshot())
+    metrics.count('calls')
+    sink(metrics.snapshot())
+
+    with open(path) as promfile:
+        assert 'etherpki_calls_total 2\n' in promfile.read()
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    assert os.listdir(str(tmpdir)) == ['etherpki.prom']
+
+
+def test_report(recording):
+    metrics.observe('fast', 0.001)
+    metrics.observe('slow', 0.5)
+    metrics.observe('slow', 1.5)
+    metrics.count('rpc.bytes_received', 3 * 1024 * 1024)
+    metrics.count('decode.logs', 40)
+
+    lines = metrics.report(wall_time=4.0).splitlines()
+    assert lines[0].split() == ['stage', 'count', 'total', 'p50', 'p95', 'max', 'share']
+    # stages are sorted by the total time spent in them
+    assert lines[1].split() == ['slow', '2', '2.00s', '500.00ms', '1.45s', '1.50s', '50.0%']
+    assert lines[2].split()[:3] == ['fast', '1', '1.00ms']
+    assert lines[3].split() == ['wall', 'time', '4.00s']
+    assert lines[5].split() == ['decode.logs', '40']
+    assert lines[6].split() == ['rpc.bytes_received', '3.0MiB']
+
+    assert 'wall time' not in metrics.report()
+
+
+def test_rpc_calls_are_recorded(recording):
+    with FakeNode(SyntheticChain(100)) as node:
+        client = EthClient(RPCTransport(node.url))
+        client.get_block_number()
+        client.get_block_number()
+        client.batch([('eth_blockNumber', []), ('eth_accounts', [])])
+
+    current = metrics.snapshot()
+    assert current['stages']['rpc.eth_blockNumber'].count == 2
+    assert current['stages']['rpc.batch'].count == 1
+    assert current['counters']['rpc.calls.eth_blockNumber'] == 3
+    assert current['counters']['rpc.calls.eth_accounts'] == 1
+    assert current['counters']['rpc.bytes_sent'] > 0 and current['counters']['rpc.bytes_received'] > 0
+
+
+def test_profile_prints_a_breakdown(tmpdir):
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmpdir.join('cache')), XDG_CONFIG_HOME=str(tmpdir.join('config')))
+    with FakeNode(SyntheticChain(500, logs_per_block=10)) as node:
+        process = subprocess.run([sys.executable, '-c', 'from etherpki.console import main; main()',
+            '--rpc-url', node.url, '--no-daemon', '--profile', 'search', '--limit', '1'], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+
+    assert process.returncode == 0, process.stderr
+    stages = dict((line.split()[0], line.split()) for line in process.stderr.splitlines() if line.strip())
+    assert stages['stage'][-1] == 'share'
+    for name in ('index.sync', 'rpc.eth_getLogs', 'decode', 'output'):
+        assert name in stages
+    assert 'wall' in stages and int(stages['decode.logs'][1]) > 0
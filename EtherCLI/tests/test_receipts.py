@@ -0,0 +1,161 @@
+"""Tests of tracking the receipts of many transactions in batched polls."""
+
+import pytest
+
+from benchmarks.synthetic import LogFactory
+from etherpki import receipts
+from etherpki.ethapi import RPCError
+from etherpki.receipts import ReceiptTracker
+
+ADDRESS = '0x' + '42' * 20
+OWNER = 'ab' * 20
+
+
+class Node(object):
+    """An Ethereum client whose receipts and head block are set by the test."""
+
+    def __init__(self, head=100):
+        self.head = head
+        self.receipts = {}
+        self.batches = []
+
+    def mine(self, txhash, logs=(), block=None, status='0x1'):
+        self.receipts[txhash] = {
+            'transactionHash': txhash,
+            'blockNumber': hex(self.head if block is None else block),
+            'gasUsed': hex(21000),
+            'status': status,
+            'logs': list(logs),
+        }
+
+    def batch(self, calls):
+        self.batches.append(calls)
+        assert calls[0] == ('eth_blockNumber', [])
+        return [hex(self.head)] + [self.receipts.get(params[0]) for (_, params) in calls[1:]]
+
+
+@pytest.fixture
+def factory():
+    return LogFactory(address=ADDRESS)
+
+
+def test_poll_batches_every_receipt(factory):
+    node = Node()
+    tracker = ReceiptTracker(node, address=ADDRESS)
+    for number in range(5):
+        tracker.track('0x%02x' % number)
+    tracker.track('0x00')
+    assert len(tracker) == 5
+
+    assert tracker.poll() == []
+    node.mine('0x01', [factory.attribute(100, 0, 7, OWNER, b'alice')])
+    node.mine('0x03', [], status='0x0')
+
+    results = tracker.poll()
+    assert len(node.batches) == 2 and all(len(calls) == 6 for calls in node.batches)
+    assert [result['transaction'] for result in results] == ['0x01', '0x03']
+    assert results[0]['status'] == 'mined' and results[0]['attributeID'] == 7
+    assert results[0]['attributeIDs'] == [7]
+    assert (results[0]['block'], results[0]['confirmations'], results[0]['gas_used']) == (100, 1, 21000)
+    assert results[1]['status'] == 'failed' and results[1]['events'] == []
+    assert len(tracker) == 3 and len(node.batches[-1]) == 6
+
+
+def test_every_id_of_a_batch_transaction_is_reported(factory):
+    node = Node()
+    tracker = ReceiptTracker(node, address=ADDRESS)
+    node.mine('0x01', [factory.signature(100, index, 30 + index, OWNER, 7, 2000000000) for index in range(3)]
+        + [factory.revocation(100, 3, 4, 12)])
+
+    result = tracker.wait('0x01', timeout=5)
+    assert (result['signatureID'], result['signatureIDs']) == (30, [30, 31, 32])
+    assert (result['revocationID'], result['revocationIDs']) == (4, [4])
+    assert 'attributeID' not in result
+    assert [event['_event_type'] for event in result['events']] == ['AttributeSigned'] * 3 + ['SignatureRevoked']
+
+
+def test_events_of_other_contracts_are_ignored(factory):
+    other = LogFactory(address='0x' + '43' * 20)
+    node = Node()
+    node.mine('0x01', [other.attribute(100, 0, 1, OWNER, b'mallory'), factory.attribute(100, 1, 2, OWNER, b'alice')])
+
+    tracker = ReceiptTracker(node, address=ADDRESS.upper().replace('0X', '0x'))
+    tracker.track('0x01')
+    (result,) = tracker.poll()
+    assert result['attributeIDs'] == [2]
+
+    tracker = ReceiptTracker(node)
+    tracker.track('0x01')
+    assert tracker.poll()[0]['attributeIDs'] == [1, 2]
+
+
+def test_confirmations():
+    node = Node()
+    tracker = ReceiptTracker(node, confirmations=3)
+    tracker.track('0x01')
+    node.mine('0x01')
+
+    assert tracker.poll() == []
+    node.head += 1
+    assert tracker.poll() == []
+
+    # a reorganisation moves the transaction to a later block
+    node.mine('0x01', block=101)
+    node.head += 1
+    assert tracker.poll() == []
+    node.head += 1
+    (result,) = tracker.poll()
+    assert (result['block'], result['confirmations']) == (101, 3)
+
+
+def test_errors():
+    node = Node()
+    tracker = ReceiptTracker(node)
+    tracker.track('0x01')
+    tracker.track('0x02')
+    node.mine('0x02')
+
+    # a failed receipt lookup is retried on the next poll
+    batch = node.batch
+    node.batch = lambda calls: [batch(calls)[0], RPCError({'message': 'unavailable'}), node.receipts['0x02']]
+    assert [result['transaction'] for result in tracker.poll()] == ['0x02']
+    assert len(tracker) == 1
+
+    node.batch = lambda calls: [RPCError({'message': 'unavailable'})] + [None] * (len(calls) - 1)
+    with pytest.raises(RPCError):
+        tracker.poll()
+
+
+def test_poll_interval_follows_blocks(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(receipts.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(receipts.time, 'sleep', lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+
+    node = Node()
+    tracker = ReceiptTracker(node, min_interval=0.5, max_interval=30)
+    tracker.track('0x01')
+
+    # blocks every 12 seconds
+    for _ in range(5):
+        tracker.poll()
+        clock[0] += 12
+        node.head += 1
+    tracker.poll()
+    assert tracker.next_interval() == pytest.approx(12, abs=0.01)
+
+    # halfway through a block, the next poll is when the block is due
+    clock[0] += 6
+    assert tracker.next_interval() == pytest.approx(6, abs=0.01)
+
+    # once the block is overdue, polls back off from min_interval
+    clock[0] += 20
+    intervals = []
+    for _ in range(4):
+        tracker.poll()
+        intervals.append(tracker.next_interval())
+    assert intervals == sorted(intervals) and intervals[0] >= 0.5 and intervals[-1] <= 30
+
+    node.mine('0x01')
+    with pytest.raises(TimeoutError):
+        ReceiptTracker(node, min_interval=0.5).wait('0x02', timeout=10)
+    assert tracker.wait('0x01', timeout=10)['transaction'] == '0x01'
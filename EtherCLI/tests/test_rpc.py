@@ -0,0 +1,154 @@
+"""Tests of the pooled JSON-RPC transport, its batches and the coalescing of concurrent calls."""
+
+import threading
+
+import pytest
+import requests
+
+from benchmarks.fakenode import ACCOUNT
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCError
+from etherpki.ethapi import RPCTransport
+
+
+class FlakyNode(FakeNode):
+    """A FakeNode that answers the first failures requests with HTTP 503, and counts connections."""
+
+    def __init__(self, chain, **kwargs):
+        FakeNode.__init__(self, chain, **kwargs)
+        self.failures = 0
+        self.requests = 0
+        self.connections = 0
+
+    def _handler_class(self):
+        node = self
+        handler = FakeNode._handler_class(self)
+
+        class FlakyHandler(handler):
+            def setup(self):
+                handler.setup(self)
+                with node._lock:
+                    node.connections += 1
+
+            def do_POST(self):
+                with node._lock:
+                    node.requests += 1
+                    fail = node.failures > 0
+                    node.failures -= fail
+                if not fail:
+                    return handler.do_POST(self)
+                self.rfile.read(int(self.headers['Content-Length']))
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        return FlakyHandler
+
+
+class CountingTransport(RPCTransport):
+    """An RPCTransport keeping the number of calls of each payload it posts."""
+
+    def __init__(self, *args, **kwargs):
+        RPCTransport.__init__(self, *args, **kwargs)
+        self.posts = []
+
+    def _post(self, payload, retry):
+        self.posts.append(len(payload) if isinstance(payload, list) else 1)
+        return RPCTransport._post(self, payload, retry)
+
+
+@pytest.fixture(scope='module')
+def node():
+    with FlakyNode(SyntheticChain(200), latency=0.02) as node:
+        yield node
+
+
+def test_request(node):
+    client = EthClient(CountingTransport(node.url))
+    assert client.get_block_number() == node.chain.head
+    assert client.get_accounts() == [ACCOUNT]
+    with pytest.raises(RPCError) as error:
+        client.request('eth_unknown', [])
+    assert error.value.code == -32601
+
+
+def test_batch(node):
+    transport = CountingTransport(node.url)
+    results = transport.batch([
+        ('eth_blockNumber', []),
+        ('eth_unknown', []),
+        ('eth_getBlockByNumber', [hex(5), False]),
+    ])
+    assert transport.posts == [3]
+    assert results[0] == hex(node.chain.head)
+    assert isinstance(results[1], RPCError) and results[1].code == -32601
+    assert results[2]['number'] == hex(5)
+    assert transport.batch([]) == []
+
+
+def test_sequential_calls_are_not_delayed_or_batched(node):
+    transport = CountingTransport(node.url, coalesce_window=10)
+    for number in range(5):
+        assert transport.request('eth_getBlockByNumber', [hex(number), False])['number'] == hex(number)
+    assert transport.posts == [1] * 5
+
+
+def test_concurrent_calls_are_coalesced(node):
+    transport = CountingTransport(node.url, coalesce_window=0.01)
+    results = [None] * 40
+    barrier = threading.Barrier(len(results))
+
+    def call(number):
+        barrier.wait()
+        results[number] = transport.request('eth_getTransactionCount', ['0x%040x' % number, 'latest'])
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [hex(0)] * len(results)
+    assert sum(transport.posts) == len(results)
+    assert len(transport.posts) < len(results) // 2
+    assert max(transport.posts) > 1
+
+
+def test_retries_transient_errors(node):
+    transport = CountingTransport(node.url, retries=3, backoff=0.001)
+    node.failures = 2
+    requests_before = node.requests
+    assert transport.request('eth_blockNumber') == hex(node.chain.head)
+    assert node.requests - requests_before == 3
+
+    node.failures = 10
+    with pytest.raises(requests.HTTPError):
+        transport.request('eth_blockNumber')
+    node.failures = 0
+
+
+def test_transactions_are_not_retried(node):
+    transport = CountingTransport(node.url, retries=3, backoff=0.001)
+    node.failures = 1
+    requests_before = node.requests
+    sent = node.calls.get('eth_sendTransaction', 0)
+    with pytest.raises(requests.HTTPError):
+        transport.request('eth_sendTransaction', [{'from': ACCOUNT, 'data': '0x'}])
+    assert node.requests - requests_before == 1
+    assert node.calls.get('eth_sendTransaction', 0) == sent
+
+    # nor is a batch containing one, whose calls all fail
+    node.failures = 1
+    results = transport.batch([('eth_blockNumber', []), ('eth_sendTransaction', [{'from': ACCOUNT, 'data': '0x'}])])
+    assert [type(result) for result in results] == [requests.HTTPError] * 2
+    assert node.requests - requests_before == 2
+
+
+def test_connections_are_reused(node):
+    transport = RPCTransport(node.url, pool_size=2)
+    connections = node.connections
+    for _ in range(5):
+        transport.request('eth_blockNumber')
+    assert node.connections - connections == 1
@@ -0,0 +1,92 @@
+"""Tests of resolving the signatures status of many attributes with batched queries."""
+
+import pytest
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki import events as events_module
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.events import Events
+from etherpki.events import build_signatures_status
+from etherpki.events import join_signatures_status
+
+NOW = 1700000000
+
+
+class CountingEvents(Events):
+    """Events counting the filter queries it makes."""
+
+    def __init__(self, *args, **kwargs):
+        Events.__init__(self, *args, **kwargs)
+        self.queries = []
+
+    def filter_signatures(self, signatureID=None, signer=None, attributeID=None):
+        self.queries.append('signatures')
+        return Events.filter_signatures(self, signatureID, signer, attributeID)
+
+    def filter_revocations(self, revocationID=None, signatureID=None):
+        self.queries.append('revocations')
+        return Events.filter_revocations(self, revocationID, signatureID)
+
+
+@pytest.fixture(scope='module')
+def node():
+    with FakeNode(SyntheticChain(3000, logs_per_block=10)) as node:
+        yield node
+
+
+@pytest.fixture
+def events(node):
+    return CountingEvents(address=CONTRACT_ADDRESS, index=False, client=EthClient(RPCTransport(node.url)), state=False)
+
+
+def signature(signatureID, attributeID, expiry):
+    return {'signatureID': signatureID, 'signer': '%040x' % signatureID, 'attributeID': attributeID, 'expiry': expiry}
+
+
+def test_join_signatures_status():
+    rawsignatures = [signature(1, 10, NOW + 1), signature(2, 10, NOW - 1), signature(3, 11, NOW),
+        signature(4, 11, NOW + 1), signature(5, 99, NOW + 1)]
+    rawrevocations = [{'revocationID': 0, 'signratureID': 4}, {'revocationID': 1, 'signratureID': 4}]
+
+    statuses = join_signatures_status([10, 11, 12], rawsignatures, rawrevocations, now=NOW)
+    assert sorted(statuses) == [10, 11, 12, 99]
+    assert statuses[10]['status'] == {'valid': 1, 'invalid': 1}
+    assert [entry['expired'] for entry in statuses[10]['signatures']] == [False, True]
+    assert statuses[11]['status'] == {'valid': 1, 'invalid': 1}
+    assert statuses[11]['signatures'][1]['revocation'] == rawrevocations
+    assert statuses[12] == {'status': {'valid': 0, 'invalid': 0}, 'signatures': []}
+
+
+def test_many_matches_one_by_one(events):
+    attribute_ids = list(range(0, 600, 7)) + [10 ** 6]
+    statuses = events.get_signatures_status_many(attribute_ids)
+    assert sorted(statuses) == sorted(attribute_ids)
+
+    revoked = 0
+    for attributeID in attribute_ids:
+        rawsignatures = events.filter_signatures(attributeID=attributeID)
+        revocations = dict((rawsignature['signatureID'],
+            events.filter_revocations(signatureID=rawsignature['signatureID'])) for rawsignature in rawsignatures)
+        expected = build_signatures_status(rawsignatures, revocations)
+        assert statuses[attributeID] == expected
+        revoked += sum(1 for entry in expected['signatures'] if entry['revocation'])
+    assert revoked > 0
+
+
+def test_queries_do_not_grow_with_signatures(events, monkeypatch):
+    # 600 attributes with about 4 signatures each, in chunks of 100 IDs
+    monkeypatch.setattr(events_module, 'MAX_TOPICS_PER_QUERY', 100)
+    statuses = events.get_signatures_status_many(range(600))
+
+    signatures = sum(len(status['signatures']) for status in statuses.values())
+    assert signatures > 2000
+    assert events.queries.count('signatures') == 6
+    assert events.queries.count('revocations') == (signatures + 99) // 100
+
+
+def test_single_attribute(events):
+    assert events.get_attribute_signatures_status(7) == events.get_signatures_status_many([7])[7]
+    assert events.get_attribute_signatures_status(10 ** 6) == {'status': {'valid': 0, 'invalid': 0}, 'signatures': []}
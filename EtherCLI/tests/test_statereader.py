@@ -0,0 +1,152 @@
+"""Tests of reading the registry from contract state, compared with reading it from logs."""
+
+import pytest
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki import statereader
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.events import Events
+from etherpki.statereader import StateReader
+
+
+@pytest.fixture(scope='module')
+def chain():
+    # the last group of logs is not complete
+    return SyntheticChain(1003, logs_per_block=10)
+
+
+@pytest.fixture(scope='module')
+def node(chain):
+    with FakeNode(chain) as node:
+        yield node
+
+
+class RecordingClient(EthClient):
+    """An EthClient that records the size and block tags of every batch."""
+
+    def __init__(self, url):
+        EthClient.__init__(self, RPCTransport(url))
+        self.batches = []
+
+    def batch(self, calls):
+        self.batches.append((len(calls), set(params[1] for (_, params) in calls)))
+        return EthClient.batch(self, calls)
+
+
+@pytest.fixture(scope='module')
+def logs(node):
+    return Events(address=CONTRACT_ADDRESS, index=False, client=EthClient(RPCTransport(node.url)), state=False)
+
+
+def state_events(node, page_size=7, batch_size=3):
+    client = RecordingClient(node.url)
+    reader = StateReader(CONTRACT_ADDRESS, client, page_size=page_size, batch_size=batch_size)
+    return Events(address=CONTRACT_ADDRESS, client=client, state=reader)
+
+
+@pytest.mark.parametrize(('page_size', 'batch_size'), [(1, 50), (3, 2), (7, 3), (100, 50)])
+def test_queries_match_the_logs(node, chain, logs, page_size, batch_size):
+    state = state_events(node, page_size, batch_size)
+    (owner, signer) = ('0x' + chain.owner(3), '0x' + chain.owner(5))
+
+    queries = [
+        ('filter_attributes', {}),
+        ('filter_attributes', {'attributeID': [0, 7, 200, 10 ** 6]}),
+        ('filter_attributes', {'owner': owner}),
+        ('filter_attributes', {'attributeID': [3, 4], 'owner': owner}),
+        ('filter_signatures', {}),
+        ('filter_signatures', {'signatureID': [0, 5, 779, 10 ** 6]}),
+        ('filter_signatures', {'attributeID': [0, 10, 200]}),
+        ('filter_signatures', {'signer': signer}),
+        ('filter_revocations', {}),
+        ('filter_revocations', {'revocationID': 3}),
+        ('filter_revocations', {'signatureID': [chain.signature_id(0, 1), chain.signature_id(10, 1), 2]}),
+        ('filter_commitments', {}),
+    ]
+    for (name, kwargs) in queries:
+        assert getattr(state, name)(**kwargs) == getattr(logs, name)(**kwargs), (name, kwargs)
+
+    ids = list(range(0, chain.attributes, 9))
+    assert state.get_signatures_status_many(ids) == logs.get_signatures_status_many(ids)
+    assert state.retrieve_attribute(10) == logs.retrieve_attribute(10)
+
+    # every call of a query is at the block the reader was pinned to, in batches of batch_size
+    assert all(size <= batch_size and tags == set([hex(chain.head)]) for (size, tags) in state.client.batches)
+
+
+def test_iter_chunks_of_every_event(node, logs):
+    reader = state_events(node).state
+    records = [record for chunk in reader.iter_chunks(None, []) for record in chunk]
+
+    # one event type after the other, rather than in the order of the logs
+    expected = [event for chunk in logs.iter_all_events() for event in chunk]
+    order = ['AttributeAdded', 'AttributeSigned', 'SignatureRevoked', 'AttributesCommitted']
+    expected.sort(key=lambda event: order.index(event['_event_type']))
+    assert records == expected
+
+    with pytest.raises(ValueError):
+        list(reader.iter_chunks(None, [1]))
+    with pytest.raises(ValueError):
+        list(reader.iter_chunks('Unknown', []))
+
+
+def test_counts_and_pages(node, chain):
+    reader = StateReader(CONTRACT_ADDRESS, RecordingClient(node.url), page_size=7, batch_size=3)
+    assert reader.get_counts() == (chain.attributes, chain.signatures, chain.revocations)
+
+    pages = list(reader.iter_attributes())
+    assert [len(page) for page in pages] == [7] * (chain.attributes // 7) + [chain.attributes % 7]
+    assert [attribute['attributeID'] for page in pages for attribute in page] == list(range(chain.attributes))
+    assert list(reader.iter_commitments()) == []
+
+    assert [signature['signatureID'] for signature in reader.get_signatures([5, 3, 3, 10 ** 6])] == [3, 5]
+    assert reader.get_attributes([]) == []
+
+
+def test_signatures_of_attributes_with_several_pages(node, chain, logs):
+    reader = StateReader(CONTRACT_ADDRESS, RecordingClient(node.url), page_size=1, batch_size=100)
+    ids = [0, 1, 10, 199]
+    assert reader.get_signatures_of_attributes(ids) == logs.filter_signatures(attributeID=ids)
+
+    # one round of first pages, and one of the further pages of every attribute, of which the
+    # attributes of groups 0 and 10 have a revoked signature less
+    assert [size for (size, _) in reader.client.batches] == [4, 2 + 3 + 2 + 3]
+
+
+def test_pinning(node, chain):
+    reader = StateReader(CONTRACT_ADDRESS, RecordingClient(node.url), block=5)
+    reader.get_counts()
+    assert reader.client.batches[-1][1] == set(['0x5'])
+
+    assert reader.pin() == chain.head
+    reader.get_counts()
+    assert reader.client.batches[-1][1] == set([hex(chain.head)])
+
+    events = Events(address=CONTRACT_ADDRESS, client=reader.client, state=StateReader(CONTRACT_ADDRESS, reader.client,
+        block=5))
+    assert events.index is None and events.sync() == 0
+    assert events.state.block == chain.head
+
+
+def test_older_deployments_are_refused(chain):
+    node = FakeNode(chain)
+    node._functions = dict((selector, entry) for (selector, entry) in node._functions.items()
+        if entry['name'] not in ('getCounts', 'getAttributes'))
+    with node:
+        reader = StateReader(CONTRACT_ADDRESS, EthClient(RPCTransport(node.url)))
+        with pytest.raises(ValueError) as error:
+            list(reader.iter_chunks('AttributeAdded', []))
+        assert 'getCounts' in str(error.value)
+        assert 'eth_call' not in node.calls
+
+
+def test_configure(monkeypatch):
+    monkeypatch.setattr(statereader, 'settings', dict(statereader.settings))
+    statereader.configure(page_size=10, batch_size=None)
+    assert (statereader.settings['page_size'], statereader.settings['batch_size']) == (10, 50)
+    assert StateReader(CONTRACT_ADDRESS, client=object()).page_size == 10
+    with pytest.raises(TypeError):
+        statereader.configure(pages=1)
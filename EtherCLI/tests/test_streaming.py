@@ -0,0 +1,123 @@
+"""Tests of streaming filter and search results, against the fake node."""
+
+import pytest
+
+from benchmarks.fakenode import CONTRACT_ADDRESS
+from benchmarks.fakenode import FakeNode
+from benchmarks.fakenode import SyntheticChain
+from etherpki.ethapi import EthClient
+from etherpki.ethapi import RPCTransport
+from etherpki.eventindex import EventIndex
+from etherpki.events import Events
+from etherpki.logfetch import LogFetcher
+
+
+@pytest.fixture(scope='module')
+def chain():
+    # 200 blocks of 10 logs
+    return SyntheticChain(2000, logs_per_block=10)
+
+
+@pytest.fixture(scope='module')
+def node(chain):
+    with FakeNode(chain) as node:
+        yield node
+
+
+def make_events(node, index=False):
+    events = Events(address=CONTRACT_ADDRESS, index=index, client=EthClient(RPCTransport(node.url)), state=False)
+    # one small block range at a time, so that the number of queries shows how far fetching went
+    events.fetcher = LogFetcher(events.client, workers=1, min_chunk=10, max_chunk=10, initial_chunk=10)
+    return events
+
+
+@pytest.fixture
+def events(node):
+    return make_events(node)
+
+
+@pytest.fixture
+def indexed(node, tmpdir):
+    events = make_events(node, index=EventIndex(str(tmpdir.join('index.db'))))
+    events.sync()
+    return events
+
+
+class CountingEvents(Events):
+    """Events that record the attribute IDs of every status query."""
+
+    def __init__(self, *args, **kwargs):
+        Events.__init__(self, *args, **kwargs)
+        self.status_queries = []
+
+    def get_signatures_status_many(self, attribute_ids):
+        attribute_ids = list(attribute_ids)
+        self.status_queries.append(attribute_ids)
+        return Events.get_signatures_status_many(self, attribute_ids)
+
+
+@pytest.mark.parametrize('source', ['events', 'indexed'])
+def test_iter_matches_filter(request, source, chain):
+    events = request.getfixturevalue(source)
+    owner = '0x' + chain.owner(3)
+
+    assert list(events.iter_attributes()) == events.filter_attributes()
+    assert list(events.iter_attributes(owner=owner)) == events.filter_attributes(owner=owner)
+    assert list(events.iter_signatures(attributeID=[1, 2])) == events.filter_signatures(attributeID=[1, 2])
+    assert list(events.iter_revocations()) == events.filter_revocations()
+    assert len(events.filter_attributes()) == chain.attributes
+
+
+def test_closing_the_generator_stops_fetching(events, node):
+    calls = node.calls.get('eth_getLogs', 0)
+    attributes = events.iter_attributes()
+    first = next(attributes)
+    attributes.close()
+
+    assert first['attributeID'] == 0
+    # the chain is 20 chunks long
+    assert node.calls['eth_getLogs'] - calls <= 2
+
+
+@pytest.mark.parametrize(('offset', 'limit'), [(0, 3), (5, 4), (0, 0), (195, 10)])
+def test_search_attributes_is_sliced(events, chain, offset, limit):
+    expected = events.filter_attributes()[offset:offset + limit]
+    results = list(events.search_attributes(offset=offset, limit=limit))
+
+    assert [attribute for (attribute, _) in results] == expected
+    statuses = events.get_signatures_status_many([attribute['attributeID'] for attribute in expected])
+    assert [status for (_, status) in results] == [statuses[attribute['attributeID']] for attribute in expected]
+
+
+def test_search_attributes_with_a_limit_stops_reading_attributes(events, chain, monkeypatch):
+    read = []
+    iter_attributes = events.iter_attributes
+
+    def counting_iter_attributes(*args):
+        for attribute in iter_attributes(*args):
+            read.append(attribute['attributeID'])
+            yield attribute
+    monkeypatch.setattr(events, 'iter_attributes', counting_iter_attributes)
+
+    results = list(events.search_attributes(attributetype='email', limit=2))
+    assert [attribute['attributeType'] for (attribute, _) in results] == ['email'] * 2
+    assert read[-1] == results[-1][0]['attributeID'] < chain.attributes - 1
+
+
+def test_iter_signatures_status_resolves_in_batches(node):
+    events = CountingEvents(address=CONTRACT_ADDRESS, index=False, client=EthClient(RPCTransport(node.url)),
+        state=False)
+    attributes = events.filter_attributes()[:10]
+    expected = Events.get_signatures_status_many(events, range(10))
+
+    results = events.iter_signatures_status(iter(attributes), batch_size=4)
+    (attribute, status) = next(results)
+
+    # only the first batch has been resolved
+    assert (attribute, status) == (attributes[0], expected[0])
+    assert events.status_queries == [[0, 1, 2, 3]]
+
+    rest = list(results)
+    assert rest == [(attribute, expected[attribute['attributeID']]) for attribute in attributes[1:]]
+    assert events.status_queries == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert list(events.iter_signatures_status([])) == []
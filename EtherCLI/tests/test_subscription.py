@@ -0,0 +1,177 @@
+"""Tests that live subscriptions retract the events of reorganised blocks."""
+
+import hashlib
+import random
+
+import pytest
+
+from benchmarks.synthetic import LogFactory
+from etherpki.ethapi import RPCError
+from etherpki.subscription import Subscription
+
+ADDRESS = '0x' + '42' * 20
+
+
+class Chain(object):
+    """An Ethereum client over a chain of blocks with attribute logs, which the test reorganises.
+
+    When filters are supported, they report the logs of new blocks and, as removed logs, those they
+    reported from blocks that were reorganised away, like geth.
+    """
+
+    def __init__(self, height, filters=True):
+        self.factory = LogFactory(address=ADDRESS)
+        self.filters = filters
+        self.blocks = []
+        self.forks = 0
+        self.attributes = 0
+        self._filters = {}
+        self.extend(height)
+
+    def extend(self, count):
+        for _ in range(count):
+            number = len(self.blocks)
+            parent = self.blocks[-1]['hash'] if self.blocks else '0x'
+            blockhash = '0x' + hashlib.sha256((parent + str(self.forks) + str(number)).encode('ascii')).hexdigest()
+            logs = []
+            for index in range(number % 3):
+                log = self.factory.attribute(number, index, self.attributes, 'ab' * 20, b'user')
+                log['blockHash'] = blockhash
+                log['transactionHash'] = '0x' + hashlib.sha256((blockhash + str(index)).encode('ascii')).hexdigest()
+                logs.append(log)
+                self.attributes += 1
+            self.blocks.append({'number': number, 'hash': blockhash, 'logs': logs})
+
+    def reorg(self, depth, length):
+        self.forks += 1
+        del self.blocks[len(self.blocks) - depth:]
+        self.extend(length)
+
+    def canonical_logs(self, to_block=None):
+        blocks = self.blocks if to_block is None else self.blocks[:to_block + 1]
+        return [log for block in blocks for log in block['logs']]
+
+    def get_block_number(self):
+        return len(self.blocks) - 1
+
+    def batch(self, calls):
+        results = []
+        for (method, params) in calls:
+            assert method == 'eth_getBlockByNumber'
+            number = int(params[0], 16)
+            results.append({'hash': self.blocks[number]['hash']} if number < len(self.blocks) else None)
+        return results
+
+    def get_logs(self, from_block=None, to_block=None, address=None, topics=None):
+        (start, end) = (int(from_block, 16), int(to_block, 16))
+        return [dict(log) for log in self.canonical_logs(end) if int(log['blockNumber'], 16) >= start]
+
+    def new_filter(self, from_block=None, to_block=None, address=None, topics=None):
+        if not self.filters:
+            raise RPCError({'code': -32601, 'message': 'the method eth_newFilter does not exist'})
+        filter_id = hex(len(self._filters) + 1)
+        # the first block the filter reports, and the logs it has reported
+        self._filters[filter_id] = (len(self.blocks), {})
+        return filter_id
+
+    def get_filter_changes(self, filter_id):
+        (start, reported) = self._filters[filter_id]
+        current = dict((key(log), log) for log in self.canonical_logs() if int(log['blockNumber'], 16) >= start)
+        changes = [dict(log, removed=True) for (logkey, log) in reported.items() if logkey not in current]
+        changes += [dict(log) for (logkey, log) in current.items() if logkey not in reported]
+        self._filters[filter_id] = (start, current)
+        return changes
+
+    def uninstall_filter(self, filter_id):
+        self._filters.pop(filter_id, None)
+
+
+def key(log):
+    return (log['blockHash'], int(log['logIndex'], 16))
+
+
+class Consumer(object):
+    """Applies notifications to the set of events it believes are on the chain."""
+
+    def __init__(self):
+        self.events = {}
+
+    def apply(self, notifications):
+        for notification in notifications:
+            notificationkey = (notification['blockHash'], notification['logIndex'])
+            if notification['type'] == 'event':
+                assert notificationkey not in self.events
+                self.events[notificationkey] = notification['event']['attributeID']
+            else:
+                assert notification['type'] == 'retraction'
+                assert self.events.pop(notificationkey) == notification['event']['attributeID']
+
+    def check(self, chain, from_block=0):
+        expected = dict((key(log), int(log['topics'][1], 16)) for log in chain.canonical_logs()
+            if int(log['blockNumber'], 16) >= from_block)
+        assert self.events == expected
+
+
+@pytest.mark.parametrize('filters', [False, True])
+@pytest.mark.parametrize('seed', range(6))
+def test_reorganisations_are_retracted(filters, seed):
+    rng = random.Random(seed)
+    chain = Chain(10, filters=filters)
+    subscription = Subscription(client=chain, address=ADDRESS, from_block=3, depth=16)
+    consumer = Consumer()
+
+    for _ in range(40):
+        action = rng.random()
+        if action < 0.4:
+            chain.extend(rng.randrange(1, 4))
+        elif action < 0.6:
+            depth = rng.randrange(1, 10)
+            chain.reorg(depth, depth + rng.randrange(-1, 3))
+        consumer.apply(subscription.poll())
+        consumer.check(chain, from_block=3)
+
+
+def test_starts_at_the_next_block():
+    chain = Chain(10)
+    subscription = Subscription(client=chain, address=ADDRESS)
+    assert subscription.poll() == []
+
+    chain.extend(3)
+    notifications = subscription.poll()
+    # blocks 10, 11 and 12 have 1, 2 and 0 logs
+    assert [notification['block'] for notification in notifications] == [10, 11, 11]
+    assert [notification['type'] for notification in notifications] == ['event'] * 3
+    assert notifications[0]['event']['_event_type'] == 'AttributeAdded'
+
+
+def test_retractions_come_first_newest_first():
+    chain = Chain(10, filters=False)
+    subscription = Subscription(client=chain, address=ADDRESS, from_block=0)
+    subscription.poll()
+
+    # blocks 7 to 9 are replaced, of which 7 and 8 have logs
+    replaced = [log for log in chain.canonical_logs() if int(log['blockNumber'], 16) >= 7]
+    chain.reorg(3, 3)
+    added = [log for log in chain.canonical_logs() if int(log['blockNumber'], 16) >= 7]
+
+    notifications = subscription.poll()
+    assert [(notification['type'], notification['blockHash'], notification['logIndex'])
+        for notification in notifications] \
+        == [('retraction', log['blockHash'], int(log['logIndex'], 16)) for log in reversed(replaced)] \
+        + [('event', log['blockHash'], int(log['logIndex'], 16)) for log in added]
+
+
+def test_resumes_from_saved_cursor(tmpdir):
+    path = str(tmpdir.join('cursor.json'))
+    chain = Chain(10, filters=False)
+    consumer = Consumer()
+
+    subscription = Subscription(client=chain, address=ADDRESS, from_block=0, cursor_path=path)
+    consumer.apply(subscription.poll())
+    subscription.save_cursor()
+
+    # the chain reorganises while the subscription is not running
+    chain.reorg(4, 6)
+    resumed = Subscription(client=chain, address=ADDRESS, cursor_path=path)
+    consumer.apply(resumed.poll())
+    consumer.check(chain)
@@ -0,0 +1,143 @@
+"""Tests that incremental trust updates agree with evaluating the whole graph again."""
+
+import random
+
+import pytest
+
+from etherpki.trust import TrustEngine
+
+NOW = 1700000000
+
+
+def address(number):
+    return '%040x' % (number + 1)
+
+
+def random_events(rng, addresses=30, attributes=50, signatures_count=200, revocations=30):
+    """Returns a random list of events, each attribute added before its signatures."""
+    events = []
+    for attributeID in range(attributes):
+        events.append({
+            '_event_type': 'AttributeAdded',
+            'attributeID': attributeID,
+            'owner': address(rng.randrange(addresses)),
+            'attributeType': rng.choice(['email', 'pgp-key']),
+        })
+
+    signatures = []
+    for signatureID in range(signatures_count):
+        # a quarter of the signatures expire at some point between NOW - 50 and NOW + 100
+        expiry = NOW + rng.randrange(-50, 100) if rng.random() < 0.25 else NOW + 10 ** 6
+        signatures.append({
+            '_event_type': 'AttributeSigned',
+            'signatureID': signatureID,
+            'signer': address(rng.randrange(addresses)),
+            'attributeID': rng.randrange(attributes),
+            'expiry': expiry,
+        })
+    rng.shuffle(signatures)
+
+    # each revocation comes somewhere after the signature it revokes
+    for revocationID in range(revocations):
+        signatureID = rng.randrange(signatures_count)
+        after = [event.get('signatureID') for event in signatures].index(signatureID)
+        signatures.insert(rng.randrange(after + 1, len(signatures) + 1),
+            {'_event_type': 'SignatureRevoked', 'revocationID': revocationID, 'signratureID': signatureID})
+    return events + signatures
+
+
+def full(events, roots, now, **settings):
+    engine = TrustEngine(roots, now=now, **settings)
+    engine.apply(events, recompute=False)
+    engine.recompute_all()
+    return engine
+
+
+def depths(engine, addresses=30):
+    return dict((address(number), engine.depth(address(number))) for number in range(addresses))
+
+
+def verdicts(engine, attributes=50):
+    return [engine.attribute_verdict(attributeID) for attributeID in range(attributes)]
+
+
+SETTINGS = [
+    {'max_depth': 1, 'threshold': 1},
+    {'max_depth': 2, 'threshold': 1},
+    {'max_depth': 3, 'threshold': 2},
+    {'max_depth': 4, 'threshold': 3},
+    {'max_depth': 3, 'threshold': 1, 'attribute_types': ['pgp-key']},
+]
+
+
+@pytest.mark.parametrize('settings', SETTINGS)
+@pytest.mark.parametrize('seed', range(8))
+def test_apply_matches_recompute_all(settings, seed):
+    rng = random.Random(seed)
+    events = random_events(rng)
+    roots = [address(number) for number in rng.sample(range(30), 3 * settings['threshold'])]
+
+    engine = TrustEngine(roots, now=NOW, **settings)
+    position = 0
+    while position < len(events):
+        step = rng.randrange(1, 25)
+        batch = events[position:position + step]
+        before = depths(engine)
+        changed = engine.apply(batch)
+        position += step
+
+        expected = full(events[:position], roots, NOW, **settings)
+        assert depths(engine) == depths(expected)
+        assert verdicts(engine) == verdicts(expected)
+        assert changed == set(key for (key, depth) in depths(engine).items() if before[key] != depth)
+
+
+@pytest.mark.parametrize('settings', SETTINGS)
+@pytest.mark.parametrize('seed', range(4))
+def test_advance_expires_signatures(settings, seed):
+    rng = random.Random(100 + seed)
+    events = random_events(rng)
+    roots = [address(number) for number in rng.sample(range(30), 3 * settings['threshold'])]
+
+    engine = full(events, roots, NOW, **settings)
+    for now in range(NOW, NOW + 110, 7):
+        engine.advance(now)
+        expected = full(events, roots, now, **settings)
+        assert depths(engine) == depths(expected)
+        assert verdicts(engine) == verdicts(expected)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_set_roots(seed):
+    rng = random.Random(200 + seed)
+    events = random_events(rng)
+    engine = full(events, [address(0)], NOW, max_depth=3, threshold=2)
+
+    for _ in range(5):
+        roots = [address(number) for number in rng.sample(range(30), rng.randrange(1, 6))]
+        engine.set_roots(roots)
+        assert depths(engine) == depths(full(events, roots, NOW, max_depth=3, threshold=2))
+
+
+def test_depths_and_verdicts():
+    (root, alice, bob, carol) = [address(number) for number in range(4)]
+    events = [
+        {'_event_type': 'AttributeAdded', 'attributeID': 0, 'owner': alice, 'attributeType': 'email'},
+        {'_event_type': 'AttributeAdded', 'attributeID': 1, 'owner': bob, 'attributeType': 'email'},
+        {'_event_type': 'AttributeAdded', 'attributeID': 2, 'owner': carol, 'attributeType': 'email'},
+        {'_event_type': 'AttributeSigned', 'signatureID': 0, 'signer': root, 'attributeID': 0, 'expiry': NOW + 10},
+        {'_event_type': 'AttributeSigned', 'signatureID': 1, 'signer': alice, 'attributeID': 1, 'expiry': NOW + 10},
+        {'_event_type': 'AttributeSigned', 'signatureID': 2, 'signer': bob, 'attributeID': 2, 'expiry': NOW + 10},
+        # a signature of one's own attribute does not count
+        {'_event_type': 'AttributeSigned', 'signatureID': 3, 'signer': carol, 'attributeID': 2, 'expiry': NOW + 10},
+    ]
+    engine = TrustEngine(['0x' + root.upper()], max_depth=2, now=NOW)
+    assert engine.apply(events) == set([alice, bob])
+    assert (engine.depth(root), engine.depth(alice), engine.depth('0x' + bob), engine.depth(carol)) == (0, 1, 2, None)
+    assert engine.attribute_verdict(1) == {'endorsed': True, 'depth': 2, 'trusted_signers': {alice: 1}}
+    assert engine.attribute_verdict(2) == {'endorsed': False, 'depth': None, 'trusted_signers': {}}
+    assert engine.attribute_verdict(3) is None
+
+    assert engine.apply([{'_event_type': 'SignatureRevoked', 'revocationID': 0, 'signratureID': 0}]) \
+        == set([alice, bob])
+    assert not engine.is_trusted(alice) and not engine.is_trusted(bob)
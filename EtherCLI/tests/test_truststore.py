@@ -0,0 +1,218 @@
+"""Tests of the on-disk truststore and its use by the user configuration."""
+
+import multiprocessing
+import os
+import random
+
+import pytest
+
+from etherpki import userconfig
+from etherpki.truststore import MAGIC
+from etherpki.truststore import TrustStore
+from etherpki.truststore import pack_address
+from etherpki.truststore import unpack_address
+
+
+def address(number):
+    return '0x%040x' % number
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('truststore.bin'))
+
+
+def test_pack_address():
+    assert pack_address('0x' + 'AB' * 20) == b'\xab' * 20
+    assert pack_address(' ' + 'ab' * 20 + '\n') == b'\xab' * 20
+    assert unpack_address(b'\xab' * 20) == '0x' + 'ab' * 20
+    for invalid in ('0x' + 'ab' * 19, '0x' + 'zz' * 20, ''):
+        with pytest.raises(ValueError):
+            pack_address(invalid)
+
+
+def test_add_remove_and_save(path):
+    store = TrustStore(path)
+    assert len(store) == 0 and list(store) == [] and not store.dirty
+
+    assert store.add_many([address(3), address(1), address(3).upper().replace('0X', '0x')]) == 2
+    assert store.add_many([address(1)]) == 0
+    assert store.remove_many([address(2), 'invalid']) == 0
+    assert store.dirty
+    assert (address(1) in store, address(2) in store, 'invalid' in store) == (True, False, False)
+    store.save()
+    store.close()
+
+    store = TrustStore(path)
+    assert list(store) == [address(1), address(3)] and not store.dirty
+    assert store.remove_many([address(3)]) == 1
+    assert store.add_many([address(3), address(2)]) == 2
+    assert len(store) == 3 and list(store) == [address(1), address(2), address(3)]
+    store.save()
+    store.close()
+
+    with open(path, 'rb') as storefile:
+        assert storefile.read() == MAGIC + b''.join(pack_address(address(number)) for number in (1, 2, 3))
+
+
+def test_invalid_addresses_are_not_added(path):
+    store = TrustStore(path)
+    with pytest.raises(ValueError):
+        store.add_many([address(1), 'invalid'])
+    assert len(store) == 0 and not store.dirty
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_matches_a_set(path, seed):
+    rng = random.Random(seed)
+    store = TrustStore(path)
+    expected = set()
+
+    for _ in range(200):
+        numbers = [rng.randrange(50) for _ in range(rng.randrange(1, 4))]
+        action = rng.random()
+        if action < 0.4:
+            assert store.add_many([address(number) for number in numbers]) == len(set(numbers) - expected)
+            expected |= set(numbers)
+        elif action < 0.7:
+            assert store.remove_many([address(number) for number in numbers]) == len(set(numbers) & expected)
+            expected -= set(numbers)
+        elif action < 0.8:
+            replacement = set(rng.randrange(50) for _ in range(rng.randrange(10)))
+            assert store.replace([address(number) for number in replacement]) \
+                == (len(replacement - expected), len(expected - replacement))
+            expected = replacement
+        elif action < 0.9:
+            store.save()
+        else:
+            store.save()
+            store.close()
+            store = TrustStore(path)
+            assert list(store) == [address(number) for number in sorted(expected)]
+
+        assert len(store) == len(expected)
+        assert all((address(number) in store) == (number in expected) for number in range(50))
+    store.close()
+
+
+def test_saving_keeps_changes_saved_by_others(path):
+    first = TrustStore(path)
+    second = TrustStore(path)
+
+    first.add_many([address(1), address(2)])
+    second.add_many([address(3)])
+    first.save()
+    second.save()
+
+    # the second store only removes what it removed, not what the first added
+    second.remove_many([address(3), address(1)])
+    first.add_many([address(4)])
+    second.save()
+    first.save()
+
+    store = TrustStore(path)
+    assert list(store) == [address(2), address(4)]
+    for opened in (first, second, store):
+        opened.close()
+
+
+def test_save_replaces_the_file_only_when_dirty(path, tmpdir):
+    store = TrustStore(path)
+    store.save()
+    assert not os.path.exists(path)
+
+    store.add_many([address(1)])
+    store.save()
+    inode = os.stat(path).st_ino
+    store.save()
+    assert os.stat(path).st_ino == inode
+
+    # the file is replaced rather than rewritten in place, leaving no temporary files behind
+    store.add_many([address(2)])
+    store.save()
+    assert os.stat(path).st_ino != inode
+    assert sorted(os.listdir(str(tmpdir))) == ['truststore.bin', 'truststore.bin.lock']
+    store.close()
+
+
+def test_invalid_files_are_rejected(path):
+    with open(path, 'wb') as storefile:
+        storefile.write(MAGIC + b'\x00' * 19)
+    with pytest.raises(ValueError):
+        TrustStore(path)
+
+    with open(path, 'wb') as storefile:
+        storefile.write(b'NOTATS1\n' + b'\x00' * 20)
+    with pytest.raises(ValueError):
+        TrustStore(path)
+
+    open(path, 'wb').close()
+    store = TrustStore(path)
+    assert len(store) == 0
+    store.close()
+
+
+def _add_and_save(args):
+    (path, numbers) = args
+    for number in numbers:
+        store = TrustStore(path)
+        store.add_many([address(number)])
+        store.save()
+        store.close()
+
+
+def test_concurrent_processes_do_not_lose_changes(path):
+    numbers = list(range(80))
+    pool = multiprocessing.Pool(4)
+    try:
+        pool.map(_add_and_save, [(path, numbers[start::4]) for start in range(4)])
+    finally:
+        pool.close()
+        pool.join()
+
+    store = TrustStore(path)
+    assert list(store) == [address(number) for number in numbers]
+    store.close()
+
+
+@pytest.fixture
+def config(tmpdir, monkeypatch):
+    """Points the user configuration at a temporary directory."""
+    directory = str(tmpdir.join('config'))
+    monkeypatch.setattr(userconfig, 'user_config_dir', lambda name: directory)
+    monkeypatch.setattr(userconfig, 'configfile', os.path.join(directory, 'config.ini'))
+    monkeypatch.setattr(userconfig, 'truststorefile', os.path.join(directory, 'truststore.bin'))
+    monkeypatch.setattr(userconfig, '_config', None)
+    monkeypatch.setattr(userconfig, '_config_changed', False)
+    monkeypatch.setattr(userconfig, '_truststore', None)
+    yield directory
+    if userconfig._truststore is not None:
+        userconfig._truststore.close()
+
+
+def test_userconfig_trust(config):
+    userconfig.trust(address(2))
+    userconfig.trust(address(1))
+    userconfig.untrust(address(2))
+    assert userconfig.is_trusted(address(1)) and not userconfig.is_trusted(address(2))
+    userconfig.save()
+
+    userconfig._truststore.close()
+    userconfig._truststore = None
+    assert userconfig.get_trusted() == [address(1)]
+
+
+def test_userconfig_migrates_the_config_truststore(config):
+    os.makedirs(config)
+    with open(userconfig.configfile, 'w') as configfile:
+        configfile.write('[general]\nkey = value\n[truststore]\n%s = True\n%s = False\n0x1234 = True\n'
+            % (address(1), address(2)))
+
+    assert userconfig.get_trusted() == [address(1)]
+    userconfig.save()
+
+    with open(userconfig.configfile) as configfile:
+        assert 'truststore' not in configfile.read()
+    store = TrustStore(userconfig.truststorefile)
+    assert list(store) == [address(1)]
+    store.close()